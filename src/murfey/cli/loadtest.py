@@ -0,0 +1,770 @@
+"""
+Generates load against a Murfey server by simulating the requests that instrument
+servers send during their sessions, to find out how many sessions a deployment can
+carry.
+
+A load profile (a YAML file; see 'loadtest_profile.yaml' for the default one) sets
+the number of instruments and sessions to simulate, the requests each session makes
+to set itself up, the mix of requests it then sends, and the phases of the run.
+Every session gets its own session token. Requests are sent open-loop: each session
+sends its requests at the times of a Poisson process whose rate follows the phases,
+whether or not its earlier requests have been answered, and latencies are measured
+from the time each request was due to be sent. The server's '/metrics' endpoint is
+scraped during the run to show how close it is to saturation.
+
+Without a server URL, a server is started in this process for the run, with an
+SQLite database in a temporary directory. Its message transport is replaced by one
+that hands messages for the feedback queue straight to the server's feedback
+callback, and answers ISPyB inserts with new IDs, so no RabbitMQ or ISPyB is needed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import random
+import secrets
+import socket
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from string import Template
+from typing import TYPE_CHECKING, Any, Iterator, Optional, cast
+
+import aiohttp
+import yaml
+from prometheus_client.parser import text_string_to_metric_families
+from pydantic import BaseModel
+from rich.console import Console
+from rich.table import Table
+
+from murfey.util.api import find_unique_index, load_route_manifest, url_path_for
+
+# The server is only imported once its configuration has been set up
+if TYPE_CHECKING:
+    from murfey.server.ispyb import TransportManager
+
+logger = logging.getLogger("murfey.cli.loadtest")
+
+default_profile = Path(__file__).parent / "loadtest_profile.yaml"
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class RequestTemplate(BaseModel):
+    router: str
+    function: str
+    weight: float = 1
+    path_params: dict[str, Any] = {}
+    data: Any = None
+
+
+class Phase(BaseModel):
+    name: str
+    duration: float  # In seconds
+    rate: float  # Requests per second sent by each session
+    start_rate: Optional[float] = None  # Ramps linearly up to 'rate' if set
+
+    def rate_at(self, elapsed: float) -> float:
+        if self.start_rate is None or self.duration <= 0:
+            return self.rate
+        return self.start_rate + (self.rate - self.start_rate) * min(
+            elapsed / self.duration, 1
+        )
+
+
+class LoadProfile(BaseModel):
+    instruments: int = 1
+    sessions_per_instrument: int = 1
+    instrument_name: str = "loadtest${instrument}"
+    visit: str = "cm00000-${session}"
+    phases: list[Phase]
+    setup: list[RequestTemplate] = []
+    requests: list[RequestTemplate]
+    metrics: list[str] = []
+    metrics_interval: float = 5
+
+
+def load_profile(profile_file: Path) -> LoadProfile:
+    with open(profile_file, "r") as stream:
+        return LoadProfile(**yaml.safe_load(stream))
+
+
+def render(value: Any, variables: dict[str, Any]) -> Any:
+    """
+    Fills in the ${name} placeholders in a value from a profile. A string that is
+    nothing but a placeholder takes the value of the variable itself, so keeps its
+    type.
+    """
+    if isinstance(value, str):
+        if value.startswith("${") and value.endswith("}") and value[2:-1] in variables:
+            return variables[value[2:-1]]
+        return Template(value).safe_substitute(variables)
+    if isinstance(value, dict):
+        return {key: render(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [render(item, variables) for item in value]
+    return value
+
+
+def route_method(router_name: str, function_name: str) -> str:
+    route_manifest: dict[str, list[dict[str, Any]]] = load_route_manifest()
+    routers = list(route_manifest.keys())
+    routes = route_manifest[routers[find_unique_index(router_name, routers)]]
+    route = routes[
+        find_unique_index(function_name, [r["function"] for r in routes], exact=True)
+    ]
+    return route["methods"][0]
+
+
+def arrival_times(
+    phases: list[Phase], rng: random.Random
+) -> Iterator[tuple[float, Phase]]:
+    """
+    Yields the times, in seconds from the start of the run, at which a session sends
+    its requests, along with the phase each falls in. Arrivals are drawn at the
+    highest rate of each phase, and kept in proportion to the rate at that time.
+    """
+    start = 0.0
+    for phase in phases:
+        end = start + phase.duration
+        peak = max(phase.rate, phase.start_rate or 0)
+        t = start
+        while peak > 0:
+            t += rng.expovariate(peak)
+            if t >= end:
+                break
+            if rng.random() * peak < phase.rate_at(t - start):
+                yield t, phase
+        start = end
+
+
+"""
+=======================================================================================
+Results
+=======================================================================================
+"""
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    status_codes: Counter[str] = field(default_factory=Counter)
+    errors: int = 0
+
+    def record(self, latency: float, status: int | str):
+        self.latencies.append(latency)
+        self.status_codes[str(status)] += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def summary(self) -> dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        histogram = {
+            str(bound): bisect_left(ordered, bound + 1e-12) for bound in LATENCY_BUCKETS
+        }
+        histogram["+Inf"] = count
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0,
+            "status_codes": dict(sorted(self.status_codes.items())),
+            "latency": (
+                {
+                    f"p{q}": round(ordered[min(int(q / 100 * count), count - 1)], 4)
+                    for q in (50, 90, 99)
+                }
+                | {"max": round(ordered[-1], 4)}
+                if count
+                else {}
+            ),
+            "histogram": histogram,
+        }
+
+
+def summarise_metrics(
+    scrapes: list[tuple[float, dict[str, float]]],
+) -> dict[str, dict[str, float]]:
+    """
+    Summarises the values of each metric scraped over the run. The rate of change is
+    included for counters.
+    """
+    summary: dict[str, dict[str, float]] = {}
+    names = {name for _, values in scrapes for name in values}
+    for name in sorted(names):
+        samples = [(t, values[name]) for t, values in scrapes if name in values]
+        (t0, first), (t1, last) = samples[0], samples[-1]
+        summary[name] = {
+            "first": first,
+            "last": last,
+            "max": max(value for _, value in samples),
+        }
+        if name.endswith("_total") and t1 > t0:
+            summary[name]["rate"] = round((last - first) / (t1 - t0), 4)
+    return summary
+
+
+def parse_metrics(text: str, names: list[str]) -> dict[str, float]:
+    """
+    Reads the named samples from a Prometheus exposition, adding up the samples of
+    each across their labels
+    """
+    values: dict[str, float] = defaultdict(float)
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name in names:
+                values[sample.name] += sample.value
+    return dict(values)
+
+
+"""
+=======================================================================================
+Load generation
+=======================================================================================
+"""
+
+
+@dataclass
+class SimulatedSession:
+    variables: dict[str, Any]
+    rng: random.Random
+    token: str = ""
+    counter: Iterator[int] = field(default_factory=lambda: itertools.count(1))
+
+
+class LoadTest:
+    def __init__(
+        self,
+        profile: LoadProfile,
+        base_url: str,
+        frontend_token: str,
+        request_timeout: float = 30,
+        connections: int = 100,
+        seed: Optional[int] = None,
+    ):
+        self.profile = profile
+        self.base_url = base_url.rstrip("/")
+        self.frontend_token = frontend_token
+        self.request_timeout = request_timeout
+        self.connections = connections
+        self.rng = random.Random(seed)
+        self.setup_attempts = 10
+        self.retry_interval = 0.5
+        self.stats: dict[str, dict[str, RouteStats]] = defaultdict(
+            lambda: defaultdict(RouteStats)
+        )
+        self.scrapes: list[tuple[float, dict[str, float]]] = []
+        self._weights = [template.weight for template in profile.requests]
+        self._methods = {
+            (template.router, template.function): route_method(
+                template.router, template.function
+            )
+            for template in profile.setup + profile.requests
+        }
+
+    def _sessions(self) -> list[SimulatedSession]:
+        sessions: list[SimulatedSession] = []
+        for instrument in range(1, self.profile.instruments + 1):
+            instrument_name = render(
+                self.profile.instrument_name, {"instrument": instrument}
+            )
+            for _ in range(self.profile.sessions_per_instrument):
+                session = len(sessions) + 1
+                variables = {
+                    "instrument": instrument,
+                    "instrument_name": instrument_name,
+                    "session": session,
+                }
+                variables["visit"] = render(self.profile.visit, variables)
+                variables["source"] = f"/loadtest/{instrument_name}/session{session}"
+                variables["destination"] = (
+                    f"{instrument_name}/{variables['visit']}/session{session}"
+                )
+                sessions.append(
+                    SimulatedSession(variables, random.Random(self.rng.getrandbits(64)))
+                )
+        return sessions
+
+    async def _request(
+        self,
+        http: aiohttp.ClientSession,
+        method: str,
+        path: str,
+        token: str,
+        data: Any = None,
+    ) -> tuple[int, Any]:
+        async with http.request(
+            method,
+            f"{self.base_url}{path}",
+            json=data,
+            headers={"Authorization": f"Bearer {token}"},
+        ) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = None
+            return response.status, body
+
+    async def _send(
+        self,
+        http: aiohttp.ClientSession,
+        session: SimulatedSession,
+        template: RequestTemplate,
+        phase: str,
+        scheduled: float,
+        attempts: int = 1,
+    ):
+        variables = session.variables | {"n": next(session.counter)}
+        method = self._methods[(template.router, template.function)]
+        status: int | str
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(self.retry_interval)
+            try:
+                path = url_path_for(
+                    template.router,
+                    template.function,
+                    **render(template.path_params, variables),
+                )
+                status, _ = await self._request(
+                    http, method, path, session.token, render(template.data, variables)
+                )
+            except Exception as e:
+                status = type(e).__name__
+            if isinstance(status, int) and status < 400:
+                break
+        self.stats[phase][f"{method} {template.function}"].record(
+            asyncio.get_running_loop().time() - scheduled, status
+        )
+
+    async def _set_up_session(
+        self, http: aiohttp.ClientSession, session: SimulatedSession
+    ):
+        variables = session.variables
+        status, session_id = await self._request(
+            http,
+            "POST",
+            url_path_for(
+                "session_info.router",
+                "create_session",
+                instrument_name=variables["instrument_name"],
+                visit=variables["visit"],
+                name=f"loadtest-{variables['session']}",
+            ),
+            self.frontend_token,
+            {"end_time": None},
+        )
+        if status != 200:
+            raise RuntimeError(f"Creating session failed with status code {status}")
+        variables["session_id"] = session_id
+        status, token = await self._request(
+            http,
+            "GET",
+            url_path_for("auth.router", "mint_session_token", session_id=session_id),
+            self.frontend_token,
+        )
+        if status != 200:
+            raise RuntimeError(
+                f"Minting session token failed with status code {status}"
+            )
+        session.token = token["access_token"]
+        # Setup requests can depend on messages the server is still processing from
+        # earlier ones, such as data collection group registrations, so are retried
+        for template in self.profile.setup:
+            await self._send(
+                http,
+                session,
+                template,
+                "setup",
+                asyncio.get_running_loop().time(),
+                attempts=self.setup_attempts,
+            )
+
+    async def _run_session(
+        self, http: aiohttp.ClientSession, session: SimulatedSession, start: float
+    ):
+        loop = asyncio.get_running_loop()
+        in_flight: set[asyncio.Task] = set()
+        for at, phase in arrival_times(self.profile.phases, session.rng):
+            if (delay := start + at - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            template = session.rng.choices(self.profile.requests, self._weights)[0]
+            task = asyncio.create_task(
+                self._send(http, session, template, phase.name, start + at)
+            )
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def _scrape_metrics(self, http: aiohttp.ClientSession):
+        try:
+            async with http.get(f"{self.base_url}/metrics/") as response:
+                text = await response.text()
+            self.scrapes.append(
+                (time.time(), parse_metrics(text, self.profile.metrics))
+            )
+        except Exception as e:
+            logger.warning(f"Failed to scrape server metrics: {e}")
+
+    async def _keep_scraping_metrics(self, http: aiohttp.ClientSession):
+        while True:
+            await self._scrape_metrics(http)
+            await asyncio.sleep(self.profile.metrics_interval)
+
+    async def run(self) -> dict[str, Any]:
+        sessions = self._sessions()
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.connections),
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+        ) as http:
+            await asyncio.gather(
+                *(self._set_up_session(http, session) for session in sessions)
+            )
+            scraper = (
+                asyncio.create_task(self._keep_scraping_metrics(http))
+                if self.profile.metrics
+                else None
+            )
+            start = asyncio.get_running_loop().time()
+            await asyncio.gather(
+                *(self._run_session(http, session, start) for session in sessions)
+            )
+            duration = asyncio.get_running_loop().time() - start
+            if scraper:
+                scraper.cancel()
+                await self._scrape_metrics(http)
+        return self._report(len(sessions), duration)
+
+    def _report(self, num_sessions: int, duration: float) -> dict[str, Any]:
+        phase_durations = {phase.name: phase.duration for phase in self.profile.phases}
+        return {
+            "target": self.base_url,
+            "instruments": self.profile.instruments,
+            "sessions": num_sessions,
+            "duration": round(duration, 3),
+            "phases": {
+                phase: {
+                    "duration": phase_durations.get(phase),
+                    "routes": {
+                        route: stats.summary()
+                        for route, stats in sorted(routes.items())
+                    },
+                }
+                for phase, routes in self.stats.items()
+            },
+            "metrics": summarise_metrics(self.scrapes),
+        }
+
+
+def print_report(report: dict[str, Any], console: Console):
+    table = Table(
+        title=f"Load on {report['target']} from {report['sessions']} sessions"
+    )
+    for column in ("Phase", "Route", "Requests", "Errors", "p50", "p90", "p99"):
+        table.add_column(
+            column, justify="left" if column in ("Phase", "Route") else "right"
+        )
+    for phase, results in report["phases"].items():
+        for route, summary in results["routes"].items():
+            latency = summary["latency"]
+            table.add_row(
+                phase,
+                route,
+                str(summary["requests"]),
+                f"{summary['error_rate']:.1%}",
+                *(
+                    f"{latency[q] * 1000:.0f} ms" if q in latency else "-"
+                    for q in ("p50", "p90", "p99")
+                ),
+            )
+    console.print(table)
+    for name, values in report["metrics"].items():
+        console.print(
+            f"{name}: " + ", ".join(f"{key} {value:g}" for key, value in values.items())
+        )
+
+
+"""
+=======================================================================================
+Local server
+=======================================================================================
+"""
+
+
+class LoopbackTransport:
+    """
+    Stands in for the server's TransportManager. Messages sent to the feedback queue
+    are handled by the server's feedback callback in a background thread, as they
+    would be after a round trip through RabbitMQ, and ISPyB inserts succeed with new
+    IDs.
+    """
+
+    feedback_queue = "murfey_feedback"
+
+    def __init__(self):
+        self.sent: Counter[str] = Counter()
+        self.transport = self
+        self._ids = itertools.count(1)
+        self._feedback: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._handle_feedback, daemon=True)
+        self._thread.start()
+
+    def send(self, queue: str, message: dict, new_connection: bool = False):
+        self.sent[queue] += 1
+        if queue == self.feedback_queue:
+            self._feedback.put(message)
+
+    def ack(self, *args, **kwargs):
+        pass
+
+    def nack(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name: str):
+        if name.startswith("do_"):
+            return lambda *args, **kwargs: {
+                "success": True,
+                "return_value": next(self._ids),
+            }
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+    def _handle_feedback(self):
+        from murfey.server.feedback import feedback_callback
+        from murfey.server.murfey_db import get_murfey_db_session
+        from murfey.util.config import get_security_config
+
+        while (message := self._feedback.get()) is not None:
+            for murfey_db in get_murfey_db_session(get_security_config()):
+                feedback_callback({}, message, _db=murfey_db)
+
+    def close(self):
+        self._feedback.put(None)
+        self._thread.join()
+
+
+def _ispyb_session_id(*args, **kwargs) -> int:
+    return 1
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_server(
+    profile: LoadProfile,
+    workdir: Path,
+    machine_config: dict[str, Any] | None = None,
+) -> Iterator[tuple[str, str, str]]:
+    """
+    Runs a Murfey server on this machine for the duration of the load test, backed
+    by an SQLite database. Yields its URL along with the name and password of a user
+    created for the load test. Any machine configuration given is applied on top of
+    the default one for each instrument.
+    """
+    import murfey.util.config
+
+    database = workdir / "murfey.db"
+    credentials = workdir / "murfey_db_credentials.yaml"
+    credentials.write_text(yaml.safe_dump({"database": str(database)}))
+    security_config = workdir / "security.yaml"
+    security_config.write_text(
+        yaml.safe_dump(
+            {
+                "murfey_db_credentials": str(credentials),
+                "crypto_key": "",
+                "db": "sqlite",
+                "auth_key": secrets.token_hex(32),
+                "rabbitmq_credentials": str(workdir / "rabbitmq.yaml"),
+                "thumbnail_cache_directory": str(workdir / "thumbnails"),
+                "upstream_index_path": str(workdir / "upstream_index"),
+            }
+        )
+    )
+    machine_config_file = workdir / "machine_config.yaml"
+    machine_config_file.write_text(
+        yaml.safe_dump(
+            {
+                name: {
+                    "instrument_name": name,
+                    "acquisition_software": ["epu", "tomo"],
+                    "rsync_basepath": str(workdir / "data"),
+                    "calibrations": {"dummy": {}},
+                    **(machine_config or {}),
+                }
+                for name in (
+                    render(profile.instrument_name, {"instrument": instrument})
+                    for instrument in range(1, profile.instruments + 1)
+                )
+            }
+        )
+    )
+    # The server reads its configuration when its modules are first imported
+    murfey.util.config.settings.murfey_security_configuration = str(security_config)
+    murfey.util.config.settings.murfey_machine_configuration = str(machine_config_file)
+    murfey.util.config.get_security_config.cache_clear()
+    murfey.util.config.get_machine_config.cache_clear()
+
+    import uvicorn
+
+    import murfey.server
+    import murfey.server.ispyb
+    from murfey.server.murfey_db import url
+    from murfey.util.db import MurfeyUser, setup
+
+    setup(url())
+    transport = LoopbackTransport()
+    # Only provides the parts of the TransportManager that the server uses
+    murfey.server._transport_object = cast("TransportManager", transport)
+    # Visits are looked up in ISPyB when data collections are registered. This has to
+    # be replaced before the workflows that use it are loaded
+    murfey.server.ispyb.get_session_id = _ispyb_session_id
+
+    from sqlmodel import Session, create_engine
+
+    from murfey.server.api.auth import hash_password
+    from murfey.server.main import app
+
+    username, password = "loadtest", secrets.token_hex(16)
+    with Session(create_engine(url())) as murfey_db:
+        murfey_db.add(
+            MurfeyUser(username=username, hashed_password=hash_password(password))
+        )
+        murfey_db.commit()
+
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_config=None)
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Local Murfey server failed to start")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}", username, password
+    finally:
+        server.should_exit = True
+        thread.join()
+        transport.close()
+
+
+async def _get_frontend_token(base_url: str, username: str, password: str) -> str:
+    async with aiohttp.ClientSession() as http:
+        async with http.post(
+            f"{base_url.rstrip('/')}{url_path_for('auth.router', 'generate_token')}",
+            data={"username": username, "password": password},
+        ) as response:
+            if response.status != 200:
+                raise RuntimeError(
+                    f"Logging in as {username!r} failed with status code "
+                    f"{response.status}"
+                )
+            return (await response.json())["access_token"]
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Simulate instrument sessions against a Murfey server, and report the "
+            "latencies and error rates of each route"
+        )
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        default=default_profile,
+        help="YAML file describing the sessions, requests and phases of the load",
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="",
+        help="Murfey server to load. A local server is started if none is given",
+    )
+    parser.add_argument(
+        "-u", "--username", type=str, default="", help="User to log in to the server as"
+    )
+    parser.add_argument(
+        "-p", "--password", type=str, default="", help="Password of the user"
+    )
+    parser.add_argument(
+        "--token",
+        type=str,
+        default="",
+        help="Frontend token to use instead of logging in",
+    )
+    parser.add_argument(
+        "--instruments", type=int, help="Number of instruments to simulate"
+    )
+    parser.add_argument(
+        "--sessions", type=int, help="Number of sessions to simulate per instrument"
+    )
+    parser.add_argument(
+        "--duration-scale",
+        type=float,
+        default=1,
+        help="Factor by which to scale the durations of the phases",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=100,
+        help="Maximum number of connections to the server open at once",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="Request timeout in seconds"
+    )
+    parser.add_argument("--seed", type=int, help="Seed for the random arrival times")
+    parser.add_argument(
+        "-o", "--output", type=Path, help="JSON file to write the results to"
+    )
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile)
+    if args.instruments:
+        profile.instruments = args.instruments
+    if args.sessions:
+        profile.sessions_per_instrument = args.sessions
+    for phase in profile.phases:
+        phase.duration *= args.duration_scale
+
+    async def _load(base_url: str, username: str, password: str) -> dict[str, Any]:
+        token = args.token or await _get_frontend_token(base_url, username, password)
+        return await LoadTest(
+            profile,
+            base_url,
+            token,
+            request_timeout=args.timeout,
+            connections=args.connections,
+            seed=args.seed,
+        ).run()
+
+    if args.url:
+        report = asyncio.run(_load(args.url, args.username, args.password))
+    else:
+        logging.getLogger("murfey").setLevel(logging.WARNING)
+        with tempfile.TemporaryDirectory() as workdir:
+            with local_server(profile, Path(workdir)) as (url, username, password):
+                report = asyncio.run(_load(url, username, password))
+
+    print_report(report, Console())
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
@@ -0,0 +1,162 @@
+"""
+Downloads the packages listed in one or more pip requirements files into the
+bootstrap package cache, so that client machines can be set up quickly, or without
+the server needing internet access at all if it is run in offline mode.
+
+For each requirement, all the distribution files of the newest version that
+satisfies it are cached, so that clients running any Python version or platform
+can install it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import html
+import re
+from pathlib import Path
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import (
+    InvalidSdistFilename,
+    InvalidWheelFilename,
+    parse_sdist_filename,
+    parse_wheel_filename,
+)
+from packaging.version import Version
+
+from murfey.server.api.bootstrap import pypi_index_url
+from murfey.server.package_cache import PackageCache, UpstreamError
+from murfey.util.config import get_security_config
+
+
+def read_requirements(requirements_file: Path) -> list[Requirement]:
+    """
+    Returns the requirements in a pip requirements file, skipping comments, blank
+    lines, and pip options.
+    """
+    requirements = []
+    for line in requirements_file.read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line or line.startswith("-"):
+            continue
+        try:
+            requirements.append(Requirement(line))
+        except InvalidRequirement:
+            print(f"Skipping invalid requirement {line!r}")
+    return requirements
+
+
+def _file_version(filename: str) -> Version | None:
+    try:
+        if filename.endswith(".whl"):
+            return parse_wheel_filename(filename)[1]
+        return parse_sdist_filename(filename)[1]
+    except (InvalidWheelFilename, InvalidSdistFilename):
+        return None
+
+
+def prewarm(
+    cache: PackageCache,
+    requirements: list[Requirement],
+    index_url: str = pypi_index_url,
+) -> tuple[list[str], list[str]]:
+    """
+    Caches the simple index page of each required package, along with all the files
+    of the newest version that satisfies the requirement. Returns the URLs of the
+    files that were cached and those that could not be.
+    """
+    cached: list[str] = []
+    failed: list[str] = []
+    for requirement in requirements:
+        # Use the same URL as the bootstrap endpoints, so the cache entries match
+        package = re.sub(r"[-_.]+", "-", requirement.name.lower())
+        page_url = f"{index_url.rstrip('/')}/{package}"
+        try:
+            page = cache.get_index(page_url).path.read_bytes().decode("utf-8")
+        except UpstreamError as e:
+            print(f"Could not find {requirement.name!r} on the package index: {e}")
+            failed.append(page_url)
+            continue
+
+        files_by_version: dict[Version, list[tuple[str, str]]] = {}
+        for href in re.findall(r'<a [^>]*href="([^"]+)"', page):
+            url, _, fragment = html.unescape(href).partition("#")
+            version = _file_version(url.rsplit("/", 1)[-1])
+            if version is None or not requirement.specifier.contains(version):
+                continue
+            files_by_version.setdefault(version, []).append((url, fragment))
+        if not files_by_version:
+            print(f"No files satisfy the requirement {str(requirement)!r}")
+            failed.append(page_url)
+            continue
+
+        newest_version = max(files_by_version)
+        for url, fragment in files_by_version[newest_version]:
+            try:
+                cached_file = cache.get_file(url)
+            except UpstreamError as e:
+                print(e)
+                failed.append(url)
+                continue
+            # Check the file against the hash given by the package index
+            if fragment.startswith("sha256=") and fragment[7:] != cached_file.sha256:
+                print(f"Hash of {url} does not match that given by the package index")
+                failed.append(url)
+                continue
+            cached.append(url)
+        print(f"Cached {requirement.name} {newest_version}")
+    return cached, failed
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Download the packages in a requirements file into the package cache used "
+            "by the bootstrap endpoints of the Murfey server"
+        )
+    )
+    parser.add_argument(
+        "requirements",
+        nargs="+",
+        type=Path,
+        help="Requirements file(s) listing the packages to cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help=(
+            "Directory of the package cache. Defaults to the one set in the security "
+            "configuration"
+        ),
+    )
+    parser.add_argument(
+        "--index-url",
+        default=pypi_index_url,
+        help="Base URL of the package index to download from",
+    )
+    args = parser.parse_args()
+
+    security_config = get_security_config()
+    cache_dir = args.cache_dir or security_config.package_cache_directory
+    if cache_dir is None:
+        exit("No package cache directory has been provided or configured")
+
+    cache = PackageCache(
+        cache_dir,
+        max_bytes=security_config.package_cache_max_size,
+        index_ttl=security_config.package_cache_index_ttl,
+    )
+    requirements = [
+        requirement
+        for requirements_file in args.requirements
+        for requirement in read_requirements(requirements_file)
+    ]
+    cached, failed = prewarm(cache, requirements, index_url=args.index_url)
+    print(
+        f"Cached {len(cached)} files in {cache_dir}, which now holds "
+        f"{cache.current_bytes / 1024**2:.1f} MiB"
+    )
+    cache.close()
+    if failed:
+        exit(f"Failed to cache {len(failed)} files")
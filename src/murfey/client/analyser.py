@@ -12,6 +12,9 @@ import functools
 import logging
 import queue
 import threading
+import time
+import zlib
+from dataclasses import dataclass
 from importlib.metadata import entry_points
 from pathlib import Path
 from typing import Type
@@ -44,6 +47,22 @@ def _get_context(name: str):
         return None
 
 
+@dataclass
+class StageTiming:
+    """
+    Running totals of the time spent in one stage of the Analyser pipeline
+    """
+
+    count: int = 0
+    total: float = 0
+    max: float = 0
+
+    def record(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
 class Analyser(Observer):
     def __init__(
         self,
@@ -53,6 +72,7 @@ class Analyser(Observer):
         force_mdoc_metadata: bool = False,
         limited: bool = False,
         serialem: bool = False,
+        num_workers: int | None = None,
     ):
         super().__init__()
         self._basepath = basepath_local.absolute()
@@ -78,6 +98,28 @@ class Analyser(Observer):
             else {}
         )
 
+        # Worker lanes that run the post-transfer step in parallel. Files are sharded
+        # across the lanes using the key provided by the context, so files sharing a
+        # key are always processed in the order they arrived
+        self.num_workers = max(
+            num_workers or self._murfey_config.get("analyser_workers", 1), 1
+        )
+        self.worker_queues: list[queue.Queue] = []
+        self.worker_threads: list[threading.Thread] = []
+        if self.num_workers > 1:
+            for i in range(self.num_workers):
+                worker_queue: queue.Queue = queue.Queue()
+                self.worker_queues.append(worker_queue)
+                self.worker_threads.append(
+                    threading.Thread(
+                        name=f"Analyser {basepath_local} worker {i}",
+                        target=self._post_transfer_in_thread,
+                        args=(worker_queue,),
+                    )
+                )
+        self._timings_lock = threading.Lock()
+        self.stage_timings: dict[str, StageTiming] = {}
+
         # SPA & Tomo-specific attributes
         self._extension: str = ""
         self._processing_params_found: bool = (
@@ -351,7 +393,12 @@ class Analyser(Observer):
                 return True
         return False
 
+    def _record_timing(self, stage: str, duration: float):
+        with self._timings_lock:
+            self.stage_timings.setdefault(stage, StageTiming()).record(duration)
+
     def post_transfer(self, transferred_file: Path):
+        start_time = time.perf_counter()
         try:
             if self._context:
                 self._context.post_transfer(
@@ -361,6 +408,37 @@ class Analyser(Observer):
             logger.error(
                 f"An exception was encountered post transfer: {e}", exc_info=True
             )
+        finally:
+            self._record_timing("post_transfer", time.perf_counter() - start_time)
+
+    def _dispatch(self, transferred_file: Path):
+        """
+        Runs the post-transfer step for the file. When running with multiple workers,
+        the file is instead queued on the worker lane that its shard key maps to.
+        Files without a shard key all go to the first lane.
+        """
+        if not self.worker_queues or self._context is None:
+            self.post_transfer(transferred_file)
+            return None
+        shard_key = self._context.shard_key(transferred_file)
+        lane = (
+            zlib.crc32(shard_key.encode()) % len(self.worker_queues) if shard_key else 0
+        )
+        self.worker_queues[lane].put(transferred_file)
+        return None
+
+    def _post_transfer_in_thread(self, worker_queue: queue.Queue):
+        """
+        Target of the worker threads. Runs the post-transfer step for each file
+        placed on its queue until it receives None.
+        """
+        while True:
+            transferred_file = worker_queue.get()
+            if transferred_file is None:
+                worker_queue.task_done()
+                break
+            self.post_transfer(transferred_file)
+            worker_queue.task_done()
 
     def _analyse_in_thread(self):
         """
@@ -379,9 +457,17 @@ class Analyser(Observer):
             if not transferred_file:
                 self._halt_thread = True
                 continue
+            start_time = time.perf_counter()
             self._analyse(transferred_file)
+            self._record_timing("analyse", time.perf_counter() - start_time)
             self.queue.task_done()
         logger.debug("Analyser thread has stopped analysing incoming files")
+        # Let the worker lanes finish off the files already sharded to them
+        for worker_queue in self.worker_queues:
+            worker_queue.put(None)
+        for worker_thread in self.worker_threads:
+            if worker_thread.is_alive():
+                worker_thread.join()
         self.notify(final=True)
 
     def _analyse(self, transferred_file: Path):
@@ -417,7 +503,7 @@ class Analyser(Observer):
                     self._murfey_config,
                     self._token,
                 )
-            self.post_transfer(transferred_file)
+            self._dispatch(transferred_file)
         else:
             # Try and determine context, and notify once when context is found
             if self._context is None:
@@ -446,12 +532,12 @@ class Analyser(Observer):
                     logger.debug(
                         f"File {transferred_file.name!r} transferred with context {self._context.name}"
                     )
-                    self.post_transfer(transferred_file)
+                    self._dispatch(transferred_file)
                 case "SPAContext":
                     logger.debug(
                         f"File {transferred_file.name!r} transferred with context {self._context.name}"
                     )
-                    self.post_transfer(transferred_file)
+                    self._dispatch(transferred_file)
 
                     # Find extension
                     if not self._extension:
@@ -465,10 +551,12 @@ class Analyser(Observer):
                         # Try and gather the metadata from each file passing through
                         # Once gathered, set the attribute to True and don't repeat again
                         try:
-                            dc_metadata = self._context.gather_metadata(
-                                self._xml_file(transferred_file),
-                                environment=self._environment,
-                            )
+                            # Held so as not to interleave with the worker lanes
+                            with self._context._lock:
+                                dc_metadata = self._context.gather_metadata(
+                                    self._xml_file(transferred_file),
+                                    environment=self._environment,
+                                )
                         except (KeyError, ValueError) as e:
                             logger.error(
                                 f"Metadata gathering failed with the following error: {e}"
@@ -489,7 +577,7 @@ class Analyser(Observer):
                     logger.debug(
                         f"File {transferred_file.name!r} transferred with context {self._context.name}"
                     )
-                    self.post_transfer(transferred_file)
+                    self._dispatch(transferred_file)
 
                     # Find extension
                     if not self._extension:
@@ -506,10 +594,12 @@ class Analyser(Observer):
                         # Try and gather the metadata from a passing .mdoc file
                         # When gathered, set the attribute to True and don't repeat again
                         try:
-                            dc_metadata = self._context.gather_metadata(
-                                transferred_file,
-                                environment=self._environment,
-                            )
+                            # Held so as not to interleave with the worker lanes
+                            with self._context._lock:
+                                dc_metadata = self._context.gather_metadata(
+                                    transferred_file,
+                                    environment=self._environment,
+                                )
                         except (KeyError, ValueError) as e:
                             logger.error(
                                 f"Metadata gathering failed with the following error: {e}"
@@ -552,6 +642,8 @@ class Analyser(Observer):
         if self._stopping:
             raise RuntimeError("Analyser has already stopped")
         logger.info(f"Analyser thread starting for {self}")
+        for worker_thread in self.worker_threads:
+            worker_thread.start()
         self.thread.start()
 
     def request_stop(self):
@@ -562,7 +654,15 @@ class Analyser(Observer):
         """
         Checks that the analyser thread is safe to stop
         """
-        return self._stopping and self._halt_thread and not self.queue.qsize()
+        return self._stopping and self._halt_thread and not self.num_files_in_queue
+
+    @property
+    def num_files_in_queue(self) -> int:
+        """
+        Number of files waiting to be analysed, including those already sharded to
+        the worker lanes
+        """
+        return self.queue.qsize() + sum(q.qsize() for q in self.worker_queues)
 
     def stop(self):
         logger.debug("Analyser thread stop requested")
@@ -3,12 +3,12 @@ from __future__ import annotations
 import logging
 from importlib.metadata import entry_points
 from pathlib import Path
+from threading import RLock
 from typing import Any, NamedTuple, OrderedDict
 
-import xmltodict
-
 from murfey.client.instance_environment import MurfeyInstanceEnvironment, SampleInfo
 from murfey.util.client import capture_post
+from murfey.util.parse_cache import parse_xml
 
 logger = logging.getLogger("murfey.client.context")
 
@@ -119,8 +119,7 @@ def ensure_dcg_exists(
             "tag": dcg_tag,
         }
     else:
-        with open(session_file, "r") as session_xml:
-            session_data = xmltodict.parse(session_xml.read())
+        session_data = parse_xml(session_file)
 
         if collection_type == "tomo":
             windows_path = session_data["TomographySession"]["AtlasId"]
@@ -178,13 +177,12 @@ def ensure_dcg_exists(
         ):
             atlas_xml_path = atlas_xml_search[0]
             logger.info(f"Atlas XML path {str(atlas_xml_path)} found")
-            with open(atlas_xml_path, "rb") as atlas_xml:
-                atlas_xml_data = xmltodict.parse(atlas_xml)
-                atlas_original_pixel_size = float(
-                    atlas_xml_data["MicroscopeImage"]["SpatialScale"]["pixelSize"]["x"][
-                        "numericValue"
-                    ]
-                )
+            atlas_xml_data = parse_xml(atlas_xml_path)
+            atlas_original_pixel_size = float(
+                atlas_xml_data["MicroscopeImage"]["SpatialScale"]["pixelSize"]["x"][
+                    "numericValue"
+                ]
+            )
             # need to calculate the pixel size of the downscaled image
             atlas_pixel_size = atlas_original_pixel_size * 7.8
             logger.info(f"Atlas image pixel size determined to be {atlas_pixel_size}")
@@ -248,6 +246,8 @@ class Context:
         self._token = token
         self.name = name
         self.data_collection_parameters: dict = {}
+        # Held while changing state shared between the Analyser's worker lanes
+        self._lock: RLock = RLock()
 
     def post_transfer(
         self,
@@ -268,6 +268,19 @@ class Context:
     ):
         self.post_transfer(transferred_file, environment=environment, **kwargs)
 
+    def shard_key(self, transferred_file: Path) -> str | None:
+        """
+        Returns the key used to distribute files across the Analyser's worker lanes.
+        Files with the same key are post-processed in order on the same lane, while
+        files with different keys can be processed in parallel. Returning None sends
+        the file to the default lane; this should be used for any file whose
+        processing depends on state shared across keys. The key must be derived from
+        the file path alone, so that it doesn't change over the course of a session,
+        and any state shared across keys must only be changed while holding the
+        context's lock.
+        """
+        return None
+
     def gather_metadata(
         self, metadata_file: Path, environment: MurfeyInstanceEnvironment | None = None
     ) -> OrderedDict | None:
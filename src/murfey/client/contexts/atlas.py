@@ -1,11 +1,13 @@
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
+from xml.sax import SAXException
 
 import xmltodict
 
 from murfey.client.context import Context, _atlas_destination, _get_source
 from murfey.client.instance_environment import MurfeyInstanceEnvironment
+from murfey.util.atlas_index import AtlasPosition
 from murfey.util.client import capture_post
 from murfey.util.spa_metadata import get_grid_square_atlas_positions
 
@@ -23,6 +25,8 @@ class AtlasContext(Context):
         super().__init__("AtlasContext", acquisition_software, token)
         self._basepath = basepath
         self._machine_config = machine_config
+        # Positions of the grid squares registered for each atlas so far
+        self._registered_grid_squares: Dict[Path, Dict[str, AtlasPosition]] = {}
 
     def post_transfer(
         self,
@@ -164,7 +168,7 @@ class AtlasContext(Context):
             # Register all grid squares on this atlas
             try:
                 gs_pix_positions = get_grid_square_atlas_positions(transferred_file)
-            except KeyError:
+            except SAXException:
                 logger.info("Unable to read grid square locations from Atlas.dm")
                 return
             for p in transferred_file.parts:
@@ -190,29 +194,42 @@ class AtlasContext(Context):
                     "sample": sample,
                 },
             )
-            # Register all grid squares on this atlas
-            for gs, pos_data in gs_pix_positions.items():
-                if pos_data:
-                    capture_post(
-                        base_url=str(environment.url.geturl()),
-                        router_name="session_control.spa_router",
-                        function_name="register_grid_square",
-                        token=self._token,
-                        instrument_name=environment.instrument_name,
-                        session_id=environment.murfey_session,
-                        gsid=int(gs),
-                        data={
-                            "tag": str(transferred_file.parent),
-                            "sample": sample,
-                            "x_location": pos_data[0],
-                            "y_location": pos_data[1],
-                            "x_stage_position": pos_data[2],
-                            "y_stage_position": pos_data[3],
-                            "width": pos_data[4],
-                            "height": pos_data[5],
-                            "angle": pos_data[6],
-                        },
-                    )
+            # Register the grid squares that are new or have moved since the atlas
+            # was last transferred, all in one request
+            registered = self._registered_grid_squares.setdefault(transferred_file, {})
+            changed = {
+                gs: pos_data
+                for gs, pos_data in gs_pix_positions.items()
+                if pos_data and registered.get(gs) != pos_data
+            }
+            if changed:
+                response = capture_post(
+                    base_url=str(environment.url.geturl()),
+                    router_name="session_control.spa_router",
+                    function_name="register_grid_squares",
+                    token=self._token,
+                    instrument_name=environment.instrument_name,
+                    session_id=environment.murfey_session,
+                    data={
+                        "grid_squares": {
+                            int(gs): {
+                                "tag": str(transferred_file.parent),
+                                "sample": sample,
+                                "x_location": pos_data[0],
+                                "y_location": pos_data[1],
+                                "x_stage_position": pos_data[2],
+                                "y_stage_position": pos_data[3],
+                                "width": pos_data[4],
+                                "height": pos_data[5],
+                                "angle": pos_data[6],
+                            }
+                            for gs, pos_data in changed.items()
+                        }
+                    },
+                )
+                # Registered again with the next transfer of the atlas otherwise
+                if response and response.status_code == 200:
+                    registered.update(changed)
             # Register atlas in smartem
             if gs_pix_positions:
                 capture_post(
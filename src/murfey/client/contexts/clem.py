@@ -67,6 +67,21 @@ class CLEMContext(Context):
         self._series_metadata: dict[str, str] = {}  # {Series name : Metadata file path}
         self._files_in_series: dict[str, int] = {}  # {Series name : Total TIFFs}
 
+    def shard_key(self, transferred_file: Path) -> str | None:
+        # TIFF files and their XLIF metadata file are sharded by image series
+        if transferred_file.suffix in (".tif", ".tiff"):
+            return "--".join(
+                [
+                    *transferred_file.parent.parts[-2:],
+                    transferred_file.stem.split("--")[0],
+                ]
+            )
+        if transferred_file.suffix == ".xlif":
+            return "--".join(
+                [*transferred_file.parent.parent.parts[-2:], transferred_file.stem]
+            )
+        return None
+
     def post_transfer(
         self,
         transferred_file: Path,
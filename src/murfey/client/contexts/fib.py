@@ -223,6 +223,15 @@ class FIBContext(Context):
         self._site_info: dict[int, LamellaSiteInfo] = {}
         self._drift_correction_images: dict[int, FIBImage] = {}
 
+    def shard_key(self, transferred_file: Path) -> str | None:
+        # Files are sharded by lamella site, with the site information shared between
+        # them only changed while holding the context's lock
+        if self._acquisition_software == "autotem":
+            for part in transferred_file.parts:
+                if part.startswith("Lamella"):
+                    return part
+        return None
+
     def post_transfer(
         self,
         transferred_file: Path,
@@ -244,33 +253,34 @@ class FIBContext(Context):
                 # Early exit if the check fails
                 return None
 
-            # Store incoming ProjectData.dat files in memory
-            if (
-                transferred_file.name == "ProjectData.dat"
-                and self._project_data.get(project_name) is None
-            ):
-                self._project_data[project_name] = transferred_file
-
-            # Identify if the current file's project is to be registered
-            if project_name not in self._target_projects:
-                if not any(
-                    pattern in str(transferred_file)
-                    for pattern in (
-                        "/DCImages/",
-                        "/LamellaEvaluationImages/",
-                        "/Sites/Lamella",
-                    )
+            # The project and lamella site information is shared between the worker
+            # lanes, so is only looked at and changed while holding the lock
+            with self._lock:
+                # Store incoming ProjectData.dat files in memory
+                if (
+                    transferred_file.name == "ProjectData.dat"
+                    and self._project_data.get(project_name) is None
                 ):
-                    # Early exit if the file is not from a relevant project
-                    return None
-                # Mark project folder for analysis
-                self._target_projects.append(project_name)
-                logger.info(
-                    f"AutoTEM project {project_name!r} identified for registration"
-                )
+                    self._project_data[project_name] = transferred_file
+
+                # Identify if the current file's project is to be registered
+                if project_name not in self._target_projects:
+                    if not any(
+                        pattern in str(transferred_file)
+                        for pattern in (
+                            "/DCImages/",
+                            "/LamellaEvaluationImages/",
+                            "/Sites/Lamella",
+                        )
+                    ):
+                        # Early exit if the file is not from a relevant project
+                        return None
+                    # Mark project folder for analysis
+                    self._target_projects.append(project_name)
+                    logger.info(
+                        f"AutoTEM project {project_name!r} identified for registration"
+                    )
 
-            # Analyse file and trigger processing only from target projects
-            if project_name in self._target_projects:
                 # Perform first-time metadata extraction using stored "ProjectData.dat" file
                 if self._project_data.get(project_name) and not self._site_info:
                     project_data = self._project_data[project_name]
@@ -290,15 +300,14 @@ class FIBContext(Context):
                 ):
                     self._make_drift_correction_gif(transferred_file, environment)
                     return None
-                # Register lamella evaluation images
-                elif (
-                    "LamellaEvaluationImages" in transferred_file.parts
-                    and transferred_file.suffix == ".png"
-                ):
-                    self._register_lamella_evaluation_image(
-                        transferred_file, environment
-                    )
-                    return None
+
+            # Register lamella evaluation images
+            if (
+                "LamellaEvaluationImages" in transferred_file.parts
+                and transferred_file.suffix == ".png"
+            ):
+                self._register_lamella_evaluation_image(transferred_file, environment)
+                return None
 
         # -----------------------------------------------------------------------------
         # Maps
@@ -597,8 +606,11 @@ class FIBContext(Context):
                     f"Could not determine output directory for lamella {lamella_number}"
                 )
                 return None
+            animation_format = self._machine_config.get("fib_animation_format", "gif")
             output_file = (
-                output_dir / "drift_correction" / f"lamella_{lamella_number}.gif"
+                output_dir
+                / "drift_correction"
+                / f"lamella_{lamella_number}.{animation_format}"
             )
             with lock:
                 self._drift_correction_images[lamella_number].output_file = output_file
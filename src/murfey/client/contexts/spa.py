@@ -19,6 +19,7 @@ from murfey.client.instance_environment import (
     MurfeyID,
     MurfeyInstanceEnvironment,
 )
+from murfey.client.session_state import SessionStateStore
 from murfey.util.client import capture_get, capture_post
 from murfey.util.spa_metadata import (
     foil_hole_data,
@@ -86,7 +87,10 @@ class SPAContext(Context):
         self._basepath = basepath
         self._machine_config = machine_config
         self._processing_job_stash: dict = {}
-        self._foil_holes: dict[int, list[int]] = {}
+        # Grid squares that have been moved on from age out of memory
+        self._foil_holes: SessionStateStore[int, list[int]] = SessionStateStore(
+            "foil_holes", key_type=int, max_entries=1000
+        )
 
     def gather_metadata(
         self, metadata_file: Path, environment: MurfeyInstanceEnvironment | None = None
@@ -324,26 +328,29 @@ class SPAContext(Context):
             capture_post(
                 base_url=str(environment.url.geturl()),
                 router_name="session_control.spa_router",
-                function_name="register_grid_square",
+                function_name="register_grid_squares",
                 token=self._token,
                 instrument_name=environment.instrument_name,
                 session_id=environment.murfey_session,
-                gsid=grid_square,
                 data={
-                    "tag": str(source),
-                    "readout_area_x": gs.readout_area_x,
-                    "readout_area_y": gs.readout_area_y,
-                    "thumbnail_size_x": gs.thumbnail_size_x,
-                    "thumbnail_size_y": gs.thumbnail_size_y,
-                    "pixel_size": gs.pixel_size,
-                    "image": str(image_path),
-                    "x_location": gs_pix_position[0],
-                    "y_location": gs_pix_position[1],
-                    "x_stage_position": gs_pix_position[2],
-                    "y_stage_position": gs_pix_position[3],
-                    "width": gs_pix_position[4],
-                    "height": gs_pix_position[5],
-                    "angle": gs_pix_position[6],
+                    "grid_squares": {
+                        grid_square: {
+                            "tag": str(source),
+                            "readout_area_x": gs.readout_area_x,
+                            "readout_area_y": gs.readout_area_y,
+                            "thumbnail_size_x": gs.thumbnail_size_x,
+                            "thumbnail_size_y": gs.thumbnail_size_y,
+                            "pixel_size": gs.pixel_size,
+                            "image": str(image_path),
+                            "x_location": gs_pix_position[0],
+                            "y_location": gs_pix_position[1],
+                            "x_stage_position": gs_pix_position[2],
+                            "y_stage_position": gs_pix_position[3],
+                            "width": gs_pix_position[4],
+                            "height": gs_pix_position[5],
+                            "angle": gs_pix_position[6],
+                        }
+                    }
                 },
             )
         foil_hole = foil_hole_from_file(transferred_file)
@@ -374,47 +381,50 @@ class SPAContext(Context):
                     if fh.image
                     else ""
                 )
-                capture_post(
-                    base_url=str(environment.url.geturl()),
-                    router_name="session_control.spa_router",
-                    function_name="register_foil_hole",
-                    token=self._token,
-                    instrument_name=environment.instrument_name,
-                    session_id=environment.murfey_session,
-                    gs_name=grid_square,
-                    data={
-                        "name": foil_hole,
-                        "x_location": fh.x_location,
-                        "y_location": fh.y_location,
-                        "x_stage_position": fh.x_stage_position,
-                        "y_stage_position": fh.y_stage_position,
-                        "readout_area_x": fh.readout_area_x,
-                        "readout_area_y": fh.readout_area_y,
-                        "thumbnail_size_x": fh.thumbnail_size_x,
-                        "thumbnail_size_y": fh.thumbnail_size_y,
-                        "pixel_size": fh.pixel_size,
-                        "diameter": fh.diameter,
-                        "tag": str(source),
-                        "image": str(image_path),
-                    },
-                )
+                foil_hole_params: dict[str, Any] = {
+                    "name": foil_hole,
+                    "x_location": fh.x_location,
+                    "y_location": fh.y_location,
+                    "x_stage_position": fh.x_stage_position,
+                    "y_stage_position": fh.y_stage_position,
+                    "readout_area_x": fh.readout_area_x,
+                    "readout_area_y": fh.readout_area_y,
+                    "thumbnail_size_x": fh.thumbnail_size_x,
+                    "thumbnail_size_y": fh.thumbnail_size_y,
+                    "pixel_size": fh.pixel_size,
+                    "diameter": fh.diameter,
+                    "tag": str(source),
+                    "image": str(image_path),
+                }
             else:
-                capture_post(
-                    base_url=str(environment.url.geturl()),
-                    router_name="session_control.spa_router",
-                    function_name="register_foil_hole",
-                    token=self._token,
-                    instrument_name=environment.instrument_name,
-                    session_id=environment.murfey_session,
-                    gs_name=grid_square,
-                    data={
-                        "name": foil_hole,
-                        "tag": str(source),
-                    },
-                )
-            self._foil_holes[grid_square].append(foil_hole)
+                foil_hole_params = {
+                    "name": foil_hole,
+                    "tag": str(source),
+                }
+            # The rest of the foil holes on the grid square are registered together
+            # from its metadata file, so only this one needs adding or updating here
+            capture_post(
+                base_url=str(environment.url.geturl()),
+                router_name="session_control.spa_router",
+                function_name="register_foil_holes",
+                token=self._token,
+                instrument_name=environment.instrument_name,
+                session_id=environment.murfey_session,
+                gs_name=grid_square,
+                data={"foil_holes": [foil_hole_params]},
+            )
+            foil_holes = self._foil_holes[grid_square]
+            foil_holes.append(foil_hole)
+            self._foil_holes[grid_square] = foil_holes
         return foil_hole
 
+    def shard_key(self, transferred_file: Path) -> str | None:
+        # Movies are sharded by the grid square they were collected on
+        try:
+            return str(grid_square_from_file(transferred_file))
+        except ValueError:
+            return None
+
     def post_transfer(
         self,
         transferred_file: Path,
@@ -456,19 +466,22 @@ class SPAContext(Context):
                             transferred_file,
                             Path(self._machine_config.get("rsync_basepath", "")),
                         )
-                        if not environment.movie_counters.get(str(source)):
-                            movie_counts_get = capture_get(
-                                base_url=str(environment.url.geturl()),
-                                router_name="session_control.router",
-                                function_name="count_number_of_movies",
-                                token=self._token,
-                            )
-                            if movie_counts_get is not None:
-                                environment.movie_counters[str(source)] = count(
-                                    movie_counts_get.json().get(str(source), 0) + 1
+                        # The movie counter is shared between the worker lanes
+                        with self._lock:
+                            if not environment.movie_counters.get(str(source)):
+                                movie_counts_get = capture_get(
+                                    base_url=str(environment.url.geturl()),
+                                    router_name="session_control.router",
+                                    function_name="count_number_of_movies",
+                                    token=self._token,
                                 )
+                                if movie_counts_get is not None:
+                                    environment.movie_counters[str(source)] = count(
+                                        movie_counts_get.json().get(str(source), 0) + 1
+                                    )
+                            movie_number = next(environment.movie_counters[str(source)])
                         environment.movies[file_transferred_to] = MovieTracker(
-                            movie_number=next(environment.movie_counters[str(source)]),
+                            movie_number=movie_number,
                             motion_correction_uuid=next(MurfeyID),
                         )
 
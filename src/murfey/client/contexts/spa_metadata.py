@@ -2,8 +2,6 @@ import logging
 from pathlib import Path
 from typing import Dict, Optional
 
-import xmltodict
-
 from murfey.client.context import (
     Context,
     _file_transferred_to,
@@ -12,8 +10,11 @@ from murfey.client.context import (
 )
 from murfey.client.instance_environment import MurfeyInstanceEnvironment
 from murfey.util.client import capture_post
+from murfey.util.parse_cache import parse_xml
 from murfey.util.spa_metadata import (
     FoilHoleInfo,
+    foil_hole_image_index,
+    get_foil_hole_targets,
     get_grid_square_atlas_positions,
     grid_square_data,
 )
@@ -22,53 +23,24 @@ logger = logging.getLogger("murfey.client.contexts.spa_metadata")
 
 
 def _foil_hole_positions(xml_path: Path, grid_square: int) -> Dict[str, FoilHoleInfo]:
-    with open(xml_path, "r") as xml:
-        for_parsing = xml.read()
-        data = xmltodict.parse(for_parsing)
-    data = data["GridSquareXml"]
-    if "TargetLocationsEfficient" in data["TargetLocations"].keys():
-        # Grids with regular foil holes
-        serialization_array = data["TargetLocations"]["TargetLocationsEfficient"][
-            "a:m_serializationArray"
-        ]
-    elif "TargetLocations" in data["TargetLocations"].keys():
-        # Lacey grids
-        serialization_array = data["TargetLocations"]["TargetLocations"][
-            "a:m_serializationArray"
-        ]
-    else:
+    targets = get_foil_hole_targets(xml_path)
+    if not targets:
         logger.warning(f"Target locations not found for {str(xml_path)}")
         return {}
-    required_key = ""
-    for key in serialization_array.keys():
-        if key.startswith("b:KeyValuePairOfintTargetLocation"):
-            required_key = key
-            break
-    if not required_key:
-        logger.info(f"Required key not found for {str(xml_path)}")
-        return {}
     foil_holes = {}
-    for fh_block in serialization_array[required_key]:
-        if fh_block["b:value"]["IsNearGridBar"] == "false":
-            image_paths = list(
-                (xml_path.parent.parent).glob(
-                    f"Images-Disc*/GridSquare_{grid_square}/FoilHoles/FoilHole_{fh_block['b:key']}_*.jpg"
-                )
-            )
-            image_paths.sort(key=lambda x: x.stat().st_ctime)
-            image_path: str = str(image_paths[-1]) if image_paths else ""
-            pix_loc = fh_block["b:value"]["PixelCenter"]
-            stage = fh_block["b:value"]["StagePosition"]
-            diameter = fh_block["b:value"]["PixelWidthHeight"]["c:width"]
-            foil_holes[fh_block["b:key"]] = FoilHoleInfo(
-                id=int(fh_block["b:key"]),
+    image_index = foil_hole_image_index(xml_path.parent.parent, grid_square)
+    for fh in targets.values():
+        if not fh.near_grid_bar:
+            image_path = image_index.newest_image(fh.id, refresh=False) or ""
+            foil_holes[str(fh.id)] = FoilHoleInfo(
+                id=fh.id,
                 grid_square_id=grid_square,
-                x_location=int(float(pix_loc["c:x"])),
-                y_location=int(float(pix_loc["c:y"])),
-                x_stage_position=float(stage["c:X"]),
-                y_stage_position=float(stage["c:Y"]),
+                x_location=int(fh.x_location),
+                y_location=int(fh.y_location),
+                x_stage_position=fh.x_stage_position,
+                y_stage_position=fh.y_stage_position,
                 image=str(image_path),
-                diameter=int(float(diameter)),
+                diameter=int(fh.diameter),
             )
     return foil_holes
 
@@ -108,6 +80,14 @@ class SPAMetadataContext(Context):
         self._registered_squares: set[int] = set()
         self._registered_squares_serialem: set[str] = set()
 
+    def shard_key(self, transferred_file: Path) -> str | None:
+        # Grid square metadata files are independent of one another
+        if transferred_file.suffix == ".dm" and transferred_file.name.startswith(
+            "GridSquare"
+        ):
+            return transferred_file.stem
+        return None
+
     def post_transfer(
         self,
         transferred_file: Path,
@@ -175,8 +155,7 @@ class SPAMetadataContext(Context):
 
         if transferred_file.name == "EpuSession.dm" and environment:
             logger.info("EPU session metadata found")
-            with open(transferred_file, "r") as epu_xml:
-                data = xmltodict.parse(epu_xml.read())
+            data = parse_xml(transferred_file)
             windows_path = data["EpuSessionXml"]["Samples"]["_items"]["SampleXml"][0][
                 "AtlasId"
             ]["#text"]
@@ -207,27 +186,31 @@ class SPAMetadataContext(Context):
                         machine_config=self._machine_config,
                         token=self._token,
                     )
-                    for gs, pos_data in gs_pix_positions.items():
-                        if pos_data:
-                            capture_post(
-                                base_url=str(environment.url.geturl()),
-                                router_name="session_control.spa_router",
-                                function_name="register_grid_square",
-                                token=self._token,
-                                instrument_name=environment.instrument_name,
-                                session_id=environment.murfey_session,
-                                gsid=int(gs),
-                                data={
-                                    "tag": dcg_tag,
-                                    "x_location": pos_data[0],
-                                    "y_location": pos_data[1],
-                                    "x_stage_position": pos_data[2],
-                                    "y_stage_position": pos_data[3],
-                                    "width": pos_data[4],
-                                    "height": pos_data[5],
-                                    "angle": pos_data[6],
-                                },
-                            )
+                    # Register all the grid squares of the atlas in one request
+                    grid_squares = {
+                        int(gs): {
+                            "tag": dcg_tag,
+                            "x_location": pos_data[0],
+                            "y_location": pos_data[1],
+                            "x_stage_position": pos_data[2],
+                            "y_stage_position": pos_data[3],
+                            "width": pos_data[4],
+                            "height": pos_data[5],
+                            "angle": pos_data[6],
+                        }
+                        for gs, pos_data in gs_pix_positions.items()
+                        if pos_data
+                    }
+                    if grid_squares:
+                        capture_post(
+                            base_url=str(environment.url.geturl()),
+                            router_name="session_control.spa_router",
+                            function_name="register_grid_squares",
+                            token=self._token,
+                            instrument_name=environment.instrument_name,
+                            session_id=environment.murfey_session,
+                            data={"grid_squares": grid_squares},
+                        )
                     if gs_pix_positions:
                         capture_post(
                             base_url=str(environment.url.geturl()),
@@ -306,32 +289,37 @@ class SPAMetadataContext(Context):
                 )
 
             if gs_name not in self._registered_squares:
-                for fh, fh_data in fh_positions.items():
+                if fh_positions:
+                    # Register all the foil holes of the grid square in one request
                     capture_post(
                         base_url=str(environment.url.geturl()),
                         router_name="session_control.spa_router",
-                        function_name="register_foil_hole",
+                        function_name="register_foil_holes",
                         token=self._token,
                         instrument_name=environment.instrument_name,
                         session_id=environment.murfey_session,
                         gs_name=gs_name,
                         data={
-                            "name": fh,
-                            "x_location": fh_data.x_location,
-                            "y_location": fh_data.y_location,
-                            "x_stage_position": fh_data.x_stage_position,
-                            "y_stage_position": fh_data.y_stage_position,
-                            "readout_area_x": fh_data.readout_area_x,
-                            "readout_area_y": fh_data.readout_area_y,
-                            "thumbnail_size_x": fh_data.thumbnail_size_x,
-                            "thumbnail_size_y": fh_data.thumbnail_size_y,
-                            "pixel_size": fh_data.pixel_size,
-                            "diameter": fh_data.diameter,
-                            "tag": visitless_source,
-                            "image": fh_data.image,
+                            "foil_holes": [
+                                {
+                                    "name": fh,
+                                    "x_location": fh_data.x_location,
+                                    "y_location": fh_data.y_location,
+                                    "x_stage_position": fh_data.x_stage_position,
+                                    "y_stage_position": fh_data.y_stage_position,
+                                    "readout_area_x": fh_data.readout_area_x,
+                                    "readout_area_y": fh_data.readout_area_y,
+                                    "thumbnail_size_x": fh_data.thumbnail_size_x,
+                                    "thumbnail_size_y": fh_data.thumbnail_size_y,
+                                    "pixel_size": fh_data.pixel_size,
+                                    "diameter": fh_data.diameter,
+                                    "tag": visitless_source,
+                                    "image": fh_data.image,
+                                }
+                                for fh, fh_data in fh_positions.items()
+                            ]
                         },
                     )
-                if fh_positions:
                     capture_post(
                         base_url=str(environment.url.geturl()),
                         router_name="session_control.spa_router",
@@ -1,11 +1,7 @@
 import logging
-from datetime import datetime
 from pathlib import Path
 from typing import Any
 
-import numpy as np
-from olefile import OleFileIO
-
 from murfey.client.context import (
     Context,
     _file_transferred_to,
@@ -14,56 +10,23 @@ from murfey.client.context import (
 )
 from murfey.client.instance_environment import MurfeyInstanceEnvironment
 from murfey.util.client import capture_post
-from murfey.util.models import File
 from murfey.util.tomo import midpoint
+from murfey.util.xrm import get_xrm_header, xrm_reference_index
 
 logger = logging.getLogger("murfey.client.contexts.sxt")
 
 
 def _find_reference(txrm_file: Path) -> Path | None:
     """Find a suitable reference to apply to the given txrm file"""
-    # Look for xrm files in the txrm folder, reverse sorted by time
-    candidates = []
-    for gf in txrm_file.parent.glob("*.xrm"):
-        candidates.append(
-            File(
-                name=gf.name,
-                description="",
-                size=gf.stat().st_size / 1e6,
-                timestamp=datetime.fromtimestamp(gf.stat().st_mtime),
-                full_path=str(gf),
-            )
-        )
-    candidates.sort(key=lambda x: x.timestamp, reverse=True)
-    for ref_option in candidates:
-        if "ref" in ref_option.name.lower():
-            mosaic_size = 1
-            with OleFileIO(ref_option.full_path) as xrm_ole:
-                # Find images which are not mosaics (txrm spec typos this as mosiac)
-                if xrm_ole.exists("ImageInfo/MosiacRows") and xrm_ole.exists(
-                    "ImageInfo/MosiacColumns"
-                ):
-                    mosaic_size = int(
-                        np.frombuffer(
-                            xrm_ole.openstream("ImageInfo/MosiacRows").getvalue(),
-                            np.int32,
-                        )[0]
-                        * np.frombuffer(
-                            xrm_ole.openstream("ImageInfo/MosiacColumns").getvalue(),
-                            np.int32,
-                        )[0]
-                    )
-            if mosaic_size == 0:
-                logger.info(f"Found reference {ref_option.name}")
-                return Path(ref_option.full_path)
+    # The newest xrm file in the txrm folder that is a reference
+    reference = xrm_reference_index(txrm_file.parent).newest_reference()
+    if reference is not None:
+        logger.info(f"Found reference {reference.name}")
+        return reference
     logger.warning(f"No reference found for {txrm_file}")
     return None
 
 
-def _get_ole_header_value(ole_file, title: str, dtype: np.dtype):
-    return np.frombuffer(ole_file.openstream(title).getvalue(), dtype)
-
-
 class SXTContext(Context):
     def __init__(
         self,
@@ -206,47 +169,30 @@ class SXTContext(Context):
                 token=self._token,
             )
 
-            with OleFileIO(str(transferred_file)) as xrm_ole:
-                if xrm_ole.exists("ImageInfo/XPosition") and xrm_ole.exists(
-                    "ImageInfo/YPosition"
-                ):
-                    x_tiles = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/XPosition", np.float32
-                    ).tolist()
-                    y_tiles = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/YPosition", np.float32
-                    ).tolist()
-                    metadata["x_position"] = x_tiles[int(len(x_tiles) / 2)]
-                    metadata["y_position"] = y_tiles[int(len(y_tiles) / 2)]
-
-                if xrm_ole.exists("ImageInfo/PixelSize"):
-                    metadata["pixel_size"] = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/PixelSize", np.float32
-                    ).tolist()[0]
-
-                if xrm_ole.exists("ImageInfo/ImageHeight"):
-                    metadata["height"] = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/ImageHeight", np.int32
-                    ).tolist()[0]
-
-                if xrm_ole.exists("ImageInfo/ImageWidth"):
-                    metadata["width"] = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/ImageWidth", np.int32
-                    ).tolist()[0]
-
-                # Find images which are not mosaics (txrm spec typos this as mosiac)
-                if xrm_ole.exists("ImageInfo/MosiacRows") and xrm_ole.exists(
-                    "ImageInfo/MosiacColumns"
-                ):
-                    metadata["mosaic_rows"] = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/MosiacRows", np.int32
-                    )[0]
-                    metadata["mosaic_columns"] = _get_ole_header_value(
-                        xrm_ole, "ImageInfo/MosiacColumns", np.int32
-                    )[0]
-                    metadata["mosaic_size"] = int(
-                        metadata["mosaic_rows"] * metadata["mosaic_columns"]
-                    )
+            header = get_xrm_header(transferred_file)
+            # Keep the reference index for the directory up to date as files arrive
+            xrm_reference_index(transferred_file.parent).add(transferred_file, header)
+
+            x_tiles = header.get("ImageInfo/XPosition")
+            y_tiles = header.get("ImageInfo/YPosition")
+            if x_tiles is not None and y_tiles is not None:
+                metadata["x_position"] = x_tiles.tolist()[int(len(x_tiles) / 2)]
+                metadata["y_position"] = y_tiles.tolist()[int(len(y_tiles) / 2)]
+
+            if (pixel_size := header.get("ImageInfo/PixelSize")) is not None:
+                metadata["pixel_size"] = pixel_size.tolist()[0]
+
+            if (height := header.get("ImageInfo/ImageHeight")) is not None:
+                metadata["height"] = height.tolist()[0]
+
+            if (width := header.get("ImageInfo/ImageWidth")) is not None:
+                metadata["width"] = width.tolist()[0]
+
+            # Find images which are not mosaics (txrm spec typos this as mosiac)
+            if (mosaic_size := header.mosaic_size) is not None:
+                metadata["mosaic_rows"] = header.values["ImageInfo/MosiacRows"][0]
+                metadata["mosaic_columns"] = header.values["ImageInfo/MosiacColumns"][0]
+                metadata["mosaic_size"] = mosaic_size
 
             source = _get_source(transferred_file, environment=environment)
             if source:
@@ -338,74 +284,42 @@ class SXTContext(Context):
             angles: list = []
             metadata["source"] = str(self._basepath)
             metadata["tilt_series_tag"] = transferred_file.stem
-            with OleFileIO(str(transferred_file)) as txrm_ole:
-                if txrm_ole.exists("ReferenceData/Image"):
-                    metadata["has_reference"] = True
-
-                if txrm_ole.exists("ImageInfo/Angles"):
-                    angles = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/Angles", np.float32
-                    ).tolist()
-                    metadata["minimum_angle"] = min(angles)
-                    metadata["maximum_angle"] = max(angles)
-
-                if txrm_ole.exists("ImageInfo/PixelSize"):
-                    pixel_size_txrm = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/PixelSize", np.float32
-                    ).tolist()
-                    metadata["pixel_size"] = pixel_size_txrm[0] * 1e4
-
-                if txrm_ole.exists("ImageInfo/ImageWidth"):
-                    image_width_txrm = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/ImageWidth", np.int32
-                    ).tolist()
-                    metadata["image_size_x"] = image_width_txrm[0]
-
-                if txrm_ole.exists("ImageInfo/ImageHeight"):
-                    image_height_txrm = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/ImageHeight", np.int32
-                    ).tolist()
-                    metadata["image_size_y"] = image_height_txrm[0]
-
-                if txrm_ole.exists("ImageInfo/ExpTimes"):
-                    exposure_time_txrm = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/ExpTimes", np.float32
-                    ).tolist()
-                    metadata["exposure_time"] = exposure_time_txrm[0]
-
-                if txrm_ole.exists("ImageInfo/XrayMagnification"):
-                    magnification_txrm = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/XrayMagnification", np.float32
-                    ).tolist()
-                    metadata["magnification"] = magnification_txrm[0]
-
-                if txrm_ole.exists("ImageInfo/ImagesTaken"):
-                    tilt_count_txrm = _get_ole_header_value(
-                        txrm_ole, "ImageInfo/ImagesTaken", np.int32
-                    ).tolist()
-                    metadata["tilt_series_length"] = tilt_count_txrm[0]
-
-                if txrm_ole.exists("PositionInfo/AxisNames") and txrm_ole.exists(
-                    "PositionInfo/MotorPositions"
-                ):
-                    # The ImageInfo/Energy field is empty
-                    # Instead it needs extracting from the PositionInfo list
-                    axis_names = [
-                        i
-                        for i in txrm_ole.openstream("PositionInfo/AxisNames")
-                        .read()
-                        .decode("ascii")
-                        .split("\x00")
-                        if i
-                    ]
-                    axis_values = _get_ole_header_value(
-                        txrm_ole, "PositionInfo/MotorPositions", np.float32
-                    )
-                    if "Energy" in axis_names:
-                        energy_index = list(np.array(axis_names) == "Energy").index(
-                            True
-                        )
-                        metadata["energy"] = int(round(axis_values[energy_index]))
+            header = get_xrm_header(transferred_file)
+            if header.has_reference:
+                metadata["has_reference"] = True
+
+            if (angles_txrm := header.get("ImageInfo/Angles")) is not None:
+                angles = angles_txrm.tolist()
+                metadata["minimum_angle"] = min(angles)
+                metadata["maximum_angle"] = max(angles)
+
+            if (pixel_size_txrm := header.get("ImageInfo/PixelSize")) is not None:
+                metadata["pixel_size"] = pixel_size_txrm.tolist()[0] * 1e4
+
+            if (image_width_txrm := header.get("ImageInfo/ImageWidth")) is not None:
+                metadata["image_size_x"] = image_width_txrm.tolist()[0]
+
+            if (image_height_txrm := header.get("ImageInfo/ImageHeight")) is not None:
+                metadata["image_size_y"] = image_height_txrm.tolist()[0]
+
+            if (exposure_time_txrm := header.get("ImageInfo/ExpTimes")) is not None:
+                metadata["exposure_time"] = exposure_time_txrm.tolist()[0]
+
+            if (
+                magnification_txrm := header.get("ImageInfo/XrayMagnification")
+            ) is not None:
+                metadata["magnification"] = magnification_txrm.tolist()[0]
+
+            if (tilt_count_txrm := header.get("ImageInfo/ImagesTaken")) is not None:
+                metadata["tilt_series_length"] = tilt_count_txrm.tolist()[0]
+
+            axis_values = header.get("PositionInfo/MotorPositions")
+            if header.axis_names and axis_values is not None:
+                # The ImageInfo/Energy field is empty
+                # Instead it needs extracting from the PositionInfo list
+                if "Energy" in header.axis_names:
+                    energy_index = header.axis_names.index("Energy")
+                    metadata["energy"] = int(round(axis_values[energy_index]))
 
             if (
                 not metadata.get("has_reference", False)
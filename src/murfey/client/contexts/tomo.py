@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import logging
 from pathlib import Path
-from threading import RLock
 from typing import Callable, Dict, List, OrderedDict
 
 import murfey.util.eer
@@ -13,8 +12,9 @@ from murfey.client.instance_environment import (
     MurfeyID,
     MurfeyInstanceEnvironment,
 )
+from murfey.client.session_state import SessionStateStore
 from murfey.util.client import capture_get, capture_post
-from murfey.util.mdoc import get_block, get_global_data, get_num_blocks
+from murfey.util.mdoc import read_mdoc
 
 logger = logging.getLogger("murfey.client.contexts.tomo")
 
@@ -85,14 +85,16 @@ class TomographyContext(Context):
         super().__init__("TomographyContext", acquisition_software, token)
         self._basepath = basepath
         self._machine_config = machine_config
-        self._tilt_series: Dict[str, List[Path]] = {}
+        self._tilt_series: SessionStateStore[str, List[Path]] = SessionStateStore(
+            "tilt_series", max_entries=1000
+        )
         self._tilt_series_with_pjids: List[str] = []
         self._tilt_series_sizes: Dict[str, int] = {}
+        self._registered_tilt_series_sizes: Dict[str, int] = {}
         self._completed_tilt_series: List[str] = []
         self._aligned_tilt_series: List[str] = []
         self._data_collection_stash: list = []
         self._processing_job_stash: dict = {}
-        self._lock: RLock = RLock()
         self._group_tag: str = str(self._basepath)
 
     def register_tomography_data_collections(
@@ -281,75 +283,71 @@ class TomographyContext(Context):
                 motion_correction_uuid=next(MurfeyID),
             )
             environment.movie_tilt_pair[file_transferred_to] = tilt_series
-            if environment.tilt_angles.get(tilt_series):
-                environment.tilt_angles[tilt_series].append(
-                    [str(file_transferred_to), tilt_angle]
+        # Tilt series state is shared between the Analyser's worker lanes
+        with self._lock:
+            if tilt_series in self._completed_tilt_series:
+                logger.warning(
+                    f"Tilt series {tilt_series} was previously thought complete but now {file_path} has been seen"
                 )
-            else:
-                environment.tilt_angles[tilt_series] = [
-                    [str(file_transferred_to), tilt_angle]
-                ]
-        if tilt_series in self._completed_tilt_series:
-            logger.warning(
-                f"Tilt series {tilt_series} was previously thought complete but now {file_path} has been seen"
-            )
-            self._completed_tilt_series.remove(tilt_series)
-            self._tilt_series_sizes[tilt_series] = 0
-            rerun_data = {
-                "session_id": environment.murfey_session,
-                "tag": tilt_series,
-                "source": str(file_path.parent),
-            }
-            capture_post(
-                base_url=str(environment.url.geturl()),
-                router_name="workflow.tomo_router",
-                function_name="register_tilt_series_for_rerun",
-                token=self._token,
-                instrument_name=environment.instrument_name,
-                visit_name=environment.visit,
-                data=rerun_data,
-            )
-            if tilt_series in self._aligned_tilt_series:
-                with self._lock:
-                    self._aligned_tilt_series.remove(tilt_series)
-
-        if not self._tilt_series.get(tilt_series):
-            logger.info(f"New tilt series found: {tilt_series}")
-            self._tilt_series[tilt_series] = [file_path]
-            ts_data = {
-                "session_id": environment.murfey_session,
-                "tag": tilt_series,
-                "source": str(file_path.parent),
-            }
-            capture_post(
-                base_url=str(environment.url.geturl()),
-                router_name="workflow.tomo_router",
-                function_name="register_tilt_series",
-                token=self._token,
-                instrument_name=environment.instrument_name,
-                visit_name=environment.visit,
-                data=ts_data,
-            )
-            if not self._tilt_series_sizes.get(tilt_series):
+                self._completed_tilt_series.remove(tilt_series)
                 self._tilt_series_sizes[tilt_series] = 0
+                rerun_data = {
+                    "session_id": environment.murfey_session,
+                    "tag": tilt_series,
+                    "source": str(file_path.parent),
+                }
+                capture_post(
+                    base_url=str(environment.url.geturl()),
+                    router_name="workflow.tomo_router",
+                    function_name="register_tilt_series_for_rerun",
+                    token=self._token,
+                    instrument_name=environment.instrument_name,
+                    visit_name=environment.visit,
+                    data=rerun_data,
+                )
+                if tilt_series in self._aligned_tilt_series:
+                    self._aligned_tilt_series.remove(tilt_series)
 
-            # Will register processing jobs for all tilt series except the first one
-            self.register_tomography_data_collections(
-                file_extension=file_path.suffix,
-                image_directory=str(
-                    environment.default_destinations.get(
-                        file_path.parent, file_path.parent
-                    )
-                ),
-                environment=environment,
-            )
-        else:
-            if file_path not in self._tilt_series[tilt_series]:
-                for p in self._tilt_series[tilt_series]:
-                    if tilt_angle == extract_tilt_angle(p):
-                        break
-                else:
-                    self._tilt_series[tilt_series].append(file_path)
+            if not self._tilt_series.get(tilt_series):
+                logger.info(f"New tilt series found: {tilt_series}")
+                self._tilt_series[tilt_series] = [file_path]
+                ts_data = {
+                    "session_id": environment.murfey_session,
+                    "tag": tilt_series,
+                    "source": str(file_path.parent),
+                }
+                capture_post(
+                    base_url=str(environment.url.geturl()),
+                    router_name="workflow.tomo_router",
+                    function_name="register_tilt_series",
+                    token=self._token,
+                    instrument_name=environment.instrument_name,
+                    visit_name=environment.visit,
+                    data=ts_data,
+                )
+                if not self._tilt_series_sizes.get(tilt_series):
+                    self._tilt_series_sizes[tilt_series] = 0
+
+                # Will register processing jobs for all tilt series except the first one
+                self.register_tomography_data_collections(
+                    file_extension=file_path.suffix,
+                    image_directory=str(
+                        environment.default_destinations.get(
+                            file_path.parent, file_path.parent
+                        )
+                    ),
+                    environment=environment,
+                )
+            else:
+                if file_path not in self._tilt_series[tilt_series]:
+                    for p in self._tilt_series[tilt_series]:
+                        if tilt_angle == extract_tilt_angle(p):
+                            break
+                    else:
+                        tilts = self._tilt_series[tilt_series]
+                        tilts.append(file_path)
+                        # Assigned back in case it was spilled to disk in the meantime
+                        self._tilt_series[tilt_series] = tilts
 
         if environment:
             tilt_data = {
@@ -425,21 +423,25 @@ class TomographyContext(Context):
         tilt_series: str,
     ) -> List[str]:
         newly_completed_series: List[str] = []
-        mdoc_tilt_series_size = self._tilt_series_sizes.get(tilt_series, 0)
-        if not self._tilt_series or not mdoc_tilt_series_size:
-            logger.debug(f"Tilt series size not yet set for {tilt_series!r}")
-            return newly_completed_series
-
-        counted_tilts = len(self._tilt_series.get(tilt_series, []))
-        tilt_series_size_check = counted_tilts >= mdoc_tilt_series_size
-        if tilt_series_size_check and tilt_series not in self._completed_tilt_series:
-            self._completed_tilt_series.append(tilt_series)
-            newly_completed_series.append(tilt_series)
-        else:
-            logger.debug(
-                f"{tilt_series!r} not complete yet. Counted {counted_tilts} tilts. "
-                f"Expected number of tilts was {mdoc_tilt_series_size}"
-            )
+        with self._lock:
+            mdoc_tilt_series_size = self._tilt_series_sizes.get(tilt_series, 0)
+            if not self._tilt_series or not mdoc_tilt_series_size:
+                logger.debug(f"Tilt series size not yet set for {tilt_series!r}")
+                return newly_completed_series
+
+            counted_tilts = len(self._tilt_series.get(tilt_series, []))
+            tilt_series_size_check = counted_tilts >= mdoc_tilt_series_size
+            if (
+                tilt_series_size_check
+                and tilt_series not in self._completed_tilt_series
+            ):
+                self._completed_tilt_series.append(tilt_series)
+                newly_completed_series.append(tilt_series)
+            else:
+                logger.debug(
+                    f"{tilt_series!r} not complete yet. Counted {counted_tilts} tilts. "
+                    f"Expected number of tilts was {mdoc_tilt_series_size}"
+                )
         return newly_completed_series
 
     def _add_tomo_tilt(
@@ -503,17 +505,22 @@ class TomographyContext(Context):
                 else:
                     logger.warning(f"Unknown data file {transferred_file}")
             if transferred_file.suffix == ".mdoc":
-                with open(transferred_file, "r") as md:
-                    tilt_series = transferred_file.stem
-                    self._tilt_series_sizes[tilt_series] = get_num_blocks(md)
+                tilt_series = transferred_file.stem
+                _, mdoc_update = read_mdoc(transferred_file)
+                with self._lock:
+                    self._tilt_series_sizes[tilt_series] = mdoc_update.num_blocks
                 if environment:
                     source = self._get_source(transferred_file, environment)
                     if source:
                         completed_tilts = self._check_tilt_series(tilt_series)
 
-                    # Always update the tilt series length in the database after an mdoc
-                    if environment.murfey_session is not None:
-                        capture_post(
+                    # Update the tilt series length in the database when it changes
+                    if (
+                        environment.murfey_session is not None
+                        and self._registered_tilt_series_sizes.get(tilt_series)
+                        != mdoc_update.num_blocks
+                    ):
+                        response = capture_post(
                             base_url=str(environment.url.geturl()),
                             router_name="workflow.tomo_router",
                             function_name="register_tilt_series_length",
@@ -523,11 +530,14 @@ class TomographyContext(Context):
                             data={
                                 "tags": [tilt_series],
                                 "source": str(transferred_file.parent),
-                                "tilt_series_lengths": [
-                                    self._tilt_series_sizes[tilt_series]
-                                ],
+                                "tilt_series_lengths": [mdoc_update.num_blocks],
                             },
                         )
+                        # Sent again with the next mdoc update if it wasn't registered
+                        if response and response.status_code == 200:
+                            self._registered_tilt_series_sizes[tilt_series] = (
+                                mdoc_update.num_blocks
+                            )
 
         if completed_tilts and environment:
             logger.info(
@@ -550,8 +560,18 @@ class TomographyContext(Context):
                     ],
                 },
             )
+            # Completed tilt series are unlikely to be needed again, so are moved out
+            # of memory
+            for tilt_series in completed_tilts:
+                self._tilt_series.compact(tilt_series)
         return completed_tilts
 
+    def shard_key(self, transferred_file: Path) -> str | None:
+        # Shard by tilt series, which the mdoc file is named after
+        if transferred_file.suffix == ".mdoc":
+            return transferred_file.stem
+        return _construct_tilt_series_name(transferred_file) or None
+
     def post_first_transfer(
         self,
         transferred_file: Path,
@@ -571,12 +591,9 @@ class TomographyContext(Context):
             if not metadata_file.is_file():
                 logger.debug(f"Metadata file {metadata_file} not found")
                 return OrderedDict({})
-            with open(metadata_file, "r") as md:
-                mdoc_data = get_global_data(md)
-                num_blocks = get_num_blocks(md)
-                md.seek(0)
-                blocks = [get_block(md) for i in range(num_blocks)]
-                mdoc_data_block = blocks[0]
+            mdoc, _ = read_mdoc(metadata_file)
+            mdoc_data = mdoc.global_data
+            mdoc_data_block = mdoc.blocks[0]
             if not mdoc_data:
                 return OrderedDict({})
             mdoc_metadata: OrderedDict = OrderedDict({})
@@ -2,7 +2,7 @@ import logging
 import shutil
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 import xmltodict
 
@@ -269,17 +269,48 @@ class TomographyMetadataContext(Context):
                 # Case of a single batch
                 batch_positions_list = [batch_positions_list]
 
+            batch_positions: Dict[str, dict] = {}
+            search_map_names: List[str] = []
             for batch_position in batch_positions_list:
                 batch_name = batch_position["Name"]
                 search_map_name = batch_position["PositionOnTileSet"]["TileSetName"]
+                if search_map_name not in search_map_names:
+                    search_map_names.append(search_map_name)
                 batch_stage_location_x = float(
                     batch_position["PositionOnTileSet"]["StagePositionX"]
                 )
                 batch_stage_location_y = float(
                     batch_position["PositionOnTileSet"]["StagePositionY"]
                 )
+                batch_positions[batch_name] = {
+                    "tag": dcg_tag,
+                    "x_stage_position": batch_stage_location_x,
+                    "y_stage_position": batch_stage_location_y,
+                    "x_beamshift": 0,
+                    "y_beamshift": 0,
+                    "search_map_name": search_map_name,
+                }
+
+                # Beamshifts
+                if batch_position.get("AdditionalExposureTemplateAreas"):
+                    beamshifts = batch_position["AdditionalExposureTemplateAreas"][
+                        "ExposureTemplateAreaParameters"
+                    ]
+                    if type(beamshifts) is dict:
+                        beamshifts = [beamshifts]
+                    for beamshift in beamshifts:
+                        # Registration of beamshifted position
+                        batch_positions[beamshift["Name"]] = {
+                            "tag": dcg_tag,
+                            "x_stage_position": batch_stage_location_x,
+                            "y_stage_position": batch_stage_location_y,
+                            "x_beamshift": float(beamshift["PositionX"]),
+                            "y_beamshift": float(beamshift["PositionY"]),
+                            "search_map_name": search_map_name,
+                        }
 
-                # Always need search map before batch position
+            # Always need search maps before batch positions
+            for search_map_name in search_map_names:
                 capture_post(
                     base_url=str(environment.url.geturl()),
                     router_name="session_control.tomo_router",
@@ -293,52 +324,13 @@ class TomographyMetadataContext(Context):
                     },
                 )
 
-                # Then register batch position
-                capture_post(
-                    base_url=str(environment.url.geturl()),
-                    router_name="session_control.tomo_router",
-                    function_name="register_batch_position",
-                    token=self._token,
-                    instrument_name=environment.instrument_name,
-                    session_id=environment.murfey_session,
-                    batch_name=batch_name,
-                    data={
-                        "tag": dcg_tag,
-                        "x_stage_position": batch_stage_location_x,
-                        "y_stage_position": batch_stage_location_y,
-                        "x_beamshift": 0,
-                        "y_beamshift": 0,
-                        "search_map_name": search_map_name,
-                    },
-                )
-
-                # Beamshifts
-                if batch_position.get("AdditionalExposureTemplateAreas"):
-                    beamshifts = batch_position["AdditionalExposureTemplateAreas"][
-                        "ExposureTemplateAreaParameters"
-                    ]
-                    if type(beamshifts) is dict:
-                        beamshifts = [beamshifts]
-                    for beamshift in beamshifts:
-                        beamshift_name = beamshift["Name"]
-                        beamshift_position_x = float(beamshift["PositionX"])
-                        beamshift_position_y = float(beamshift["PositionY"])
-
-                        # Registration of beamshifted position
-                        capture_post(
-                            base_url=str(environment.url.geturl()),
-                            router_name="session_control.tomo_router",
-                            function_name="register_batch_position",
-                            token=self._token,
-                            instrument_name=environment.instrument_name,
-                            session_id=environment.murfey_session,
-                            batch_name=beamshift_name,
-                            data={
-                                "tag": dcg_tag,
-                                "x_stage_position": batch_stage_location_x,
-                                "y_stage_position": batch_stage_location_y,
-                                "x_beamshift": beamshift_position_x,
-                                "y_beamshift": beamshift_position_y,
-                                "search_map_name": search_map_name,
-                            },
-                        )
+            # Then register all the batch positions at once
+            capture_post(
+                base_url=str(environment.url.geturl()),
+                router_name="session_control.tomo_router",
+                function_name="register_batch_positions",
+                token=self._token,
+                instrument_name=environment.instrument_name,
+                session_id=environment.murfey_session,
+                data={"batch_positions": batch_positions},
+            )
@@ -0,0 +1,330 @@
+"""
+Notifications of changes to the entries of directories, so that directory watchers
+can wait for something to change rather than polling on a timer.
+
+Linux is supported through inotify and Windows through change notification handles,
+both reached through ctypes. Change notification handles keep the directories they
+watch open, which can stop them being renamed or removed, so they are only used when
+asked for. Elsewhere, or if setting up notifications fails, the polling fallback just
+waits for the timeout. Only changes to the entries of the
+watched directories themselves are reported, i.e. files and directories being
+created, removed or renamed within them, and not changes further down the tree.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Dict, List, Optional
+
+log = logging.getLogger("murfey.client.directory_events")
+
+
+class DirectoryEvents:
+    """
+    Polling fallback, for when changes to directories can't be watched for
+    """
+
+    name = "polling"
+
+    def __init__(self):
+        self._wake = threading.Event()
+
+    def watch(self, directory: str) -> bool:
+        """
+        Starts watching a directory for changes, returning whether it is watched
+        """
+        return False
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits until a watched directory changes, the timeout expires or 'wake' is
+        called, returning whether any watched directories changed
+        """
+        self._wake.wait(timeout)
+        self._wake.clear()
+        return False
+
+    def wake(self):
+        """
+        Wakes the thread waiting for changes. Does nothing once closed.
+        """
+        self._wake.set()
+
+    def close(self):
+        """
+        Stops watching for changes. Safe to call more than once.
+        """
+        pass
+
+
+# Masks from <sys/inotify.h>
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x01000000
+_IN_EVENT = struct.Struct("iIII")
+
+
+class InotifyDirectoryEvents(DirectoryEvents):
+    name = "inotify"
+
+    def __init__(self):
+        super().__init__()
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        wake_read, wake_write = os.pipe()
+        os.set_blocking(wake_read, False)
+        # Wakes are dropped rather than blocking if the pipe is full, as the waiting
+        # thread has yet to be woken by the ones already in it
+        os.set_blocking(wake_write, False)
+        # The file descriptors are set to None, under the lock, once closed
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = fd
+        self._wake_read: Optional[int] = wake_read
+        self._wake_write: Optional[int] = wake_write
+        self._watches: Dict[int, str] = {}
+        self._watched: Dict[str, int] = {}
+
+    def watch(self, directory: str) -> bool:
+        with self._lock:
+            if self._fd is None:
+                return False
+            if directory in self._watched:
+                return True
+            wd = self._libc.inotify_add_watch(
+                self._fd,
+                os.fsencode(directory),
+                _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_ONLYDIR,
+            )
+            if wd < 0:
+                # Most likely to be the limit on the number of watches being reached,
+                # in which case the directory is left to be polled
+                errno = ctypes.get_errno()
+                log.debug(f"Unable to watch {directory}: {os.strerror(errno)}")
+                return False
+            self._watches[wd] = directory
+            self._watched[directory] = wd
+            return True
+
+    def _read_events(self, fd: int) -> bool:
+        changed = False
+        while True:
+            try:
+                buffer = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, name_length = _IN_EVENT.unpack_from(buffer, offset)
+                offset += _IN_EVENT.size + name_length
+                if mask & _IN_IGNORED:
+                    # The directory was removed, so is no longer watched
+                    with self._lock:
+                        directory = self._watches.pop(wd, None)
+                        if directory is not None:
+                            self._watched.pop(directory, None)
+                changed = True
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Must be called from the same thread as 'close', as the file descriptors are
+        waited on outside of the lock
+        """
+        with self._lock:
+            fd, wake_read = self._fd, self._wake_read
+        if fd is None or wake_read is None:
+            return False
+        readable, _, _ = select.select([fd, wake_read], [], [], timeout)
+        if wake_read in readable:
+            try:
+                while os.read(wake_read, 1024):
+                    pass
+            except BlockingIOError:
+                pass
+        return self._read_events(fd)
+
+    def wake(self):
+        with self._lock:
+            if self._wake_write is None:
+                return
+            try:
+                os.write(self._wake_write, b"\x00")
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        with self._lock:
+            fds = (self._fd, self._wake_read, self._wake_write)
+            self._fd = self._wake_read = self._wake_write = None
+            self._watches.clear()
+            self._watched.clear()
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+
+# Constants from the Windows API
+_FILE_NOTIFY_CHANGE_FILE_NAME = 0x1
+_FILE_NOTIFY_CHANGE_DIR_NAME = 0x2
+_INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+_MAXIMUM_WAIT_OBJECTS = 64
+_WAIT_OBJECT_0 = 0
+
+
+class WindowsDirectoryEvents(DirectoryEvents):
+    """
+    Watches directories with change notification handles, which are waited on
+    together. A wait can only cover a limited number of handles, so directories
+    beyond that are left to be polled.
+    """
+
+    name = "change notifications"
+
+    def __init__(self):
+        super().__init__()
+        from ctypes import wintypes
+
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)  # type: ignore[attr-defined]
+        self._kernel32.FindFirstChangeNotificationW.argtypes = [
+            wintypes.LPCWSTR,
+            wintypes.BOOL,
+            wintypes.DWORD,
+        ]
+        self._kernel32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        self._kernel32.FindNextChangeNotification.argtypes = [wintypes.HANDLE]
+        self._kernel32.FindCloseChangeNotification.argtypes = [wintypes.HANDLE]
+        self._kernel32.CreateEventW.argtypes = [
+            wintypes.LPVOID,
+            wintypes.BOOL,
+            wintypes.BOOL,
+            wintypes.LPCWSTR,
+        ]
+        self._kernel32.CreateEventW.restype = wintypes.HANDLE
+        self._kernel32.SetEvent.argtypes = [wintypes.HANDLE]
+        self._kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+        self._kernel32.WaitForMultipleObjects.argtypes = [
+            wintypes.DWORD,
+            ctypes.POINTER(wintypes.HANDLE),
+            wintypes.BOOL,
+            wintypes.DWORD,
+        ]
+        self._kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        self._handle_type = wintypes.HANDLE
+        # An auto-reset event, used to wake the waiting thread
+        wake_event = self._kernel32.CreateEventW(None, False, False, None)
+        if not wake_event:
+            raise ctypes.WinError(ctypes.get_last_error())  # type: ignore[attr-defined]
+        # The wake event is set to None, under the lock, once closed
+        self._lock = threading.Lock()
+        self._wake_event: Optional[int] = wake_event
+        self._handles: List[int] = [wake_event]
+        self._watched: Dict[str, int] = {}
+
+    def watch(self, directory: str) -> bool:
+        with self._lock:
+            if self._wake_event is None:
+                return False
+            if directory in self._watched:
+                return True
+            if len(self._handles) >= _MAXIMUM_WAIT_OBJECTS:
+                return False
+            handle = self._kernel32.FindFirstChangeNotificationW(
+                directory,
+                False,
+                _FILE_NOTIFY_CHANGE_FILE_NAME | _FILE_NOTIFY_CHANGE_DIR_NAME,
+            )
+            if handle in (None, _INVALID_HANDLE_VALUE):
+                error = ctypes.get_last_error()  # type: ignore[attr-defined]
+                log.debug(f"Unable to watch {directory}: Windows error {error}")
+                return False
+            self._handles.append(handle)
+            self._watched[directory] = handle
+            return True
+
+    def _wait_for(self, timeout_ms: int) -> int | None:
+        with self._lock:
+            if not self._handles:
+                return None
+            handles = (self._handle_type * len(self._handles))(*self._handles)
+        result = self._kernel32.WaitForMultipleObjects(
+            len(handles), handles, False, timeout_ms
+        )
+        if _WAIT_OBJECT_0 <= result < _WAIT_OBJECT_0 + len(handles):
+            return handles[result - _WAIT_OBJECT_0]
+        return None
+
+    def wait(self, timeout: float) -> bool:
+        changed = False
+        handle = self._wait_for(int(timeout * 1000))
+        # Bounded, so that a directory that changes constantly can't hold up the wait
+        for _ in range(_MAXIMUM_WAIT_OBJECTS):
+            if handle is None:
+                break
+            if handle != self._wake_event:
+                changed = True
+                if not self._kernel32.FindNextChangeNotification(handle):
+                    # The directory has gone, so stop waiting on it
+                    self._unwatch(handle)
+            # Collect any other directories that have changed in the meantime
+            handle = self._wait_for(0)
+        return changed
+
+    def _unwatch(self, handle: int):
+        with self._lock:
+            self._handles.remove(handle)
+            for directory, watched_handle in list(self._watched.items()):
+                if watched_handle == handle:
+                    del self._watched[directory]
+        self._kernel32.FindCloseChangeNotification(handle)
+
+    def wake(self):
+        with self._lock:
+            if self._wake_event is not None:
+                self._kernel32.SetEvent(self._wake_event)
+
+    def close(self):
+        with self._lock:
+            wake_event = self._wake_event
+            handles = self._handles[1:]
+            self._wake_event = None
+            self._handles = []
+            self._watched.clear()
+        if wake_event is None:
+            return
+        for handle in handles:
+            self._kernel32.FindCloseChangeNotification(handle)
+        self._kernel32.CloseHandle(wake_event)
+
+
+def directory_events(windows_change_notifications: bool = False) -> DirectoryEvents:
+    """
+    Returns the best way of watching for changes to directories on this platform,
+    falling back on polling. Directories are polled on Windows unless change
+    notifications are enabled.
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            return InotifyDirectoryEvents()
+        if sys.platform == "win32" and windows_change_notifications:
+            return WindowsDirectoryEvents()
+    except (AttributeError, OSError) as e:
+        log.warning(f"Unable to watch for directory changes, so polling instead: {e}")
+    return DirectoryEvents()
@@ -5,11 +5,12 @@ import logging
 from itertools import count
 from pathlib import Path
 from threading import RLock
-from typing import Dict, List, NamedTuple, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from urllib.parse import ParseResult
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
+from murfey.client.session_state import SessionStateStore
 from murfey.client.watchdir import DirWatcher
 
 logger = logging.getLogger("murfey.client.instance_environment")
@@ -40,9 +41,14 @@ class MurfeyInstanceEnvironment(BaseModel):
     default_destinations: Dict[Path, str] = {}
     destination_registry: Dict[str, str] = {}
     watchers: Dict[Path, DirWatcher] = {}
-    movies: Dict[Path, MovieTracker] = {}
-    movie_tilt_pair: Dict[Path, str] = {}
-    tilt_angles: Dict[str, List[List[str]]] = {}
+    # The per-movie state is bounded in memory, with older entries spilled to disk
+    state_max_entries: int = 100_000
+    movies: SessionStateStore[Path, MovieTracker] = Field(
+        default_factory=lambda: SessionStateStore("movies", key_type=Path)
+    )
+    movie_tilt_pair: SessionStateStore[Path, str] = Field(
+        default_factory=lambda: SessionStateStore("movie_tilt_pair", key_type=Path)
+    )
     movie_counters: Dict[str, itertools.count] = {}
     visit: str = ""
     dose_per_frame: Optional[float] = None
@@ -57,15 +63,29 @@ class MurfeyInstanceEnvironment(BaseModel):
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    def model_post_init(self, __context: Any):
+        for store in self._state_stores():
+            store.max_entries = self.state_max_entries
+
+    def _state_stores(self) -> Tuple[SessionStateStore, ...]:
+        return (self.movies, self.movie_tilt_pair)
+
+    def set_state_max_entries(self, max_entries: int):
+        self.state_max_entries = max_entries
+        for store in self._state_stores():
+            store.max_entries = max_entries
+
+    def state_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {store.name: store.stats()._asdict() for store in self._state_stores()}
+
     def clear(self):
         self.sources = []
         self.default_destinations = {}
         for w in self.watchers.values():
             w.stop()
         self.watchers = {}
-        self.movies = {}
-        self.movie_tilt_pair = {}
-        self.tilt_angles = {}
+        for store in self._state_stores():
+            store.clear()
         self.visit = ""
         self.dose_per_frame = None
         self.gain_ref = None
@@ -81,6 +81,9 @@ class MultigridController:
             self.token,
             instrument_name=self._environment.instrument_name,
         )
+        self._environment.set_state_max_entries(
+            self._machine_config.get("session_state_max_entries", 100_000)
+        )
         self._data_suffixes = (".mrc", ".tiff", ".tif", ".eer")
         self._data_substrings = [
             s
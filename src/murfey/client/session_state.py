@@ -0,0 +1,311 @@
+"""
+Bounded stores for the state kept by the instrument server over the course of a
+session.
+
+Sessions can run for a week and see millions of movies, so the per-file state built
+up as they are transferred cannot all be kept in memory. Each store keeps the most
+recently used entries in memory, up to a maximum number of entries, and spills the
+least recently used ones to an SQLite file on local disk. Spilled entries are read
+back into memory the next time they are looked up, so the store behaves like a
+dictionary regardless of where its entries are. Entries that are not expected to be
+used again, such as those of completed tilt series, can be compacted straight to
+disk without waiting for them to age out of memory.
+
+Each entry lives either in memory or on disk, never both, so values can be mutated
+in place while they are in memory. Values that are mutated in place should be
+assigned back to the store afterwards, in case they were spilled in the meantime.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterator,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+logger = logging.getLogger("murfey.client.session_state")
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+# Number of in-memory entries pickled to estimate the memory used by the store
+_MEMORY_SAMPLE_SIZE = 64
+_MISSING: Any = object()
+
+
+class SessionStateStats(NamedTuple):
+    name: str
+    entries: int
+    entries_in_memory: int
+    entries_on_disk: int
+    memory_bytes: int  # Estimated from the pickled size of a sample of the entries
+    disk_bytes: int
+    evictions: int
+    disk_reads: int
+    compactions: int
+
+
+def _close_spill_file(db: sqlite3.Connection, path: Path, delete: bool):
+    db.close()
+    if delete:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(f"{path}{suffix}")
+            except FileNotFoundError:
+                pass
+
+
+class SessionStateStore(MutableMapping[K, V], Generic[K, V]):
+    """
+    A dictionary holding at most 'max_entries' entries in memory, with the least
+    recently used entries beyond that spilled to an SQLite file. The keys are
+    stored on disk as strings, and turned back into keys with 'key_type'.
+
+    If no path is given, the entries are spilled to a temporary file that is removed
+    when the store is closed. A store given a path keeps all its entries there when it
+    is closed, and a store given the path of an existing file picks them up again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        key_type: Callable[[str], K] = str,  # type: ignore[assignment]
+        max_entries: int = 100_000,
+        path: Optional[Path] = None,
+    ):
+        self.name = name
+        self.lock = threading.RLock()
+        self._key_type = key_type
+        self._max_entries = max(max_entries, 1)
+        self._path = path
+        self._memory: OrderedDict[K, V] = OrderedDict()
+        # The spill file is only created once something is spilled to it
+        self._db: Optional[sqlite3.Connection] = None
+        self._close: Optional[weakref.finalize] = None
+        self._on_disk = 0
+        self._evictions = 0
+        self._disk_reads = 0
+        self._compactions = 0
+        if path is not None and path.exists():
+            self._open()
+
+    @property
+    def max_entries(self) -> int:
+        return self._max_entries
+
+    @max_entries.setter
+    def max_entries(self, max_entries: int):
+        with self.lock:
+            self._max_entries = max(max_entries, 1)
+            self._evict()
+
+    def _open(self) -> sqlite3.Connection:
+        if self._db is not None:
+            return self._db
+        if self._path is None:
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=f"murfey-{self.name}-", suffix=".sqlite"
+            )
+            os.close(fd)
+            path, delete = Path(tmp_path), True
+        else:
+            path, delete = self._path, False
+        db = sqlite3.connect(path, check_same_thread=False)
+        # The spill file is a cache rather than a record, so it isn't synced to disk
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB)"
+        )
+        db.commit()
+        self._on_disk = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self._db = db
+        self._close = weakref.finalize(self, _close_spill_file, db, path, delete)
+        logger.debug(f"Spilling {self.name} session state to {path}")
+        return db
+
+    def close(self):
+        """
+        Closes the store, saving the entries in memory to disk first if the store
+        was given a path to keep them at
+        """
+        with self.lock:
+            if self._path is not None and self._memory:
+                self._spill(list(self._memory.items()))
+            if self._close is not None:
+                self._close()
+            self._db = None
+            self._close = None
+            self._memory.clear()
+            self._on_disk = 0
+
+    def _spill(self, items: List[Tuple[K, V]]):
+        db = self._open()
+        db.executemany(
+            "INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+            (
+                (str(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                for key, value in items
+            ),
+        )
+        db.commit()
+        self._on_disk += len(items)
+
+    def _evict(self):
+        if len(self._memory) <= self._max_entries:
+            return
+        # Spill a tenth of the working set at a time, so that the cost of writing
+        # to disk is spread over many insertions
+        num_to_evict = len(self._memory) - self._max_entries
+        num_to_evict += self._max_entries // 10
+        num_to_evict = min(num_to_evict, len(self._memory))
+        self._spill([self._memory.popitem(last=False) for _ in range(num_to_evict)])
+        self._evictions += num_to_evict
+
+    def _delete_from_disk(self, key: K) -> bool:
+        if not self._on_disk or self._db is None:
+            return False
+        deleted = self._db.execute(
+            "DELETE FROM entries WHERE key = ?", (str(key),)
+        ).rowcount
+        # Committed along with the next spill, as nothing else reads the file
+        self._on_disk -= deleted
+        return bool(deleted)
+
+    def _read_from_disk(self, key: K) -> V:
+        """
+        Takes an entry off the disk, so that it can be moved back into memory
+        """
+        if not self._on_disk or self._db is None:
+            raise KeyError(key)
+        row = self._db.execute(
+            "SELECT value FROM entries WHERE key = ?", (str(key),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        self._delete_from_disk(key)
+        self._disk_reads += 1
+        return pickle.loads(row[0])
+
+    def __getitem__(self, key: K) -> V:
+        with self.lock:
+            value = self._memory.get(key, _MISSING)
+            if value is not _MISSING:
+                self._memory.move_to_end(key)
+                return value
+            value = self._read_from_disk(key)
+            self._memory[key] = value
+            self._evict()
+            return value
+
+    def __setitem__(self, key: K, value: V):
+        with self.lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+            else:
+                self._delete_from_disk(key)
+            self._memory[key] = value
+            self._evict()
+
+    def __delitem__(self, key: K):
+        with self.lock:
+            if self._memory.pop(key, _MISSING) is _MISSING:
+                if not self._delete_from_disk(key):
+                    raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        with self.lock:
+            if key in self._memory:
+                return True
+            if not self._on_disk or self._db is None:
+                return False
+            return (
+                self._db.execute(
+                    "SELECT 1 FROM entries WHERE key = ?", (str(key),)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self) -> int:
+        return len(self._memory) + self._on_disk
+
+    def __iter__(self) -> Iterator[K]:
+        # Iterates over a snapshot of the keys, so the store can be changed meanwhile
+        with self.lock:
+            keys = list(self._memory)
+            if self._on_disk and self._db is not None:
+                keys.extend(
+                    self._key_type(key)
+                    for (key,) in self._db.execute("SELECT key FROM entries")
+                )
+        return iter(keys)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}({self.name!r}, entries={len(self)}, "
+            f"max_entries={self._max_entries})"
+        )
+
+    def clear(self):
+        with self.lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.commit()
+            self._on_disk = 0
+
+    def compact(self, key: K):
+        """
+        Moves an entry that is not expected to be used again straight to disk
+        """
+        with self.lock:
+            value = self._memory.pop(key, _MISSING)
+            if value is _MISSING:
+                value = self._read_from_disk(key)
+            self._spill([(key, value)])
+            self._compactions += 1
+
+    def stats(self) -> SessionStateStats:
+        with self.lock:
+            entries_in_memory = len(self._memory)
+            sample = list(itertools.islice(self._memory.items(), _MEMORY_SAMPLE_SIZE))
+            memory_bytes = 0
+            if sample:
+                sample_bytes = sum(
+                    len(pickle.dumps(item, pickle.HIGHEST_PROTOCOL)) for item in sample
+                )
+                memory_bytes = sample_bytes * entries_in_memory // len(sample)
+            disk_bytes = 0
+            if self._db is not None:
+                page_count = self._db.execute("PRAGMA page_count").fetchone()[0]
+                page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+                disk_bytes = page_count * page_size
+            return SessionStateStats(
+                name=self.name,
+                entries=entries_in_memory + self._on_disk,
+                entries_in_memory=entries_in_memory,
+                entries_on_disk=self._on_disk,
+                memory_bytes=memory_bytes,
+                disk_bytes=disk_bytes,
+                evictions=self._evictions,
+                disk_reads=self._disk_reads,
+                compactions=self._compactions,
+            )
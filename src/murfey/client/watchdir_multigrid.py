@@ -1,3 +1,15 @@
+"""
+Watches the top-level directory of a multigrid session for new grids, notifying
+listeners of the metadata, fraction and atlas directories to transfer as they appear.
+
+Rather than globbing the whole directory tree on a timer, the directory listings are
+cached against the modification time of each directory, so that only directories
+whose entries have changed are listed again. Where the platform supports it, the
+watcher waits for the directories it has listed to change, so that new grids are
+picked up as soon as they appear and nothing is looked at in between, with a pass
+over the directories on a timer as a fallback.
+"""
+
 from __future__ import annotations
 
 import logging
@@ -5,23 +17,50 @@ import os
 import threading
 import time
 from pathlib import Path
-from typing import List
+from typing import Dict, NamedTuple, Optional, Set
 
+from murfey.client.directory_events import DirectoryEvents, directory_events
 from murfey.util.client import Observer
 
 log = logging.getLogger("murfey.client.watchdir_multigrid")
 
+# Directories modified more recently than this are always listed again, as further
+# changes within the resolution of their modification times would go unnoticed
+_MTIME_RESOLUTION_NS = 2_000_000_000
+
+
+class _Listing(NamedTuple):
+    mtime_ns: int
+    entries: Dict[str, bool]  # Entry name -> whether it is a directory
+
+
+class MultigridWatcherStats(NamedTuple):
+    notifier: str  # How changes to directories are watched for
+    passes: int
+    directory_listings: int
+    last_pass_seconds: float
+    total_pass_seconds: float
+    directories_detected: int
+    # Time between a directory appearing and listeners being notified of it
+    last_detection_latency: Optional[float]
+    max_detection_latency: Optional[float]
+
 
 class MultigridDirWatcher(Observer):
     def __init__(
         self,
         path: str | os.PathLike,
         machine_config: dict,
+        poll_interval: float = 15,
     ):
         super().__init__()
         self._basepath = Path(path)
         self._machine_config = machine_config
-        self._seen_dirs: List[Path] = []
+        self._poll_interval = poll_interval
+        self._seen_dirs: Set[Path] = set()
+        self._listings: Dict[str, _Listing] = {}
+        # Replaced when the thread starts, if changes can be watched for
+        self._events: DirectoryEvents = DirectoryEvents()
         self.thread = threading.Thread(
             name=f"MultigridDirWatcher {self._basepath}",
             target=self._process,
@@ -30,6 +69,14 @@ class MultigridDirWatcher(Observer):
         # Toggleable settings
         self._analyse = True
         self._stopping = False
+        # Metrics
+        self._passes = 0
+        self._directory_listings = 0
+        self._last_pass_seconds = 0.0
+        self._total_pass_seconds = 0.0
+        self._directories_detected = 0
+        self._last_detection_latency: Optional[float] = None
+        self._max_detection_latency: Optional[float] = None
 
     def start(self):
         if self.thread.is_alive():
@@ -40,15 +87,79 @@ class MultigridDirWatcher(Observer):
     def request_stop(self):
         self._stopping = True
         self._halt_thread = True
+        self._events.wake()
 
     def stop(self):
         log.debug("MultigridDirWatcher thread stop requested")
         self._stopping = True
         self._halt_thread = True
+        self._events.wake()
         if self.thread.is_alive():
             self.thread.join()
         log.debug("MultigridDirWatcher thread stop completed")
 
+    def stats(self) -> MultigridWatcherStats:
+        return MultigridWatcherStats(
+            notifier=self._events.name,
+            passes=self._passes,
+            directory_listings=self._directory_listings,
+            last_pass_seconds=self._last_pass_seconds,
+            total_pass_seconds=self._total_pass_seconds,
+            directories_detected=self._directories_detected,
+            last_detection_latency=self._last_detection_latency,
+            max_detection_latency=self._max_detection_latency,
+        )
+
+    def _entries(self, directory: Path) -> Dict[str, bool]:
+        """
+        Returns the entries of a directory, only listing it again if it has changed
+        since it was last listed
+        """
+        key = os.fspath(directory)
+        try:
+            mtime_ns = os.stat(key).st_mtime_ns
+        except OSError:
+            self._listings.pop(key, None)
+            return {}
+        listing = self._listings.get(key)
+        if (
+            listing is not None
+            and listing.mtime_ns == mtime_ns
+            and time.time_ns() - mtime_ns > _MTIME_RESOLUTION_NS
+        ):
+            return listing.entries
+        # Watch before listing, so that nothing added in between is missed
+        self._events.watch(key)
+        entries = {}
+        try:
+            with os.scandir(key) as it:
+                for entry in it:
+                    try:
+                        entries[entry.name] = entry.is_dir()
+                    except OSError:
+                        entries[entry.name] = False
+        except OSError:
+            return {}
+        self._listings[key] = _Listing(mtime_ns, entries)
+        self._directory_listings += 1
+        return entries
+
+    def _is_dir(self, path: Path) -> bool:
+        return self._entries(path.parent).get(path.name, False)
+
+    def _is_file(self, path: Path) -> bool:
+        return self._entries(path.parent).get(path.name) is False
+
+    def _detected(self, directory: Path):
+        # Directories appear when their parent directory was last modified
+        listing = self._listings.get(os.fspath(directory.parent))
+        self._directories_detected += 1
+        if listing is None:
+            return
+        latency = max(time.time() - listing.mtime_ns / 1e9, 0)
+        self._last_detection_latency = latency
+        self._max_detection_latency = max(self._max_detection_latency or 0, latency)
+
     def _handle_metadata(self, directory: Path, extra_directory: str, limited=True):
         """
         Handles all unknown directories in the visit folder
@@ -56,6 +167,7 @@ class MultigridDirWatcher(Observer):
         named using "extra_directory"
         For SPA and Tomo this is metadata, for SXT this will be both metadata and data
         """
+        self._detected(directory)
         self.notify(
             directory,
             extra_directory=extra_directory,
@@ -63,85 +175,115 @@ class MultigridDirWatcher(Observer):
             limited=limited,
             tag="metadata",
         )
-        self._seen_dirs.append(directory)
+        self._seen_dirs.add(directory)
 
     def _handle_fractions(self, directory: Path):
         processing_started = False
-        if directory.is_dir() and directory not in self._seen_dirs:
+        if directory not in self._seen_dirs and self._is_dir(directory):
             # Check contents, and skip .gain files written by EPU
-            directory_children = [d for d in directory.iterdir() if d.suffix != ".gain"]
+            directory_children = [
+                directory / name
+                for name in sorted(self._entries(directory))
+                if Path(name).suffix != ".gain"
+            ]
             for d02 in directory_children:
                 # Transfer each Images-Disc folder as a separate rsyncer
                 if d02.name.startswith("Images-Disc") and d02 not in self._seen_dirs:
+                    self._detected(d02)
                     self.notify(
                         d02,
                         remove_files=True,
                         analyse=self._analyse,
                         tag="fractions",
                     )
-                    self._seen_dirs.append(d02)
+                    self._seen_dirs.add(d02)
                 processing_started = d02 in self._seen_dirs
             if not processing_started and directory_children:
                 # Tomography case of full directory transfer if no Images-Disc1
+                self._detected(directory)
                 self.notify(
                     directory,
                     analyse=self._analyse,
                     tag="fractions",
                 )
-                self._seen_dirs.append(directory)
+                self._seen_dirs.add(directory)
 
-    def _process(self):
-        while not self._stopping:
-            for d in self._basepath.glob("*"):
-                if d.name.startswith("New folder"):
-                    self._seen_dirs.append(d)
-                elif d.name in self._machine_config["create_directories"]:
-                    if d.is_dir() and d not in self._seen_dirs:
-                        self.notify(
-                            d,
-                            use_suggested_path=False,
-                            analyse=(
-                                (
-                                    d.name
-                                    in self._machine_config[
-                                        "analyse_created_directories"
-                                    ]
+    def _scan(self):
+        entries = self._entries(self._basepath)
+        for name in sorted(entries):
+            d = self._basepath / name
+            d_is_dir = entries[name]
+            if d.name.startswith("New folder"):
+                self._seen_dirs.add(d)
+            elif d.name in self._machine_config["create_directories"]:
+                if d_is_dir and d not in self._seen_dirs:
+                    self._detected(d)
+                    self.notify(
+                        d,
+                        use_suggested_path=False,
+                        analyse=(
+                            (
+                                d.name
+                                in self._machine_config["analyse_created_directories"]
+                            )
+                            if self._analyse
+                            else False
+                        ),
+                        tag="atlas",
+                    )
+                    self._seen_dirs.add(d)
+            else:
+                # hack for tomo multigrid metadata structure
+                sample_dirs = (
+                    [
+                        d / sample
+                        for sample in sorted(self._entries(d))
+                        if sample.startswith("Sample")
+                    ]
+                    if d_is_dir
+                    else []
+                )
+                if sample_dirs:
+                    for sample in sample_dirs:
+                        if self._is_file(sample / "Session.dm"):
+                            # Transfer only folders where a tomo session exists
+                            if sample not in self._seen_dirs:
+                                self._handle_metadata(
+                                    sample,
+                                    extra_directory=f"metadata_{sample.parent.name}_{sample.name}",
                                 )
-                                if self._analyse
-                                else False
-                            ),
-                            tag="atlas",
+                            self._handle_fractions(
+                                sample.parent.parent.parent
+                                / f"{sample.parent.name}_{sample.name}",
+                            )
+
+                elif self._machine_config["single_data_directory"]:
+                    if d_is_dir and d not in self._seen_dirs:
+                        self._handle_metadata(
+                            d, extra_directory=f"{d.name}", limited=False
                         )
-                        self._seen_dirs.append(d)
-                else:
-                    # hack for tomo multigrid metadata structure
-                    sample_dirs = list(d.glob("Sample*"))
-                    if d.is_dir() and len(sample_dirs):
-                        for sample in sample_dirs:
-                            if (sample / "Session.dm").is_file():
-                                # Transfer only folders where a tomo session exists
-                                if sample not in self._seen_dirs:
-                                    self._handle_metadata(
-                                        sample,
-                                        extra_directory=f"metadata_{sample.parent.name}_{sample.name}",
-                                    )
-                                self._handle_fractions(
-                                    sample.parent.parent.parent
-                                    / f"{sample.parent.name}_{sample.name}",
-                                )
 
-                    elif self._machine_config["single_data_directory"]:
-                        if d.is_dir() and d not in self._seen_dirs:
-                            self._handle_metadata(
-                                d, extra_directory=f"{d.name}", limited=False
-                            )
+                else:
+                    if d_is_dir and d not in self._seen_dirs:
+                        self._handle_metadata(d, extra_directory=f"metadata_{d.name}")
+                    self._handle_fractions(d.parent.parent / d.name)
 
-                    else:
-                        if d.is_dir() and d not in self._seen_dirs:
-                            self._handle_metadata(
-                                d, extra_directory=f"metadata_{d.name}"
-                            )
-                        self._handle_fractions(d.parent.parent / d.name)
-            time.sleep(15)
+    def _process(self):
+        self._events = directory_events(
+            windows_change_notifications=self._machine_config.get(
+                "windows_change_notifications", False
+            )
+        )
+        if self._stopping:
+            self._events.wake()
+        while not self._stopping:
+            start = time.perf_counter()
+            self._scan()
+            self._last_pass_seconds = time.perf_counter() - start
+            self._total_pass_seconds += self._last_pass_seconds
+            self._passes += 1
+            # Returns as soon as a watched directory changes
+            self._events.wait(self._poll_interval)
+        self._events.close()
 
         self.notify(final=True)
@@ -3,6 +3,7 @@ from __future__ import annotations
 import secrets
 import subprocess
 import time
+from dataclasses import asdict
 from datetime import datetime
 from functools import partial
 from logging import getLogger
@@ -12,7 +13,7 @@ from typing import Annotated, Any, Optional
 from urllib.parse import urlparse
 
 import requests
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
@@ -22,11 +23,12 @@ from murfey.client.multigrid_control import MultigridController
 from murfey.client.rsync import RSyncer
 from murfey.client.watchdir_multigrid import MultigridDirWatcher
 from murfey.instrument_server import murfey_server_url
+from murfey.instrument_server.gain_references import gain_reference_catalogue
 from murfey.util import posix_path, sanitise, sanitise_nonpath, secure_path
 from murfey.util.api import url_path_for
 from murfey.util.client import read_config
 from murfey.util.instrument_models import MultigridWatcherSpec
-from murfey.util.models import File, Token
+from murfey.util.models import GainReferenceFile, Token
 
 logger = getLogger("murfey.instrument_server.api")
 
@@ -228,6 +230,16 @@ def stop_multigrid_watcher(session_id: MurfeySessionID, label: str):
     return {"success": True}
 
 
+@router.get("/sessions/{session_id}/multigrid_watcher/stats")
+def get_multigrid_watcher_stats(session_id: MurfeySessionID):
+    if session_id not in watchers:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No multigrid watcher found for session {session_id}",
+        )
+    return watchers[session_id].stats()._asdict()
+
+
 @router.get("/sessions/{session_id}/multigrid_controller/status")
 def check_multigrid_controller_status(
     session_id: MurfeySessionID,
@@ -241,6 +253,16 @@ def check_multigrid_controller_status(
     return {"exists": False}
 
 
+@router.get("/sessions/{session_id}/multigrid_controller/state")
+def get_multigrid_controller_state_stats(session_id: MurfeySessionID):
+    if session_id not in controllers:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No multigrid controller found for session {session_id}",
+        )
+    return controllers[session_id]._environment.state_stats()
+
+
 @router.post("/sessions/{session_id}/multigrid_controller/visit_end_time")
 def update_multigrid_controller_visit_end_time(
     session_id: MurfeySessionID, end_time: datetime
@@ -310,6 +332,8 @@ class ObserverInfo(BaseModel):
     alive: bool
     stopping: bool
     num_files_skipped: int = 0
+    worker_queue_depths: list[int] = []
+    stage_timings: dict[str, dict[str, float]] = {}
 
 
 @router.get("/sessions/{session_id}/rsyncer_info")
@@ -343,9 +367,13 @@ def get_analyser_info(session_id: MurfeySessionID) -> list[ObserverInfo]:
             ObserverInfo(
                 source=str(k),
                 num_files_transferred=0,
-                num_files_in_queue=v.queue.qsize(),
+                num_files_in_queue=v.num_files_in_queue,
                 alive=v.thread.is_alive(),
                 stopping=v._stopping,
+                worker_queue_depths=[q.qsize() for q in v.worker_queues],
+                stage_timings={
+                    stage: asdict(timing) for stage, timing in v.stage_timings.items()
+                },
             )
         )
     return info
@@ -383,32 +411,76 @@ def register_processing_parameters(
     return {"success": True}
 
 
+# Instrument name -> (time fetched, machine config)
+_machine_configs: dict[str, tuple[float, dict[str, Any]]] = {}
+_machine_config_ttl = 300  # In seconds
+# How long a request waits for the gain reference directory to be indexed, if it
+# hasn't been already, before returning the gain references found so far
+_gain_reference_index_timeout = 10  # In seconds
+# Requests ask for the gain references to be brought up to date in the background if
+# they are older than this
+_gain_reference_max_age = 5  # In seconds
+
+
+def _get_machine_config(instrument_name: str, session_id: int) -> dict[str, Any]:
+    """
+    Returns the machine config from the Murfey server, fetching it at most once
+    every few minutes. Failed responses are not kept, so they are retried.
+    """
+    cached = _machine_configs.get(instrument_name)
+    if cached is not None and time.monotonic() - cached[0] < _machine_config_ttl:
+        return cached[1]
+    response = requests.get(
+        f"{_get_murfey_url()}{url_path_for('session_control.router', 'machine_info_by_instrument', instrument_name=sanitise_nonpath(instrument_name))}",
+        headers={"Authorization": f"Bearer {tokens[session_id]}"},
+    )
+    machine_config = response.json()
+    if response.status_code == 200:
+        _machine_configs[instrument_name] = (time.monotonic(), machine_config)
+    return machine_config
+
+
 @router.get(
     "/instruments/{instrument_name}/sessions/{session_id}/possible_gain_references"
 )
 def get_possible_gain_references(
-    instrument_name: str, session_id: MurfeySessionID
-) -> list[File]:
-    machine_config = requests.get(
-        f"{_get_murfey_url()}{url_path_for('session_control.router', 'machine_info_by_instrument', instrument_name=sanitise_nonpath(instrument_name))}",
-        headers={"Authorization": f"Bearer {tokens[session_id]}"},
-    ).json()
-    candidates = []
-    for gf in secure_path(
-        Path(machine_config["gain_reference_directory"]), keep_spaces=True
-    ).glob("**/*"):
-        if gf.is_file():
-            candidates.append(
-                File(
-                    name=gf.name,
-                    description="",
-                    size=gf.stat().st_size / 1e6,
-                    timestamp=datetime.fromtimestamp(gf.stat().st_mtime),
-                    full_path=str(gf),
-                )
-            )
-    candidates.sort(key=lambda x: x.timestamp, reverse=True)
-    return candidates
+    instrument_name: str,
+    session_id: MurfeySessionID,
+    response: Response,
+    detector: Optional[str] = None,
+    file_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> list[GainReferenceFile]:
+    """
+    Returns the files in the gain reference directory, newest first. The total
+    number of files matching the filters is given in the 'X-Total-Count' header.
+    """
+    machine_config = _get_machine_config(instrument_name, session_id)
+    catalogue = gain_reference_catalogue(
+        secure_path(Path(machine_config["gain_reference_directory"]), keep_spaces=True)
+    )
+    if not catalogue.wait_until_ready(_gain_reference_index_timeout):
+        logger.warning(
+            "The gain reference directory is still being indexed; "
+            f"returning the {len(catalogue)} gain references found so far"
+        )
+    else:
+        # Gain references collected since the catalogue was last refreshed are picked
+        # up in the background, so that requests don't wait on the file system
+        catalogue.request_refresh(_gain_reference_max_age)
+    total, gain_references = catalogue.query(
+        detector=detector,
+        file_type=file_type,
+        since=since,
+        until=until,
+        offset=offset,
+        limit=limit,
+    )
+    response.headers["X-Total-Count"] = str(total)
+    return [gain_reference.as_file() for gain_reference in gain_references]
 
 
 class GainReference(BaseModel):
@@ -0,0 +1,367 @@
+"""
+Catalogue of the gain reference files in the gain reference directory of an
+instrument.
+
+The gain reference directory is often a network share holding years of references,
+so rather than walking it whenever the gain references are asked for, it is indexed
+by a background thread. Each directory is only listed again when its modification
+time changes, which happens whenever files are added to, removed from or renamed
+within it. Files rewritten in place don't change the modification time of their
+directory, so the files in the directories that haven't changed are looked at with a
+single stat each instead. Requests are answered from the catalogue as it stands, with
+the results for each combination of filters kept sorted by recency, so that the cost
+of a request does not depend on the number of files in the directory. If the
+catalogue hasn't been refreshed recently, they also wake the background thread to
+bring it up to date, without waiting for it to do so.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+from stat import S_ISREG
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from murfey.util.models import GainReferenceFile
+
+logger = getLogger("murfey.instrument_server.gain_references")
+
+# File types of the gain references, by file extension. The gain references for EER
+# files written by Falcon detectors have their own extension.
+_FILE_TYPES = {
+    ".gain": "eer",
+    ".dm4": "dm4",
+    ".mrc": "mrc",
+    ".tif": "tiff",
+    ".tiff": "tiff",
+}
+_DETECTOR_PATTERNS = (
+    ("falcon", re.compile(r"falcon|(?<![a-z0-9])f4i?(?![a-z0-9])")),
+    ("k3", re.compile(r"(?<![a-z0-9])k3(?![0-9])")),
+    ("k2", re.compile(r"(?<![a-z0-9])k2(?![0-9])")),
+)
+
+
+def file_type_of(name: str) -> str:
+    suffix = os.path.splitext(name)[1].lower()
+    return _FILE_TYPES.get(suffix, suffix.lstrip("."))
+
+
+def detector_hint(name: str, file_type: str) -> Optional[str]:
+    """
+    Works out which detector a gain reference is for from its file name, falling
+    back on its file type
+    """
+    lowered = name.lower()
+    for detector, pattern in _DETECTOR_PATTERNS:
+        if pattern.search(lowered):
+            return detector
+    if file_type == "eer":
+        return "falcon"
+    return None
+
+
+class GainReference(NamedTuple):
+    path: str
+    name: str
+    size: int  # In bytes
+    mtime: float
+    file_type: str
+    detector: Optional[str]
+
+    def as_file(self) -> GainReferenceFile:
+        return GainReferenceFile(
+            name=self.name,
+            description="",
+            size=int(self.size / 1e6 + 0.5),  # In MB, rounded to the nearest
+            timestamp=datetime.fromtimestamp(self.mtime),
+            full_path=self.path,
+            size_bytes=self.size,
+            file_type=self.file_type,
+            detector=self.detector,
+        )
+
+
+class _Directory(NamedTuple):
+    mtime_ns: int
+    files: Dict[str, GainReference]
+    subdirectories: list[str]
+
+
+class _View(NamedTuple):
+    gain_references: list[GainReference]  # Newest first
+    keys: list[float]  # Negated modification times, in ascending order
+
+
+class GainReferenceCatalogue:
+    """
+    The gain reference files in a directory and its subdirectories, kept up to date
+    by a background thread once started
+    """
+
+    def __init__(self, directory: Path, refresh_interval: float = 60):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self._directories: Dict[str, _Directory] = {}
+        # Incremented whenever the files in the catalogue change
+        self._version = 0
+        # Sorted and filtered views of the files, made as they are asked for and
+        # dropped when the files change
+        self._views: Dict[Tuple[Optional[str], Optional[str]], _View] = {}
+        self._views_version = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh: Optional[float] = None  # Time the last refresh started
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        # Set to refresh the catalogue before the refresh interval is up
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(d.files) for d in self._directories.values())
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name=f"gain_reference_catalogue:{self.directory}",
+                daemon=True,
+            )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Cleared before refreshing, so that refreshes asked for while this one
+            # is underway are not lost
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.warning(
+                    f"Failed to index gain references in {str(self.directory)!r}",
+                    exc_info=True,
+                )
+            finally:
+                self._ready.set()
+            self._wake.wait(self.refresh_interval)
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def _scan_directory(
+        self, directory: str, previous: Optional[_Directory], mtime_ns: int
+    ) -> _Directory:
+        files: Dict[str, GainReference] = {}
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                    continue
+                try:
+                    # This is the only stat made on the file, and is free on
+                    # Windows, where it comes with the directory listing
+                    file_stat = entry.stat()
+                except OSError:
+                    continue
+                if not S_ISREG(file_stat.st_mode):
+                    continue
+                existing = previous.files.get(entry.name) if previous else None
+                if (
+                    existing is not None
+                    and existing.mtime == file_stat.st_mtime
+                    and existing.size == file_stat.st_size
+                ):
+                    files[entry.name] = existing
+                    continue
+                file_type = file_type_of(entry.name)
+                files[entry.name] = GainReference(
+                    path=entry.path,
+                    name=entry.name,
+                    size=file_stat.st_size,
+                    mtime=file_stat.st_mtime,
+                    file_type=file_type,
+                    detector=detector_hint(entry.name, file_type),
+                )
+        return _Directory(mtime_ns, files, subdirectories)
+
+    def _check_files(self, previous: _Directory) -> Optional[_Directory]:
+        """
+        Looks at the files of a directory that hasn't changed since it was last
+        listed, returning the directory with its files updated if any of them have
+        been rewritten or removed since
+        """
+        files = dict(previous.files)
+        for name, existing in previous.files.items():
+            try:
+                file_stat = os.stat(existing.path)
+            except OSError:
+                del files[name]
+                continue
+            if (
+                existing.mtime != file_stat.st_mtime
+                or existing.size != file_stat.st_size
+            ):
+                files[name] = existing._replace(
+                    size=file_stat.st_size, mtime=file_stat.st_mtime
+                )
+        if files == previous.files:
+            return None
+        return previous._replace(files=files)
+
+    def refresh(self) -> bool:
+        """
+        Brings the catalogue up to date, only listing the directories that have
+        changed since they were last listed. Returns whether any files changed.
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def request_refresh(self, max_age: float) -> bool:
+        """
+        Wakes the background thread to bring the catalogue up to date, without
+        waiting for it, unless it was last refreshed less than 'max_age' seconds ago.
+        Returns whether a refresh was asked for.
+        """
+        last_refresh = self._last_refresh
+        if last_refresh is not None and time.monotonic() - last_refresh < max_age:
+            return False
+        self._wake.set()
+        return True
+
+    def _refresh(self) -> bool:
+        self._last_refresh = time.monotonic()
+        start = time.perf_counter()
+        updates: Dict[str, _Directory] = {}
+        seen = set()
+        stack = [str(self.directory)]
+        while stack:
+            directory = stack.pop()
+            seen.add(directory)
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            previous = self._directories.get(directory)
+            if previous is None or previous.mtime_ns != mtime_ns:
+                try:
+                    updates[directory] = self._scan_directory(
+                        directory, previous, mtime_ns
+                    )
+                except OSError as e:
+                    logger.debug(f"Unable to list {directory!r}: {e}")
+                    continue
+                stack.extend(updates[directory].subdirectories)
+            else:
+                checked = self._check_files(previous)
+                if checked is not None:
+                    updates[directory] = checked
+                stack.extend(previous.subdirectories)
+        removed = [d for d in self._directories if d not in seen]
+        changed = bool(removed) or any(
+            self._directories.get(d) is None
+            or self._directories[d].files != update.files
+            for d, update in updates.items()
+        )
+        with self._lock:
+            self._directories.update(updates)
+            for directory in removed:
+                del self._directories[directory]
+            if changed:
+                self._version += 1
+        if changed:
+            logger.info(
+                f"Indexed {len(self)} gain references in {str(self.directory)!r} "
+                f"after updating {len(updates)} directories in "
+                f"{time.perf_counter() - start:.2f} s"
+            )
+        return changed
+
+    def _view(self, detector: Optional[str], file_type: Optional[str]) -> _View:
+        with self._lock:
+            if self._views_version != self._version:
+                self._views = {}
+                self._views_version = self._version
+            view = self._views.get((detector, file_type))
+            if view is not None:
+                return view
+            all_files = self._views.get((None, None))
+            if all_files is None:
+                gain_references = sorted(
+                    (
+                        gain_reference
+                        for d in self._directories.values()
+                        for gain_reference in d.files.values()
+                    ),
+                    key=lambda g: (-g.mtime, g.path),
+                )
+                all_files = self._views[(None, None)] = _View(
+                    gain_references, [-g.mtime for g in gain_references]
+                )
+            if detector is None and file_type is None:
+                return all_files
+            gain_references = [
+                g
+                for g in all_files.gain_references
+                if (detector is None or g.detector == detector)
+                and (file_type is None or g.file_type == file_type)
+            ]
+            view = self._views[(detector, file_type)] = _View(
+                gain_references, [-g.mtime for g in gain_references]
+            )
+            return view
+
+    def query(
+        self,
+        detector: Optional[str] = None,
+        file_type: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Tuple[int, list[GainReference]]:
+        """
+        Returns the number of gain references matching the filters, along with the
+        requested page of them, newest first
+        """
+        view = self._view(
+            detector.lower() if detector else None,
+            file_type.lower() if file_type else None,
+        )
+        first = bisect_left(view.keys, -until.timestamp()) if until else 0
+        last = bisect_right(view.keys, -since.timestamp()) if since else len(view.keys)
+        total = max(last - first, 0)
+        start = first + max(offset, 0)
+        stop = last if limit is None else min(last, start + max(limit, 0))
+        return total, view.gain_references[start:stop]
+
+
+_catalogues: Dict[Path, GainReferenceCatalogue] = {}
+_catalogues_lock = threading.Lock()
+
+
+def gain_reference_catalogue(directory: Path) -> GainReferenceCatalogue:
+    """
+    Returns the catalogue of the gain references in a directory, starting to build
+    it in the background if this is the first time it has been asked for
+    """
+    with _catalogues_lock:
+        catalogue = _catalogues.get(directory)
+        if catalogue is None:
+            catalogue = _catalogues[directory] = GainReferenceCatalogue(directory)
+    catalogue.start()
+    return catalogue
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import hashlib
 import secrets
+import threading
 import time
+from collections import OrderedDict
 from logging import getLogger
+from typing import NamedTuple, Optional
 from uuid import uuid4
 
 import aiohttp
@@ -16,9 +20,11 @@ from fastapi.security import (
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import event, inspect
 from sqlmodel import Session, create_engine, select
 from typing_extensions import Annotated, Any
 
+import murfey.server.prometheus as prom
 from murfey.server.murfey_db import murfey_db, url
 from murfey.util.api import url_path_for
 from murfey.util.config import get_security_config
@@ -65,6 +71,147 @@ def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 
+class _CachedValidation(NamedTuple):
+    valid: bool
+    expires_at: float
+    session_id: Optional[int]
+    user: Optional[str]
+
+
+def _unverified_claims(token: str) -> dict[str, Any]:
+    try:
+        return jwt.get_unverified_claims(token)
+    except JWTError:
+        return {}
+
+
+class TokenCache:
+    """
+    Caches the outcomes of token validations, so that repeated requests made with
+    the same token don't each need a round trip to the auth server or the database.
+
+    Entries are keyed on the type of validation and a digest of the token, so the
+    tokens themselves are not kept. Accepted tokens are cached until they expire or
+    for 'max_ttl' seconds, whichever is sooner, and rejected tokens are cached for
+    'negative_ttl' seconds.
+
+    The cache is held by each server process, and invalidating entries only removes
+    them from the process that made the change. When the server runs with several
+    workers, the others keep accepting a revoked token until their entries expire,
+    so 'max_ttl' bounds how long that can happen for.
+    """
+
+    def __init__(self, max_ttl: float, negative_ttl: float, max_entries: int = 10000):
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], _CachedValidation] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(validation: str, token: str | None) -> tuple[str, str]:
+        return validation, hashlib.sha256((token or "").encode()).hexdigest()
+
+    def get(self, validation: str, token: str | None) -> Optional[bool]:
+        """
+        Returns the cached outcome of the validation, or None if there isn't one
+        """
+        key = self._key(validation, token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        # Validations of access to specific visits are counted together
+        label = validation.split(":")[0]
+        if entry is None:
+            prom.auth_cache_misses.labels(validation=label).inc()
+            return None
+        prom.auth_cache_hits.labels(validation=label).inc()
+        return entry.valid
+
+    def set(
+        self,
+        validation: str,
+        token: str | None,
+        valid: bool,
+        claims: dict[str, Any] | None = None,
+    ):
+        """
+        Records the outcome of the validation. The claims of the token are read
+        without verification if not provided, and are used to bound the lifetime of
+        the entry and to look it up for invalidation.
+        """
+        ttl = self.max_ttl if valid else self.negative_ttl
+        if ttl <= 0:
+            return None
+        if claims is None:
+            claims = _unverified_claims(token) if token else {}
+        expires_at = time.time() + ttl
+        for expiry_claim in ("exp", "expiry_time"):
+            if isinstance(claims.get(expiry_claim), (int, float)):
+                expires_at = min(expires_at, claims[expiry_claim])
+        session_id = claims.get("session")
+        entry = _CachedValidation(
+            valid=valid,
+            expires_at=expires_at,
+            session_id=session_id if isinstance(session_id, int) else None,
+            user=claims.get("user"),
+        )
+        key = self._key(validation, token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return None
+
+    def _remove_where(self, condition) -> int:
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if condition(entry)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def invalidate_session(self, session_id: int) -> int:
+        """
+        Removes the cached validations of tokens minted for this session
+        """
+        return self._remove_where(lambda entry: entry.session_id == session_id)
+
+    def invalidate_user(self, username: str) -> int:
+        """
+        Removes the cached validations of tokens belonging to this user
+        """
+        return self._remove_where(lambda entry: entry.user == username)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(
+    max_ttl=security_config.auth_cache_ttl,
+    negative_ttl=security_config.auth_negative_cache_ttl,
+)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_tokens(mapper, connection, target: User):
+    # Covers changes to the password as well as renamed and removed users
+    usernames = {target.username}
+    if (state := inspect(target)) is not None:
+        usernames.update(state.attrs.username.history.deleted)
+    for username in usernames:
+        token_cache.invalidate_user(username)
+
+
 """
 =======================================================================================
 VALIDATION FUNCTIONS
@@ -95,10 +242,10 @@ AUTH_HEADERS = (
 def check_user(username: str) -> bool:
     try:
         with Session(engine) as murfey_db:
-            users = murfey_db.exec(select(User)).all()
+            user = murfey_db.exec(select(User).where(User.username == username)).first()
     except Exception:
         return False
-    return username in [u.username for u in users]
+    return user is not None
 
 
 async def submit_to_auth_endpoint(
@@ -134,13 +281,7 @@ async def submit_to_auth_endpoint(
     return validation_outcome if success and validation_outcome else {"valid": False}
 
 
-async def validate_token(
-    token: Annotated[str, Depends(oauth2_scheme)],
-    request: Request,
-):
-    """
-    Used by the backend routers to validate requests coming in from frontend.
-    """
+async def _validate_token(token: str, request: Request) -> bool:
     try:
         # Validate using auth URL if provided; will error if invalid
         if auth_url:
@@ -162,6 +303,22 @@ async def validate_token(
             else:
                 raise JWTError
     except JWTError:
+        return False
+    return True
+
+
+async def validate_token(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    request: Request,
+):
+    """
+    Used by the backend routers to validate requests coming in from frontend.
+    """
+    valid = token_cache.get("frontend_token", token)
+    if valid is None:
+        valid = await _validate_token(token, request)
+        token_cache.set("frontend_token", token, valid)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials from frontend",
@@ -183,12 +340,7 @@ def validate_session_against_visit(session_id: int, visit: str):
     return visit == session_data[0].visit
 
 
-async def validate_instrument_token(
-    token: Annotated[str, Depends(instrument_oauth2_scheme)],
-):
-    """
-    Used by the backend routers to check the incoming instrument server token.
-    """
+async def _validate_instrument_token(token: str) -> bool:
     try:
         # Validate using auth URL if provided
         if security_config.instrument_auth_url:
@@ -225,6 +377,21 @@ async def validate_instrument_token(
             else:
                 raise JWTError
     except JWTError:
+        return False
+    return True
+
+
+async def validate_instrument_token(
+    token: Annotated[str, Depends(instrument_oauth2_scheme)],
+):
+    """
+    Used by the backend routers to check the incoming instrument server token.
+    """
+    valid = token_cache.get("instrument_token", token)
+    if valid is None:
+        valid = await _validate_instrument_token(token)
+        token_cache.set("instrument_token", token, valid)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials from instrument",
@@ -252,19 +419,24 @@ async def validate_instrument_server_session_access(
     visit_name = get_visit_name(session_id)
 
     if security_config.instrument_auth_url:
-        async with aiohttp.ClientSession() as session:
-            headers = (
-                {}
-                if not security_config.instrument_auth_type
-                else {"Authorization": f"Bearer {token}"}
-            )
-            async with session.get(
-                f"{security_config.instrument_auth_url}/validate_visit_access/{visit_name}",
-                headers=headers,
-            ) as response:
-                success = response.status == 200
-                validation_outcome = await response.json()
-        if not (success and validation_outcome.get("valid")):
+        validation = f"instrument_visit_access:{visit_name}"
+        valid = token_cache.get(validation, token)
+        if valid is None:
+            async with aiohttp.ClientSession() as session:
+                headers = (
+                    {}
+                    if not security_config.instrument_auth_type
+                    else {"Authorization": f"Bearer {token}"}
+                )
+                async with session.get(
+                    f"{security_config.instrument_auth_url}/validate_visit_access/{visit_name}",
+                    headers=headers,
+                ) as response:
+                    success = response.status == 200
+                    validation_outcome = await response.json()
+            valid = bool(success and validation_outcome.get("valid"))
+            token_cache.set(validation, token, valid)
+        if not valid:
             logger.warning("Unauthorised visit access request from instrument")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
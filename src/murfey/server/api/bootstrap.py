@@ -21,7 +21,7 @@ import random
 import re
 import zipfile
 from io import BytesIO
-from typing import Any
+from typing import Any, Optional
 from urllib.parse import quote
 
 import packaging.version
@@ -31,6 +31,11 @@ from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 
 import murfey
 from murfey.server.api import templates
+from murfey.server.package_cache import (
+    PackageNotCached,
+    UpstreamError,
+    get_package_cache,
+)
 from murfey.util.config import get_hostname, get_machine_config, get_microscope
 
 tag = {
@@ -96,6 +101,76 @@ def resolve_netloc(request: Request) -> str:
     return f"{host}:{port}"
 
 
+def _proxy_file(
+    url: str,
+    key: str | None = None,
+    filename: str | None = None,
+    mutable: bool = False,
+    media_type: str | None = None,
+) -> Response:
+    """
+    Returns the file at the given URL. If the package cache is set up, the file is
+    served from disk, being downloaded into the cache first if needed; otherwise, it
+    is streamed through from upstream. Files that can change upstream should be
+    marked as 'mutable', so that the cached copy gets revalidated.
+    """
+    headers: dict[str, str] = {}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    cache = get_package_cache()
+    if cache is None:
+        response = http_session.get(url, stream=True)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code)
+        if response.headers.get("Content-Length"):
+            headers["Content-Length"] = response.headers["Content-Length"]
+        return StreamingResponse(
+            content=response.iter_content(chunk_size=8192),
+            status_code=response.status_code,
+            headers=headers,
+            media_type=response.headers.get("Content-Type", media_type),
+        )
+
+    try:
+        cached = cache.get_index(url, key) if mutable else cache.get_file(url, key)
+    except PackageNotCached:
+        raise HTTPException(status_code=404, detail="File has not been cached")
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code)
+    # FileResponse handles Range requests, and can be sent using sendfile
+    return FileResponse(
+        cached.path,
+        headers=headers,
+        media_type=cached.content_type or media_type,
+    )
+
+
+def _get_index_content(
+    url: str, key: str | None = None
+) -> tuple[bytes, int, Optional[str]]:
+    """
+    Returns the content, status code, and content type of an index page, which can
+    change upstream. The cached copy is used if it is still fresh or if it has been
+    revalidated with the upstream server.
+    """
+    cache = get_package_cache()
+    if cache is None:
+        response = http_session.get(url)
+        return (
+            response.content,
+            response.status_code,
+            response.headers.get("Content-Type"),
+        )
+    try:
+        cached = cache.get_index(url, key)
+    except PackageNotCached:
+        raise HTTPException(status_code=404, detail="Index has not been cached")
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code)
+    return cached.path.read_bytes(), 200, cached.content_type
+
+
 """
 =======================================================================================
 VERSION-RELATED API ENDPOINTS
@@ -190,12 +265,12 @@ def get_murfey_wheel():
     murfey.bootstrap is compatible with all relevant versions of Python.
     This also ignores yanked releases, which again should be fine.
     """
-    full_path_response = http_session.get(f"{pypi_index_url.rstrip('/')}/murfey")
+    content, _, _ = _get_index_content(f"{pypi_index_url.rstrip('/')}/murfey")
     wheels = {}
 
     for wheel_file in re.findall(
         b"<a [^>]*>([^<]*).whl</a>",
-        full_path_response.content,
+        content,
     ):
         try:
             filename = wheel_file.decode("utf-8") + ".whl"
@@ -226,20 +301,10 @@ def get_cygwin_setup():
     Cygwin distribution that then remains on the client machines.
     """
     filename = "setup-x86_64.exe"
-    response = http_session.get(f"https://www.cygwin.com/{filename}")
-
-    # Construct headers to return with response
-    headers: dict[str, str] = {
-        "Content-Disposition": f"attachment; filename=cygwin-{filename}"
-    }
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type"),
+    return _proxy_file(
+        f"https://www.cygwin.com/{filename}",
+        filename=f"cygwin-{filename}",
+        mutable=True,
     )
 
 
@@ -251,16 +316,14 @@ def find_cygwin_mirror() -> str:
     lifetime of the server.
     """
     url = "https://www.cygwin.com/mirrors.lst"
-    mirrors = http_session.get(url)
-    logger.info(
-        f"Reading mirrors from {url} returned status code {mirrors.status_code} {mirrors.reason}"
-    )
+    content, status_code, _ = _get_index_content(url)
+    logger.info(f"Reading mirrors from {url} returned status code {status_code}")
 
     # Don't cache result if we can't get mirrors list
-    assert mirrors.status_code == 200
+    assert status_code == 200
 
     mirror_priorities = {}
-    for mirror in mirrors.content.split(b"\n"):
+    for mirror in content.split(b"\n"):
         mirror_line = mirror.decode("utf-8").strip().split(";")
         if not mirror_line or len(mirror_line) < 4:
             continue
@@ -315,17 +378,15 @@ def parse_cygwin_request(
         )
 
     logger.info(f"Forwarding Cygwin download request to {_sanitise_str(url)}")
-    response = http_session.get(url)
 
-    headers: dict[str, str] = {}
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type"),
+    # Package archives are immutable, but the setup files and directory listings
+    # are updated by the mirrors. Cache them under the request path, so that the
+    # same files are found again regardless of the mirror they were fetched from
+    return _proxy_file(
+        url,
+        key=f"cygwin/{request_path}",
+        mutable=request_path.endswith("/")
+        or request_path.rsplit("/", 1)[-1].startswith("setup"),
     )
 
 
@@ -462,17 +523,9 @@ def get_msys2_setup(
     ):
         raise ValueError(f"{setup_file!r} is not a valid executable")
 
-    response = http_session.get(f"{msys2_url}/distrib/{setup_file}")
-
-    headers: dict[str, str] = {}
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type"),
+    # The 'latest' installers are replaced with each new release
+    return _proxy_file(
+        f"{msys2_url}/distrib/{setup_file}", mutable="latest" in setup_file
     )
 
 
@@ -489,10 +542,9 @@ def get_msys2_main_index(
 
     # Construct URL and get response
     env_url = f"{msys2_url}"
-    response = http_session.get(env_url)
+    content, status_code, content_type = _get_index_content(env_url)
 
     # Parse and rewrite package index content
-    content: bytes = response.content  # Get content in bytes
     content_text: str = content.decode("utf-8")  # Convert to strings
     content_text_list = []
     for line in content_text.splitlines():
@@ -511,8 +563,8 @@ def get_msys2_main_index(
     content_new = content_text_new.encode("utf-8")  # Convert back to bytes
     return Response(
         content=content_new,
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
+        status_code=status_code,
+        media_type=content_type,
     )
 
 
@@ -534,10 +586,9 @@ def get_msys2_environment_index(
 
     # Construct URL to main MSYS repo and get response
     arch_url = f"{msys2_url}/{quote(system, safe='/')}"
-    response = http_session.get(arch_url)
+    content, status_code, content_type = _get_index_content(arch_url)
 
     # Parse and rewrite package index content
-    content: bytes = response.content  # Get content in bytes
     content_text: str = content.decode("utf-8")  # Convert to strings
     content_text_list = []
     for line in content_text.splitlines():
@@ -555,8 +606,8 @@ def get_msys2_environment_index(
     content_new = content_text_new.encode("utf-8")  # Convert back to bytes
     return Response(
         content=content_new,
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
+        status_code=status_code,
+        media_type=content_type,
     )
 
 
@@ -581,11 +632,11 @@ def get_msys2_package_index(
     package_list_url = (
         f"{msys2_url}/{quote(system, safe='/')}/{quote(environment, safe='/')}"
     )
-    response = http_session.get(package_list_url)
+    content, status_code, content_type = _get_index_content(package_list_url)
     return Response(
-        content=response.content,
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
+        content=content,
+        status_code=status_code,
+        media_type=content_type,
     )
 
 
@@ -618,20 +669,10 @@ def get_msys2_package_file(
 
     # Construct URL to main MSYS repo and get response
     package_url = f"{msys2_url}/{quote(system, safe='/')}/{quote(environment, safe='/')}/{quote(package, safe='/')}"
-    response = http_session.get(package_url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
 
-    headers: dict[str, str] = {}
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type"),
-    )
+    # Package archives are immutable, whereas the package databases ('.db' and
+    # '.files' archives and their signatures) are updated as packages are released
+    return _proxy_file(package_url, mutable=".pkg.tar." not in package)
 
 
 """
@@ -712,13 +753,13 @@ def get_index_page():
     Returns a mirror of the https://index.crates.io landing page.
     """
 
-    response = http_session.get(rust_index)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
+    content, status_code, content_type = _get_index_content(rust_index)
+    if status_code != 200:
+        raise HTTPException(status_code=status_code)
     return Response(
-        content=response.content,
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
+        content=content,
+        status_code=status_code,
+        media_type=content_type,
     )
 
 
@@ -799,14 +840,7 @@ def get_index_package_metadata(
 
     # Request and return the metadata as a JSON file
     url = f"{rust_index}/{c1}/{c2}/{package}"
-    response = http_session.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-    return StreamingResponse(
-        response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
-    )
+    return _proxy_file(url, mutable=True)
 
 
 @rust.get("/index/{n}/{package}", response_class=StreamingResponse)
@@ -831,14 +865,7 @@ def get_index_package_metadata_for_short_package_names(
 
     # Request and return the metadata as a JSON file
     url = f"{rust_index}/{n}/{package}"
-    response = http_session.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-    return StreamingResponse(
-        response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
-    )
+    return _proxy_file(url, mutable=True)
 
 
 @rust.get("/crates/{package}/{version}/download", response_class=StreamingResponse)
@@ -862,20 +889,12 @@ def get_rust_package_download(
 
     # Request and return crate from https://static.crates.io
     url = f"{rust_dl}/{package}/{version}/download"
-    response = http_session.get(url)
     file_name = f"{package}-{version}.crate"  # Construct file name to save package as
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-
-    headers = {"Content-Disposition": f'attachment; filename="{file_name}"'}
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type", "application/octet-stream"),
+    return _proxy_file(
+        url,
+        key=f"{rust_dl}/{package}/{file_name}",
+        filename=file_name,
+        media_type="application/octet-stream",
     )
 
 
@@ -995,20 +1014,12 @@ def get_rust_api_package_download(
 
     # Request and return package
     url = f"{rust_api}/api/v1/crates/{package}/{version}/download"
-    response = http_session.get(url)
     file_name = f"{package}-{version}.crate"  # Construct crate name to save as
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-
-    headers = {"Content-Disposition": f'attachment; filename="{file_name}"'}
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type", "application/octet-stream"),
+    return _proxy_file(
+        url,
+        key=f"{rust_dl}/{package}/{file_name}",
+        filename=file_name,
+        media_type="application/octet-stream",
     )
 
 
@@ -1044,20 +1055,7 @@ def get_rust_package_crate(
 
     # Request and return package
     url = f"{rust_dl}/{package}/{crate}"
-    response = http_session.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-
-    headers = {"Content-Disposition": f'attachment; filename="{crate}"'}
-    if response.headers.get("Content-Length"):
-        headers["Content-Length"] = response.headers["Content-Length"]
-
-    return StreamingResponse(
-        content=response.iter_content(chunk_size=8192),
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type", "application/octet-stream"),
-    )
+    return _proxy_file(url, filename=crate, media_type="application/octet-stream")
 
 
 """
@@ -1070,10 +1068,10 @@ python_repo_url = "https://files.pythonhosted.org"
 pypi_index_url = "https://pypi.org/simple/"
 
 
-def _get_full_pypi_path_response(package: str) -> requests.Response:
+def _get_full_pypi_path_response(package: str) -> tuple[bytes, Optional[str]]:
     """
-    Validates the package name, sanitises it if valid, and attempts to return a HTTP
-    response from PyPI.
+    Validates the package name, sanitises it if valid, and attempts to return the
+    content and content type of its simple index page from PyPI.
     """
 
     # Check that a package name follows PEP 503 naming conventions, containing only
@@ -1086,10 +1084,10 @@ def _get_full_pypi_path_response(package: str) -> requests.Response:
 
     # Get HTTP response
     url = f"{pypi_index_url.rstrip('/')}/{package_clean}"
-    response = http_session.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-    return response
+    content, status_code, content_type = _get_index_content(url)
+    if status_code != 200:
+        raise HTTPException(status_code=status_code)
+    return content, content_type
 
 
 @pypi.get("/index/", response_class=Response)
@@ -1098,11 +1096,11 @@ def get_pypi_index():
     Obtain list of all PyPI packages via the simple API (PEP 503).
     """
 
-    response = http_session.get(pypi_index_url)
+    content, status_code, content_type = _get_index_content(pypi_index_url)
     return Response(
-        content=response.content,
-        status_code=response.status_code,
-        media_type=response.headers.get("Content-Type"),
+        content=content,
+        status_code=status_code,
+        media_type=content_type,
     )
 
 
@@ -1122,10 +1120,9 @@ def get_pypi_package_downloads_list(request: Request, package: str) -> Response:
     base_url = f"{scheme}://{netloc}{router_path}"
 
     # Validate package and URL
-    full_path_response = _get_full_pypi_path_response(package)
+    content, content_type = _get_full_pypi_path_response(package)
 
     # Process lines related to PyPI packages in response
-    content: bytes = full_path_response.content  # In bytes
     content_text: str = content.decode("utf-8")  # Convert to strings
 
     # PyPI's simple index now directly points to https://pythonhosted.org
@@ -1137,8 +1134,8 @@ def get_pypi_package_downloads_list(request: Request, package: str) -> Response:
 
     return Response(
         content=content_new,
-        status_code=full_path_response.status_code,
-        media_type=full_path_response.headers.get("Content-Type"),
+        status_code=200,
+        media_type=content_type,
     )
 
 
@@ -1157,18 +1154,7 @@ def get_pypi_file(
 
     package_url = f"{python_repo_url}/packages/{a}/{b}/{c}/{filename}"
     logger.debug(f"Forwarding package request to {package_url!r}")
-    response = http_session.get(package_url, stream=True)
-
-    # Construct headers to return with response
-    headers: dict[str, str] = {}
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code)
-    return StreamingResponse(
-        content=response.raw,
-        status_code=response.status_code,
-        headers=headers,
-        media_type=response.headers.get("Content-Type"),
-    )
+    return _proxy_file(package_url)
 
 
 """
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from fastapi import APIRouter
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from fastapi.responses import FileResponse
 from sqlmodel import select
 
 from murfey.server.murfey_db import murfey_db
+from murfey.server.thumbnails import THUMBNAIL_SIZES, get_thumbnail_cache
 from murfey.util.config import get_machine_config
 from murfey.util.db import DataCollectionGroup, FoilHole, GridSquare
 
@@ -12,6 +16,40 @@ from murfey.util.db import DataCollectionGroup, FoilHole, GridSquare
 router = APIRouter(prefix="/display", tags=["Display"])
 machine_config = get_machine_config()
 
+# Images are only modified if reprocessed, in which case their ETag changes
+IMAGE_CACHE_CONTROL = "public, max-age=3600"
+
+
+def _image_response(
+    image_path: str, size: Optional[int], if_none_match: Optional[str]
+) -> Response:
+    """
+    Returns the image, or a thumbnail of it if a size is given, with a strong ETag
+    derived from the image's path, modification time and size. If the client
+    already holds the current version, a 304 response is returned instead.
+    """
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(
+            status_code=422, detail=f"Thumbnail size must be one of {THUMBNAIL_SIZES}"
+        )
+    thumbnail_cache = get_thumbnail_cache()
+    source = Path(image_path)
+    try:
+        etag = thumbnail_cache.etag(source, size or 0)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip() for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+    if size is None:
+        return FileResponse(source, headers=headers)
+    return FileResponse(
+        thumbnail_cache.get(source, size), headers=headers, media_type="image/jpeg"
+    )
+
 
 @router.get("/instruments/{instrument_name}/instrument_name")
 def get_instrument_display_name(instrument_name: str) -> str:
@@ -34,7 +72,12 @@ def get_mic_image(instrument_name: str):
     "/sessions/{session_id}/data_collection_groups/{dcgid}/grid_squares/{grid_square_name}/image"
 )
 def get_grid_square_img(
-    session_id: int, dcgid: int, grid_square_name: int, db=murfey_db
+    session_id: int,
+    dcgid: int,
+    grid_square_name: int,
+    size: Optional[int] = Query(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+    db=murfey_db,
 ):
     grid_square = db.exec(
         select(GridSquare, DataCollectionGroup)
@@ -43,7 +86,7 @@ def get_grid_square_img(
         .where(DataCollectionGroup.id == dcgid)
         .where(GridSquare.name == grid_square_name)
     ).one()
-    return FileResponse(grid_square[0].image)
+    return _image_response(grid_square[0].image, size, if_none_match)
 
 
 @router.get(
@@ -54,6 +97,8 @@ def get_foil_hole_img(
     dcgid: int,
     grid_square_name: int,
     foil_hole_name: int,
+    size: Optional[int] = Query(default=None),
+    if_none_match: Optional[str] = Header(default=None),
     db=murfey_db,
 ):
     foil_hole = db.exec(
@@ -65,4 +110,4 @@ def get_foil_hole_img(
         .where(DataCollectionGroup.id == dcgid)
         .where(GridSquare.name == grid_square_name)
     ).one()
-    return FileResponse(foil_hole[0].image)
+    return _image_response(foil_hole[0].image, size, if_none_match)
@@ -1,4 +1,5 @@
 import os
+from collections import OrderedDict
 from datetime import datetime
 from logging import getLogger
 from pathlib import Path
@@ -155,6 +156,14 @@ class FractionationParameters(BaseModel):
     fractionation_file_name: str = "eer_fractionation.txt"
 
 
+# The fractionation files most recently set up, keyed by the session and the
+# parameters used for them, so that the clients requesting one for every movie they
+# see are answered without looking up the machine configuration or reading the
+# movie again
+_fractionation_files: OrderedDict[tuple, str] = OrderedDict()
+_max_fractionation_files = 1024
+
+
 @router.post("/visits/{visit_name}/sessions/{session_id}/eer_fractionation_file")
 async def write_eer_fractionation_file(
     visit_name: str,
@@ -162,6 +171,34 @@ async def write_eer_fractionation_file(
     fractionation_params: FractionationParameters,
     db=murfey_db,
 ) -> dict:
+    # The session's processing parameters take precedence over those requested
+    session_parameters = db.exec(
+        select(SessionProcessingParameters).where(
+            SessionProcessingParameters.session_id == session_id
+        )
+    ).all()
+    if session_parameters:
+        fractionation_params.dose_per_frame = session_parameters[0].dose_per_frame
+        fractionation_params.fractionation = session_parameters[0].eer_fractionation
+    registry_key = (
+        session_id,
+        visit_name,
+        fractionation_params.fractionation_file_name,
+        fractionation_params.fractionation,
+        fractionation_params.dose_per_frame,
+        fractionation_params.num_frames,
+    )
+    if (
+        (registered := _fractionation_files.get(registry_key))
+        and (
+            not session_parameters
+            or session_parameters[0].eer_fractionation_file == registered
+        )
+        and Path(registered).is_file()
+    ):
+        _fractionation_files.move_to_end(registry_key)
+        return {"eer_fractionation_file": registered}
+
     instrument_name = (
         db.exec(select(Session).where(Session.id == session_id)).one().instrument_name
     )
@@ -184,19 +221,13 @@ async def write_eer_fractionation_file(
             / secure_filename(fractionation_params.fractionation_file_name)
         )
 
-    session_parameters = db.exec(
-        select(SessionProcessingParameters).where(
-            SessionProcessingParameters.session_id == session_id
-        )
-    ).all()
     if session_parameters:
-        fractionation_params.dose_per_frame = session_parameters[0].dose_per_frame
-        fractionation_params.fractionation = session_parameters[0].eer_fractionation
         session_parameters[0].eer_fractionation_file = str(file_path)
         db.add(session_parameters[0])
         db.commit()
 
     if file_path.is_file():
+        _register_fractionation_file(registry_key, file_path)
         return {"eer_fractionation_file": str(file_path)}
 
     if not fractionation_params.dose_per_frame:
@@ -220,4 +251,12 @@ async def write_eer_fractionation_file(
         frac_file.write(
             f"{num_eer_frames} {fractionation_params.fractionation} {fractionation_params.dose_per_frame / fractionation_params.fractionation}"
         )
+    _register_fractionation_file(registry_key, file_path)
     return {"eer_fractionation_file": str(file_path)}
+
+
+def _register_fractionation_file(registry_key: tuple, file_path: Path):
+    _fractionation_files[registry_key] = str(file_path)
+    _fractionation_files.move_to_end(registry_key)
+    while len(_fractionation_files) > _max_fractionation_files:
+        _fractionation_files.popitem(last=False)
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import asyncio
 import datetime
 import logging
 import os
@@ -8,8 +7,7 @@ from pathlib import Path
 from typing import Annotated, Any, List, Optional
 from urllib.parse import quote
 
-import aiohttp
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from pydantic import BaseModel
 from sqlmodel import select
 from werkzeug.utils import secure_filename
@@ -36,12 +34,17 @@ from murfey.server.api.auth import (
     oauth2_scheme,
     validate_token,
 )
+from murfey.server.instrument_client import instrument_server_client
 from murfey.server.murfey_db import murfey_db
 from murfey.util import sanitise, secure_path
 from murfey.util.api import url_path_for
 from murfey.util.config import get_machine_config
 from murfey.util.db import RsyncInstance, Session, SessionProcessingParameters
-from murfey.util.models import File, MultigridWatcherSetup, UpstreamFileRequestInfo
+from murfey.util.models import (
+    GainReferenceFile,
+    MultigridWatcherSetup,
+    UpstreamFileRequestInfo,
+)
 
 # Create APIRouter class object
 router = APIRouter(
@@ -52,8 +55,6 @@ router = APIRouter(
 
 log = logging.getLogger("murfey.server.api.instrument")
 
-lock = asyncio.Lock()
-
 
 @router.post(
     "/instruments/{instrument_name}/sessions/{session_id}/activate_instrument_server"
@@ -76,19 +77,18 @@ async def activate_instrument_server_for_session(
         {"timestamp": timestamp, "session": session_id, "visit": visit_name},
         token=token_in,
     )
-    async with lock:
+    async with instrument_server_client.lock(session_id):
         instrument_server_tokens[session_id] = {}
         machine_config = get_machine_config(instrument_name=instrument_name)[
             instrument_name
         ]
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'token_handshake_for_session', session_id=session_id)}",
-                json={"access_token": token, "token_type": "bearer"},
-            ) as response:
-                success = response.status == 200
-                instrument_server_token = await response.json()
-                instrument_server_tokens[session_id] = instrument_server_token
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'token_handshake_for_session', session_id=session_id)}",
+            json={"access_token": token, "token_type": "bearer"},
+        ) as response:
+            success = response.status == 200
+            instrument_server_token = await response.json()
+            instrument_server_tokens[session_id] = instrument_server_token
 
     if success:
         log.info("Handshake successful")
@@ -103,18 +103,17 @@ async def check_if_session_is_active(
 ):
     if instrument_server_tokens.get(session_id) is None:
         return {"active": False}
-    async with lock:
-        async with aiohttp.ClientSession() as clientsession:
-            machine_config = get_machine_config(instrument_name=instrument_name)[
-                instrument_name
-            ]
-            async with clientsession.get(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'check_token', session_id=session_id)}",
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as response:
-                return {"active": response.status == 200}
+    async with instrument_server_client.lock(session_id):
+        machine_config = get_machine_config(instrument_name=instrument_name)[
+            instrument_name
+        ]
+        async with instrument_server_client.get(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'check_token', session_id=session_id)}",
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as response:
+            return {"active": response.status == 200}
 
 
 @router.get("/sessions/{session_id}/multigrid_controller/status")
@@ -134,14 +133,13 @@ async def check_multigrid_controller_status(session_id: MurfeySessionID, db=murf
             is None
         ):
             return {"exists": False}
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.get(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'check_multigrid_controller_status', session_id=session_id)}",
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data: dict[str, Any] = await resp.json()
+        async with instrument_server_client.get(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'check_multigrid_controller_status', session_id=session_id)}",
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data: dict[str, Any] = await resp.json()
     else:
         data = {"detail": "No instrument server URL found"}
     log.debug(f"Received response: {data}")
@@ -161,70 +159,69 @@ async def setup_multigrid_watcher(
     if machine_config.instrument_server_url:
         session = db.exec(select(Session).where(Session.id == session_id)).one()
         visit = session.visit
-        async with aiohttp.ClientSession() as clientsession:
-            acquisition_uuid = session.smartem_acquisition_uuid
-            if (
-                SMARTEM_ACTIVE
-                and machine_config.smartem_api_url
-                and acquisition_uuid is None
-            ):
-                log.info("registering an acquisition with smartem")
-                try:
-                    microscope_data = MicroscopeData(instrument_id=instrument_name)
-                    smartem_client = SmartEMAPIClient(
-                        base_url=machine_config.smartem_api_url,
-                        logger=log,
-                        keycloak_client=keycloak_client,
-                    )
-                    acquisition_data = AcquisitionData(
-                        name=visit,
-                        id=visit,
-                        instrument=microscope_data,
-                        storage_path=str(secure_path(watcher_spec.source / visit)),
-                        start_time=datetime.datetime.now(),
-                    )
-                    acquisition_response_data = smartem_client.create_acquisition(
-                        acquisition_data
-                    )
-                    acquisition_uuid = acquisition_response_data.uuid
-                except Exception:
-                    log.warning(
-                        "failed to register acquisition with smartem", exc_info=True
-                    )
-            else:
-                log.info("smartem not configured")
-            if acquisition_uuid is not None:
-                async with clientsession.post(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'update_session', session_id=session_id)}",
-                    parameters={"smartem_acquisition_uuid": acquisition_uuid},
-                    headers={
-                        "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                    },
-                ) as resp:
-                    await resp.json()
-
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'setup_multigrid_watcher', session_id=session_id)}",
-                json={
-                    "source": str(secure_path(watcher_spec.source / visit)),
-                    "visit": visit,
-                    "label": visit,
-                    "instrument_name": instrument_name,
-                    "destination_overrides": {
-                        str(k): v for k, v in watcher_spec.destination_overrides.items()
-                    },
-                    "rsync_restarts": watcher_spec.rsync_restarts,
-                    "visit_end_time": (
-                        str(session.visit_end_time) if session.visit_end_time else None
-                    ),
-                    "acquisition_uuid": acquisition_uuid,
-                    "serialem": watcher_spec.serialem,
-                },
+        acquisition_uuid = session.smartem_acquisition_uuid
+        if (
+            SMARTEM_ACTIVE
+            and machine_config.smartem_api_url
+            and acquisition_uuid is None
+        ):
+            log.info("registering an acquisition with smartem")
+            try:
+                microscope_data = MicroscopeData(instrument_id=instrument_name)
+                smartem_client = SmartEMAPIClient(
+                    base_url=machine_config.smartem_api_url,
+                    logger=log,
+                    keycloak_client=keycloak_client,
+                )
+                acquisition_data = AcquisitionData(
+                    name=visit,
+                    id=visit,
+                    instrument=microscope_data,
+                    storage_path=str(secure_path(watcher_spec.source / visit)),
+                    start_time=datetime.datetime.now(),
+                )
+                acquisition_response_data = smartem_client.create_acquisition(
+                    acquisition_data
+                )
+                acquisition_uuid = acquisition_response_data.uuid
+            except Exception:
+                log.warning(
+                    "failed to register acquisition with smartem", exc_info=True
+                )
+        else:
+            log.info("smartem not configured")
+        if acquisition_uuid is not None:
+            async with instrument_server_client.post(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'update_session', session_id=session_id)}",
+                parameters={"smartem_acquisition_uuid": acquisition_uuid},
                 headers={
                     "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
                 },
             ) as resp:
-                data = await resp.json()
+                await resp.json()
+
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'setup_multigrid_watcher', session_id=session_id)}",
+            json={
+                "source": str(secure_path(watcher_spec.source / visit)),
+                "visit": visit,
+                "label": visit,
+                "instrument_name": instrument_name,
+                "destination_overrides": {
+                    str(k): v for k, v in watcher_spec.destination_overrides.items()
+                },
+                "rsync_restarts": watcher_spec.rsync_restarts,
+                "visit_end_time": (
+                    str(session.visit_end_time) if session.visit_end_time else None
+                ),
+                "acquisition_uuid": acquisition_uuid,
+                "serialem": watcher_spec.serialem,
+            },
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -242,14 +239,13 @@ async def start_multigrid_watcher(session_id: MurfeySessionID, db=murfey_db):
             f"Submitting request to start multigrid watcher for session {session_id} "
             f"with processing {('enabled' if process else 'disabled')}"
         )
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'start_multigrid_watcher', session_id=session_id)}?process={'true' if process else 'false'}",
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'start_multigrid_watcher', session_id=session_id)}?process={'true' if process else 'false'}",
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     log.debug(f"Received response: {data}")
     return data
 
@@ -277,14 +273,13 @@ async def update_visit_end_time(
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'update_multigrid_controller_visit_end_time', session_id=session_id)}?end_time={quote(end_time.isoformat())}",
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'update_multigrid_controller_visit_end_time', session_id=session_id)}?end_time={quote(end_time.isoformat())}",
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -335,23 +330,22 @@ async def pass_proc_params_to_instrument_server(
     ]
     if machine_config.instrument_server_url:
         label = db.exec(select(Session).where(Session.id == session_id)).one().name
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'register_processing_parameters', session_id=session_id)}",
-                json={
-                    "label": label,
-                    "params": {
-                        "dose_per_frame": proc_params.dose_per_frame,
-                        "symmetry": proc_params.symmetry,
-                        "eer_fractionation": proc_params.eer_fractionation,
-                        "gain_ref": session.current_gain_ref,
-                    },
-                },
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'register_processing_parameters', session_id=session_id)}",
+            json={
+                "label": label,
+                "params": {
+                    "dose_per_frame": proc_params.dose_per_frame,
+                    "symmetry": proc_params.symmetry,
+                    "eer_fractionation": proc_params.eer_fractionation,
+                    "gain_ref": session.current_gain_ref,
                 },
-            ) as resp:
-                data = await resp.json()
+            },
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -362,11 +356,10 @@ async def check_instrument_server(instrument_name: MurfeyInstrumentName):
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.get(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'health')}",
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.get(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'health')}",
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -374,21 +367,40 @@ async def check_instrument_server(instrument_name: MurfeyInstrumentName):
     "/instruments/{instrument_name}/sessions/{session_id}/possible_gain_references"
 )
 async def get_possible_gain_references(
-    instrument_name: MurfeyInstrumentName, session_id: MurfeySessionID
-) -> List[File]:
+    instrument_name: MurfeyInstrumentName,
+    session_id: MurfeySessionID,
+    response: Response,
+    detector: Optional[str] = None,
+    file_type: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> List[GainReferenceFile]:
     data = []
     machine_config = get_machine_config(instrument_name=instrument_name)[
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with lock:
+        async with instrument_server_client.lock(session_id):
             token = instrument_server_tokens[session_id]["access_token"]
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.get(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'get_possible_gain_references', instrument_name=sanitise(instrument_name), session_id=session_id)}",
-                headers={"Authorization": f"Bearer {token}"},
-            ) as resp:
-                data = await resp.json()
+        params = {
+            "detector": detector,
+            "file_type": file_type,
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat() if until else None,
+            "offset": offset,
+            "limit": limit,
+        }
+        async with instrument_server_client.get(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'get_possible_gain_references', instrument_name=sanitise(instrument_name), session_id=session_id)}",
+            route_class="long_running",
+            headers={"Authorization": f"Bearer {token}"},
+            params={k: v for k, v in params.items() if v is not None},
+        ) as resp:
+            data = await resp.json()
+            if "X-Total-Count" in resp.headers:
+                response.headers["X-Total-Count"] = resp.headers["X-Total-Count"]
     return data
 
 
@@ -412,19 +424,19 @@ async def request_gain_reference_upload(
     visit_path = f"{datetime.datetime.now().year}/{visit}"
     data = {}
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'upload_gain_reference', instrument_name=instrument_name, session_id=session_id)}",
-                json={
-                    "gain_path": str(gain_reference_request.gain_path),
-                    "visit_path": visit_path,
-                    "gain_destination_dir": machine_config.gain_directory_name,
-                },
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'upload_gain_reference', instrument_name=instrument_name, session_id=session_id)}",
+            route_class="long_running",
+            json={
+                "gain_path": str(gain_reference_request.gain_path),
+                "visit_path": visit_path,
+                "gain_destination_dir": machine_config.gain_directory_name,
+            },
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -445,15 +457,15 @@ async def request_upstream_tiff_data_download(
             / secure_filename(visit_name)
         )
         if machine_config.instrument_server_url:
-            async with aiohttp.ClientSession() as clientsession:
-                async with clientsession.post(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'gather_upstream_tiffs', visit_name=secure_filename(visit_name), session_id=session_id)}",
-                    json={"download_dir": download_dir},
-                    headers={
-                        "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                    },
-                ) as resp:
-                    data = await resp.json()
+            async with instrument_server_client.post(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'gather_upstream_tiffs', visit_name=secure_filename(visit_name), session_id=session_id)}",
+                route_class="long_running",
+                json={"download_dir": download_dir},
+                headers={
+                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+                },
+            ) as resp:
+                data = await resp.json()
     return data
 
 
@@ -493,26 +505,26 @@ async def request_upstream_file_download(
     download_dir = str(
         machine_config.upstream_data_download_directory / secure_filename(visit_name)
     )
-    async with aiohttp.ClientSession() as clientsession:
-        url_path = url_path_for(
-            "api.router",
-            "run_upstream_file_download_request",
-            visit_name=secure_filename(visit_name),
-            session_id=session_id,
-        )
-        async with clientsession.post(
-            f"{machine_config.instrument_server_url}{url_path}",
-            headers={
-                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-            },
-            json={
-                "download_dir": download_dir,
-                "upstream_instrument": upstream_file_request.upstream_instrument,
-                "upstream_visit_path": str(upstream_file_request.upstream_visit_path),
-                "search_strings": upstream_file_request.search_strings,
-            },
-        ) as resp:
-            data = await resp.json()
+    url_path = url_path_for(
+        "api.router",
+        "run_upstream_file_download_request",
+        visit_name=secure_filename(visit_name),
+        session_id=session_id,
+    )
+    async with instrument_server_client.post(
+        f"{machine_config.instrument_server_url}{url_path}",
+        route_class="long_running",
+        headers={
+            "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+        },
+        json={
+            "download_dir": download_dir,
+            "upstream_instrument": upstream_file_request.upstream_instrument,
+            "upstream_visit_path": str(upstream_file_request.upstream_visit_path),
+            "search_strings": upstream_file_request.search_strings,
+        },
+    ) as resp:
+        data = await resp.json()
     return data
 
 
@@ -532,17 +544,16 @@ async def stop_rsyncer(
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'stop_rsyncer', session_id=session_id)}",
-                json={
-                    "source": str(secure_path(Path(rsyncer_source.source))),
-                },
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'stop_rsyncer', session_id=session_id)}",
+            json={
+                "source": str(secure_path(Path(rsyncer_source.source))),
+            },
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -558,17 +569,17 @@ async def finalise_rsyncer(
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'finalise_rsyncer', session_id=session_id)}",
-                json={
-                    "source": str(secure_path(Path(rsyncer_source.source))),
-                },
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'finalise_rsyncer', session_id=session_id)}",
+            route_class="long_running",
+            json={
+                "source": str(secure_path(Path(rsyncer_source.source))),
+            },
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -583,15 +594,15 @@ async def finalise_session(session_id: MurfeySessionID, db=murfey_db):
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'finalise_session', session_id=session_id)}",
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
-                log.debug(f"Received response {data}")
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api.router', 'finalise_session', session_id=session_id)}",
+            route_class="long_running",
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
+            log.debug(f"Received response {data}")
     return data
 
 
@@ -605,14 +616,13 @@ async def abandon_session(session_id: MurfeySessionID, db=murfey_db):
         instrument_name
     ]
     if machine_config.instrument_server_url:
-        async with aiohttp.ClientSession() as clientsession:
-            async with clientsession.post(
-                f"{machine_config.instrument_server_url}{url_path_for('api_router', 'abandon_controller', session_id=session_id)}",
-                headers={
-                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                },
-            ) as resp:
-                data = await resp.json()
+        async with instrument_server_client.post(
+            f"{machine_config.instrument_server_url}{url_path_for('api_router', 'abandon_controller', session_id=session_id)}",
+            headers={
+                "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+            },
+        ) as resp:
+            data = await resp.json()
     return data
 
 
@@ -629,17 +639,16 @@ async def remove_rsyncer(
     ]
     if isinstance(session_id, int):
         if machine_config.instrument_server_url:
-            async with aiohttp.ClientSession() as clientsession:
-                async with clientsession.post(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'remove_rsyncer', session_id=session_id)}",
-                    json={
-                        "source": str(secure_path(Path(rsyncer_source.source))),
-                    },
-                    headers={
-                        "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                    },
-                ) as resp:
-                    data = await resp.json()
+            async with instrument_server_client.post(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'remove_rsyncer', session_id=session_id)}",
+                json={
+                    "source": str(secure_path(Path(rsyncer_source.source))),
+                },
+                headers={
+                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+                },
+            ) as resp:
+                data = await resp.json()
     return data
 
 
@@ -656,17 +665,16 @@ async def restart_rsyncer(
     ]
     if isinstance(session_id, int):
         if machine_config.instrument_server_url:
-            async with aiohttp.ClientSession() as clientsession:
-                async with clientsession.post(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'restart_rsyncer', session_id=session_id)}",
-                    json={
-                        "source": str(secure_path(Path(rsyncer_source.source))),
-                    },
-                    headers={
-                        "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                    },
-                ) as resp:
-                    data = await resp.json()
+            async with instrument_server_client.post(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'restart_rsyncer', session_id=session_id)}",
+                json={
+                    "source": str(secure_path(Path(rsyncer_source.source))),
+                },
+                headers={
+                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+                },
+            ) as resp:
+                data = await resp.json()
     return data
 
 
@@ -697,34 +705,33 @@ async def flush_skipped_rsyncer(
     ]
     if isinstance(session_id, int):
         if machine_config.instrument_server_url:
-            async with aiohttp.ClientSession() as clientsession:
-                # Send request to instrument server to update multigrid controller
-                async with clientsession.post(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'update_multigrid_controller_visit_end_time', session_id=session_id)}?end_time={quote(session_entry.visit_end_time.isoformat())}",
-                    headers={
-                        "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                    },
-                ) as resp:
-                    update_result = await resp.json()
-                if not update_result.get("success", False):
-                    return {"success": False}
-                # Send request to flush the rsyncer
-                async with clientsession.post(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'flush_skipped_rsyncer', session_id=session_id)}",
-                    json={
-                        "source": str(secure_path(Path(rsyncer_source.source))),
-                    },
-                    headers={
-                        "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
-                    },
-                ) as resp:
-                    flush_result = await resp.json()
-                if not flush_result.get("success", False):
-                    return {"success": False}
-                # Reset the skipped file count for the specific Prometheus gauge to 0
-                prom.skipped_files.labels(
-                    rsync_source=rsyncer_source.source, visit=session_entry.visit
-                ).set(0)
+            # Send request to instrument server to update multigrid controller
+            async with instrument_server_client.post(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'update_multigrid_controller_visit_end_time', session_id=session_id)}?end_time={quote(session_entry.visit_end_time.isoformat())}",
+                headers={
+                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+                },
+            ) as resp:
+                update_result = await resp.json()
+            if not update_result.get("success", False):
+                return {"success": False}
+            # Send request to flush the rsyncer
+            async with instrument_server_client.post(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'flush_skipped_rsyncer', session_id=session_id)}",
+                json={
+                    "source": str(secure_path(Path(rsyncer_source.source))),
+                },
+                headers={
+                    "Authorization": f"Bearer {instrument_server_tokens[session_id]['access_token']}"
+                },
+            ) as resp:
+                flush_result = await resp.json()
+            if not flush_result.get("success", False):
+                return {"success": False}
+            # Reset the skipped file count for the specific Prometheus gauge to 0
+            prom.skipped_files.labels(
+                rsync_source=rsyncer_source.source, visit=session_entry.visit
+            ).set(0)
     return flush_result
 
 
@@ -760,17 +767,16 @@ async def get_rsyncer_info(
     ).all()
     if machine_config.instrument_server_url:
         try:
-            async with lock:
+            async with instrument_server_client.lock(session_id):
                 token = instrument_server_tokens[session_id]["access_token"]
-            async with aiohttp.ClientSession() as clientsession:
-                async with clientsession.get(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'get_rsyncer_info', session_id=session_id)}",
-                    headers={"Authorization": f"Bearer {token}"},
-                ) as resp:
-                    if resp.status == 200:
-                        rsyncer_list = await resp.json()
-                    else:
-                        rsyncer_list = []
+            async with instrument_server_client.get(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'get_rsyncer_info', session_id=session_id)}",
+                headers={"Authorization": f"Bearer {token}"},
+            ) as resp:
+                if resp.status == 200:
+                    rsyncer_list = await resp.json()
+                else:
+                    rsyncer_list = []
         except KeyError:
             rsyncer_list = []
         except Exception:
@@ -780,17 +786,16 @@ async def get_rsyncer_info(
             )
 
         try:
-            async with lock:
+            async with instrument_server_client.lock(session_id):
                 token = instrument_server_tokens[session_id]["access_token"]
-            async with aiohttp.ClientSession() as clientsession:
-                async with clientsession.get(
-                    f"{machine_config.instrument_server_url}{url_path_for('api.router', 'get_analyser_info', session_id=session_id)}",
-                    headers={"Authorization": f"Bearer {token}"},
-                ) as resp:
-                    if resp.status == 200:
-                        analyser_list = await resp.json()
-                    else:
-                        analyser_list = []
+            async with instrument_server_client.get(
+                f"{machine_config.instrument_server_url}{url_path_for('api.router', 'get_analyser_info', session_id=session_id)}",
+                headers={"Authorization": f"Bearer {token}"},
+            ) as resp:
+                if resp.status == 200:
+                    analyser_list = await resp.json()
+                else:
+                    analyser_list = []
         except KeyError:
             analyser_list = []
         except Exception:
@@ -60,9 +60,12 @@ from murfey.util.db import (
     Session,
 )
 from murfey.util.models import (
+    BatchPositionListParameters,
     BatchPositionParameters,
     ClientInfo,
+    FoilHoleListParameters,
     FoilHoleParameters,
+    GridSquareListParameters,
     GridSquareParameters,
     RsyncerInfo,
     SearchMapParameters,
@@ -72,10 +75,13 @@ from murfey.util.models import (
 from murfey.workflows.spa.atlas import atlas_jpg_from_mrc
 from murfey.workflows.spa.flush_spa_preprocess import (
     register_foil_hole as _register_foil_hole,
+    register_foil_holes as _register_foil_holes,
     register_grid_square as _register_grid_square,
+    register_grid_squares as _register_grid_squares,
 )
 from murfey.workflows.tomo.tomo_metadata import (
     register_batch_position_in_database,
+    register_batch_positions_in_database,
     register_search_map_in_database,
 )
 
@@ -520,6 +526,29 @@ def register_foil_hole(
     return _register_foil_hole(session_id, gs_name, foil_hole_params, db)
 
 
+@spa_router.post("/sessions/{session_id}/grid_squares")
+def register_grid_squares(
+    session_id: MurfeySessionID,
+    grid_square_list: GridSquareListParameters,
+    db=murfey_db,
+):
+    logger.info(f"Registering {len(grid_square_list.grid_squares)} grid squares")
+    return _register_grid_squares(session_id, grid_square_list.grid_squares, db)
+
+
+@spa_router.post("/sessions/{session_id}/grid_square/{gs_name}/foil_holes")
+def register_foil_holes(
+    session_id: MurfeySessionID,
+    gs_name: int,
+    foil_hole_list: FoilHoleListParameters,
+    db=murfey_db,
+) -> List[Optional[int]]:
+    logger.info(
+        f"Registering {len(foil_hole_list.foil_holes)} foil holes for grid square {gs_name}"
+    )
+    return _register_foil_holes(session_id, gs_name, foil_hole_list.foil_holes, db)
+
+
 tomo_router = APIRouter(
     prefix="/session_control/tomo",
     dependencies=[Depends(validate_instrument_token)],
@@ -547,6 +576,20 @@ def register_batch_position(
     return register_batch_position_in_database(session_id, batch_name, batch_params, db)
 
 
+@tomo_router.post("/sessions/{session_id}/batch_positions")
+def register_batch_positions(
+    session_id: MurfeySessionID,
+    batch_position_list: BatchPositionListParameters,
+    db=murfey_db,
+):
+    logger.info(
+        f"Registering {len(batch_position_list.batch_positions)} batch positions"
+    )
+    return register_batch_positions_in_database(
+        session_id, batch_position_list.batch_positions, db
+    )
+
+
 correlative_router = APIRouter(
     prefix="/session_control/correlative",
     dependencies=[Depends(validate_instrument_token)],
@@ -555,8 +598,10 @@ correlative_router = APIRouter(
 
 
 @correlative_router.get("/sessions/{session_id}/upstream_visits")
-async def find_upstream_visits(session_id: MurfeySessionID, db=murfey_db):
-    return _find_upstream_visits(session_id=session_id, db=db)
+async def find_upstream_visits(
+    session_id: MurfeySessionID, refresh: bool = False, db=murfey_db
+):
+    return _find_upstream_visits(session_id=session_id, db=db, refresh=refresh)
 
 
 @correlative_router.get(
@@ -566,6 +611,7 @@ async def gather_upstream_files(
     visit_name: str,
     session_id: MurfeySessionID,
     upstream_file_request: UpstreamFileRequestInfo,
+    refresh: bool = False,
     db=murfey_db,
 ):
     return _gather_upstream_files(
@@ -574,6 +620,7 @@ async def gather_upstream_files(
         upstream_visit_path=upstream_file_request.upstream_visit_path,
         search_strings=upstream_file_request.search_strings,
         db=db,
+        refresh=refresh,
     )
 
 
@@ -595,8 +642,12 @@ async def get_upstream_file(
 @correlative_router.get(
     "/visits/{visit_name}/sessions/{session_id}/upstream_tiff_paths"
 )
-async def gather_upstream_tiffs(visit_name: str, session_id: int, db=murfey_db):
-    return _gather_upstream_tiffs(visit_name=visit_name, session_id=session_id, db=db)
+async def gather_upstream_tiffs(
+    visit_name: str, session_id: int, refresh: bool = False, db=murfey_db
+):
+    return _gather_upstream_tiffs(
+        visit_name=visit_name, session_id=session_id, db=db, refresh=refresh
+    )
 
 
 @correlative_router.get(
@@ -4,7 +4,7 @@ from pathlib import Path
 from typing import Dict, List, Optional
 
 import requests
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 from sqlmodel import select
@@ -30,7 +30,12 @@ from murfey.server.api.session_shared import (
     get_upstream_file as _get_upstream_file,
     remove_session_by_id,
 )
-from murfey.server.ispyb import DB as ispyb_db, get_all_ongoing_visits
+from murfey.server.ispyb import (
+    DB as ispyb_db,
+    get_all_ongoing_visits,
+    invalidate_ispyb_caches,
+    ispyb_caches,
+)
 from murfey.server.murfey_db import murfey_db
 from murfey.util import sanitise
 from murfey.util.config import get_machine_config
@@ -97,6 +102,23 @@ def get_current_visits(instrument_name: MurfeyInstrumentName, db=ispyb_db):
     return get_all_ongoing_visits(instrument_name, db)
 
 
+@router.delete("/ispyb_cache")
+def invalidate_ispyb_cache(query: Optional[str] = None):
+    """
+    Removes the cached results of ISPyB lookups, for when visits in ISPyB have been
+    changed. The results of all the lookups are removed unless a query is named.
+    """
+    if query is not None and query not in ispyb_caches:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No cached ISPyB lookups for {query!r}; "
+            f"expected one of {', '.join(ispyb_caches)}",
+        )
+    removed = invalidate_ispyb_caches(query)
+    logger.info(f"Removed {removed} cached ISPyB lookups")
+    return {"removed": removed}
+
+
 @router.get("/instruments/{instrument_name}/visits/")
 def all_visit_info(
     instrument_name: MurfeyInstrumentName, request: Request, db=ispyb_db
@@ -517,8 +539,10 @@ correlative_router = APIRouter(
 
 
 @correlative_router.get("/sessions/{session_id}/upstream_visits")
-async def find_upstream_visits(session_id: MurfeySessionID, db=murfey_db):
-    return _find_upstream_visits(session_id=session_id, db=db)
+async def find_upstream_visits(
+    session_id: MurfeySessionID, refresh: bool = False, db=murfey_db
+):
+    return _find_upstream_visits(session_id=session_id, db=db, refresh=refresh)
 
 
 @correlative_router.get(
@@ -528,6 +552,7 @@ async def gather_upstream_files(
     visit_name: str,
     session_id: MurfeySessionID,
     upstream_file_request: UpstreamFileRequestInfo,
+    refresh: bool = False,
     db=murfey_db,
 ):
     return _gather_upstream_files(
@@ -536,6 +561,7 @@ async def gather_upstream_files(
         upstream_visit_path=upstream_file_request.upstream_visit_path,
         search_strings=upstream_file_request.search_strings,
         db=db,
+        refresh=refresh,
     )
 
 
@@ -557,8 +583,12 @@ async def get_upstream_file(
 @correlative_router.get(
     "/visits/{visit_name}/sessions/{session_id}/upstream_tiff_paths"
 )
-async def gather_upstream_tiffs(visit_name: str, session_id: int, db=murfey_db):
-    return _gather_upstream_tiffs(visit_name=visit_name, session_id=session_id, db=db)
+async def gather_upstream_tiffs(
+    visit_name: str, session_id: int, refresh: bool = False, db=murfey_db
+):
+    return _gather_upstream_tiffs(
+        visit_name=visit_name, session_id=session_id, db=db, refresh=refresh
+    )
 
 
 @correlative_router.get(
@@ -1,5 +1,4 @@
 import logging
-import os
 from pathlib import Path
 from typing import Dict, List
 
@@ -8,6 +7,8 @@ from sqlmodel.orm.session import Session as SQLModelSession
 from werkzeug.utils import secure_filename
 
 import murfey.server.prometheus as prom
+from murfey.server.api.auth import token_cache
+from murfey.server.upstream_index import get_upstream_index
 from murfey.util import safe_run, sanitise, secure_path
 from murfey.util.config import get_machine_config
 from murfey.util.db import (
@@ -88,6 +89,8 @@ def remove_session_by_id(session_id: int, db):
         )
     db.delete(session)
     db.commit()
+    # Tokens minted for this session should no longer be accepted
+    token_cache.invalidate_session(session_id)
     logger.debug(f"Successfully removed session {session_id} from database")
     return
 
@@ -137,52 +140,18 @@ def get_foil_hole(session_id: int, fh_name: int, db) -> Dict[str, int]:
     return {f[1].tag: f[0].id for f in foil_holes}
 
 
-def find_upstream_visits(session_id: int, db: SQLModelSession, max_depth: int = 2):
+def find_upstream_visits(
+    session_id: int,
+    db: SQLModelSession,
+    max_depth: int = 2,
+    refresh: bool = False,
+):
     """
     Returns a nested dictionary, in which visits and the full paths to their directories
-    are further grouped by instrument name.
+    are further grouped by instrument name. The directories are looked up in the
+    upstream index, which is checked against the file system again if 'refresh' is set.
     """
 
-    def _recursive_search(
-        dirpath: str | Path,
-        search_string: str,
-        partial_match: bool = True,
-        max_depth: int = 1,
-        result: dict[str, Path] | None = None,
-    ):
-        # If no dictionary was passed in, create a new dictionary
-        if result is None:
-            result = {}
-        # Stop recursing for this route once max depth hits 0
-        if max_depth == 0:
-            return result
-
-        # Walk through the directories
-        try:
-            for entry in os.scandir(dirpath):
-                if entry.is_dir():
-                    # Update dictionary with match and stop recursing for this route
-                    if (
-                        search_string in entry.name
-                        if partial_match
-                        else search_string == entry.name
-                    ):
-                        if result is not None:  # MyPy needs this 'is not None' check
-                            result[entry.name] = Path(entry.path)
-                    else:
-                        # Continue searching down this route until max depth is reached
-                        result = _recursive_search(
-                            dirpath=entry.path,
-                            search_string=search_string,
-                            partial_match=partial_match,
-                            max_depth=max_depth - 1,
-                            result=result,
-                        )
-        # Safely skip the directory if it can't access it
-        except PermissionError:
-            logger.warning(f"Unable to access {dirpath}; skipping", exc_info=True)
-        return result
-
     murfey_session = db.exec(
         select(MurfeySession).where(MurfeySession.id == session_id)
     ).one()
@@ -197,12 +166,12 @@ def find_upstream_visits(session_id: int, db: SQLModelSession, max_depth: int =
         upstream_instrument,
         upstream_data_dir,
     ) in machine_config.upstream_data_directories.items():
-        # Recursively look for matching visit names under current directory
-        upstream_visits[upstream_instrument] = _recursive_search(
-            dirpath=upstream_data_dir,
+        # Look for matching visit names under current directory
+        upstream_visits[upstream_instrument] = get_upstream_index().find_directories(
+            Path(upstream_data_dir),
             search_string=f"{visit_name.split('-')[0]}-",
-            partial_match=True,
             max_depth=max_depth,
+            refresh=refresh,
         )
     return upstream_visits
 
@@ -213,6 +182,7 @@ def gather_upstream_files(
     upstream_visit_path: Path,
     search_strings: list[str] | None,
     db: SQLModelSession,
+    refresh: bool = False,
 ):
     """
     Searches the specified upstream instrument for files based on the search strings
@@ -250,9 +220,11 @@ def gather_upstream_files(
     # Search for files matching the provided search strings
     for search_string in search_strings:
         logger.info(f"Using search string {sanitise(search_string)}")
-        for file in upstream_visit_path.glob(search_string):
-            if file.is_file():
-                file_list.append(file)
+        file_list.extend(
+            get_upstream_index().glob(
+                Path(upstream_visit_path), search_string, refresh=refresh
+            )
+        )
     logger.info(
         f"Found {len(file_list)} files for download "
         f"from {sanitise(upstream_instrument)}"
@@ -287,7 +259,9 @@ def get_upstream_tiff_dirs(visit_name: str, instrument_name: str) -> List[Path]:
     return tiff_dirs
 
 
-def gather_upstream_tiffs(visit_name: str, session_id: int, db: SQLModelSession):
+def gather_upstream_tiffs(
+    visit_name: str, session_id: int, db: SQLModelSession, refresh: bool = False
+):
     """
     Looks for TIFF files associated with the current session in the permitted storage
     servers, and returns their relative file paths as a list.
@@ -297,15 +271,17 @@ def gather_upstream_tiffs(visit_name: str, session_id: int, db: SQLModelSession)
         .one()
         .instrument_name
     )
-    upstream_tiff_paths = []
+    upstream_tiff_paths: List[str] = []
     tiff_dirs = get_upstream_tiff_dirs(visit_name, instrument_name)
     if not tiff_dirs:
         return None
     for tiff_dir in tiff_dirs:
-        for f in tiff_dir.glob("**/*.tiff"):
-            upstream_tiff_paths.append(str(f.relative_to(tiff_dir)))
-        for f in tiff_dir.glob("**/*.tif"):
-            upstream_tiff_paths.append(str(f.relative_to(tiff_dir)))
+        upstream_tiff_paths.extend(
+            str(f.path)
+            for f in get_upstream_index().files(
+                tiff_dir, suffixes=(".tiff", ".tif"), refresh=refresh
+            )
+        )
     return upstream_tiff_paths
 
 
@@ -1,14 +1,34 @@
+"""
+Conversion of gain references into the MRC files used for processing.
+
+Gain references are read, flipped and binned in-process with numpy, and written
+using 'mrcfile', matching what IMOD's 'dm2mrc', 'tif2mrc', 'clip' and 'newstack'
+produce. The IMOD programs are only run if a gain reference cannot be read here.
+Prepared gain references are cached under a key derived from the contents of the
+original file and the transforms applied to it, so preparing the same gain
+reference again, such as when a session is restarted, only copies the result.
+"""
+
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import logging
 import os
 import shutil
+import struct
+import tempfile
 from enum import Enum
+from io import BytesIO
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import mrcfile
+import numpy as np
+from PIL import Image
 
 from murfey.util import secure_path
+from murfey.util.config import get_security_config
 
 logger = logging.getLogger("murfey.server.gain")
 
@@ -28,6 +48,179 @@ def _sanitise(gain_path: Path, tag: str) -> Path:
     return dest
 
 
+# Numpy types of the simple data types in DM4 files
+_DM4_SIMPLE_TYPES = {
+    2: "i2",
+    3: "i4",
+    4: "u2",
+    5: "u4",
+    6: "f4",
+    7: "f8",
+    8: "u1",  # Boolean
+    9: "i1",
+    10: "u1",
+    11: "i8",
+    12: "u8",
+}
+
+
+def _dm4_data_size(info: tuple[int, ...]) -> int:
+    """
+    Returns the size in bytes of a DM4 tag's data from its type information
+    """
+    kind = info[0]
+    if kind in _DM4_SIMPLE_TYPES:
+        return np.dtype(_DM4_SIMPLE_TYPES[kind]).itemsize
+    if kind == 18:  # String
+        return 2 * info[1]
+    if kind == 15:  # Struct
+        return sum(
+            np.dtype(_DM4_SIMPLE_TYPES[info[4 + 2 * i]]).itemsize
+            for i in range(info[2])
+        )
+    if kind == 20:  # Array
+        return info[-1] * _dm4_data_size(info[1:-1])
+    raise ValueError(f"Unknown DM4 data type {kind}")
+
+
+def _read_dm4_data(data: bytes, offset: int, order: str) -> tuple[Any, int]:
+    if data[offset : offset + 4] != b"%%%%":
+        raise ValueError(f"Malformed DM4 tag at byte {offset}")
+    (num_info,) = struct.unpack_from(">Q", data, offset + 4)
+    info = struct.unpack_from(f">{num_info}Q", data, offset + 12)
+    offset += 12 + 8 * num_info
+    value = None
+    if info[0] in _DM4_SIMPLE_TYPES:
+        value = np.frombuffer(
+            data, dtype=order + _DM4_SIMPLE_TYPES[info[0]], count=1, offset=offset
+        )[0].item()
+    elif info[0] == 20 and info[1] in _DM4_SIMPLE_TYPES:
+        value = np.frombuffer(
+            data, dtype=order + _DM4_SIMPLE_TYPES[info[1]], count=info[2], offset=offset
+        )
+    return value, offset + _dm4_data_size(info)
+
+
+def _read_dm4_group(
+    data: bytes, offset: int, order: str
+) -> tuple[list[tuple[str, Any]], int]:
+    # Groups start with whether they are sorted and open, which are not needed
+    (num_tags,) = struct.unpack_from(">Q", data, offset + 2)
+    offset += 10
+    tags: list[tuple[str, Any]] = []
+    for _ in range(num_tags):
+        kind, name_length = struct.unpack_from(">BH", data, offset)
+        name = data[offset + 3 : offset + 3 + name_length].decode("latin-1")
+        offset += 3 + name_length + 8  # The size of the tag follows its name
+        if kind == 20:
+            value, offset = _read_dm4_group(data, offset, order)
+        elif kind == 21:
+            value, offset = _read_dm4_data(data, offset, order)
+        else:
+            raise ValueError(f"Unknown DM4 tag kind {kind} at byte {offset}")
+        tags.append((name, value))
+    return tags, offset
+
+
+def read_dm4(data: bytes) -> np.ndarray:
+    """
+    Reads the largest image in a DigitalMicrograph 4 file, which is the image
+    itself rather than its thumbnail
+    """
+    (version,) = struct.unpack_from(">I", data, 0)
+    if version != 4:
+        raise ValueError(f"Unsupported DigitalMicrograph file version {version}")
+    (byte_order,) = struct.unpack_from(">I", data, 12)
+    tags, _ = _read_dm4_group(data, 16, "<" if byte_order == 1 else ">")
+    images = []
+    for _, image in dict(tags).get("ImageList", []):
+        image_data = dict(dict(image).get("ImageData", []))
+        dimensions = [size for _, size in image_data.get("Dimensions", [])]
+        pixels = image_data.get("Data")
+        if (
+            isinstance(pixels, np.ndarray)
+            and len(dimensions) == 2
+            and pixels.size == dimensions[0] * dimensions[1]
+        ):
+            images.append(pixels.reshape(dimensions[1], dimensions[0]))
+    if not images:
+        raise ValueError("No 2D images were found in the DigitalMicrograph file")
+    return max(images, key=lambda image: image.size)
+
+
+def read_tiff(data: bytes) -> np.ndarray:
+    with Image.open(BytesIO(data)) as image:
+        return np.asarray(image)
+
+
+def transform_gain(
+    image: np.ndarray, flip: Optional[str] = None, binning: int = 1
+) -> np.ndarray:
+    """
+    Converts a gain reference image, with its first row at the top, to the array
+    written to the MRC file. This is inverted in Y, as IMOD's conversion programs
+    do, and then flipped around the X or Y axis and binned by averaging, as with
+    'clip flipx' or 'clip flipy' and 'newstack -bin'.
+    """
+    gain = np.asarray(image, dtype=np.float32)[::-1]
+    if flip == "flipx":
+        gain = gain[::-1]
+    elif flip == "flipy":
+        gain = gain[:, ::-1]
+    if binning > 1:
+        height, width = (size // binning for size in gain.shape)
+        gain = (
+            gain[: height * binning, : width * binning]
+            .reshape(height, binning, width, binning)
+            .mean(axis=(1, 3), dtype=np.float32)
+        )
+    return np.ascontiguousarray(gain)
+
+
+def _gain_cache_directory() -> Path:
+    cache_directory = (
+        get_security_config().gain_cache_directory
+        or Path(tempfile.gettempdir()) / "murfey_gain"
+    )
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    return cache_directory
+
+
+def _write_mrc(gain: np.ndarray, path: Path):
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".mrc.tmp")
+    os.close(fd)
+    try:
+        with mrcfile.new(tmp_name, overwrite=True) as mrc:
+            mrc.set_data(gain)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _prepare_natively(
+    gain_path: Path,
+    read: Callable[[bytes], np.ndarray],
+    outputs: Dict[Path, Tuple[Optional[str], int]],
+):
+    """
+    Writes the gain reference to each of the output paths, given with the flip
+    and binning to apply for it, using the cached results where there are any
+    """
+    data = secure_path(gain_path).read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    cache_directory = _gain_cache_directory()
+    image: Optional[np.ndarray] = None
+    for output, (flip, binning) in outputs.items():
+        key = hashlib.sha256(f"{digest}\0{flip}\0{binning}".encode()).hexdigest()
+        cached = cache_directory / f"{key}.mrc"
+        if not cached.is_file():
+            if image is None:
+                image = read(data)
+            _write_mrc(transform_gain(image, flip, binning), cached)
+        shutil.copyfile(cached, secure_path(output))
+
+
 async def prepare_gain(
     camera: int,
     gain_path: Path,
@@ -37,9 +230,6 @@ async def prepare_gain(
     tag: str = "",
     chmod: int = 0o750,
 ) -> Tuple[Path | None, Path | None]:
-    if not all(executables.get(s) for s in ("dm2mrc", "clip", "newstack")):
-        logger.error("No executables were provided to prepare the gain reference with")
-        return None, None
     if camera == Camera.FALCON:
         logger.info("Gain reference preparation not needed for Falcon detector")
         return None, None
@@ -56,14 +246,48 @@ async def prepare_gain(
         )
         if secure_path(gain_out).is_file():
             return gain_out, gain_out_superres if rescale else gain_out
-        for k, v in env.items():
-            os.environ[k] = v
         gain_tag = f"gain_{tag}" if tag else "gain"
         gain_dir = secure_path(gain_path.parent / gain_tag)
         gain_dir.mkdir(exist_ok=True)
         os.chmod(gain_dir, chmod)
-        gain_path = _sanitise(gain_path, tag)
         flip = "flipx" if camera == Camera.K3_FLIPX else "flipy"
+
+        # The super-resolution gain reference is kept in the gain directory
+        gain_path_superres = gain_dir / (
+            gain_path.name.replace(" ", "_") + "_superres.mrc"
+        )
+        try:
+            await asyncio.to_thread(
+                _prepare_natively,
+                gain_path,
+                read_dm4,
+                (
+                    {gain_path_superres: (flip, 1), gain_out: (flip, 2)}
+                    if rescale
+                    else {gain_out: (flip, 1)}
+                ),
+            )
+        except Exception:
+            logger.warning(
+                f"Could not prepare the gain reference {gain_path} in-process; "
+                "trying with IMOD instead",
+                exc_info=True,
+            )
+        else:
+            if rescale:
+                secure_path(gain_out_superres).symlink_to(
+                    secure_path(gain_path_superres)
+                )
+            return gain_out, gain_out_superres if rescale else gain_out
+
+        if not all(executables.get(s) for s in ("dm2mrc", "clip", "newstack")):
+            logger.error(
+                "No executables were provided to prepare the gain reference with"
+            )
+            return None, None
+        for k, v in env.items():
+            os.environ[k] = v
+        gain_path = _sanitise(gain_path, tag)
         gain_path_mrc = gain_path.with_suffix(".mrc")
         gain_path_superres = gain_path.parent / (gain_path.name + "_superres.mrc")
         dm4_proc = await asyncio.create_subprocess_shell(
@@ -115,14 +339,28 @@ async def prepare_eer_gain(
     env: Dict[str, str],
     tag: str = "",
 ) -> Tuple[Path | None, Path | None]:
+    gain_out = (
+        gain_path.parent / f"gain_{tag}.mrc" if tag else gain_path.parent / "gain.mrc"
+    )
+    try:
+        await asyncio.to_thread(
+            _prepare_natively, gain_path, read_tiff, {gain_out: (None, 1)}
+        )
+    except Exception:
+        logger.warning(
+            f"Could not prepare the EER gain reference {gain_path} in-process; "
+            "trying with IMOD instead",
+            exc_info=True,
+        )
+    else:
+        shutil.copy(secure_path(gain_path), secure_path(gain_out.with_suffix(".gain")))
+        return gain_out, None
+
     if not executables.get("tif2mrc"):
         logger.error(
             "No executables were provided to prepare the EER gain reference with"
         )
         return None, None
-    gain_out = (
-        gain_path.parent / f"gain_{tag}.mrc" if tag else gain_path.parent / "gain.mrc"
-    )
     for k, v in env.items():
         os.environ[k] = v
     mrc_convert = await asyncio.create_subprocess_shell(
@@ -0,0 +1,167 @@
+"""
+The HTTP client used by the backend server to forward requests to the instrument
+servers. A single client is shared by the whole application so that connections to
+each instrument server are kept alive and reused between requests, rather than a
+new connection being made for every call.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable, Literal
+
+import aiohttp
+
+from murfey.util.config import get_security_config
+
+logger = logging.getLogger("murfey.server.instrument_client")
+
+RouteClass = Literal["control", "long_running"]
+
+# Control calls are expected to be answered promptly, whereas long-running calls
+# (file downloads, directory scans, and finalisation) may take a while to respond
+ROUTE_TIMEOUTS: dict[RouteClass, aiohttp.ClientTimeout] = {
+    "control": aiohttp.ClientTimeout(total=None, connect=5, sock_read=60),
+    "long_running": aiohttp.ClientTimeout(total=None, connect=5, sock_read=None),
+}
+
+
+class InstrumentServerClient:
+    """
+    Application-scoped HTTP client for the instrument servers. Each instrument
+    server host gets its own pool of up to 'limit_per_host' keep-alive connections.
+
+    GET requests are idempotent, so they are retried up to 'get_retries' times if
+    the connection fails or times out. Other requests are only ever sent once.
+    """
+
+    def __init__(
+        self,
+        limit_per_host: int = 8,
+        keepalive_timeout: float = 60,
+        get_retries: int = 2,
+        retry_delay: float = 0.2,
+    ):
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.get_retries = get_retries
+        self.retry_delay = retry_delay
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+
+    async def start(self):
+        """
+        Creates the client session; called when the application starts up
+        """
+        if self._session is None or self._session.closed:
+            self._loop = asyncio.get_running_loop()
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=0,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                ),
+                timeout=ROUTE_TIMEOUTS["control"],
+            )
+            logger.debug("Started instrument server client")
+
+    async def close(self):
+        """
+        Closes the client session and its connections; called on shutdown
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.debug("Closed instrument server client")
+        self._session = None
+        self._loop = None
+        self._locks.clear()
+
+    def _discard_session(self):
+        """
+        Drops a session belonging to another event loop, closing it on that loop if
+        it is still running. Otherwise, the session can't be closed cleanly, so it
+        is detached from its connections, which are released along with the loop.
+        """
+        session, loop = self._session, self._loop
+        self._session = None
+        self._loop = None
+        self._locks.clear()
+        if session is None or session.closed:
+            return
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            session.detach()
+        logger.debug("Discarded instrument server client from another event loop")
+
+    async def session(self) -> aiohttp.ClientSession:
+        """
+        Returns the client session, starting it if the application lifespan hasn't
+        done so already or if it belongs to an event loop that is no longer in use
+        """
+        if self._loop is not asyncio.get_running_loop():
+            self._discard_session()
+        await self.start()
+        assert self._session is not None
+        return self._session
+
+    def lock(self, key: Hashable) -> asyncio.Lock:
+        """
+        Returns the lock for the given instrument or session, so that requests that
+        need to be serialised only wait for others concerning the same one
+        """
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    @staticmethod
+    def _request_kwargs(route_class: RouteClass, kwargs: dict) -> dict:
+        # Control calls use the session's default timeouts
+        if route_class != "control":
+            kwargs["timeout"] = ROUTE_TIMEOUTS[route_class]
+        return kwargs
+
+    @asynccontextmanager
+    async def get(
+        self, url: str, route_class: RouteClass = "control", **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        session = await self.session()
+        kwargs = self._request_kwargs(route_class, kwargs)
+        attempt = 0
+        while True:
+            request = session.get(url, **kwargs)
+            try:
+                response = await request.__aenter__()
+                break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.get_retries:
+                    raise
+                attempt += 1
+                logger.warning(
+                    f"GET request to instrument server failed; retrying "
+                    f"({attempt}/{self.get_retries})",
+                    exc_info=True,
+                )
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+        try:
+            yield response
+        finally:
+            await request.__aexit__(None, None, None)
+
+    @asynccontextmanager
+    async def post(
+        self, url: str, route_class: RouteClass = "control", **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        session = await self.session()
+        async with session.post(
+            url, **self._request_kwargs(route_class, kwargs)
+        ) as response:
+            yield response
+
+
+instrument_server_client = InstrumentServerClient(
+    limit_per_host=get_security_config().instrument_server_connections_per_host
+)
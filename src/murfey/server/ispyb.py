@@ -2,7 +2,23 @@ from __future__ import annotations
 
 import datetime
 import logging
-from typing import Callable, Generator, List, Literal, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Hashable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    TypeVar,
+)
 
 import ispyb
 import workflows.transport
@@ -29,9 +45,11 @@ from ispyb.sqlalchemy import (
     url,
 )
 from pydantic import BaseModel
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, sessionmaker
 
+import murfey.server.prometheus as prom
 from murfey.util import sanitise
 from murfey.util.config import get_security_config
 from murfey.util.models import (
@@ -41,6 +59,7 @@ from murfey.util.models import (
 )
 
 log = logging.getLogger("murfey.server.ispyb")
+T = TypeVar("T")
 security_config = get_security_config()
 
 try:
@@ -91,7 +110,9 @@ def _send_using_new_connection(transport_type: str, queue: str, message: dict) -
 
 
 class TransportManager:
-    def __init__(self, transport_type: Literal["PikaTransport"]):
+    def __init__(
+        self, transport_type: Literal["PikaTransport"], update_delay: float = 2.0
+    ):
         self._transport_type = transport_type
         self.transport = workflows.transport.lookup(transport_type)()
         self.transport.connect()
@@ -109,6 +130,15 @@ class TransportManager:
             self.ispyb = None
         self._connection_callback: Callable | None = None
 
+        # Write-behind queue of GridSquare column updates, keyed by ID. Updates that
+        # fail to be written are queued again, up to 'max_update_attempts' times
+        self.update_delay = update_delay
+        self.max_update_attempts = 3
+        self._pending_updates: dict[int, dict[str, Any]] = {}
+        self._update_attempts: dict[int, int] = {}
+        self._pending_updates_lock = threading.Lock()
+        self._flush_timer: threading.Timer | None = None
+
     def reconnect(self):
         try:
             self.transport.disconnect()
@@ -215,14 +245,10 @@ class TransportManager:
             )
         return {"success": False, "return_value": None}
 
-    def do_insert_grid_square(
-        self,
-        atlas_id: int,
-        grid_square_id: int,
+    @staticmethod
+    def _grid_square_pixel_size(
         grid_square_parameters: GridSquareParameters,
-        color_flags: dict[str, int] | None = None,
-    ):
-        color_flags = color_flags or {}
+    ) -> Optional[float]:
         # most of this is for mypy
         pixel_size = grid_square_parameters.pixel_size
         if (
@@ -236,6 +262,16 @@ class TransportManager:
                 grid_square_parameters.readout_area_x
                 / grid_square_parameters.thumbnail_size_x
             )
+        return pixel_size
+
+    @classmethod
+    def _grid_square_record(
+        cls,
+        atlas_id: int,
+        grid_square_id: int,
+        grid_square_parameters: GridSquareParameters,
+        color_flags: dict[str, int] | None = None,
+    ) -> GridSquare:
         record = GridSquare(
             atlasId=atlas_id,
             gridSquareLabel=grid_square_id,
@@ -247,13 +283,113 @@ class TransportManager:
             angle=grid_square_parameters.angle,
             stageLocationX=grid_square_parameters.x_stage_position,
             stageLocationY=grid_square_parameters.y_stage_position,
-            pixelSize=pixel_size,
+            pixelSize=cls._grid_square_pixel_size(grid_square_parameters),
             mode=grid_square_parameters.collection_mode,
         )
         # Optionally insert colour flags
-        if color_flags:
-            for col_name, value in color_flags.items():
-                setattr(record, col_name, value)
+        for col_name, value in (color_flags or {}).items():
+            setattr(record, col_name, value)
+        return record
+
+    @classmethod
+    def _grid_square_updates(
+        cls,
+        grid_square_parameters: GridSquareParameters,
+        color_flags: dict[str, int] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Returns the GridSquare columns to change for an update with these parameters
+        """
+        updates: dict[str, Any] = {}
+        pixel_size = cls._grid_square_pixel_size(grid_square_parameters)
+        if grid_square_parameters.image:
+            updates["gridSquareImage"] = grid_square_parameters.image
+        if grid_square_parameters.x_location_scaled:
+            updates["pixelLocationX"] = grid_square_parameters.x_location_scaled
+        if grid_square_parameters.y_location_scaled:
+            updates["pixelLocationY"] = grid_square_parameters.y_location_scaled
+        if grid_square_parameters.height_scaled is not None:
+            updates["height"] = grid_square_parameters.height_scaled
+        if grid_square_parameters.width_scaled is not None:
+            updates["width"] = grid_square_parameters.width_scaled
+        if grid_square_parameters.angle:
+            updates["angle"] = grid_square_parameters.angle
+        if grid_square_parameters.x_stage_position:
+            updates["stageLocationX"] = grid_square_parameters.x_stage_position
+        if grid_square_parameters.y_stage_position:
+            updates["stageLocationY"] = grid_square_parameters.y_stage_position
+        if pixel_size:
+            updates["pixelSize"] = pixel_size
+        if grid_square_parameters.collection_mode:
+            updates["mode"] = grid_square_parameters.collection_mode
+        # Optionally insert colour flags
+        updates.update(color_flags or {})
+        return updates
+
+    def _insert_records(self, records: list, table_name: str) -> dict:
+        """
+        Inserts a list of records of the same table in a single transaction, returning
+        their new primary keys in the same order as the records
+        """
+        try:
+            with ISPyBSession() as db:
+                db.add_all(records)
+                # Primary keys are populated by the flush, so read them before
+                # the commit expires the records
+                db.flush()
+                ids = [
+                    inspect(record).mapper.primary_key_from_instance(record)[0]
+                    for record in records
+                ]
+                db.commit()
+                log.info(f"Created {len(ids)} {table_name} entries")
+                return {"success": True, "return_value": ids}
+        except ispyb.ISPyBException as e:
+            log.error(
+                "Inserting %s entries caused exception '%s'.",
+                table_name,
+                e,
+                exc_info=True,
+            )
+        return {"success": False, "return_value": None}
+
+    def _update_grid_square_rows(
+        self, updates: dict[int, dict[str, Any]], table_name: str = "GridSquare"
+    ) -> dict:
+        """
+        Applies the column changes to each of the GridSquare rows, keyed by ID, in a
+        single transaction using bulk UPDATE statements
+        """
+        rows = [
+            {"gridSquareId": grid_square_id, **columns}
+            for grid_square_id, columns in updates.items()
+            if columns
+        ]
+        try:
+            if rows:
+                with ISPyBSession() as db:
+                    db.execute(update(GridSquare), rows)
+                    db.commit()
+            return {"success": True, "return_value": list(updates.keys())}
+        except (ispyb.ISPyBException, SQLAlchemyError) as e:
+            log.error(
+                "Updating %s entries caused exception '%s'.",
+                table_name,
+                e,
+                exc_info=True,
+            )
+        return {"success": False, "return_value": None}
+
+    def do_insert_grid_square(
+        self,
+        atlas_id: int,
+        grid_square_id: int,
+        grid_square_parameters: GridSquareParameters,
+        color_flags: dict[str, int] | None = None,
+    ):
+        record = self._grid_square_record(
+            atlas_id, grid_square_id, grid_square_parameters, color_flags
+        )
         try:
             with ISPyBSession() as db:
                 db.add(record)
@@ -268,13 +404,33 @@ class TransportManager:
             )
         return {"success": False, "return_value": None}
 
+    def do_insert_grid_squares(
+        self,
+        grid_squares: List[tuple[int, int, GridSquareParameters]],
+        color_flags: List[dict[str, int] | None] | None = None,
+    ):
+        """
+        Inserts a list of (atlas ID, grid square label, parameters) in a single
+        transaction, optionally with the colour flags for each of them. The IDs of
+        the new grid squares are returned in the same order.
+        """
+        color_flags = color_flags or [None] * len(grid_squares)
+        return self._insert_records(
+            [
+                self._grid_square_record(atlas_id, grid_square_id, parameters, flags)
+                for (atlas_id, grid_square_id, parameters), flags in zip(
+                    grid_squares, color_flags
+                )
+            ],
+            "GridSquare",
+        )
+
     def do_update_grid_square(
         self,
         grid_square_id: int,
         grid_square_parameters: GridSquareParameters,
         color_flags: dict[str, int] | None = None,
     ):
-        color_flags = color_flags or {}
         try:
             with ISPyBSession() as db:
                 grid_square: GridSquare = (
@@ -282,44 +438,10 @@ class TransportManager:
                     .filter(GridSquare.gridSquareId == grid_square_id)
                     .one()
                 )
-                pixel_size = grid_square_parameters.pixel_size
-                if (
-                    pixel_size is not None
-                    and grid_square_parameters.readout_area_x is not None
-                    and grid_square_parameters.thumbnail_size_x is not None
-                ):
-                    pixel_size *= (
-                        grid_square_parameters.readout_area_x
-                        / grid_square_parameters.thumbnail_size_x
-                    )
-                if grid_square_parameters.image:
-                    grid_square.gridSquareImage = grid_square_parameters.image
-                if grid_square_parameters.x_location_scaled:
-                    grid_square.pixelLocationX = (
-                        grid_square_parameters.x_location_scaled
-                    )
-                if grid_square_parameters.y_location_scaled:
-                    grid_square.pixelLocationY = (
-                        grid_square_parameters.y_location_scaled
-                    )
-                if grid_square_parameters.height_scaled is not None:
-                    grid_square.height = grid_square_parameters.height_scaled
-                if grid_square_parameters.width_scaled is not None:
-                    grid_square.width = grid_square_parameters.width_scaled
-                if grid_square_parameters.angle:
-                    grid_square.angle = grid_square_parameters.angle
-                if grid_square_parameters.x_stage_position:
-                    grid_square.stageLocationX = grid_square_parameters.x_stage_position
-                if grid_square_parameters.y_stage_position:
-                    grid_square.stageLocationY = grid_square_parameters.y_stage_position
-                if pixel_size:
-                    grid_square.pixelSize = pixel_size
-                if grid_square_parameters.collection_mode:
-                    grid_square.mode = grid_square_parameters.collection_mode
-                # Optionally insert colour flags
-                if color_flags:
-                    for col_name, value in color_flags.items():
-                        setattr(grid_square, col_name, value)
+                for col_name, value in self._grid_square_updates(
+                    grid_square_parameters, color_flags
+                ).items():
+                    setattr(grid_square, col_name, value)
                 db.add(grid_square)
                 db.commit()
                 return {"success": True, "return_value": grid_square.gridSquareId}
@@ -331,12 +453,110 @@ class TransportManager:
             )
         return {"success": False, "return_value": None}
 
-    def do_insert_foil_hole(
+    def do_update_grid_squares(
+        self,
+        grid_square_updates: List[tuple[int, GridSquareParameters]],
+        color_flags: List[dict[str, int] | None] | None = None,
+    ):
+        """
+        Updates a list of (grid square ID, parameters) in a single transaction,
+        optionally with the colour flags for each of them. Repeated updates to the
+        same grid square are merged in order.
+        """
+        color_flags = color_flags or [None] * len(grid_square_updates)
+        updates: dict[int, dict[str, Any]] = {}
+        for (grid_square_id, parameters), flags in zip(
+            grid_square_updates, color_flags
+        ):
+            updates.setdefault(grid_square_id, {}).update(
+                self._grid_square_updates(parameters, flags)
+            )
+        return self._update_grid_square_rows(updates)
+
+    def queue_grid_square_update(
         self,
+        grid_square_id: int,
+        grid_square_parameters: GridSquareParameters,
+        color_flags: dict[str, int] | None = None,
+    ):
+        """
+        Queues an update to a grid square to be written by the next call to
+        'flush_updates', or after 'update_delay' seconds at the latest. Further
+        updates to the same grid square in that time are merged into a single write,
+        with later values taking precedence.
+        """
+        self._queue_update(
+            grid_square_id,
+            self._grid_square_updates(grid_square_parameters, color_flags),
+        )
+
+    def _queue_update(self, grid_square_id: int, columns: dict[str, Any]):
+        with self._pending_updates_lock:
+            self._pending_updates.setdefault(grid_square_id, {}).update(columns)
+            self._start_flush_timer()
+
+    def _start_flush_timer(self):
+        # Must be called while holding the pending updates lock
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.update_delay, self.flush_updates)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _requeue_updates(self, updates: dict[int, dict[str, Any]]):
+        """
+        Puts updates that failed to be written back on the queue, behind any newer
+        updates to the same grid squares, dropping those that have been tried
+        'max_update_attempts' times already
+        """
+        lost = []
+        with self._pending_updates_lock:
+            for grid_square_id, columns in updates.items():
+                attempts = self._update_attempts.get(grid_square_id, 0) + 1
+                if attempts >= self.max_update_attempts:
+                    self._update_attempts.pop(grid_square_id, None)
+                    lost.append(grid_square_id)
+                    continue
+                self._update_attempts[grid_square_id] = attempts
+                self._pending_updates[grid_square_id] = {
+                    **columns,
+                    **self._pending_updates.get(grid_square_id, {}),
+                }
+            if len(lost) < len(updates):
+                self._start_flush_timer()
+        if lost:
+            log.error(
+                f"Gave up writing queued updates to GridSquare entries {lost} after "
+                f"{self.max_update_attempts} attempts"
+            )
+
+    def flush_updates(self) -> dict:
+        """
+        Writes all the queued GridSquare updates to ISPyB. Updates that can't be
+        written are queued to be tried again after 'update_delay' seconds.
+        """
+        with self._pending_updates_lock:
+            updates, self._pending_updates = self._pending_updates, {}
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        if not updates:
+            return {"success": True, "return_value": []}
+        log.debug(f"Writing queued updates for {len(updates)} GridSquare entries")
+        result = self._update_grid_square_rows(updates)
+        if result["success"]:
+            with self._pending_updates_lock:
+                for grid_square_id in updates:
+                    self._update_attempts.pop(grid_square_id, None)
+        else:
+            self._requeue_updates(updates)
+        return result
+
+    @staticmethod
+    def _foil_hole_record(
         grid_square_id: int,
         scale_factor: Optional[float],
         foil_hole_parameters: FoilHoleParameters,
-    ):
+    ) -> FoilHole:
         pixel_size = foil_hole_parameters.pixel_size
         diameter = foil_hole_parameters.diameter
         x_location = foil_hole_parameters.x_location
@@ -366,7 +586,7 @@ class TransportManager:
                 if foil_hole_parameters.y_location
                 else None
             )
-        record = FoilHole(
+        return FoilHole(
             gridSquareId=grid_square_id,
             foilHoleLabel=foil_hole_parameters.name,
             foilHoleImage=foil_hole_parameters.image,
@@ -377,6 +597,16 @@ class TransportManager:
             stageLocationY=foil_hole_parameters.y_stage_position,
             pixelSize=pixel_size,
         )
+
+    def do_insert_foil_hole(
+        self,
+        grid_square_id: int,
+        scale_factor: Optional[float],
+        foil_hole_parameters: FoilHoleParameters,
+    ):
+        record = self._foil_hole_record(
+            grid_square_id, scale_factor, foil_hole_parameters
+        )
         try:
             with ISPyBSession() as db:
                 db.add(record)
@@ -391,6 +621,56 @@ class TransportManager:
             )
         return {"success": False, "return_value": None}
 
+    def do_insert_foil_holes(
+        self,
+        grid_square_id: int,
+        scale_factor: Optional[float],
+        foil_hole_parameters: List[FoilHoleParameters],
+    ):
+        """
+        Inserts all the foil holes of a grid square in a single transaction. The IDs
+        of the new foil holes are returned in the same order as the parameters.
+        """
+        return self._insert_records(
+            [
+                self._foil_hole_record(grid_square_id, scale_factor, params)
+                for params in foil_hole_parameters
+            ],
+            "FoilHole",
+        )
+
+    @staticmethod
+    def _update_foil_hole_record(
+        foil_hole: FoilHole,
+        scale_factor: float,
+        foil_hole_parameters: FoilHoleParameters,
+    ):
+        if foil_hole_parameters.image:
+            foil_hole.foilHoleImage = foil_hole_parameters.image
+        if foil_hole_parameters.x_location:
+            foil_hole.pixelLocationX = int(
+                foil_hole_parameters.x_location * scale_factor
+            )
+        if foil_hole_parameters.y_location:
+            foil_hole.pixelLocationY = int(
+                foil_hole_parameters.y_location * scale_factor
+            )
+        if foil_hole_parameters.diameter is not None:
+            foil_hole.diameter = foil_hole_parameters.diameter * scale_factor
+        if foil_hole_parameters.x_stage_position:
+            foil_hole.stageLocationX = foil_hole_parameters.x_stage_position
+        if foil_hole_parameters.y_stage_position:
+            foil_hole.stageLocationY = foil_hole_parameters.y_stage_position
+        if (
+            foil_hole_parameters.readout_area_x is not None
+            and foil_hole_parameters.thumbnail_size_x is not None
+            and foil_hole_parameters.pixel_size is not None
+        ):
+            foil_hole.pixelSize = foil_hole_parameters.pixel_size * (
+                foil_hole_parameters.readout_area_x
+                / foil_hole_parameters.thumbnail_size_x
+            )
+
     def do_update_foil_hole(
         self,
         foil_hole_id: int,
@@ -402,31 +682,9 @@ class TransportManager:
                 foil_hole = (
                     db.query(FoilHole).filter(FoilHole.foilHoleId == foil_hole_id).one()
                 )
-                if foil_hole_parameters.image:
-                    foil_hole.foilHoleImage = foil_hole_parameters.image
-                if foil_hole_parameters.x_location:
-                    foil_hole.pixelLocationX = int(
-                        foil_hole_parameters.x_location * scale_factor
-                    )
-                if foil_hole_parameters.y_location:
-                    foil_hole.pixelLocationY = int(
-                        foil_hole_parameters.y_location * scale_factor
-                    )
-                if foil_hole_parameters.diameter is not None:
-                    foil_hole.diameter = foil_hole_parameters.diameter * scale_factor
-                if foil_hole_parameters.x_stage_position:
-                    foil_hole.stageLocationX = foil_hole_parameters.x_stage_position
-                if foil_hole_parameters.y_stage_position:
-                    foil_hole.stageLocationY = foil_hole_parameters.y_stage_position
-                if (
-                    foil_hole_parameters.readout_area_x is not None
-                    and foil_hole_parameters.thumbnail_size_x is not None
-                    and foil_hole_parameters.pixel_size is not None
-                ):
-                    foil_hole.pixelSize = foil_hole_parameters.pixel_size * (
-                        foil_hole_parameters.readout_area_x
-                        / foil_hole_parameters.thumbnail_size_x
-                    )
+                self._update_foil_hole_record(
+                    foil_hole, scale_factor, foil_hole_parameters
+                )
                 db.add(foil_hole)
                 db.commit()
                 return {"success": True, "return_value": foil_hole.foilHoleId}
@@ -438,11 +696,45 @@ class TransportManager:
             )
         return {"success": False, "return_value": None}
 
-    def do_insert_search_map(
+    def do_update_foil_holes(
         self,
-        atlas_id: int,
-        search_map_parameters: SearchMapParameters,
+        scale_factor: float,
+        foil_hole_updates: List[tuple[int, FoilHoleParameters]],
     ):
+        """
+        Updates a list of (foil hole ID, parameters) in a single transaction
+        """
+        try:
+            with ISPyBSession() as db:
+                foil_holes = {
+                    foil_hole.foilHoleId: foil_hole
+                    for foil_hole in db.query(FoilHole).filter(
+                        FoilHole.foilHoleId.in_(
+                            [foil_hole_id for foil_hole_id, _ in foil_hole_updates]
+                        )
+                    )
+                }
+                for foil_hole_id, foil_hole_parameters in foil_hole_updates:
+                    if (foil_hole := foil_holes.get(foil_hole_id)) is None:
+                        log.warning(f"FoilHole {foil_hole_id} not found for update")
+                        continue
+                    self._update_foil_hole_record(
+                        foil_hole, scale_factor, foil_hole_parameters
+                    )
+                db.commit()
+                return {"success": True, "return_value": list(foil_holes.keys())}
+        except ispyb.ISPyBException as e:
+            log.error(
+                "Updating FoilHole entries caused exception '%s'.",
+                e,
+                exc_info=True,
+            )
+        return {"success": False, "return_value": None}
+
+    @staticmethod
+    def _search_map_pixel_size(
+        search_map_parameters: SearchMapParameters,
+    ) -> Optional[float]:
         pixel_size = search_map_parameters.pixel_size
         if (
             pixel_size
@@ -452,7 +744,13 @@ class TransportManager:
             pixel_size *= (
                 search_map_parameters.height / search_map_parameters.height_on_atlas
             )
-        record = GridSquare(
+        return pixel_size
+
+    @classmethod
+    def _search_map_record(
+        cls, atlas_id: int, search_map_parameters: SearchMapParameters
+    ) -> GridSquare:
+        return GridSquare(
             atlasId=atlas_id,
             gridSquareImage=search_map_parameters.image,
             pixelLocationX=int(search_map_parameters.x_location / 7.8)
@@ -470,8 +768,42 @@ class TransportManager:
             angle=0,
             stageLocationX=search_map_parameters.x_stage_position,
             stageLocationY=search_map_parameters.y_stage_position,
-            pixelSize=pixel_size,
+            pixelSize=cls._search_map_pixel_size(search_map_parameters),
         )
+
+    @classmethod
+    def _search_map_updates(
+        cls, search_map_parameters: SearchMapParameters
+    ) -> dict[str, Any]:
+        """
+        Returns the GridSquare columns to change for an update with these parameters
+        """
+        updates: dict[str, Any] = {}
+        pixel_size = cls._search_map_pixel_size(search_map_parameters)
+        if search_map_parameters.image:
+            updates["gridSquareImage"] = search_map_parameters.image
+        if search_map_parameters.x_location:
+            updates["pixelLocationX"] = int(search_map_parameters.x_location / 7.8)
+        if search_map_parameters.y_location:
+            updates["pixelLocationY"] = int(search_map_parameters.y_location / 7.8)
+        if search_map_parameters.height_on_atlas:
+            updates["height"] = int(search_map_parameters.height_on_atlas / 7.8)
+        if search_map_parameters.width_on_atlas:
+            updates["width"] = int(search_map_parameters.width_on_atlas / 7.8)
+        if search_map_parameters.x_stage_position:
+            updates["stageLocationX"] = search_map_parameters.x_stage_position
+        if search_map_parameters.y_stage_position:
+            updates["stageLocationY"] = search_map_parameters.y_stage_position
+        if pixel_size:
+            updates["pixelSize"] = pixel_size
+        return updates
+
+    def do_insert_search_map(
+        self,
+        atlas_id: int,
+        search_map_parameters: SearchMapParameters,
+    ):
+        record = self._search_map_record(atlas_id, search_map_parameters)
         try:
             with ISPyBSession() as db:
                 db.add(record)
@@ -496,38 +828,10 @@ class TransportManager:
                     .filter(GridSquare.gridSquareId == search_map_id)
                     .one()
                 )
-                pixel_size = search_map_parameters.pixel_size
-                if (
-                    pixel_size
-                    and search_map_parameters.height
-                    and search_map_parameters.height_on_atlas
-                ):
-                    pixel_size *= (
-                        search_map_parameters.height
-                        / search_map_parameters.height_on_atlas
-                    )
-                if search_map_parameters.image:
-                    grid_square.gridSquareImage = search_map_parameters.image
-                if search_map_parameters.x_location:
-                    grid_square.pixelLocationX = int(
-                        search_map_parameters.x_location / 7.8
-                    )
-                if search_map_parameters.y_location:
-                    grid_square.pixelLocationY = int(
-                        search_map_parameters.y_location / 7.8
-                    )
-                if search_map_parameters.height_on_atlas:
-                    grid_square.height = int(
-                        search_map_parameters.height_on_atlas / 7.8
-                    )
-                if search_map_parameters.width_on_atlas:
-                    grid_square.width = int(search_map_parameters.width_on_atlas / 7.8)
-                if search_map_parameters.x_stage_position:
-                    grid_square.stageLocationX = search_map_parameters.x_stage_position
-                if search_map_parameters.y_stage_position:
-                    grid_square.stageLocationY = search_map_parameters.y_stage_position
-                if pixel_size:
-                    grid_square.pixelSize = pixel_size
+                for col_name, value in self._search_map_updates(
+                    search_map_parameters
+                ).items():
+                    setattr(grid_square, col_name, value)
                 db.add(grid_square)
                 db.commit()
                 return {"success": True, "return_value": grid_square.gridSquareId}
@@ -539,6 +843,20 @@ class TransportManager:
             )
         return {"success": False, "return_value": None}
 
+    def do_update_search_maps(
+        self,
+        search_map_updates: List[tuple[int, SearchMapParameters]],
+    ):
+        """
+        Updates a list of (search map ID, parameters) in a single transaction
+        """
+        updates: dict[int, dict[str, Any]] = {}
+        for search_map_id, parameters in search_map_updates:
+            updates.setdefault(search_map_id, {}).update(
+                self._search_map_updates(parameters)
+            )
+        return self._update_grid_square_rows(updates, "SearchMap (GridSquare)")
+
     def do_insert_sxt_roi(
         self,
         atlas_id: int,
@@ -973,6 +1291,198 @@ def _get_session() -> Generator[Optional[Session], None, None]:
 DB = Depends(_get_session)
 
 
+class _CachedLookup(NamedTuple):
+    value: Any
+    loaded_at: float
+
+
+class ISPyBLookupCache:
+    """
+    Read-through cache of the results of an ISPyB lookup, keyed on the values being
+    looked up.
+
+    Results are reused for 'ttl' seconds. After that, they are still returned for up
+    to 'stale_ttl' seconds more while the lookup is repeated in the background, so
+    that a slow ISPyB database only holds up requests when there is nothing cached.
+    Concurrent lookups of the same missing result wait for a single query instead of
+    each running their own. Results of None, which mean ISPyB couldn't be reached,
+    are not cached, and neither are errors.
+    """
+
+    def __init__(
+        self, name: str, ttl: float, stale_ttl: float = 0, max_entries: int = 1024
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, _CachedLookup] = OrderedDict()
+        # Lookups currently being made, which other requests for the same key wait on
+        self._pending: Dict[Hashable, Future] = {}
+        # Incremented on invalidation, so that lookups already under way when the
+        # cache is invalidated don't add their results to it
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, lookup: Callable[[Session], T], db: Session) -> T:
+        """
+        Returns the cached result for the key, or looks it up using the database
+        session provided if there isn't one
+        """
+        refresh: Optional[Future] = None
+        future: Optional[Future] = None
+        leader = False
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.monotonic() - entry.loaded_at if entry is not None else None
+            if age is not None and age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                if age >= self.ttl and key not in self._pending:
+                    refresh = self._pending[key] = Future()
+            else:
+                entry = None
+                future = self._pending.get(key)
+                if future is None:
+                    leader = True
+                    future = self._pending[key] = Future()
+            generation = self._generation
+
+        if entry is not None:
+            prom.ispyb_cache_hits.labels(query=self.name).inc()
+            if age is not None and age >= self.ttl:
+                prom.ispyb_cache_stale_hits.labels(query=self.name).inc()
+            if refresh is not None:
+                threading.Thread(
+                    target=self._refresh,
+                    args=(key, lookup, refresh, generation),
+                    name=f"ispyb_{self.name}_refresh",
+                    daemon=True,
+                ).start()
+            return entry.value
+        prom.ispyb_cache_misses.labels(query=self.name).inc()
+        assert future is not None
+        if not leader:
+            return future.result()
+        return self._load(key, lookup, db, future, generation)
+
+    def _load(
+        self,
+        key: Hashable,
+        lookup: Callable[[Session], T],
+        db: Session,
+        future: Future,
+        generation: int,
+    ) -> T:
+        start = time.perf_counter()
+        try:
+            value = lookup(db)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(e)
+            raise
+        finally:
+            prom.ispyb_query_seconds.labels(query=self.name).observe(
+                time.perf_counter() - start
+            )
+        with self._lock:
+            self._pending.pop(key, None)
+            if value is not None and generation == self._generation:
+                self._entries[key] = _CachedLookup(value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def _refresh(
+        self,
+        key: Hashable,
+        lookup: Callable[[Session], T],
+        future: Future,
+        generation: int,
+    ):
+        # The session of the request that found the entry expired can't be shared
+        # with another thread, so the background lookup uses its own
+        db = ISPyBSession()
+        if db is None:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_result(None)
+            return
+        try:
+            self._load(key, lookup, db, future, generation)
+        except Exception:
+            log.warning(
+                f"Failed to refresh cached ISPyB {self.name} lookup", exc_info=True
+            )
+        finally:
+            db.close()
+
+    def invalidate(self, key: Optional[Hashable] = None) -> int:
+        """
+        Removes the cached result for the key, or all cached results if no key is
+        given, returning the number of results removed
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            return 0 if self._entries.pop(key, None) is None else 1
+
+
+# Which visit a session ID belongs to and the ID of a proposal don't change, so
+# those are kept for longer than the ongoing visits
+session_id_cache = ISPyBLookupCache("session_id", ttl=security_config.ispyb_cache_ttl)
+proposal_id_cache = ISPyBLookupCache("proposal_id", ttl=security_config.ispyb_cache_ttl)
+ongoing_visits_cache = ISPyBLookupCache(
+    "ongoing_visits",
+    ttl=security_config.ispyb_visits_cache_ttl,
+    stale_ttl=security_config.ispyb_visits_stale_ttl,
+)
+ispyb_caches: Dict[str, ISPyBLookupCache] = {
+    cache.name: cache
+    for cache in (session_id_cache, proposal_id_cache, ongoing_visits_cache)
+}
+
+
+def invalidate_ispyb_caches(query: Optional[str] = None) -> int:
+    """
+    Removes the cached results of one or all of the ISPyB lookups, returning the
+    number of results removed
+    """
+    caches = [ispyb_caches[query]] if query is not None else ispyb_caches.values()
+    return sum(cache.invalidate() for cache in caches)
+
+
+def _lookup_session_id(
+    db: Session,
+    microscope: str,
+    proposal_code: str,
+    proposal_number: str,
+    visit_number: str,
+) -> int:
+    query = (
+        db.query(BLSession)
+        .join(Proposal)
+        .filter(
+            BLSession.proposalId == Proposal.proposalId,
+            BLSession.beamLineName == microscope,
+            Proposal.proposalCode == proposal_code,
+            Proposal.proposalNumber == proposal_number,
+            BLSession.visit_number == visit_number,
+        )
+        .add_columns(BLSession.sessionId)
+        .all()
+    )
+    return query[0][1]
+
+
 def get_session_id(
     microscope: str,
     proposal_code: str,
@@ -992,25 +1502,23 @@ def get_session_id(
     # Lookup BLSession ID
     if db is None:
         return None
-    query = (
-        db.query(BLSession)
-        .join(Proposal)
-        .filter(
-            BLSession.proposalId == Proposal.proposalId,
-            BLSession.beamLineName == microscope,
-            Proposal.proposalCode == proposal_code,
-            Proposal.proposalNumber == proposal_number,
-            BLSession.visit_number == visit_number,
+    try:
+        return session_id_cache.get(
+            (microscope, proposal_code, str(proposal_number), str(visit_number)),
+            partial(
+                _lookup_session_id,
+                microscope=microscope,
+                proposal_code=proposal_code,
+                proposal_number=proposal_number,
+                visit_number=visit_number,
+            ),
+            db,
         )
-        .add_columns(BLSession.sessionId)
-        .all()
-    )
-    res = query[0][1]
-    db.close()
-    return res
+    finally:
+        db.close()
 
 
-def get_proposal_id(proposal_code: str, proposal_number: str, db: Session) -> int:
+def _lookup_proposal_id(db: Session, proposal_code: str, proposal_number: str) -> int:
     query = (
         db.query(Proposal)
         .filter(
@@ -1022,10 +1530,19 @@ def get_proposal_id(proposal_code: str, proposal_number: str, db: Session) -> in
     return query[0].proposalId
 
 
-def get_all_ongoing_visits(microscope: str, db: Session | None) -> list[Visit]:
-    if db is None:
-        print("No database found")
-        return []
+def get_proposal_id(proposal_code: str, proposal_number: str, db: Session) -> int:
+    return proposal_id_cache.get(
+        (proposal_code, str(proposal_number)),
+        partial(
+            _lookup_proposal_id,
+            proposal_code=proposal_code,
+            proposal_number=proposal_number,
+        ),
+        db,
+    )
+
+
+def _lookup_ongoing_visits(db: Session, microscope: str) -> list[Visit]:
     query = (
         db.query(BLSession)
         .join(Proposal)
@@ -1057,3 +1574,17 @@ def get_all_ongoing_visits(microscope: str, db: Session | None) -> list[Visit]:
         )
         for row in query
     ]
+
+
+def get_all_ongoing_visits(microscope: str, db: Session | None) -> list[Visit]:
+    if db is None:
+        print("No database found")
+        return []
+    visits = ongoing_visits_cache.get(
+        microscope, partial(_lookup_ongoing_visits, microscope=microscope), db
+    )
+    if visits is None:
+        return []
+    # Leave out any visits that have ended since they were looked up
+    now = datetime.datetime.now()
+    return [visit for visit in visits if visit.end > now]
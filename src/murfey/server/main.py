@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+from contextlib import asynccontextmanager
 from importlib.metadata import entry_points
 
 from fastapi import FastAPI
@@ -30,6 +31,7 @@ import murfey.server.api.workflow_fib
 import murfey.server.api.workflow_sim
 import murfey.server.api.workflow_sxt
 from murfey.server import template_files
+from murfey.server.instrument_client import instrument_server_client
 from murfey.util.config import get_security_config
 
 logger = logging.getLogger("murfey.server.main")
@@ -45,7 +47,18 @@ security_config = get_security_config()
 
 settings = Settings()
 
-app = FastAPI(title="Murfey server", debug=True, openapi_tags=tags_metadata)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one HTTP client for all requests forwarded to the instrument servers
+    await instrument_server_client.start()
+    yield
+    await instrument_server_client.close()
+
+
+app = FastAPI(
+    title="Murfey server", debug=True, openapi_tags=tags_metadata, lifespan=lifespan
+)
 
 metrics_app = make_asgi_app()
 app.mount("/metrics", metrics_app)
@@ -0,0 +1,337 @@
+"""
+A persistent, content-addressed cache for the files passed through by the bootstrap
+proxies, so that air-gapped client machines being set up at the same time do not
+each cause the same packages to be downloaded again from the internet.
+
+Files are stored on disk under the SHA-256 digest of their contents, and an SQLite
+index maps the URL (or other key) they were requested with to that digest. Package
+files are immutable once published, so they are fetched only once, whereas index
+pages and package databases change over time and are revalidated with the upstream
+server using their ETag or Last-Modified header once their time-to-live has expired.
+The cache is kept below a maximum size by evicting the least recently used files.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+import requests
+
+from murfey.util.config import get_security_config
+
+logger = logging.getLogger("murfey.server.package_cache")
+
+
+class PackageNotCached(LookupError):
+    """
+    Raised in offline mode when a file that has not been cached is requested
+    """
+
+
+class UpstreamError(Exception):
+    """
+    Raised when a file could not be fetched from the upstream server
+    """
+
+    def __init__(self, url: str, status_code: int):
+        super().__init__(f"Fetching {url} returned status code {status_code}")
+        self.url = url
+        self.status_code = status_code
+
+
+class CachedFile(NamedTuple):
+    path: Path
+    size: int
+    content_type: Optional[str]
+    sha256: str
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+"""
+
+
+class PackageCache:
+    """
+    On-disk cache of upstream files, keyed by content hash. It is safe to use from
+    multiple threads, and concurrent requests for the same uncached file wait for a
+    single download from the upstream server to complete rather than each making
+    their own.
+
+    In offline mode, no requests are made to the upstream servers at all, and only
+    files that are already in the cache can be returned.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int = 20 * 1024**3,
+        index_ttl: float = 300,
+        offline: bool = False,
+        http_session: requests.Session | None = None,
+        chunk_size: int = 1024**2,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.index_ttl = index_ttl
+        self.offline = offline
+        self.http_session = http_session or requests.Session()
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        self._blob_dir = self.directory / "blobs"
+        self._tmp_dir = self.directory / "tmp"
+        self._blob_dir.mkdir(parents=True, exist_ok=True)
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._fetch_locks: dict[str, tuple[threading.Lock, int]] = {}
+        self._db = sqlite3.connect(
+            self.directory / "index.sqlite", check_same_thread=False
+        )
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self._blob_dir / sha256[:2] / sha256
+
+    @property
+    def current_bytes(self) -> int:
+        with self._lock:
+            (total,) = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT DISTINCT sha256, size FROM entries)"
+            ).fetchone()
+        return total
+
+    def get_file(self, url: str, key: str | None = None) -> CachedFile:
+        """
+        Returns an immutable file, downloading it from 'url' only if it has not been
+        cached before. 'key' can be given to cache the file under a name other than
+        the URL it is downloaded from, such as when it is downloaded from a mirror.
+        """
+        key = key or url
+        if (cached := self._lookup(key)) is not None:
+            self.hits += 1
+            return cached
+        if self.offline:
+            raise PackageNotCached(key)
+        with self._fetch_lock(key):
+            # Another thread may have downloaded it while this one was waiting
+            if (cached := self._lookup(key)) is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            return self._fetch(url, key)
+
+    def get_index(self, url: str, key: str | None = None) -> CachedFile:
+        """
+        Returns a file that can change upstream, such as an index page or package
+        database. Cached copies are used as they are until they are older than the
+        time-to-live, after which they are revalidated with the upstream server.
+        If the upstream server cannot be reached, the cached copy is used instead.
+        """
+        key = key or url
+        if (cached := self._lookup(key, max_age=self.index_ttl)) is not None:
+            self.hits += 1
+            return cached
+        if self.offline:
+            if (cached := self._lookup(key)) is not None:
+                self.hits += 1
+                return cached
+            raise PackageNotCached(key)
+        with self._fetch_lock(key):
+            if (cached := self._lookup(key, max_age=self.index_ttl)) is not None:
+                self.hits += 1
+                return cached
+            try:
+                return self._fetch(url, key, revalidate=True)
+            except requests.RequestException:
+                if (cached := self._lookup(key)) is None:
+                    raise
+                logger.warning(
+                    f"Could not revalidate {url}; using the cached copy instead",
+                    exc_info=True,
+                )
+                return cached
+
+    @contextmanager
+    def _fetch_lock(self, key: str) -> Iterator[None]:
+        with self._lock:
+            lock, waiting = self._fetch_locks.get(key, (threading.Lock(), 0))
+            self._fetch_locks[key] = (lock, waiting + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, waiting = self._fetch_locks[key]
+                if waiting == 1:
+                    del self._fetch_locks[key]
+                else:
+                    self._fetch_locks[key] = (lock, waiting - 1)
+
+    def _lookup(self, key: str, max_age: float | None = None) -> CachedFile | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, size, content_type, fetched_at FROM entries "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            sha256, size, content_type, fetched_at = row
+            if max_age is not None and time.time() - fetched_at > max_age:
+                return None
+            path = self._blob_path(sha256)
+            if not path.is_file():
+                # The file was removed from under the cache
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+        return CachedFile(path, size, content_type, sha256)
+
+    def _fetch(self, url: str, key: str, revalidate: bool = False) -> CachedFile:
+        headers: dict[str, str] = {}
+        if revalidate:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT etag, last_modified FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None:
+                etag, last_modified = row
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+
+        logger.debug(f"Fetching {url} for the package cache")
+        with self.http_session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and headers:
+                self.revalidations += 1
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE entries SET fetched_at = ? WHERE key = ?",
+                        (time.time(), key),
+                    )
+                    self._db.commit()
+                if (cached := self._lookup(key)) is not None:
+                    return cached
+                # The cached copy has since been evicted, so download it again
+                return self._fetch(url, key)
+            if response.status_code != 200:
+                raise UpstreamError(url, response.status_code)
+
+            # Write to a temporary file first, so partial downloads are never served
+            sha256 = hashlib.sha256()
+            size = 0
+            fd, tmp_name = tempfile.mkstemp(dir=self._tmp_dir)
+            try:
+                with os.fdopen(fd, "wb") as tmp_file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        sha256.update(chunk)
+                        tmp_file.write(chunk)
+                        size += len(chunk)
+                digest = sha256.hexdigest()
+                blob_path = self._blob_path(digest)
+                blob_path.parent.mkdir(exist_ok=True)
+                os.replace(tmp_name, blob_path)
+            except BaseException:
+                Path(tmp_name).unlink(missing_ok=True)
+                raise
+
+        now = time.time()
+        content_type = response.headers.get("Content-Type")
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    digest,
+                    size,
+                    content_type,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    now,
+                    now,
+                ),
+            )
+            self._db.commit()
+            self._evict(keep=key)
+        return CachedFile(blob_path, size, content_type, digest)
+
+    def _evict(self, keep: str):
+        """
+        Removes the least recently used entries until the cache is below its maximum
+        size. Files are only deleted once no other entries refer to them.
+        """
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM "
+            "(SELECT DISTINCT sha256, size FROM entries)"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return None
+        for key, sha256, size in self._db.execute(
+            "SELECT key, sha256, size FROM entries WHERE key != ? ORDER BY last_access",
+            (keep,),
+        ).fetchall():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            (references,) = self._db.execute(
+                "SELECT COUNT(*) FROM entries WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if not references:
+                self._blob_path(sha256).unlink(missing_ok=True)
+                total -= size
+                logger.debug(f"Evicted {key} from the package cache")
+            if total <= self.max_bytes:
+                break
+        self._db.commit()
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_package_cache() -> PackageCache | None:
+    """
+    Returns the package cache configured in the security configuration, or None if
+    no cache directory has been set up, in which case files are passed through.
+    """
+    security_config = get_security_config()
+    if security_config.package_cache_directory is None:
+        return None
+    return PackageCache(
+        security_config.package_cache_directory,
+        max_bytes=security_config.package_cache_max_size,
+        index_ttl=security_config.package_cache_index_ttl,
+        offline=security_config.package_cache_offline,
+    )
@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 seen_files = Gauge(
     "acquired_files", "Number of files produced", ["rsync_source", "visit"]
@@ -40,3 +40,36 @@ exposure_time = Gauge("exposure_time", "Exposure time for a single movie")
 
 
 alert_end_time = Gauge("alert_end_time", "End time for alerts", ["visit"])
+
+
+auth_cache_hits = Counter(
+    "auth_cache_hits",
+    "Number of token validations answered from the cache",
+    ["validation"],
+)
+auth_cache_misses = Counter(
+    "auth_cache_misses",
+    "Number of token validations that were not cached",
+    ["validation"],
+)
+
+ispyb_cache_hits = Counter(
+    "ispyb_cache_hits",
+    "Number of ISPyB lookups answered from the cache",
+    ["query"],
+)
+ispyb_cache_stale_hits = Counter(
+    "ispyb_cache_stale_hits",
+    "Number of ISPyB lookups answered from expired cache entries",
+    ["query"],
+)
+ispyb_cache_misses = Counter(
+    "ispyb_cache_misses",
+    "Number of ISPyB lookups that were not cached",
+    ["query"],
+)
+ispyb_query_seconds = Histogram(
+    "ispyb_query_seconds",
+    "Time taken by the ISPyB queries made for cached lookups",
+    ["query"],
+)
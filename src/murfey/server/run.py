@@ -191,6 +191,10 @@ def run():
     murfey.server._running_server.run()
     logger.info("Server shutting down")
 
+    # Write out any ISPyB updates still waiting in the queue
+    if murfey.server._transport_object:
+        murfey.server._transport_object.flush_updates()
+
 
 def shutdown():
     if murfey.server._running_server:
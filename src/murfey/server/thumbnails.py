@@ -0,0 +1,172 @@
+"""
+Reduced-size copies of the grid square and foil hole images, so that pages showing
+many of them at once do not need to download the full-resolution images.
+
+Thumbnails are stored in a size-bounded cache directory, under a key derived from
+the path, modification time and size of the image they were made from, so that they
+are regenerated if the image is overwritten. They can be made when an image is first
+requested, or ahead of time when the grid square or foil hole is registered.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from murfey.util.config import get_security_config
+
+logger = logging.getLogger("murfey.server.thumbnails")
+
+# Longest edge, in pixels, of each of the thumbnails that can be requested
+THUMBNAIL_SIZES = (128, 512, 2048)
+
+
+def _to_displayable(image: Image.Image) -> Image.Image:
+    """
+    Converts an image into a mode that can be saved as a JPEG. Images with 16-bit
+    or floating point pixels, as written from MRC files, are rescaled to 8 bits.
+    """
+    if image.mode in ("L", "RGB"):
+        return image
+    if image.mode in ("1", "P", "LA", "RGBA", "CMYK", "YCbCr"):
+        return image.convert("RGB")
+    data = np.asarray(image, dtype=np.float32)
+    low, high = float(data.min()), float(data.max())
+    scale = 255 / (high - low) if high > low else 0
+    return Image.fromarray(((data - low) * scale).astype(np.uint8), mode="L")
+
+
+class ThumbnailCache:
+    """
+    Directory of thumbnails, with the least recently used ones being removed once
+    their total size exceeds 'max_bytes'.
+    """
+
+    def __init__(
+        self, directory: Path, max_bytes: int = 2 * 1024**3, quality: int = 85
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.current_bytes = sum(
+            file.stat().st_size for file in self.directory.glob("*/*.jpg")
+        )
+
+    def key(self, source: Path, size: int) -> str:
+        """
+        Returns the key of the given size of thumbnail of the source image, which
+        changes if the image is modified. A size of 0 refers to the image itself.
+        """
+        stat = os.stat(source)
+        return hashlib.sha256(
+            f"{source}\0{stat.st_mtime_ns}\0{stat.st_size}\0{size}\0{self.quality}".encode()
+        ).hexdigest()
+
+    def etag(self, source: Path, size: int) -> str:
+        return f'"{self.key(source, size)}"'
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.jpg"
+
+    def get(self, source: Path, size: int) -> Path:
+        """
+        Returns the path to a thumbnail of the source image, making it if needed
+        """
+        path = self._path(self.key(source, size))
+        if path.is_file():
+            # The modification time marks when a thumbnail was last used
+            os.utime(path)
+            return path
+        with Image.open(source) as image:
+            image.draft(image.mode, (size, size))  # Decodes JPEGs at reduced size
+            self._save(_to_displayable(image), size, path)
+        return path
+
+    def generate(
+        self, source: Path, image: Image.Image | None = None
+    ) -> dict[int, Path]:
+        """
+        Makes all sizes of thumbnail of the source image, using the image if it has
+        already been opened. Smaller thumbnails are made from the larger ones.
+        """
+        paths = {size: self._path(self.key(source, size)) for size in THUMBNAIL_SIZES}
+        if all(path.is_file() for path in paths.values()):
+            return paths
+        if image is None:
+            with Image.open(source) as opened:
+                return self.generate(source, opened)
+        thumbnail = _to_displayable(image)
+        for size in sorted(THUMBNAIL_SIZES, reverse=True):
+            thumbnail = self._save(thumbnail, size, paths[size])
+        return paths
+
+    def _save(self, image: Image.Image, size: int, path: Path) -> Image.Image:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size))
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                thumbnail.save(tmp_file, format="JPEG", quality=self.quality)
+            replaced = path.exists()
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            if not replaced:
+                self.current_bytes += path.stat().st_size
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+        return thumbnail
+
+    def _evict(self):
+        # Clear down to 90% of the maximum, so eviction doesn't run on every save
+        target = self.max_bytes * 0.9
+        files = []
+        for file in self.directory.glob("*/*.jpg"):
+            try:
+                files.append((file.stat(), file))
+            except FileNotFoundError:
+                continue
+        self.current_bytes = sum(stat.st_size for stat, _ in files)
+        for stat, file in sorted(files, key=lambda f: f[0].st_mtime_ns):
+            if self.current_bytes <= target:
+                break
+            file.unlink(missing_ok=True)
+            self.current_bytes -= stat.st_size
+
+
+@lru_cache(maxsize=1)
+def get_thumbnail_cache() -> ThumbnailCache:
+    security_config = get_security_config()
+    return ThumbnailCache(
+        security_config.thumbnail_cache_directory
+        or Path(tempfile.gettempdir()) / "murfey_thumbnails",
+        max_bytes=security_config.thumbnail_cache_max_size,
+    )
+
+
+def generate_thumbnails(source: Path, image: Image.Image | None = None):
+    """
+    Makes the thumbnails of a newly registered image ahead of them being requested,
+    if configured to. Failures are logged rather than raised, as the thumbnails can
+    still be made when they are first requested.
+    """
+    if not get_security_config().thumbnail_eager_generation:
+        return None
+    try:
+        get_thumbnail_cache().generate(source, image)
+    except Exception:
+        logger.warning(f"Could not make thumbnails of {source}", exc_info=True)
+    return None
@@ -0,0 +1,386 @@
+"""
+An index of the directories and files in the upstream data directories, so that
+finding the visits and files from other instruments to pass on to a correlative
+workflow does not require walking the upstream stores, which can hold years of
+visits on network file systems, every time they are requested.
+
+Each directory searched is indexed as a tree in an SQLite file, which is shared by
+all the server processes. Queries are answered from the index while it is within
+the configured maximum age. After that, the tree is updated incrementally: every
+indexed directory is checked, but only those whose modification times have changed
+are listed again. Visits whose contents have not changed for long enough are taken
+to be closed, and are not checked again unless a refresh is explicitly requested.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+from murfey.util.config import get_security_config
+
+logger = logging.getLogger("murfey.server.upstream_index")
+
+
+class IndexedFile(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trees (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    max_depth INTEGER NOT NULL,
+    with_files INTEGER NOT NULL,
+    scanned_at REAL,
+    changed_at REAL,
+    UNIQUE (root, max_depth, with_files)
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    tree_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER,
+    PRIMARY KEY (tree_id, path)
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (tree_id, parent);
+CREATE TABLE IF NOT EXISTS files (
+    tree_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    suffix TEXT NOT NULL,
+    PRIMARY KEY (tree_id, path)
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files (tree_id, parent);
+CREATE INDEX IF NOT EXISTS files_suffix ON files (tree_id, suffix);
+"""
+
+
+def _join(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent else name
+
+
+def _glob_to_regex(pattern: str) -> re.Pattern:
+    """
+    Translates a relative glob pattern, as used with 'Path.glob()', into a regular
+    expression matching the relative paths it would find. '**' matches any number
+    of directories, and the other wildcards do not match across directories.
+    """
+    regex = ""
+    parts = pattern.split("/")
+    for i, part in enumerate(parts):
+        if part == "**":
+            regex += "(?:[^/]+/)*"
+            continue
+        j = 0
+        while j < len(part):
+            char = part[j]
+            if char == "*":
+                regex += "[^/]*"
+            elif char == "?":
+                regex += "[^/]"
+            elif char == "[" and (end := part.find("]", j + 2)) != -1:
+                contents = part[j + 1 : end].replace("\\", "\\\\")
+                if contents.startswith("!"):
+                    contents = "^" + contents[1:]
+                regex += f"[{contents}]"
+                j = end
+            else:
+                regex += re.escape(char)
+            j += 1
+        if i < len(parts) - 1:
+            regex += "/"
+    return re.compile(regex)
+
+
+def _literal_prefix(pattern: str) -> str:
+    """
+    Returns the leading directories of the pattern that contain no wildcards
+    """
+    prefix = ""
+    for part in pattern.split("/")[:-1]:
+        if any(char in part for char in "*?["):
+            break
+        prefix += f"{part}/"
+    return prefix
+
+
+class UpstreamIndex:
+    """
+    SQLite index of directory trees. It is safe to use from multiple threads, and
+    from multiple processes sharing the same index file.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_age: float = 60,
+        immutable_after: float = 7 * 24 * 3600,
+    ):
+        self.path = Path(path)
+        self.max_age = max_age
+        self.immutable_after = immutable_after
+        self.scans = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._scan_locks: dict[tuple, threading.Lock] = {}
+        self._db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _tree(self, root: Path, max_depth: int, with_files: bool, refresh: bool) -> int:
+        """
+        Returns the ID of the tree at the root, first bringing it up to date if it
+        is older than the maximum age, or if a refresh is requested
+        """
+        key = (str(root), max_depth, int(with_files))
+        with self._lock:
+            scan_lock = self._scan_locks.setdefault(key, threading.Lock())
+        # Requests for a tree being scanned wait for that scan, rather than repeat it
+        with scan_lock:
+            with self._lock, self._db:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO trees (root, max_depth, with_files) "
+                    "VALUES (?, ?, ?)",
+                    key,
+                )
+                tree_id, scanned_at, changed_at = self._db.execute(
+                    "SELECT id, scanned_at, changed_at FROM trees "
+                    "WHERE root = ? AND max_depth = ? AND with_files = ?",
+                    key,
+                ).fetchone()
+            now = time.time()
+            if refresh or scanned_at is None:
+                self._scan(tree_id, root, max_depth, with_files, full=refresh)
+            elif now - scanned_at > self.max_age:
+                # Only visit listings can be closed; new visits can always appear
+                closed = (
+                    with_files
+                    and changed_at is not None
+                    and now - changed_at > self.immutable_after
+                )
+                if not closed:
+                    self._scan(tree_id, root, max_depth, with_files, full=False)
+        return tree_id
+
+    def _scan(
+        self, tree_id: int, root: Path, max_depth: int, with_files: bool, full: bool
+    ):
+        """
+        Updates the index of the tree. Unless a full scan is requested, directories
+        with the same modification time as when they were last listed are assumed
+        to contain the same entries, and are not listed again.
+        """
+        self.scans += 1
+        with self._lock:
+            known = dict(
+                self._db.execute(
+                    "SELECT path, mtime_ns FROM dirs WHERE tree_id = ?", (tree_id,)
+                ).fetchall()
+            )
+        seen: set[str] = set()
+        newest_mtime_ns = 0
+        listed: list[tuple[str, int | None, list[str], list[tuple]]] = []
+        stack: list[tuple[str, int]] = [("", 0)]
+        while stack:
+            rel_path, depth = stack.pop()
+            seen.add(rel_path)
+            dir_path = root / rel_path if rel_path else root
+            try:
+                mtime_ns: int | None = os.stat(dir_path).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError):
+                seen.discard(rel_path)
+                continue
+            except PermissionError:
+                logger.warning(f"Unable to access {dir_path}; skipping")
+                continue
+            assert mtime_ns is not None
+            newest_mtime_ns = max(newest_mtime_ns, mtime_ns)
+            if not full and known.get(rel_path) == mtime_ns:
+                with self._lock:
+                    subdirs = [
+                        name
+                        for (name,) in self._db.execute(
+                            "SELECT name FROM dirs WHERE tree_id = ? AND parent = ?",
+                            (tree_id, rel_path),
+                        )
+                    ]
+            else:
+                subdirs = []
+                files = []
+                try:
+                    with os.scandir(dir_path) as entries:
+                        for entry in entries:
+                            if entry.is_dir():
+                                subdirs.append(entry.name)
+                            elif with_files and entry.is_file():
+                                stat = entry.stat()
+                                files.append(
+                                    (
+                                        _join(rel_path, entry.name),
+                                        stat.st_size,
+                                        stat.st_mtime_ns,
+                                        os.path.splitext(entry.name)[1].lower(),
+                                    )
+                                )
+                except PermissionError:
+                    logger.warning(f"Unable to access {dir_path}; skipping")
+                    # Don't record the directory as listed, so it is tried again
+                    mtime_ns = None
+                listed.append((rel_path, mtime_ns, subdirs, files))
+            for name in subdirs:
+                child = _join(rel_path, name)
+                if depth + 1 < max_depth or max_depth < 0:
+                    stack.append((child, depth + 1))
+                else:
+                    # Recorded, but not listed
+                    seen.add(child)
+
+        with self._lock, self._db:
+            # Another process may have scanned the tree since it was read above, so
+            # the write lock is taken before anything is read, and the listings are
+            # replaced rather than assumed to be absent
+            self._db.execute("BEGIN IMMEDIATE")
+            removed = set(known) - seen
+            for rel_path in removed:
+                self._db.execute(
+                    "DELETE FROM dirs WHERE tree_id = ? AND path = ?",
+                    (tree_id, rel_path),
+                )
+                self._db.execute(
+                    "DELETE FROM files WHERE tree_id = ? AND parent = ?",
+                    (tree_id, rel_path),
+                )
+            for rel_path, mtime_ns, subdirs, files in listed:
+                self._db.execute(
+                    "INSERT INTO dirs (tree_id, path, parent, name, mtime_ns) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (tree_id, path) "
+                    "DO UPDATE SET mtime_ns = excluded.mtime_ns",
+                    (
+                        tree_id,
+                        rel_path,
+                        rel_path.rpartition("/")[0] if rel_path else None,
+                        rel_path.rpartition("/")[2],
+                        mtime_ns,
+                    ),
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO dirs (tree_id, path, parent, name) "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (tree_id, _join(rel_path, name), rel_path, name)
+                        for name in subdirs
+                    ],
+                )
+                if with_files:
+                    self._db.execute(
+                        "DELETE FROM files WHERE tree_id = ? AND parent = ?",
+                        (tree_id, rel_path),
+                    )
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO files "
+                        "(tree_id, path, parent, size, mtime_ns, suffix) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(tree_id, f[0], rel_path, *f[1:]) for f in files],
+                    )
+            # Adding or removing entries updates the modification time of the
+            # directory containing them, so the newest one marks the last change
+            self._db.execute(
+                "UPDATE trees SET scanned_at = ?, changed_at = ? WHERE id = ?",
+                (time.time(), newest_mtime_ns / 1e9 or None, tree_id),
+            )
+
+    def find_directories(
+        self,
+        root: Path,
+        search_string: str,
+        max_depth: int,
+        refresh: bool = False,
+    ) -> dict[str, Path]:
+        """
+        Returns the directories within 'max_depth' levels of the root that have the
+        search string in their name, keyed by name. Directories within ones that
+        match are not included.
+        """
+        tree_id = self._tree(root, max_depth, False, refresh)
+        with self._lock:
+            matches = self._db.execute(
+                "SELECT path, name FROM dirs "
+                "WHERE tree_id = ? AND path != '' AND instr(name, ?) > 0 "
+                "ORDER BY length(path)",
+                (tree_id, search_string),
+            ).fetchall()
+        result: dict[str, Path] = {}
+        matched: list[str] = []
+        for rel_path, name in matches:
+            if any(rel_path.startswith(f"{match}/") for match in matched):
+                continue
+            matched.append(rel_path)
+            result[name] = root / rel_path
+        return result
+
+    def glob(self, root: Path, pattern: str, refresh: bool = False) -> list[Path]:
+        """
+        Returns the files under the root matching the relative glob pattern
+        """
+        tree_id = self._tree(root, -1, True, refresh)
+        prefix = _literal_prefix(pattern)
+        regex = _glob_to_regex(pattern)
+        query = "SELECT path FROM files WHERE tree_id = ?"
+        params: tuple = (tree_id,)
+        if prefix:
+            # Everything starting with the prefix sorts before it with '/' raised
+            query += " AND path >= ? AND path < ?"
+            params += (prefix, f"{prefix[:-1]}0")
+        with self._lock:
+            rel_paths = self._db.execute(query + " ORDER BY path", params).fetchall()
+        return [
+            root / rel_path for (rel_path,) in rel_paths if regex.fullmatch(rel_path)
+        ]
+
+    def files(
+        self, root: Path, suffixes: tuple[str, ...], refresh: bool = False
+    ) -> list[IndexedFile]:
+        """
+        Returns the files under the root with the given suffixes, relative to it
+        """
+        tree_id = self._tree(root, -1, True, refresh)
+        with self._lock:
+            return [
+                IndexedFile(Path(rel_path), size, mtime_ns)
+                for suffix in suffixes
+                for rel_path, size, mtime_ns in self._db.execute(
+                    "SELECT path, size, mtime_ns FROM files "
+                    "WHERE tree_id = ? AND suffix = ? ORDER BY path",
+                    (tree_id, suffix),
+                )
+            ]
+
+
+@lru_cache(maxsize=1)
+def get_upstream_index() -> UpstreamIndex:
+    security_config = get_security_config()
+    return UpstreamIndex(
+        security_config.upstream_index_path
+        or Path(tempfile.gettempdir()) / "murfey_upstream_index.sqlite",
+        max_age=security_config.upstream_index_max_age,
+        immutable_after=security_config.upstream_index_immutable_after,
+    )
@@ -0,0 +1,275 @@
+"""
+Index of the positions of the grid squares on an EPU atlas.
+
+The atlas metadata file ('Atlas.dm') lists every grid square found on the atlas, and
+is rewritten by EPU as the session goes on. Rather than parsing the whole XML
+document into memory, the file is streamed through once to pull out the position of
+each grid square, after which looking up a grid square is a dictionary lookup.
+
+The index is kept in memory for as long as the atlas is unchanged, and is also saved
+to a hidden file next to the atlas, so that other processes working on the same
+atlas (and the same process after a restart) can load it instead of parsing the
+atlas again. When the atlas is rewritten, the index reports which grid squares have
+been added, moved or removed since it was last read.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple
+from xml.sax.handler import ContentHandler
+
+from defusedxml.sax import make_parser
+
+logger = logging.getLogger("murfey.util.atlas_index")
+
+# Bumped whenever the contents of the saved index files change
+_INDEX_VERSION = 1
+_CHUNK_SIZE = 1024**2
+
+
+class AtlasPosition(NamedTuple):
+    x_location: int
+    y_location: int
+    x_stage_position: float  # In nm
+    y_stage_position: float  # In nm
+    width: int
+    height: int
+    angle: float
+
+
+class AtlasIndexUpdate(NamedTuple):
+    changed: Dict[str, AtlasPosition]  # Grid squares added or moved
+    removed: list[str]
+    parsed: bool  # Whether the atlas had to be parsed to bring the index up to date
+
+
+# Paths to the values of each grid square node, relative to the node
+_KEY = ("key",)
+_FIELDS = {
+    ("value", "PositionOnTheAtlas", "Center", "x"): 0,
+    ("value", "PositionOnTheAtlas", "Center", "y"): 1,
+    ("value", "PositionOnTheAtlas", "Physical", "x"): 2,
+    ("value", "PositionOnTheAtlas", "Physical", "y"): 3,
+    ("value", "PositionOnTheAtlas", "Size", "width"): 4,
+    ("value", "PositionOnTheAtlas", "Size", "height"): 5,
+    ("value", "PositionOnTheAtlas", "Rotation"): 6,
+}
+
+
+class _AtlasHandler(ContentHandler):
+    """
+    SAX handler that collects the grid square nodes of each atlas tile. Only the text
+    of the elements that are needed is kept, so memory use does not grow with the
+    size of the atlas beyond the positions themselves.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.positions: Dict[str, AtlasPosition] = {}
+        self._path: list[str] = []
+        # Depth of the grid square node currently being read, if any
+        self._node_depth = 0
+        self._values: dict[tuple[str, ...], str] = {}
+        self._text: list[str] = []
+
+    def _in_tile_nodes(self) -> bool:
+        return self._path[-3:] == ["TileXml", "Nodes", "KeyValuePairs"]
+
+    def startElement(self, name: str, attrs):
+        # The namespace prefixes are not needed to find the grid squares
+        name = name.rpartition(":")[2]
+        if (
+            not self._node_depth
+            and name.startswith("KeyValuePairOfintNodeXml")
+            and self._in_tile_nodes()
+        ):
+            self._node_depth = len(self._path) + 1
+            self._values = {}
+        self._path.append(name)
+        self._text = []
+
+    def characters(self, content: str):
+        if self._node_depth:
+            self._text.append(content)
+
+    def endElement(self, name: str):
+        if self._node_depth:
+            if len(self._path) == self._node_depth:
+                self._add_node()
+                self._node_depth = 0
+            else:
+                relative_path = tuple(self._path[self._node_depth :])
+                if relative_path == _KEY or relative_path in _FIELDS:
+                    self._values[relative_path] = "".join(self._text).strip()
+        self._path.pop()
+        self._text = []
+
+    def _add_node(self):
+        grid_square = self._values.get(_KEY)
+        if not grid_square or grid_square in self.positions:
+            return
+        values = [""] * len(_FIELDS)
+        for path, i in _FIELDS.items():
+            values[i] = self._values.get(path, "")
+        try:
+            self.positions[grid_square] = AtlasPosition(
+                x_location=int(float(values[0])),
+                y_location=int(float(values[1])),
+                x_stage_position=float(values[2]) * 1e9,
+                y_stage_position=float(values[3]) * 1e9,
+                width=int(float(values[4])),
+                height=int(float(values[5])),
+                angle=float(values[6]),
+            )
+        except ValueError:
+            logger.debug(f"Skipping grid square {grid_square} with incomplete position")
+
+
+def parse_atlas_positions(xml_path: Path) -> tuple[Dict[str, AtlasPosition], str]:
+    """
+    Streams through an atlas metadata file, returning the position of each grid
+    square on it along with a digest of the file's contents
+    """
+    handler = _AtlasHandler()
+    parser = make_parser()
+    parser.setContentHandler(handler)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(xml_path, "rb") as xml:
+        while chunk := xml.read(_CHUNK_SIZE):
+            digest.update(chunk)
+            parser.feed(chunk)
+    parser.close()
+    return handler.positions, digest.hexdigest()
+
+
+def _file_digest(file_path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AtlasIndex:
+    """
+    The grid square positions on an atlas, brought up to date with the atlas on
+    each update. The positions are replaced rather than modified when the atlas
+    changes, so a reference to them is not affected by later updates.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fspath = os.fspath(path)
+        self.index_path = path.parent / f".{path.name}.index.json"
+        self.positions: Dict[str, AtlasPosition] = {}
+        self.lock = threading.Lock()
+        self._stat: tuple[int, int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def get(self, grid_square: str | int) -> AtlasPosition | None:
+        return self.positions.get(str(grid_square))
+
+    def _load(self, mtime_ns: int, size: int) -> Dict[str, AtlasPosition] | None:
+        """
+        Loads the saved index if it was made from the current contents of the atlas
+        """
+        try:
+            saved = json.loads(self.index_path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.debug(f"Unable to read atlas index {str(self.index_path)}")
+            return None
+        if saved.get("version") != _INDEX_VERSION or saved.get("size") != size:
+            return None
+        # The atlas may have been copied to where it is now, so fall back to checking
+        # its contents if the modification time doesn't match
+        if saved.get("mtime_ns") != mtime_ns and saved.get("digest") != _file_digest(
+            self.path
+        ):
+            return None
+        return {
+            grid_square: AtlasPosition(*values)
+            for grid_square, values in saved["positions"].items()
+        }
+
+    def _save(self, mtime_ns: int, size: int, digest: str):
+        tmp_path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}")
+        try:
+            tmp_path.write_text(
+                json.dumps(
+                    {
+                        "version": _INDEX_VERSION,
+                        "atlas": self.path.name,
+                        "mtime_ns": mtime_ns,
+                        "size": size,
+                        "digest": digest,
+                        "positions": self.positions,
+                    }
+                )
+            )
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.debug(f"Atlas index could not be saved to {self.index_path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def update(self) -> AtlasIndexUpdate:
+        stat = os.stat(self._fspath)
+        if self._stat == (stat.st_mtime_ns, stat.st_size):
+            return AtlasIndexUpdate(changed={}, removed=[], parsed=False)
+        parsed = False
+        positions = self._load(stat.st_mtime_ns, stat.st_size)
+        if positions is None:
+            positions, digest = parse_atlas_positions(self.path)
+            parsed = True
+        changed = {
+            grid_square: position
+            for grid_square, position in positions.items()
+            if self.positions.get(grid_square) != position
+        }
+        removed = [
+            grid_square
+            for grid_square in self.positions
+            if grid_square not in positions
+        ]
+        self.positions = positions
+        self._stat = (stat.st_mtime_ns, stat.st_size)
+        if parsed:
+            self._save(stat.st_mtime_ns, stat.st_size, digest)
+            logger.info(
+                f"Indexed {len(positions)} grid squares on atlas {str(self.path)}"
+            )
+        return AtlasIndexUpdate(changed=changed, removed=removed, parsed=parsed)
+
+
+# Keyed by the absolute path of the atlas as a string, which is quicker to look up
+_atlas_indexes: OrderedDict[str, AtlasIndex] = OrderedDict()
+_atlas_indexes_lock = threading.Lock()
+_max_atlas_indexes = 64
+
+
+def read_atlas_index(path: Path) -> tuple[AtlasIndex, AtlasIndexUpdate]:
+    """
+    Brings the index of an atlas up to date, returning it along with the grid squares
+    that have changed since the atlas was last read
+    """
+    key = os.path.abspath(path)
+    with _atlas_indexes_lock:
+        index = _atlas_indexes.get(key)
+        if index is None:
+            index = _atlas_indexes[key] = AtlasIndex(Path(key))
+            while len(_atlas_indexes) > _max_atlas_indexes:
+                _atlas_indexes.popitem(last=False)
+        else:
+            _atlas_indexes.move_to_end(key)
+    with index.lock:
+        return index, index.update()
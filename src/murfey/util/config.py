@@ -51,6 +51,12 @@ class MachineConfig(BaseModel):  # type: ignore
     gain_reference_directory: Optional[Path] = None
     eer_fractionation_file_template: str = ""
     single_data_directory: bool = False
+    analyser_workers: int = 1
+    session_state_max_entries: int = 100_000  # Per-file entries kept in memory
+    # Watch for new directories with change notifications on Windows, rather than
+    # polling. These keep the watched directories open, which can stop them being
+    # renamed or removed.
+    windows_change_notifications: bool = False
 
     # Data transfer setup -------------------------------------------------------------
     # General setup
@@ -97,6 +103,9 @@ class MachineConfig(BaseModel):  # type: ignore
     picking_model_search_directory: str = "processing"
     initial_model_search_directory: str = "processing/initial_model"
 
+    # FIB milling setup
+    fib_animation_format: Literal["gif", "webp"] = "gif"  # Drift correction animation
+
     # Data analysis plugins
     external_executables: dict[str, str] = {}
     external_executables_eer: dict[str, str] = {}
@@ -247,6 +256,12 @@ class Security(BaseModel):
 
     # ISPyB settings
     ispyb_credentials: Optional[Path] = None
+    # Lifetimes (in seconds) of cached ISPyB lookups. Lookups of ongoing visits that
+    # have expired are still used for up to 'ispyb_visits_stale_ttl' seconds more,
+    # while they are looked up again in the background
+    ispyb_cache_ttl: int = 24 * 60 * 60
+    ispyb_visits_cache_ttl: int = 60
+    ispyb_visits_stale_ttl: int = 600
 
     # Murfey server connection settings
     auth_url: str = ""
@@ -259,7 +274,35 @@ class Security(BaseModel):
     allow_user_token: bool = False  # TUI 'user' token support
     session_validation: str = ""
     session_token_timeout: Optional[int] = None
+    # Lifetimes (in seconds) of cached token validation results. Each server worker
+    # has its own cache, and revoking a token only clears the cache of the worker that
+    # handled the change, so other workers can accept it for up to 'auth_cache_ttl'
+    auth_cache_ttl: int = 10
+    auth_negative_cache_ttl: int = 10
     allow_origins: list[str] = ["*"]
+    instrument_server_connections_per_host: int = 8
+
+    # Bootstrap package cache settings; files are passed through if no directory set
+    package_cache_directory: Optional[Path] = None
+    package_cache_max_size: int = 20 * 1024**3  # In bytes
+    package_cache_index_ttl: int = 300  # Seconds before index pages are revalidated
+    package_cache_offline: bool = False  # Serve only what is already cached
+
+    # Grid square and foil hole thumbnail settings
+    thumbnail_cache_directory: Optional[Path] = None  # Uses a temporary directory
+    thumbnail_cache_max_size: int = 2 * 1024**3  # In bytes
+    thumbnail_eager_generation: bool = False  # Make thumbnails on registration
+
+    # Prepared gain reference cache settings
+    gain_cache_directory: Optional[Path] = None  # Uses a temporary directory
+
+    # Also store every picked particle size, rather than only their summary
+    particle_sizes_raw_rows: bool = False
+
+    # Upstream data directory index settings
+    upstream_index_path: Optional[Path] = None  # Uses a temporary directory
+    upstream_index_max_age: int = 60  # Seconds before listings are checked again
+    upstream_index_immutable_after: int = 7 * 24 * 3600  # Seconds without changes
 
     # RabbitMQ settings
     rabbitmq_credentials: Path
@@ -342,6 +342,12 @@ class TiltSeries(SQLModel, table=True):  # type: ignore
     processing_requested: bool = False
     x_location: Optional[float] = None
     y_location: Optional[float] = None
+    # Position of the tilt series, kept so that it can be placed on the search map
+    # again if the search map changes
+    x_stage_position: Optional[float] = None
+    y_stage_position: Optional[float] = None
+    x_beamshift: Optional[float] = None
+    y_beamshift: Optional[float] = None
     session: Optional[Session] = Relationship(back_populates="tilt_series")
     tilts: List["Tilt"] = Relationship(
         back_populates="tilt_series", sa_relationship_kwargs={"cascade": "delete"}
@@ -437,6 +443,10 @@ class ProcessingJob(SQLModel, table=True):  # type: ignore
     particle_sizes: List["ParticleSizes"] = Relationship(
         back_populates="processing_job", sa_relationship_kwargs={"cascade": "delete"}
     )
+    particle_size_sketch: Optional["ParticleSizeSketch"] = Relationship(
+        back_populates="processing_job",
+        sa_relationship_kwargs={"cascade": "delete", "uselist": False},
+    )
     spa_parameters: List["SPARelionParameters"] = Relationship(
         back_populates="processing_job", sa_relationship_kwargs={"cascade": "delete"}
     )
@@ -737,6 +747,25 @@ class ParticleSizes(SQLModel, table=True):  # type: ignore
     )
 
 
+class ParticleSizeSketch(SQLModel, table=True):  # type: ignore
+    """
+    Summary of all the particle sizes picked for a processing job, stored as a
+    serialised quantile sketch (see murfey.util.quantile_sketch).
+
+    Existing databases gain this table by running 'murfey.create_db --no-clear',
+    which creates any missing tables and leaves the others untouched. Summaries are
+    then made from the stored particle sizes the next time particles are picked
+    for each processing job.
+    """
+
+    pj_id: int = Field(primary_key=True, foreign_key="processingjob.processingJobId")
+    count: int = 0
+    sketch: bytes
+    processing_job: Optional[ProcessingJob] = Relationship(
+        back_populates="particle_size_sketch"
+    )
+
+
 class SPARelionParameters(SQLModel, table=True):  # type: ignore
     pj_id: int = Field(primary_key=True, foreign_key="processingjob.processingJobId")
     angpix: float
@@ -1146,9 +1175,41 @@ FUNCTIONS
 """
 
 
+# Columns added to tables after they were first created. Creating the tables leaves
+# existing ones untouched, so these are added to them when the database is set up
+# without clearing it ('murfey.create_db --no-clear')
+_added_columns: dict[str, list[str]] = {
+    "tiltseries": [
+        "x_stage_position",
+        "y_stage_position",
+        "x_beamshift",
+        "y_beamshift",
+    ],
+}
+
+
+def _add_missing_columns(engine: sqlalchemy.Engine):
+    inspector = sqlalchemy.inspect(engine)
+    with engine.begin() as connection:
+        for table_name, column_names in _added_columns.items():
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            table = SQLModel.metadata.tables[table_name]
+            for column_name in column_names:
+                if column_name in existing:
+                    continue
+                column_type = table.c[column_name].type.compile(dialect=engine.dialect)
+                connection.execute(
+                    sqlalchemy.text(
+                        f"ALTER TABLE {table_name} "
+                        f"ADD COLUMN {column_name} {column_type}"
+                    )
+                )
+
+
 def setup(url: str):
     engine = create_engine(url)
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns(engine)
 
 
 def clear(url: str):
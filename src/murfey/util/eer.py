@@ -1,33 +1,146 @@
+"""
+Functions for reading the headers of EER movies, which are TIFF files (mostly
+following the BigTIFF format, https://www.awaresystems.be/imaging/tiff/bigtiff.html)
+with one image file directory (IFD) per frame.
+
+Counting the frames means following the chain of IFDs through the file. Rather than
+seeking to and reading each IFD separately, which is slow on network file systems,
+the file is memory-mapped where possible, and otherwise read in large windows, so
+that the IFDs near each other are read together. Headers are cached by the path,
+size and modification time of the file, so each movie is only read once.
+"""
+
 from __future__ import annotations
 
+import mmap
 import os
+import struct
+from functools import lru_cache
 from pathlib import Path
-from typing import BinaryIO, Literal
+from typing import BinaryIO, NamedTuple
 
 from murfey.util import secure_path
 
+# TIFF tags read from the first IFD
+_IMAGE_WIDTH = 256
+_IMAGE_LENGTH = 257
+_COMPRESSION = 259
+
+# Sizes in bytes of the TIFF field types that can hold the tags above
+_FIELD_FORMATS = {3: "H", 4: "I", 16: "Q"}
+
+
+class EERHeader(NamedTuple):
+    num_frames: int
+    width: int
+    height: int
+    compression: int
+
+
+class _WindowedReader:
+    """
+    Reads from a file stream in windows of 'window_size' bytes, so that reads close
+    to the previous one are served from memory
+    """
+
+    def __init__(self, file_stream: BinaryIO, window_size: int = 256 * 1024):
+        self.file_stream = file_stream
+        self.window_size = window_size
+        self._start = 0
+        self._window = b""
+
+    def __call__(self, offset: int, size: int) -> bytes:
+        end = offset + size
+        if not (self._start <= offset and end <= self._start + len(self._window)):
+            self.file_stream.seek(offset, 0)
+            self._start = offset
+            self._window = bytes(self.file_stream.read(max(size, self.window_size)))
+        return self._window[offset - self._start : end - self._start]
+
+
+def _read_header(read) -> EERHeader:
+    """
+    Walks the IFD chain using 'read(offset, size)', counting the frames and reading
+    the image geometry from the first of them. Movies that are still being written
+    can end part way through the chain, so a short read is taken as its end.
+    """
+
+    def unpack(field_format: str, offset: int) -> int | None:
+        size = struct.calcsize(field_format)
+        data = read(offset, size)
+        if len(data) < size:
+            return None
+        return struct.unpack(field_format, data)[0]
+
+    # II means intel ordering (little-endian), and MM motorola ordering (big-endian)
+    order = "<" if read(0, 2) == b"II" else ">"
+    version = unpack(f"{order}H", 2)
+    if version == 42:  # Classic TIFF
+        offset_format, count_format, entry_size = "I", "H", 12
+        ifd = unpack(f"{order}I", 4)
+    else:
+        offset_format, count_format, entry_size = "Q", "Q", 20
+        ifd = unpack(f"{order}Q", 8) if version is not None else None
+    count_size = struct.calcsize(count_format)
+    offset_size = struct.calcsize(offset_format)
+
+    num_frames = 0
+    tags: dict[int, int] = {}
+    while ifd:
+        num_tags = unpack(f"{order}{count_format}", ifd)
+        if num_tags is None:
+            break
+        entries_start = ifd + count_size
+        if num_frames == 0:
+            entries = read(entries_start, num_tags * entry_size)
+            for i in range(len(entries) // entry_size):
+                entry = entries[i * entry_size : (i + 1) * entry_size]
+                tag, field_type = struct.unpack(f"{order}HH", entry[:4])
+                if (field_format := _FIELD_FORMATS.get(field_type)) is not None:
+                    tags[tag] = struct.unpack_from(
+                        f"{order}{field_format}", entry, entry_size - offset_size
+                    )[0]
+        num_frames += 1
+        ifd = unpack(f"{order}{offset_format}", entries_start + num_tags * entry_size)
+    return EERHeader(
+        num_frames=num_frames,
+        width=tags.get(_IMAGE_WIDTH, 0),
+        height=tags.get(_IMAGE_LENGTH, 0),
+        compression=tags.get(_COMPRESSION, 0),
+    )
+
+
+def read_eer_header(file_stream: BinaryIO) -> EERHeader:
+    """
+    Reads the header of an open EER file, memory-mapping it if it is a file on disk
+    """
+    try:
+        fileno = file_stream.fileno()
+        # Empty files, such as movies that have only just been created, can't be mapped
+        mappable = os.fstat(fileno).st_size > 0
+    except (AttributeError, OSError):
+        mappable = False
+    if not mappable:
+        return _read_header(_WindowedReader(file_stream))
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        return _read_header(lambda offset, size: mapped[offset : offset + size])
+
 
 def _count_ifds(file_stream: BinaryIO) -> int:
-    file_stream.seek(0, 0)
-    # get the byte order mark
-    # for TIFFs II means intel ordering (little-endian) and MM means motorola ordering (big-endian)
-    bom = bytes(file_stream.read(2)).decode("utf-8")
-    byteorder: Literal["little", "big"] = "little" if bom == "II" else "big"
-    file_stream.seek(8, 0)
-    ifd = int.from_bytes(file_stream.read(8), byteorder)
-    n = 0
-    # bounce between IFDs and count them until they run out
-    # EER mostly follows the BigTIFF file format (https://www.awaresystems.be/imaging/tiff/bigtiff.html)
-    while ifd != 0:
-        n += 1
-        file_stream.seek(ifd, 0)
-        num_tags = int.from_bytes(file_stream.read(8), byteorder)
-        file_stream.seek(ifd + 8 + 20 * num_tags, 0)
-        ifd = int.from_bytes(file_stream.read(8), byteorder)
-    return n
+    return read_eer_header(file_stream).num_frames
+
+
+@lru_cache(maxsize=4096)
+def _cached_eer_header(eer_path: str, size: int, mtime_ns: int) -> EERHeader:
+    with open(eer_path, "rb") as eer:
+        return read_eer_header(eer)
+
+
+def eer_header(eer_path: os.PathLike) -> EERHeader:
+    path = secure_path(Path(eer_path))
+    stat = os.stat(path)
+    return _cached_eer_header(str(path), stat.st_size, stat.st_mtime_ns)
 
 
 def num_frames(eer_path: os.PathLike) -> int:
-    with open(secure_path(Path(eer_path)), "rb") as eer:
-        n = _count_ifds(eer)
-    return n
+    return eer_header(eer_path).num_frames
@@ -1,14 +1,51 @@
+"""
+Parsing of the SerialEM metadata (mdoc) files written alongside tilt series.
+
+An mdoc file starts with a global section of 'key = value' lines, followed by a
+block of them for each image, each headed by a '[ZValue = n]' line. SerialEM rewrites
+the file after every tilt, so the same file is transferred again and again over the
+course of a tilt series. The parsed state of each file is kept along with how far
+into the file it has been read, so that when the file is read again only the bytes
+added since are parsed.
+"""
+
 from __future__ import annotations
 
+import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import TextIO
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple, TextIO
+
+# Number of bytes at the start of the file, and before the point it was last read up
+# to, that are compared to check that it has only been added to since
+_SIGNATURE_SIZE = 256
+
+
+class MdocBlock(dict):
+    """
+    The values of a section of an mdoc file. The 'DateTime' value is converted to a
+    datetime the first time it is looked up.
+    """
+
+    def __getitem__(self, key: str) -> Any:
+        value = super().__getitem__(key)
+        if key == "DateTime" and isinstance(value, str):
+            value = datetime.strptime(value, "%d-%b-%Y %H:%M:%S")
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
 
 
-def _basic_parse(line: str) -> dict:
-    kv = [p.strip() for p in line.split("=")]
-    if kv[0] == "DateTime":
-        return {kv[0]: datetime.strptime(kv[1], "%d-%b-%Y %H:%M:%S")}
-    return {kv[0]: tuple(kv[1].split()) if " " in kv[1] else kv[1]}
+def _parse_line(line: str) -> tuple[str, str | tuple[str, ...]]:
+    key, _, value = line.partition("=")
+    key, value = key.strip(), value.strip()
+    if key == "DateTime":
+        return key, value
+    return key, tuple(value.split()) if " " in value else value
 
 
 def get_block(mdocfile: TextIO) -> dict:
@@ -17,11 +54,12 @@ def get_block(mdocfile: TextIO) -> dict:
             break
     else:
         return {}
-    as_dict = {}
+    as_dict = MdocBlock()
     while line := mdocfile.readline():
-        if line.replace(" ", "") == "\n":
+        if not line.strip():
             break
-        as_dict.update(_basic_parse(line))
+        key, value = _parse_line(line)
+        as_dict[key] = value
     return as_dict
 
 
@@ -34,9 +72,141 @@ def get_num_blocks(mdocfile: TextIO) -> int:
 
 
 def get_global_data(mdocfile: TextIO) -> dict:
-    as_dict = {}
+    as_dict = MdocBlock()
     while line := mdocfile.readline():
-        if line.startswith("[") or line.replace(" ", "") == "\n":
+        if line.startswith("[") or not line.strip():
             break
-        as_dict.update(_basic_parse(line))
+        key, value = _parse_line(line)
+        as_dict[key] = value
     return as_dict
+
+
+class _MdocParser:
+    """
+    Parses the lines of an mdoc file in a single pass, and can be fed more lines as
+    the file grows
+    """
+
+    def __init__(self):
+        self.global_data = MdocBlock()
+        self.blocks: list[MdocBlock] = []
+        # Which part of the file the next line belongs to: the global section, the
+        # current block, or the lines between blocks
+        self._section: MdocBlock | None = self.global_data
+
+    def feed(self, lines: Iterable[str]):
+        for line in lines:
+            if line.startswith("[ZValue"):
+                self._section = MdocBlock()
+                self.blocks.append(self._section)
+            elif not line.strip() or line.startswith("["):
+                self._section = None
+            elif self._section is not None:
+                key, value = _parse_line(line)
+                self._section[key] = value
+
+
+def parse_mdoc(mdocfile: TextIO) -> tuple[dict, list[MdocBlock]]:
+    """
+    Reads the global section and all the blocks of an mdoc file in one pass
+    """
+    parser = _MdocParser()
+    parser.feed(mdocfile)
+    return parser.global_data, parser.blocks
+
+
+class MdocUpdate(NamedTuple):
+    new_blocks: list[MdocBlock]
+    num_blocks: int
+    previous_num_blocks: int
+    reparsed: bool  # Whether the file had to be parsed from the start
+
+    @property
+    def length_changed(self) -> bool:
+        return self.num_blocks != self.previous_num_blocks
+
+
+class MdocFile:
+    """
+    The parsed state of an mdoc file, along with the point the file has been read up
+    to. Each update parses the lines added to the file since the last one, or the
+    whole file again if it was truncated or rewritten with different contents.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.bytes_parsed = 0  # Over all updates
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._parser = _MdocParser()
+        self.offset = 0
+        self._head = b""
+        self._tail = b""
+
+    @property
+    def global_data(self) -> dict:
+        return self._parser.global_data
+
+    @property
+    def blocks(self) -> list[MdocBlock]:
+        return self._parser.blocks
+
+    def _only_added_to(self, md, size: int) -> bool:
+        if size < self.offset:
+            return False
+        if md.read(len(self._head)) != self._head:
+            return False
+        md.seek(self.offset - len(self._tail))
+        return md.read(len(self._tail)) == self._tail
+
+    def update(self) -> MdocUpdate:
+        previous_num_blocks = len(self.blocks)
+        reparsed = False
+        with open(self.path, "rb") as md:
+            size = os.fstat(md.fileno()).st_size
+            if self.offset and not self._only_added_to(md, size):
+                self._reset()
+                reparsed = True
+            md.seek(self.offset)
+            data = md.read(size - self.offset)
+            # Only parse complete lines, leaving any partly written line until later
+            end = data.rfind(b"\n") + 1
+            if end:
+                self._parser.feed(
+                    data[:end].decode("utf-8", errors="replace").splitlines()
+                )
+                self.bytes_parsed += end
+                self.offset += end
+                if len(self._head) < _SIGNATURE_SIZE:
+                    md.seek(0)
+                    self._head = md.read(min(self.offset, _SIGNATURE_SIZE))
+                self._tail = (self._tail + data[:end])[-_SIGNATURE_SIZE:]
+        first_new_block = 0 if reparsed else previous_num_blocks
+        return MdocUpdate(
+            new_blocks=self.blocks[first_new_block:],
+            num_blocks=len(self.blocks),
+            previous_num_blocks=previous_num_blocks,
+            reparsed=reparsed,
+        )
+
+
+_mdoc_files: OrderedDict[Path, MdocFile] = OrderedDict()
+_mdoc_files_lock = threading.Lock()
+_max_mdoc_files = 512
+
+
+def read_mdoc(path: Path) -> tuple[MdocFile, MdocUpdate]:
+    """
+    Brings the parsed state of an mdoc file up to date, returning it along with what
+    has changed since the file was last read
+    """
+    path = Path(path).absolute()
+    with _mdoc_files_lock:
+        mdoc = _mdoc_files.pop(path, None) or MdocFile(path)
+        _mdoc_files[path] = mdoc
+        while len(_mdoc_files) > _max_mdoc_files:
+            _mdoc_files.popitem(last=False)
+    with mdoc.lock:
+        return mdoc, mdoc.update()
@@ -58,6 +58,12 @@ class File(BaseModel):
         return v
 
 
+class GainReferenceFile(File):
+    size_bytes: Optional[int] = None
+    file_type: Optional[str] = None  # e.g. "eer" or "dm4"
+    detector: Optional[str] = None  # Worked out from the file name, if possible
+
+
 class ConnectionFileParameters(BaseModel):
     filename: str
     destinations: List[str]
@@ -308,6 +314,11 @@ class GridSquareParameters(BaseModel):
     collection_mode: Optional[str] = None
 
 
+class GridSquareListParameters(BaseModel):
+    # Grid square parameters, keyed by the grid square name
+    grid_squares: Dict[int, GridSquareParameters]
+
+
 class FoilHoleParameters(BaseModel):
     tag: str
     name: int
@@ -324,6 +335,10 @@ class FoilHoleParameters(BaseModel):
     diameter: Optional[float] = None
 
 
+class FoilHoleListParameters(BaseModel):
+    foil_holes: List[FoilHoleParameters]
+
+
 class SearchMapParameters(BaseModel):
     tag: str
     x_location: float | None = None
@@ -352,6 +367,11 @@ class BatchPositionParameters(BaseModel):
     search_map_name: str
 
 
+class BatchPositionListParameters(BaseModel):
+    # Batch position parameters, keyed by the batch position name
+    batch_positions: Dict[str, BatchPositionParameters]
+
+
 class MultigridWatcherSetup(BaseModel):
     source: Path
     destination_overrides: Dict[Path, str] = {}
@@ -0,0 +1,123 @@
+"""
+A thread-safe, size-bounded LRU cache for the results of parsing metadata files.
+
+Entries are keyed on the parser used together with the file's path, modification
+time and size, so a file that is rewritten (as EPU and Tomo do with their metadata
+files) is transparently re-parsed on its next lookup, while unchanged files are only
+ever parsed once. A single instance of the cache is shared across all the client
+contexts so that the same XML file parsed by different contexts is only read once.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, TypeVar
+
+import xmltodict
+
+logger = logging.getLogger("murfey.util.parse_cache")
+
+T = TypeVar("T")
+
+
+class _CacheKey(NamedTuple):
+    parser: str
+    path: str
+    mtime_ns: int
+    size: int
+
+
+class ParseCache:
+    """
+    LRU cache of parsed file contents. The memory used by each entry is estimated
+    from the size of the file it was parsed from, and the least recently used
+    entries are evicted once the total exceeds 'max_bytes'.
+
+    Cached values are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[_CacheKey, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, file_path: Path, parser: Callable[[Path], T]) -> T:
+        """
+        Returns the result of running 'parser' on the file, running it only if the
+        file has not been parsed by it before or has changed since.
+        """
+        stat = os.stat(file_path)
+        key = _CacheKey(
+            parser=f"{parser.__module__}.{parser.__qualname__}",
+            path=str(file_path),
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+        )
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Parse outside of the lock so that slow parses don't block other files
+        result = parser(file_path)
+        with self._lock:
+            # Drop entries for older versions of the same file
+            for stale_key in [
+                k
+                for k in self._entries
+                if k.parser == key.parser and k.path == key.path
+            ]:
+                self._remove(stale_key)
+            if key not in self._entries and stat.st_size <= self.max_bytes:
+                self._entries[key] = (result, stat.st_size)
+                self.current_bytes += stat.st_size
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+        return result
+
+    def _remove(self, key: _CacheKey):
+        _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def invalidate(self, file_path: Path | None = None):
+        """
+        Removes all cached entries for the given file, or clears the whole cache if
+        no file is provided.
+        """
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+                self.current_bytes = 0
+                return None
+            for key in [k for k in self._entries if k.path == str(file_path)]:
+                self._remove(key)
+        return None
+
+
+# Shared across all the contexts on the instrument server
+parse_cache = ParseCache()
+
+
+def _parse_xml_file(file_path: Path) -> dict:
+    with open(file_path, "rb") as xml:
+        return xmltodict.parse(xml)
+
+
+def parse_xml(file_path: Path) -> dict:
+    """
+    Parses an XML file into a dictionary using 'xmltodict', returning the cached
+    result if the file has not changed since it was last parsed.
+    """
+    return parse_cache.get(file_path, _parse_xml_file)
@@ -0,0 +1,145 @@
+"""
+A mergeable streaming quantile sketch, following Karnin, Lang and Liberty, "Optimal
+Quantile Approximation in Streams" (2016), for summarising large numbers of values,
+such as picked particle sizes, in a small, fixed amount of storage.
+
+Values are held in a stack of compactors, where each value at level 'h' stands for
+2**h of the values added. When a compactor fills up, it is sorted and every other
+value is promoted to the level above, starting from a randomly chosen end. The
+capacities of the levels decrease geometrically going down the stack, so that the
+sketch holds about 3k values however many are added to it.
+
+With the default 'k' of 200, the rank of the value returned for a quantile 'q' is
+within 0.02 * count of q * count with high probability. Summaries of separate
+streams can be merged with the same error bound. The values are stored as 32-bit
+floats, so are also subject to a relative rounding error of about 1e-7.
+"""
+
+from __future__ import annotations
+
+import math
+import random
+from typing import Iterable
+
+import numpy as np
+
+# Ratio between the capacities of successive compactors
+_CAPACITY_RATIO = 2 / 3
+
+
+class QuantileSketch:
+    def __init__(self, k: int = 200, rng: random.Random | None = None):
+        self.k = k
+        self.count = 0
+        self.compactors: list[list[float]] = [[]]
+        self._rng = rng or random.Random()
+        self._held = 0
+        self._max_held = self._capacity(0)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(_CAPACITY_RATIO**depth * self.k)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self._max_held = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def update(self, value: float):
+        self.update_many((value,))
+
+    def update_many(self, values: Iterable[float]):
+        for value in values:
+            self.compactors[0].append(float(value))
+            self.count += 1
+            self._held += 1
+            if self._held >= self._max_held:
+                self._compress()
+
+    def merge(self, other: QuantileSketch):
+        """
+        Adds the values summarised by another sketch to this one
+        """
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, values in enumerate(other.compactors):
+            self.compactors[level].extend(values)
+        self.count += other.count
+        self._held = sum(len(values) for values in self.compactors)
+        while self._held >= self._max_held:
+            self._compress()
+
+    def _compress(self):
+        # Only the lowest full compactor is compacted, which frees enough space
+        for level, values in enumerate(self.compactors):
+            if len(values) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self._grow()
+                values.sort()
+                # An odd value out is kept at this level
+                kept = [values.pop()] if len(values) % 2 else []
+                promoted = values[self._rng.getrandbits(1) :: 2]
+                self.compactors[level + 1].extend(promoted)
+                self.compactors[level] = kept
+                self._held -= len(values) - len(promoted)
+                return None
+        return None
+
+    def quantiles(self, qs: Iterable[float]) -> list[float]:
+        """
+        Returns the approximate value at each of the quantiles, given as fractions
+        """
+        if not self.count:
+            raise ValueError("No values have been added to the sketch")
+        weighted = sorted(
+            (value, 1 << level)
+            for level, values in enumerate(self.compactors)
+            for value in values
+        )
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for q in qs:
+            target = q * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            results.append(value)
+        return results
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles((q,))[0]
+
+    def to_bytes(self) -> bytes:
+        """
+        Packs the sketch into the 'k', count, number of values at each level, and
+        then the values themselves as 32-bit floats
+        """
+        header = np.array(
+            [self.k, self.count, *(len(values) for values in self.compactors)],
+            dtype="<i8",
+        )
+        return (
+            np.int64(len(header)).astype("<i8").tobytes()
+            + header.tobytes()
+            + np.array(
+                [value for values in self.compactors for value in values], dtype="<f4"
+            ).tobytes()
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> QuantileSketch:
+        header_length = int(np.frombuffer(data, dtype="<i8", count=1)[0])
+        header = np.frombuffer(data, dtype="<i8", count=header_length, offset=8)
+        values = np.frombuffer(data, dtype="<f4", offset=8 * (header_length + 1))
+        sketch = cls(k=int(header[0]))
+        sketch.count = int(header[1])
+        boundaries = np.cumsum(header[2:])[:-1]
+        sketch.compactors = [
+            level.tolist() for level in np.split(values.astype(float), boundaries)
+        ]
+        sketch._held = len(values)
+        sketch._max_held = sum(
+            sketch._capacity(h) for h in range(len(sketch.compactors))
+        )
+        return sketch
@@ -1,11 +1,23 @@
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, NamedTuple, Optional, Tuple, Union
+from xml.etree.ElementTree import Element
 
-import xmltodict
+from defusedxml.ElementTree import iterparse
+
+from murfey.util.atlas_index import AtlasPosition, read_atlas_index
+from murfey.util.parse_cache import parse_cache, parse_xml
 
 logger = logging.getLogger("murfey.util.spa_metadata")
 
+# Directories modified more recently than this are always listed again, as further
+# changes within the resolution of their modification times would go unnoticed
+_MTIME_RESOLUTION_NS = 2_000_000_000
+
 
 class FoilHoleInfo(NamedTuple):
     id: int
@@ -38,6 +50,204 @@ class GridSquareInfo(NamedTuple):
     tag: str = ""
 
 
+class FoilHoleTarget(NamedTuple):
+    id: int
+    x_location: float
+    y_location: float
+    x_stage_position: float
+    y_stage_position: float
+    diameter: float
+    near_grid_bar: bool = False
+
+
+def _local_name(tag: str) -> str:
+    """
+    Strips the namespace from an ElementTree tag
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_local(element: Element, *names: str) -> Element | None:
+    """
+    Walks down the element tree following the child elements with the given names,
+    ignoring their namespaces
+    """
+    for name in names:
+        child = next((c for c in element if _local_name(c.tag) == name), None)
+        if child is None:
+            return None
+        element = child
+    return element
+
+
+def _extract_foil_hole_targets(xml_path: Path) -> Dict[int, FoilHoleTarget]:
+    """
+    Streams through a GridSquare metadata file, pulling out only the foil hole
+    target locations and discarding each element once it has been read.
+    """
+    targets: Dict[int, FoilHoleTarget] = {}
+    lacey_targets: Dict[int, FoilHoleTarget] = {}
+    parents: list[str] = []
+    for event, elem in iterparse(xml_path, events=("start", "end")):
+        name = _local_name(elem.tag)
+        if event == "start":
+            parents.append(name)
+            continue
+        parents.pop()
+        if not name.startswith("KeyValuePairOfintTargetLocation"):
+            continue
+        key = _find_local(elem, "key")
+        pix = _find_local(elem, "value", "PixelCenter")
+        stage = _find_local(elem, "value", "StagePosition")
+        diameter = _find_local(elem, "value", "PixelWidthHeight", "width")
+        near_grid_bar = _find_local(elem, "value", "IsNearGridBar")
+        try:
+            target = FoilHoleTarget(
+                id=int(key.text),  # type: ignore
+                x_location=float(_find_local(pix, "x").text),  # type: ignore
+                y_location=float(_find_local(pix, "y").text),  # type: ignore
+                x_stage_position=float(_find_local(stage, "X").text),  # type: ignore
+                y_stage_position=float(_find_local(stage, "Y").text),  # type: ignore
+                diameter=float(diameter.text),  # type: ignore
+                near_grid_bar=near_grid_bar is not None
+                and near_grid_bar.text == "true",
+            )
+        except (AttributeError, TypeError, ValueError):
+            logger.debug(f"Skipping incomplete target location in {str(xml_path)}")
+        else:
+            # Grids with regular foil holes use "TargetLocationsEfficient"
+            if "TargetLocationsEfficient" in parents:
+                targets[target.id] = target
+            else:
+                lacey_targets[target.id] = target
+        elem.clear()
+    return targets or lacey_targets
+
+
+def get_foil_hole_targets(xml_path: Path) -> Dict[int, FoilHoleTarget]:
+    """
+    Returns the foil hole target locations in a GridSquare metadata file, keyed by
+    foil hole ID. The file is only parsed again if it has changed.
+    """
+    return parse_cache.get(xml_path, _extract_foil_hole_targets)
+
+
+class _FoilHoleImages(NamedTuple):
+    mtime_ns: int
+    images: Dict[str, Tuple[int, float]]  # Image path -> (foil hole ID, creation time)
+
+
+class FoilHoleImageIndex:
+    """
+    Index of the newest image of each foil hole in a grid square, built from a single
+    listing of the grid square's "FoilHoles" directories. The directories are only
+    listed again when their modification time changes, or while it is too recent to
+    tell whether they have changed since, and only the files that have appeared since
+    the last listing are inspected.
+    """
+
+    def __init__(self, images_root: Path, grid_square: int):
+        self._images_root = images_root
+        self._grid_square = grid_square
+        self._listings: Dict[str, _FoilHoleImages] = {}
+        # Foil hole ID -> (creation time, image path)
+        self._newest: Dict[int, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def _list(
+        self, fh_dir: str, mtime_ns: int, previous: Optional[_FoilHoleImages]
+    ) -> _FoilHoleImages:
+        known = previous.images if previous else {}
+        images: Dict[str, Tuple[int, float]] = {}
+        with os.scandir(fh_dir) as entries:
+            for entry in entries:
+                if not (
+                    entry.name.startswith("FoilHole_") and entry.name.endswith(".jpg")
+                ):
+                    continue
+                image = known.get(entry.path)
+                if image is None:
+                    try:
+                        image = (
+                            foil_hole_from_file(Path(entry.name)),
+                            entry.stat().st_ctime,
+                        )
+                    except (IndexError, ValueError, OSError):
+                        continue
+                images[entry.path] = image
+        return _FoilHoleImages(mtime_ns, images)
+
+    def refresh(self):
+        with self._lock:
+            changed = False
+            found = set()
+            for fh_path in self._images_root.glob(
+                f"Images-Disc*/GridSquare_{self._grid_square}/FoilHoles"
+            ):
+                fh_dir = str(fh_path)
+                previous = self._listings.get(fh_dir)
+                try:
+                    mtime = os.stat(fh_dir).st_mtime_ns
+                    # Images written within the resolution of the modification time
+                    # of the directory may have been missed by the last listing
+                    if (
+                        previous is None
+                        or previous.mtime_ns != mtime
+                        or time.time_ns() - mtime <= _MTIME_RESOLUTION_NS
+                    ):
+                        self._listings[fh_dir] = self._list(fh_dir, mtime, previous)
+                        changed = True
+                except FileNotFoundError:
+                    continue
+                found.add(fh_dir)
+            for fh_dir in list(self._listings):
+                if fh_dir not in found:
+                    del self._listings[fh_dir]
+                    changed = True
+            if changed:
+                # Worked out again from all the listings, so removed images are dropped
+                newest: Dict[int, Tuple[float, str]] = {}
+                for listing in self._listings.values():
+                    for image_path, (foil_hole, ctime) in listing.images.items():
+                        current = newest.get(foil_hole)
+                        if current is None or (ctime, image_path) >= current:
+                            newest[foil_hole] = (ctime, image_path)
+                self._newest = newest
+
+    def newest_image(self, foil_hole: int, refresh: bool = True) -> Path | None:
+        if refresh:
+            self.refresh()
+        newest = self._newest.get(foil_hole)
+        return Path(newest[1]) if newest else None
+
+
+# Indexes of the grid squares looked up most recently, newest last
+_foil_hole_image_indexes: OrderedDict[Tuple[Path, int], FoilHoleImageIndex] = (
+    OrderedDict()
+)
+_foil_hole_image_indexes_lock = threading.Lock()
+_max_foil_hole_image_indexes = 256
+
+
+def foil_hole_image_index(images_root: Path, grid_square: int) -> FoilHoleImageIndex:
+    """
+    Returns the up-to-date foil hole image index for the grid square, looking for
+    images in the "Images-Disc*" directories under 'images_root'
+    """
+    with _foil_hole_image_indexes_lock:
+        key = (images_root, grid_square)
+        index = _foil_hole_image_indexes.get(key)
+        if index is None:
+            index = _foil_hole_image_indexes[key] = FoilHoleImageIndex(
+                images_root, grid_square
+            )
+        _foil_hole_image_indexes.move_to_end(key)
+        while len(_foil_hole_image_indexes) > _max_foil_hole_image_indexes:
+            _foil_hole_image_indexes.popitem(last=False)
+    index.refresh()
+    return index
+
+
 def grid_square_from_file(f: Path) -> int:
     for p in f.parts:
         if p.startswith("GridSquare"):
@@ -51,72 +261,17 @@ def foil_hole_from_file(f: Path) -> int:
 
 def get_grid_square_atlas_positions(
     xml_path: Path, grid_square: str = ""
-) -> Dict[
-    str,
-    Tuple[
-        Optional[int],
-        Optional[int],
-        Optional[float],
-        Optional[float],
-        Optional[int],
-        Optional[int],
-        Optional[float],
-    ],
-]:
-    with open(
-        xml_path,
-        "r",
-    ) as dm:
-        atlas_data = xmltodict.parse(dm.read())
-    tile_info = atlas_data["AtlasSessionXml"]["Atlas"]["TilesEfficient"]["_items"][
-        "TileXml"
-    ]
-    gs_pix_positions: Dict[
-        str,
-        Tuple[
-            Optional[int],
-            Optional[int],
-            Optional[float],
-            Optional[float],
-            Optional[int],
-            Optional[int],
-            Optional[float],
-        ],
-    ] = {}
-    for ti in tile_info:
-        try:
-            nodes = ti["Nodes"]["KeyValuePairs"]
-        except KeyError:
-            continue
-        required_key = ""
-        for key in nodes.keys():
-            if key.startswith("KeyValuePairOfintNodeXml"):
-                required_key = key
-                break
-        if not required_key:
-            continue
-        for gs in nodes[required_key]:
-            if not isinstance(gs, dict):
-                continue
-            if not grid_square or gs["key"] == grid_square:
-                gs_pix_positions[gs["key"]] = (
-                    int(float(gs["value"]["b:PositionOnTheAtlas"]["c:Center"]["d:x"])),
-                    int(float(gs["value"]["b:PositionOnTheAtlas"]["c:Center"]["d:y"])),
-                    float(gs["value"]["b:PositionOnTheAtlas"]["c:Physical"]["d:x"])
-                    * 1e9,
-                    float(gs["value"]["b:PositionOnTheAtlas"]["c:Physical"]["d:y"])
-                    * 1e9,
-                    int(
-                        float(gs["value"]["b:PositionOnTheAtlas"]["c:Size"]["d:width"])
-                    ),
-                    int(
-                        float(gs["value"]["b:PositionOnTheAtlas"]["c:Size"]["d:height"])
-                    ),
-                    float(gs["value"]["b:PositionOnTheAtlas"]["c:Rotation"]),
-                )
-                if grid_square:
-                    break
-    return gs_pix_positions
+) -> Dict[str, AtlasPosition]:
+    """
+    Returns the position on the atlas of the given grid square, or of all the grid
+    squares on the atlas if none is given. The atlas is only read again if it has
+    changed since the last lookup.
+    """
+    index, _ = read_atlas_index(xml_path)
+    if grid_square:
+        position = index.get(grid_square)
+        return {grid_square: position} if position is not None else {}
+    return dict(index.positions)
 
 
 def grid_square_data(xml_path: Path, grid_square: int) -> GridSquareInfo:
@@ -131,8 +286,7 @@ def grid_square_data(xml_path: Path, grid_square: int) -> GridSquareInfo:
     if image_paths:
         image_paths.sort(key=lambda x: x.stat().st_ctime)
         image_path = image_paths[-1]
-        with open(Path(image_path).with_suffix(".xml")) as gs_xml:
-            gs_xml_data = xmltodict.parse(gs_xml.read())
+        gs_xml_data = parse_xml(Path(image_path).with_suffix(".xml"))
         readout_area = gs_xml_data["MicroscopeImage"]["microscopeData"]["acquisition"][
             "camera"
         ]["ReadoutArea"]
@@ -153,42 +307,20 @@ def grid_square_data(xml_path: Path, grid_square: int) -> GridSquareInfo:
 
 
 def foil_hole_data(xml_path: Path, foil_hole: int, grid_square: int) -> FoilHoleInfo:
-    required_key = ""
+    targets: Dict[int, FoilHoleTarget] = {}
     if xml_path.is_file():
-        with open(xml_path, "r") as xml:
-            for_parsing = xml.read()
-            data = xmltodict.parse(for_parsing)
-        data = data["GridSquareXml"]
-        if "TargetLocationsEfficient" in data["TargetLocations"].keys():
-            # Grids with regular foil holes
-            serialization_array = data["TargetLocations"]["TargetLocationsEfficient"][
-                "a:m_serializationArray"
-            ]
-        elif "TargetLocations" in data["TargetLocations"].keys():
-            # Lacey grids
-            serialization_array = data["TargetLocations"]["TargetLocations"][
-                "a:m_serializationArray"
-            ]
-        else:
+        targets = get_foil_hole_targets(xml_path)
+        if not targets:
             logger.warning(f"Target locations not found for {str(xml_path)}")
             return FoilHoleInfo(id=foil_hole, grid_square_id=grid_square)
-
-        if len(serialization_array.keys()) == 0:
-            return FoilHoleInfo(id=foil_hole, grid_square_id=grid_square)
-        for key in serialization_array.keys():
-            if key.startswith("b:KeyValuePairOfintTargetLocation"):
-                required_key = key
-                break
-    image_paths = list(
-        (xml_path.parent.parent).glob(
-            f"Images-Disc*/GridSquare_{grid_square}/FoilHoles/FoilHole_{foil_hole}_*.jpg"
+    image_path: Union[Path, str] = (
+        foil_hole_image_index(xml_path.parent.parent, grid_square).newest_image(
+            foil_hole, refresh=False
         )
+        or ""
     )
-    image_paths.sort(key=lambda x: x.stat().st_ctime)
-    image_path: Union[Path, str] = image_paths[-1] if image_paths else ""
     if image_path:
-        with open(Path(image_path).with_suffix(".xml")) as fh_xml:
-            fh_xml_data = xmltodict.parse(fh_xml.read())
+        fh_xml_data = parse_xml(Path(image_path).with_suffix(".xml"))
         readout_area = fh_xml_data["MicroscopeImage"]["microscopeData"]["acquisition"][
             "camera"
         ]["ReadoutArea"]
@@ -196,27 +328,23 @@ def foil_hole_data(xml_path: Path, foil_hole: int, grid_square: int) -> FoilHole
             "numericValue"
         ]
         full_size = (int(readout_area["a:width"]), int(readout_area["a:height"]))
-    if required_key:
-        for fh_block in serialization_array[required_key]:
-            pix = fh_block["b:value"]["PixelCenter"]
-            stage = fh_block["b:value"]["StagePosition"]
-            diameter = fh_block["b:value"]["PixelWidthHeight"]["c:width"]
-            if int(fh_block["b:key"]) == foil_hole:
-                return FoilHoleInfo(
-                    id=foil_hole,
-                    grid_square_id=grid_square,
-                    x_location=float(pix["c:x"]),
-                    y_location=float(pix["c:y"]),
-                    x_stage_position=float(stage["c:X"]),
-                    y_stage_position=float(stage["c:Y"]),
-                    readout_area_x=full_size[0] if image_path else None,
-                    readout_area_y=full_size[1] if image_path else None,
-                    thumbnail_size_x=None,
-                    thumbnail_size_y=None,
-                    pixel_size=float(pixel_size) if image_path else None,
-                    image=str(image_path),
-                    diameter=diameter,
-                )
+    if targets:
+        if (target := targets.get(foil_hole)) is not None:
+            return FoilHoleInfo(
+                id=foil_hole,
+                grid_square_id=grid_square,
+                x_location=target.x_location,
+                y_location=target.y_location,
+                x_stage_position=target.x_stage_position,
+                y_stage_position=target.y_stage_position,
+                readout_area_x=full_size[0] if image_path else None,
+                readout_area_y=full_size[1] if image_path else None,
+                thumbnail_size_x=None,
+                thumbnail_size_y=None,
+                pixel_size=float(pixel_size) if image_path else None,
+                image=str(image_path),
+                diameter=target.diameter,
+            )
     elif image_path:
         return FoilHoleInfo(
             id=foil_hole,
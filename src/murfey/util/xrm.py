@@ -0,0 +1,199 @@
+"""
+Reading of the metadata in the xrm and txrm files written by Zeiss soft X-ray
+microscopes.
+
+These files are OLE compound documents, with each metadata value stored in its own
+stream alongside the image data. Only the header streams used by Murfey are read,
+so the cost of reading the metadata does not depend on the size of the images. The
+headers are cached against the size and modification time of each file, so that a
+file is only opened again if it changes.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+from olefile import OleFileIO
+
+logger = logging.getLogger("murfey.util.xrm")
+
+# The header streams that are read, and the types of their values. The mosaic streams
+# are spelt as they are in the file format specification.
+HEADER_STREAMS: Dict[str, type] = {
+    "ImageInfo/XPosition": np.float32,
+    "ImageInfo/YPosition": np.float32,
+    "ImageInfo/PixelSize": np.float32,
+    "ImageInfo/ImageHeight": np.int32,
+    "ImageInfo/ImageWidth": np.int32,
+    "ImageInfo/MosiacRows": np.int32,
+    "ImageInfo/MosiacColumns": np.int32,
+    "ImageInfo/Angles": np.float32,
+    "ImageInfo/ExpTimes": np.float32,
+    "ImageInfo/XrayMagnification": np.float32,
+    "ImageInfo/ImagesTaken": np.int32,
+    "PositionInfo/MotorPositions": np.float32,
+}
+_AXIS_NAMES = "PositionInfo/AxisNames"
+_REFERENCE_IMAGE = "ReferenceData/Image"
+
+
+class XrmHeader(NamedTuple):
+    values: Dict[str, np.ndarray]
+    axis_names: list[str]
+    has_reference: bool  # Whether a reference image is stored in the file
+
+    def get(self, name: str) -> np.ndarray | None:
+        return self.values.get(name)
+
+    @property
+    def mosaic_size(self) -> int | None:
+        rows = self.values.get("ImageInfo/MosiacRows")
+        columns = self.values.get("ImageInfo/MosiacColumns")
+        if rows is None or columns is None:
+            return None
+        return int(rows[0] * columns[0])
+
+
+def read_xrm_header(file_path: Path) -> XrmHeader:
+    """
+    Reads the header streams of an xrm or txrm file, leaving the image streams unread
+    """
+    with OleFileIO(str(file_path)) as ole:
+        values: Dict[str, np.ndarray] = {
+            name: np.frombuffer(ole.openstream(name).getvalue(), dtype)
+            for name, dtype in HEADER_STREAMS.items()
+            if ole.exists(name)
+        }
+        axis_names = (
+            [
+                name
+                for name in ole.openstream(_AXIS_NAMES)
+                .read()
+                .decode("ascii")
+                .split("\x00")
+                if name
+            ]
+            if ole.exists(_AXIS_NAMES)
+            else []
+        )
+        has_reference = ole.exists(_REFERENCE_IMAGE)
+    return XrmHeader(values=values, axis_names=axis_names, has_reference=has_reference)
+
+
+# Absolute path -> (modification time, size, header)
+_headers: OrderedDict[str, Tuple[int, int, XrmHeader]] = OrderedDict()
+_headers_lock = threading.Lock()
+_max_headers = 4096
+
+
+def get_xrm_header(file_path: Path) -> XrmHeader:
+    """
+    Returns the header of an xrm or txrm file, only reading the file if it has not
+    been read before or has changed since
+    """
+    key = os.path.abspath(file_path)
+    stat = os.stat(key)
+    with _headers_lock:
+        entry = _headers.get(key)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            _headers.move_to_end(key)
+            return entry[2]
+
+    # Read outside of the lock so that slow reads don't hold up other files
+    header = read_xrm_header(file_path)
+    with _headers_lock:
+        _headers[key] = (stat.st_mtime_ns, stat.st_size, header)
+        _headers.move_to_end(key)
+        while len(_headers) > _max_headers:
+            _headers.popitem(last=False)
+    return header
+
+
+class XrmReferenceIndex:
+    """
+    Index of the reference images among the xrm files in a directory. Files are added
+    as they are transferred, and the directory is only listed again when its
+    modification time changes, so that each file is looked at once. Only the files
+    named as references have their headers read, to check that they are single
+    images rather than mosaics.
+    """
+
+    def __init__(self, directory: Path):
+        self._directory = directory
+        self._dir_mtime: int | None = None
+        # File name -> (modification time, size) when last looked at
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        # File name -> (modification time, path) of the references found
+        self._references: Dict[str, Tuple[int, Path]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, xrm_file: Path, header: XrmHeader | None = None):
+        """
+        Adds an xrm file in the directory to the index, using its header if it has
+        already been read
+        """
+        with self._lock:
+            self._add(xrm_file, os.stat(xrm_file), header)
+
+    def _add(self, xrm_file: Path, stat: os.stat_result, header: XrmHeader | None):
+        if self._seen.get(xrm_file.name) == (stat.st_mtime_ns, stat.st_size):
+            return
+        self._seen[xrm_file.name] = (stat.st_mtime_ns, stat.st_size)
+        if "ref" not in xrm_file.name.lower():
+            return
+        try:
+            header = header or get_xrm_header(xrm_file)
+        except OSError as e:
+            logger.warning(f"Unable to read the header of {xrm_file}: {e}")
+            return
+        # References are single images rather than mosaics
+        if header.mosaic_size == 0:
+            self._references[xrm_file.name] = (stat.st_mtime_ns, xrm_file)
+        else:
+            self._references.pop(xrm_file.name, None)
+
+    def refresh(self):
+        with self._lock:
+            try:
+                mtime = self._directory.stat().st_mtime_ns
+            except FileNotFoundError:
+                return
+            if self._dir_mtime == mtime:
+                return
+            self._dir_mtime = mtime
+            present = set()
+            with os.scandir(self._directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".xrm") or not entry.is_file():
+                        continue
+                    present.add(entry.name)
+                    self._add(Path(entry.path), entry.stat(), None)
+            for name in set(self._seen) - present:
+                self._seen.pop(name)
+                self._references.pop(name, None)
+
+    def newest_reference(self, refresh: bool = True) -> Path | None:
+        if refresh:
+            self.refresh()
+        with self._lock:
+            if not self._references:
+                return None
+            return max(self._references.values(), key=lambda r: r[0])[1]
+
+
+_reference_indexes: Dict[Path, XrmReferenceIndex] = {}
+_reference_indexes_lock = threading.Lock()
+
+
+def xrm_reference_index(directory: Path) -> XrmReferenceIndex:
+    """
+    Returns the reference index for a directory of xrm files
+    """
+    with _reference_indexes_lock:
+        return _reference_indexes.setdefault(directory, XrmReferenceIndex(directory))
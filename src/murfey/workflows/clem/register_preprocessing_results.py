@@ -9,15 +9,17 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
 import traceback
 from collections.abc import Collection
+from concurrent.futures import Future
 from functools import cached_property
 from importlib.metadata import entry_points
 from pathlib import Path
 from typing import Literal, Optional, TypeAlias
 
 from pydantic import BaseModel, computed_field
-from sqlmodel import Session, select
+from sqlmodel import Session, col, or_, select
 
 import murfey.util.db as MurfeyDB
 from murfey.server import _transport_object
@@ -356,11 +358,41 @@ def _register_dcg_and_atlas(
     murfey_db.commit()
 
 
+class _GridSquareRegistrationState:
+    """
+    Tracks the imaging sites of a data collection group that have been added or
+    changed since grid squares were last registered for it, and whether a
+    registration pass is currently running.
+    """
+
+    def __init__(self):
+        self.changed_site_ids: set[int] = set()
+        # All the sites are registered on the first pass after a restart, or after
+        # a new atlas is registered, as the atlas extents place every grid square
+        self.full_refresh = True
+        self.running = False
+        # Completed by the pass that registers the sites changed so far
+        self.next_pass: Future[bool] = Future()
+
+
+_grid_square_registration_states: dict[
+    tuple[int, str], _GridSquareRegistrationState
+] = {}
+_grid_square_registration_condition = threading.Condition()
+
+
 def _register_grid_square(
     session_id: int,
     imaging_site: MurfeyDB.ImagingSite,
     murfey_db: Session,
 ):
+    """
+    Marks the imaging site as changed, then registers grid squares for all of the
+    changed sites in its data collection group. If a registration pass is already
+    running for the data collection group, this waits for it to finish, after which
+    the sites that changed in the meantime are registered together in one pass. That
+    pass is run by one of the results waiting on it, using its own database session.
+    """
     # Skip this step if no transport manager object is configured
     if _transport_object is None:
         logger.error("Unable to find transport manager")
@@ -369,6 +401,145 @@ def _register_grid_square(
         logger.warning("Current imaging site has no data collection group name")
         return
 
+    with _grid_square_registration_condition:
+        state = _grid_square_registration_states.setdefault(
+            (session_id, dcg_name), _GridSquareRegistrationState()
+        )
+        if imaging_site.data_type == "atlas":
+            state.full_refresh = True
+        elif imaging_site.id is not None:
+            state.changed_site_ids.add(imaging_site.id)
+        registration = state.next_pass
+        while state.running and not registration.done():
+            _grid_square_registration_condition.wait()
+        run_pass = not registration.done()
+        if run_pass:
+            state.running = True
+            state.next_pass = Future()
+            changed_site_ids, full_refresh = state.changed_site_ids, state.full_refresh
+            state.changed_site_ids = set()
+            state.full_refresh = False
+
+    if run_pass:
+        registered = False
+        try:
+            registered = _register_changed_grid_squares(
+                session_id, dcg_name, changed_site_ids, full_refresh, murfey_db
+            )
+            registration.set_result(registered)
+        except Exception as e:
+            registration.set_exception(e)
+        finally:
+            with _grid_square_registration_condition:
+                if not registered:
+                    # Keep the sites for the next pass
+                    state.changed_site_ids |= changed_site_ids
+                    state.full_refresh |= full_refresh
+                state.running = False
+                _grid_square_registration_condition.notify_all()
+    registration.result()
+
+
+def _grid_square_parameters(
+    imaging_site: MurfeyDB.ImagingSite,
+    atlas_entry: MurfeyDB.ImagingSite,
+    dcg_name: str,
+) -> GridSquareParameters | None:
+    """
+    Places the imaging site on the atlas, using the thumbnail sizes and scales
+    """
+    if (
+        imaging_site.x0 is None
+        or imaging_site.x1 is None
+        or imaging_site.y0 is None
+        or imaging_site.y1 is None
+    ):
+        logger.warning(
+            f"Image series {imaging_site.site_name!r} not populated with required values"
+        )
+        return None
+    assert atlas_entry.x0 is not None and atlas_entry.x1 is not None
+    assert atlas_entry.y0 is not None and atlas_entry.y1 is not None
+    assert atlas_entry.thumbnail_pixels_x is not None
+    assert atlas_entry.thumbnail_pixels_y is not None
+    atlas_width_real = atlas_entry.x1 - atlas_entry.x0
+    atlas_height_real = atlas_entry.y1 - atlas_entry.y0
+
+    # Find the real coordinates of the image midpoint
+    x_mid_real = 0.5 * (imaging_site.x0 + imaging_site.x1)
+    y_mid_real = 0.5 * (imaging_site.y0 + imaging_site.y1)
+
+    # Find pixel coordinates corresponding to image midpoint on atlas
+    x_mid_px = int(
+        round(
+            (x_mid_real - atlas_entry.x0)
+            / atlas_width_real
+            * atlas_entry.thumbnail_pixels_x
+        )
+    )
+    y_mid_px = int(
+        round(
+            (y_mid_real - atlas_entry.y0)
+            / atlas_height_real
+            * atlas_entry.thumbnail_pixels_y
+        )
+    )
+
+    # Find the size of the image, in pixels, when overlaid on the atlas
+    width_scaled = int(
+        round(
+            (imaging_site.x1 - imaging_site.x0)
+            / atlas_width_real
+            * atlas_entry.thumbnail_pixels_x
+        )
+        or 1
+    )
+    height_scaled = int(
+        round(
+            (imaging_site.y1 - imaging_site.y0)
+            / atlas_height_real
+            * atlas_entry.thumbnail_pixels_y
+        )
+        or 1
+    )
+
+    return GridSquareParameters(
+        tag=dcg_name,
+        x_location=imaging_site.x0,
+        x_location_scaled=x_mid_px,
+        y_location=imaging_site.y0,
+        y_location_scaled=y_mid_px,
+        readout_area_x=imaging_site.image_pixels_x,
+        readout_area_y=imaging_site.image_pixels_y,
+        thumbnail_size_x=imaging_site.thumbnail_pixels_x,
+        thumbnail_size_y=imaging_site.thumbnail_pixels_y,
+        width=imaging_site.image_pixels_x,
+        width_scaled=width_scaled,
+        height=imaging_site.image_pixels_y,
+        height_scaled=height_scaled,
+        x_stage_position=x_mid_real,
+        y_stage_position=y_mid_real,
+        pixel_size=imaging_site.image_pixel_size,
+        image=imaging_site.thumbnail_path,
+        collection_mode=imaging_site.collection_mode,
+    )
+
+
+def _register_changed_grid_squares(
+    session_id: int,
+    dcg_name: str,
+    changed_site_ids: set[int],
+    full_refresh: bool,
+    murfey_db: Session,
+) -> bool:
+    """
+    Registers or updates the grid squares of the changed imaging sites, along with
+    any sites that have not been registered yet, in one batch each on ISPyB and a
+    single commit on Murfey. Returns False if the sites could not be placed yet,
+    as there is no populated atlas to place them on.
+    """
+    assert _transport_object is not None
+
     # Check if an atlas has been registered
     if not (
         # Sort by ascending insertion order
@@ -383,176 +554,149 @@ def _register_grid_square(
         logger.info(
             f"No atlas has been registered for data collection group {dcg_name!r} yet"
         )
-        return
+        return False
     atlas_entry = atlas_results[-1]  # Use the latest registered atlas
+    if (
+        atlas_entry.x0 is None
+        or atlas_entry.x1 is None
+        or atlas_entry.y0 is None
+        or atlas_entry.y1 is None
+        or atlas_entry.thumbnail_pixels_x is None
+        or atlas_entry.thumbnail_pixels_y is None
+    ):
+        logger.warning("Atlas entry not populated with required values")
+        return False
 
-    # Check if there are CLEM entries to register
-    if clem_img_site_to_register := murfey_db.exec(
+    # Look up the changed sites, and any that have yet to be registered
+    site_query = (
         select(MurfeyDB.ImagingSite)
         .where(MurfeyDB.ImagingSite.session_id == session_id)
         .where(MurfeyDB.ImagingSite.dcg_name == dcg_name)
         .where(MurfeyDB.ImagingSite.data_type == "grid_square")
-    ).all():
-        if (
-            atlas_entry.x0 is not None
-            and atlas_entry.x1 is not None
-            and atlas_entry.y0 is not None
-            and atlas_entry.y1 is not None
-            and atlas_entry.thumbnail_pixels_x is not None
-            and atlas_entry.thumbnail_pixels_y is not None
-        ):
-            atlas_width_real = atlas_entry.x1 - atlas_entry.x0
-            atlas_height_real = atlas_entry.y1 - atlas_entry.y0
-        else:
-            logger.warning("Atlas entry not populated with required values")
-            return
-
-        for clem_img_site in clem_img_site_to_register:
-            # Register datasets using thumbnail sizes and scales
-            if (
-                clem_img_site.x0 is not None
-                and clem_img_site.x1 is not None
-                and clem_img_site.y0 is not None
-                and clem_img_site.y1 is not None
-            ):
-                # Find the real coordinates of the image midpoint
-                x_mid_real = 0.5 * (clem_img_site.x0 + clem_img_site.x1)
-                y_mid_real = 0.5 * (clem_img_site.y0 + clem_img_site.y1)
-
-                # Find pixel coordinates corresponding to image midpoint on atlas
-                x_mid_px = int(
-                    round(
-                        (x_mid_real - atlas_entry.x0)
-                        / atlas_width_real
-                        * atlas_entry.thumbnail_pixels_x
-                    )
-                )
-                y_mid_px = int(
-                    round(
-                        (y_mid_real - atlas_entry.y0)
-                        / atlas_height_real
-                        * atlas_entry.thumbnail_pixels_y
-                    )
-                )
-
-                # Find the size of the image, in pixels, when overlaid on the atlas
-                width_scaled = int(
-                    round(
-                        (clem_img_site.x1 - clem_img_site.x0)
-                        / atlas_width_real
-                        * atlas_entry.thumbnail_pixels_x
-                    )
-                    or 1
-                )
-                height_scaled = int(
-                    round(
-                        (clem_img_site.y1 - clem_img_site.y0)
-                        / atlas_height_real
-                        * atlas_entry.thumbnail_pixels_y
-                    )
-                    or 1
-                )
-            else:
-                logger.warning(
-                    f"Image series {clem_img_site.site_name!r} not populated with required values"
-                )
-                continue
-
-            # Populate grid square Pydantic model
-            grid_square_params = GridSquareParameters(
-                tag=dcg_name,
-                x_location=clem_img_site.x0,
-                x_location_scaled=x_mid_px,
-                y_location=clem_img_site.y0,
-                y_location_scaled=y_mid_px,
-                readout_area_x=clem_img_site.image_pixels_x,
-                readout_area_y=clem_img_site.image_pixels_y,
-                thumbnail_size_x=clem_img_site.thumbnail_pixels_x,
-                thumbnail_size_y=clem_img_site.thumbnail_pixels_y,
-                width=clem_img_site.image_pixels_x,
-                width_scaled=width_scaled,
-                height=clem_img_site.image_pixels_y,
-                height_scaled=height_scaled,
-                x_stage_position=0.5 * (clem_img_site.x0 + clem_img_site.x1),
-                y_stage_position=0.5 * (clem_img_site.y0 + clem_img_site.y1),
-                pixel_size=clem_img_site.image_pixel_size,
-                image=clem_img_site.thumbnail_path,
-                collection_mode=clem_img_site.collection_mode,
+    )
+    if not full_refresh:
+        site_query = site_query.where(
+            or_(
+                col(MurfeyDB.ImagingSite.id).in_(changed_site_ids),
+                col(MurfeyDB.ImagingSite.grid_square_id).is_(None),
             )
-            # Construct colour flags for ISPyB
-            color_flags = {
-                ispyb_color_flags: int(getattr(clem_img_site, murfey_color_flags, 0))
-                for murfey_color_flags, ispyb_color_flags in COLOR_FLAGS_MURFEY_TO_ISPYB.items()
-            }
-            # Register or update the grid square entry as required
-            if grid_square_entry := murfey_db.exec(
-                select(MurfeyDB.GridSquare)
-                .where(MurfeyDB.GridSquare.name == clem_img_site.id)
-                .where(MurfeyDB.GridSquare.tag == grid_square_params.tag)
-                .where(MurfeyDB.GridSquare.session_id == session_id)
-            ).one_or_none():
-                # Update existing grid square entry on Murfey
-                grid_square_entry.x_location = grid_square_params.x_location
-                grid_square_entry.y_location = grid_square_params.y_location
-                grid_square_entry.x_stage_position = grid_square_params.x_stage_position
-                grid_square_entry.y_stage_position = grid_square_params.y_stage_position
-                grid_square_entry.readout_area_x = grid_square_params.readout_area_x
-                grid_square_entry.readout_area_y = grid_square_params.readout_area_y
-                grid_square_entry.thumbnail_size_x = grid_square_params.thumbnail_size_x
-                grid_square_entry.thumbnail_size_y = grid_square_params.thumbnail_size_y
-                grid_square_entry.pixel_size = grid_square_params.pixel_size
-                grid_square_entry.image = grid_square_params.image
-
-                # Update existing entry on ISPyB
-                _transport_object.do_update_grid_square(
-                    grid_square_id=grid_square_entry.id,
-                    grid_square_parameters=grid_square_params,
-                    color_flags=color_flags,
-                )
-            else:
-                # Look up data collection group for current series
-                dcg_entry = murfey_db.exec(
-                    select(MurfeyDB.DataCollectionGroup)
-                    .where(MurfeyDB.DataCollectionGroup.session_id == session_id)
-                    .where(MurfeyDB.DataCollectionGroup.tag == grid_square_params.tag)
-                ).one()
-                # Register to ISPyB
-                grid_square_ispyb_result = _transport_object.do_insert_grid_square(
-                    atlas_id=dcg_entry.atlas_id,
-                    grid_square_id=clem_img_site.id,
-                    grid_square_parameters=grid_square_params,
-                    color_flags=color_flags,
-                )
-                # Register to Murfey
-                grid_square_entry = MurfeyDB.GridSquare(
-                    id=grid_square_ispyb_result.get("return_value", None),
-                    name=clem_img_site.id,
-                    session_id=session_id,
-                    tag=grid_square_params.tag,
-                    x_location=grid_square_params.x_location,
-                    y_location=grid_square_params.y_location,
-                    x_stage_position=grid_square_params.x_stage_position,
-                    y_stage_position=grid_square_params.y_stage_position,
-                    readout_area_x=grid_square_params.readout_area_x,
-                    readout_area_y=grid_square_params.readout_area_y,
-                    thumbnail_size_x=grid_square_params.thumbnail_size_x,
-                    thumbnail_size_y=grid_square_params.thumbnail_size_y,
-                    pixel_size=grid_square_params.pixel_size,
-                    image=grid_square_params.image,
-                )
-            murfey_db.add(grid_square_entry)
-
-            # Add grid square ID to existing CLEM image series entry
-            clem_img_site.grid_square_id = grid_square_entry.id
-            murfey_db.add(clem_img_site)
-
-        # Do one commit at the end
-        murfey_db.commit()
-    else:
+        )
+    if not (clem_img_sites := murfey_db.exec(site_query).all()):
         logger.info(
             f"No grid squares to register for data collection group {dcg_name!r} yet"
         )
-    return
+        return True
+    grid_square_entries = {
+        grid_square.name: grid_square
+        for grid_square in murfey_db.exec(
+            select(MurfeyDB.GridSquare)
+            .where(MurfeyDB.GridSquare.session_id == session_id)
+            .where(MurfeyDB.GridSquare.tag == dcg_name)
+            .where(
+                col(MurfeyDB.GridSquare.name).in_([site.id for site in clem_img_sites])
+            )
+        ).all()
+    }
+
+    updates: list[tuple[MurfeyDB.ImagingSite, MurfeyDB.GridSquare]] = []
+    update_params: list[tuple[int, GridSquareParameters]] = []
+    update_color_flags: list[dict[str, int] | None] = []
+    inserts: list[tuple[int, MurfeyDB.ImagingSite, GridSquareParameters]] = []
+    insert_color_flags: list[dict[str, int] | None] = []
+    for clem_img_site in clem_img_sites:
+        if (site_id := clem_img_site.id) is None:
+            continue
+        if (
+            grid_square_params := _grid_square_parameters(
+                clem_img_site, atlas_entry, dcg_name
+            )
+        ) is None:
+            continue
+        # Construct colour flags for ISPyB
+        color_flags = {
+            ispyb_color_flags: int(getattr(clem_img_site, murfey_color_flags, 0))
+            for murfey_color_flags, ispyb_color_flags in COLOR_FLAGS_MURFEY_TO_ISPYB.items()
+        }
+        if (grid_square_entry := grid_square_entries.get(site_id)) is None:
+            inserts.append((site_id, clem_img_site, grid_square_params))
+            insert_color_flags.append(color_flags)
+            continue
+        # Update existing grid square entry on Murfey
+        grid_square_entry.x_location = grid_square_params.x_location
+        grid_square_entry.y_location = grid_square_params.y_location
+        grid_square_entry.x_stage_position = grid_square_params.x_stage_position
+        grid_square_entry.y_stage_position = grid_square_params.y_stage_position
+        grid_square_entry.readout_area_x = grid_square_params.readout_area_x
+        grid_square_entry.readout_area_y = grid_square_params.readout_area_y
+        grid_square_entry.thumbnail_size_x = grid_square_params.thumbnail_size_x
+        grid_square_entry.thumbnail_size_y = grid_square_params.thumbnail_size_y
+        grid_square_entry.pixel_size = grid_square_params.pixel_size
+        grid_square_entry.image = grid_square_params.image
+        updates.append((clem_img_site, grid_square_entry))
+        if grid_square_entry.id is not None:
+            update_params.append((grid_square_entry.id, grid_square_params))
+            update_color_flags.append(color_flags)
+
+    # Update existing entries on ISPyB in one batch
+    if update_params:
+        _transport_object.do_update_grid_squares(
+            update_params, color_flags=update_color_flags
+        )
+
+    # Register new entries to ISPyB in one batch, then to Murfey
+    new_entries: list[tuple[MurfeyDB.ImagingSite, MurfeyDB.GridSquare]] = []
+    if inserts:
+        dcg_entry = murfey_db.exec(
+            select(MurfeyDB.DataCollectionGroup)
+            .where(MurfeyDB.DataCollectionGroup.session_id == session_id)
+            .where(MurfeyDB.DataCollectionGroup.tag == dcg_name)
+        ).one()
+        grid_square_ids: list[int | None] = [None] * len(inserts)
+        if (atlas_id := dcg_entry.atlas_id) is not None:
+            grid_square_ispyb_result = _transport_object.do_insert_grid_squares(
+                [
+                    (atlas_id, site_id, grid_square_params)
+                    for site_id, _, grid_square_params in inserts
+                ],
+                color_flags=insert_color_flags,
+            )
+            grid_square_ids = (
+                grid_square_ispyb_result.get("return_value") or grid_square_ids
+            )
+        else:
+            logger.warning(
+                f"No atlas registered in ISPyB for data collection group {dcg_name!r}"
+            )
+        for (site_id, clem_img_site, grid_square_params), grid_square_id in zip(
+            inserts, grid_square_ids
+        ):
+            grid_square_entry = MurfeyDB.GridSquare(
+                id=grid_square_id,
+                name=site_id,
+                session_id=session_id,
+                tag=grid_square_params.tag,
+                x_location=grid_square_params.x_location,
+                y_location=grid_square_params.y_location,
+                x_stage_position=grid_square_params.x_stage_position,
+                y_stage_position=grid_square_params.y_stage_position,
+                readout_area_x=grid_square_params.readout_area_x,
+                readout_area_y=grid_square_params.readout_area_y,
+                thumbnail_size_x=grid_square_params.thumbnail_size_x,
+                thumbnail_size_y=grid_square_params.thumbnail_size_y,
+                pixel_size=grid_square_params.pixel_size,
+                image=grid_square_params.image,
+            )
+            new_entries.append((clem_img_site, grid_square_entry))
+        murfey_db.add_all(grid_square_entry for _, grid_square_entry in new_entries)
+        # Populate the IDs of any grid squares not given one by ISPyB
+        murfey_db.flush()
+
+    # Add grid square IDs to the CLEM image series entries, and do one commit
+    for clem_img_site, grid_square_entry in (*updates, *new_entries):
+        clem_img_site.grid_square_id = grid_square_entry.id
+    murfey_db.add_all(site for site, _ in (*updates, *new_entries))
+    murfey_db.commit()
+    return True
 
 
 def run(message: dict, murfey_db: Session) -> dict[str, bool]:
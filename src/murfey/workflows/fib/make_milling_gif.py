@@ -1,9 +1,31 @@
+"""
+Builds animations of the drift correction images collected while milling each FIB
+lamella site. The client requests a new animation every time an image arrives, so
+rather than loading and normalising every image again on each request, the frames
+are cached once prepared, and new frames are appended to the existing GIF file.
+
+Requests for the same animation that arrive in quick succession are coalesced, so
+that only the first and the most recent of them cause the animation to be rebuilt.
+Each request waits for the build that covers it, so that failures are reported.
+"""
+
+from __future__ import annotations
+
+import hashlib
 import logging
 import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
 from pathlib import Path
 from typing import Any
 
 import numpy as np
+import PIL.GifImagePlugin
 import PIL.Image
 from sqlmodel import Session as SQLModelSession, select
 
@@ -14,6 +36,305 @@ from murfey.util.models import FIBGIFParameters
 
 logger = logging.getLogger(__name__)
 
+# Time between frames of the animation, in milliseconds
+FRAME_DURATION = 30
+
+
+def _load_frame(image_path: Path) -> np.ndarray:
+    """
+    Loads an image, downscales it to fit within 512 x 512 pixels, and normalises it
+    to 8 bits using the 0.5th and 99.5th percentiles of its values.
+    """
+    with PIL.Image.open(image_path) as im:
+        im.thumbnail((512, 512))
+        frame = np.array(im, dtype=np.float32)
+    vmin, vmax = np.percentile(frame, (0.5, 99.5))
+    scale = 255 / ((vmax - vmin) or 1)
+    np.clip(frame, a_min=vmin, a_max=vmax, out=frame)
+    np.subtract(frame, vmin, out=frame)
+    np.multiply(frame, scale, out=frame)
+    return frame.astype(np.uint8)
+
+
+# An image path, along with its modification time and size, so that an image that
+# is written again is not mistaken for the earlier one
+FrameKey = tuple[Path, int, int]
+
+
+def frame_key(image_path: Path) -> FrameKey:
+    try:
+        stat = image_path.stat()
+    except OSError:
+        # Loading the image will fail too, and report the problem
+        return (image_path, 0, 0)
+    return (image_path, stat.st_mtime_ns, stat.st_size)
+
+
+class FrameCache:
+    """
+    LRU cache of prepared frames, keyed by the image they were made from. Frames
+    are kept in memory up to 'max_memory_bytes', after which the least recently
+    used ones are written to the spill directory, which is itself bounded.
+    """
+
+    def __init__(
+        self,
+        spill_directory: Path,
+        max_memory_bytes: int = 256 * 1024**2,
+        max_spill_bytes: int = 2 * 1024**3,
+    ):
+        self.spill_directory = spill_directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.decoded = 0
+        self._memory: OrderedDict[FrameKey, np.ndarray] = OrderedDict()
+        self._spilled: OrderedDict[FrameKey, tuple[Path, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_path: Path) -> np.ndarray:
+        key = frame_key(image_path)
+        with self._lock:
+            if (frame := self._memory.get(key)) is not None:
+                self._memory.move_to_end(key)
+                return frame
+            spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            spill_file, size = spilled
+            with self._lock:
+                self.spill_bytes -= size
+            try:
+                frame = np.load(spill_file)
+                spill_file.unlink(missing_ok=True)
+            except OSError:
+                frame = None
+        if spilled is None or frame is None:
+            frame = _load_frame(image_path)
+            self.decoded += 1
+        with self._lock:
+            self._memory[key] = frame
+            self.memory_bytes += frame.nbytes
+            while self.memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                self._spill(*self._memory.popitem(last=False))
+        return frame
+
+    def _spill(self, key: FrameKey, frame: np.ndarray):
+        self.memory_bytes -= frame.nbytes
+        self.spill_directory.mkdir(parents=True, exist_ok=True)
+        spill_file = (
+            self.spill_directory
+            / f"{hashlib.sha256(str(key).encode()).hexdigest()}.npy"
+        )
+        try:
+            np.save(spill_file, frame)
+        except OSError:
+            logger.warning(f"Could not spill frame for {key[0]}", exc_info=True)
+            return None
+        self._spilled[key] = (spill_file, frame.nbytes)
+        self.spill_bytes += frame.nbytes
+        # Drop the oldest frames entirely; they will be loaded again if needed
+        while self.spill_bytes > self.max_spill_bytes and self._spilled:
+            old_file, size = self._spilled.popitem(last=False)[1]
+            old_file.unlink(missing_ok=True)
+            self.spill_bytes -= size
+        return None
+
+
+class MillingAnimationBuilder:
+    """
+    Writes the animation for each lamella site from the frame cache. When the
+    images requested start with those already in an existing GIF written by this
+    builder, only the new frames are encoded and appended to the file.
+    """
+
+    def __init__(
+        self,
+        frame_cache: FrameCache,
+        debounce: float = 2.0,
+        max_animations: int = 256,
+    ):
+        self.frame_cache = frame_cache
+        self.debounce = debounce
+        self.max_animations = max_animations
+        self.encoded = 0
+        # The frames in, and size and modification time of, the GIFs last written
+        self._written: OrderedDict[Path, tuple[list[FrameKey], int, int]] = (
+            OrderedDict()
+        )
+        # Only the animations built within the debounce period, oldest first
+        self._last_built: OrderedDict[Path, float] = OrderedDict()
+        self._pending: dict[Path, tuple[FIBGIFParameters, Future[Path]]] = {}
+        # Locks are dropped once no build is using them
+        self._build_locks: weakref.WeakValueDictionary[Path, threading.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def submit(self, gif_params: FIBGIFParameters) -> Future[Path]:
+        """
+        Builds the animation straight away if it has not been built recently.
+        Otherwise, the request is held until the debounce period has passed,
+        replacing any other request for the same animation that is already being
+        held. The future returned is completed by the build that covers the request.
+        """
+        output_file = gif_params.output_file
+        with self._lock:
+            if (pending := self._pending.get(output_file)) is not None:
+                self._pending[output_file] = (gif_params, pending[1])
+                return pending[1]
+            future: Future[Path] = Future()
+            now = time.monotonic()
+            while self._last_built:
+                oldest_file, built_at = next(iter(self._last_built.items()))
+                if built_at + self.debounce > now:
+                    break
+                del self._last_built[oldest_file]
+            wait = self._last_built.get(output_file, -np.inf) + self.debounce - now
+            if wait > 0:
+                self._pending[output_file] = (gif_params, future)
+                timer = threading.Timer(wait, self._build_pending, args=(output_file,))
+                timer.daemon = True
+                timer.start()
+                return future
+            self._mark_built(output_file)
+        self._build_into(future, gif_params)
+        return future
+
+    def _mark_built(self, output_file: Path):
+        self._last_built[output_file] = time.monotonic()
+        self._last_built.move_to_end(output_file)
+
+    def _build_pending(self, output_file: Path):
+        with self._lock:
+            gif_params, future = self._pending.pop(output_file)
+            self._mark_built(output_file)
+        self._build_into(future, gif_params)
+
+    def _build_into(self, future: Future[Path], gif_params: FIBGIFParameters):
+        try:
+            future.set_result(self.build(gif_params))
+        except Exception as e:
+            logger.error(
+                f"Error creating FIB milling animation {gif_params.output_file}",
+                exc_info=True,
+            )
+            future.set_exception(e)
+
+    def build(self, gif_params: FIBGIFParameters) -> Path:
+        output_file = gif_params.output_file
+        images = list(gif_params.images)
+        if not images:
+            raise ValueError("No images were provided or loaded")
+        with self._lock:
+            build_lock = self._build_locks.get(output_file)
+            if build_lock is None:
+                build_lock = self._build_locks[output_file] = threading.Lock()
+        with build_lock:
+            if output_file.suffix.lower() == ".webp":
+                self._write_webp(output_file, images)
+            elif (appendable := self._appendable_frames(output_file, images)) is None:
+                self._write_gif(output_file, images)
+            elif appendable:
+                self._append_to_gif(output_file, images, appendable)
+        return output_file
+
+    def _appendable_frames(
+        self, output_file: Path, images: list[Path]
+    ) -> list[Path] | None:
+        """
+        Returns the images that need appending to the existing GIF, or None if it
+        needs writing from the start
+        """
+        with self._lock:
+            written = self._written.get(output_file)
+        if written is None:
+            return None
+        written_frames, size, mtime_ns = written
+        try:
+            stat = output_file.stat()
+        except FileNotFoundError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            return None
+        if (
+            len(images) < len(written_frames)
+            or [frame_key(image_path) for image_path in images[: len(written_frames)]]
+            != written_frames
+        ):
+            return None
+        return images[len(written_frames) :]
+
+    def _encode_frame(self, image_path: Path) -> bytes:
+        frame = PIL.Image.fromarray(self.frame_cache.get(image_path), mode="L")
+        self.encoded += 1
+        return b"".join(
+            PIL.GifImagePlugin.getdata(frame, duration=FRAME_DURATION)  # type: ignore[arg-type]
+        )
+
+    def _write_gif(self, output_file: Path, images: list[Path]):
+        # The first frame is saved with the header, loop extension, and a global
+        # greyscale palette, which the 8-bit frames appended to it then index into
+        first = PIL.Image.fromarray(self.frame_cache.get(images[0]), mode="L")
+        self.encoded += 1
+        header = BytesIO()
+        first.save(
+            header,
+            format="GIF",
+            save_all=True,
+            duration=FRAME_DURATION,
+            loop=0,
+            optimize=False,
+        )
+        with open(output_file, "wb") as gif:
+            gif.write(header.getvalue()[:-1])  # Without the trailer
+            for image_path in images[1:]:
+                gif.write(self._encode_frame(image_path))
+            gif.write(b";")
+        self._record(output_file, images)
+
+    def _append_to_gif(self, output_file: Path, images: list[Path], new: list[Path]):
+        with open(output_file, "r+b") as gif:
+            gif.seek(-1, os.SEEK_END)
+            if gif.read(1) != b";":
+                raise ValueError(f"{output_file} does not end with a GIF trailer")
+            gif.seek(-1, os.SEEK_END)
+            for image_path in new:
+                gif.write(self._encode_frame(image_path))
+            gif.write(b";")
+        self._record(output_file, images)
+
+    def _record(self, output_file: Path, images: list[Path]):
+        stat = output_file.stat()
+        frames = [frame_key(image_path) for image_path in images]
+        with self._lock:
+            self._written[output_file] = (frames, stat.st_size, stat.st_mtime_ns)
+            self._written.move_to_end(output_file)
+            while len(self._written) > self.max_animations:
+                self._written.popitem(last=False)
+
+    def _write_webp(self, output_file: Path, images: list[Path]):
+        frames = [
+            PIL.Image.fromarray(self.frame_cache.get(image_path), mode="L")
+            for image_path in images
+        ]
+        self.encoded += len(frames)
+        frames[0].save(
+            output_file,
+            format="WEBP",
+            append_images=frames[1:],
+            save_all=True,
+            duration=FRAME_DURATION,
+            loop=0,
+            quality=80,
+        )
+
+
+# Shared by all messages handled by this server process
+milling_animation_builder = MillingAnimationBuilder(
+    FrameCache(Path(tempfile.gettempdir()) / "murfey_milling_frames")
+)
+
 
 def run(message: dict[str, Any], murfey_db: SQLModelSession):
     # Outer try-finally block to close Murfey DB with
@@ -41,6 +362,7 @@ def run(message: dict[str, Any], murfey_db: SQLModelSession):
         output_file = sanitise_path(gif_params.output_file)
         if not output_file.is_relative_to(rsync_basepath):
             raise ValueError("Output file path is not permitted")
+        gif_params.output_file = output_file
 
         # Create folders in the visit directory and onwards and change permissions
         visit_index = output_file.parts.index(visit_name)
@@ -56,35 +378,10 @@ def run(message: dict[str, Any], murfey_db: SQLModelSession):
                     )
                     continue
 
-        # Load the images as PIL Image objects
-        converted: list[PIL.Image.Image] = []
-        for f in gif_params.images:
-            with PIL.Image.open(f) as im:
-                im.thumbnail((512, 512))
-                frame = np.array(im, dtype=np.float32)
-            # Normalise to 8-bit
-            vmin, vmax = np.percentile(frame, (0.5, 99.5))
-            scale = 255 / ((vmax - vmin) or 1)
-            np.clip(frame, a_min=vmin, a_max=vmax, out=frame)
-            np.subtract(frame, vmin, out=frame)
-            np.multiply(frame, scale, out=frame)
-            # Convert back to PIL Image
-            converted.append(
-                PIL.Image.fromarray(frame.astype(np.uint8), mode="L").copy()
-            )
-            del frame  # Explicitly remove frame from memory
-        # Save stack as a GIF
-        if not converted:
-            raise ValueError("No images were provided or loaded")
-        converted[0].save(
-            output_file,
-            format="GIF",
-            append_images=converted[1:],
-            save_all=True,
-            duration=30,
-            loop=0,
-        )
-        logger.info(f"Created GIF file {output_file}")
+        # Build the animation now, or once no more requests have come in for a while,
+        # and wait for the build that covers this request
+        milling_animation_builder.submit(gif_params).result()
+        logger.info(f"Created animation file {output_file}")
         return {"success": True}
     except Exception:
         logger.error("Error creating FIB milling GIF", exc_info=True)
@@ -27,6 +27,7 @@ except ImportError:
 
 from murfey.server import _transport_object
 from murfey.server.feedback import _murfey_id
+from murfey.server.thumbnails import generate_thumbnails
 from murfey.util import sanitise, secure_path
 from murfey.util.config import get_machine_config, get_microscope
 from murfey.util.db import (
@@ -56,12 +57,7 @@ from murfey.util.spa_metadata import (
 logger = logging.getLogger("murfey.workflows.spa.flush_spa_preprocess")
 
 
-def register_grid_square(
-    session_id: int,
-    gsid: int,
-    grid_square_params: GridSquareParameters,
-    murfey_db: Session,
-):
+def _scale_grid_square_parameters(grid_square_params: GridSquareParameters):
     # Calculate scaled down version of the image for registration to ISPyB first
     if grid_square_params.x_location is not None:
         grid_square_params.x_location_scaled = int(grid_square_params.x_location / 7.8)
@@ -72,20 +68,205 @@ def register_grid_square(
     if grid_square_params.width is not None:
         grid_square_params.width_scaled = int(grid_square_params.width / 7.8)
 
+
+def _find_data_collection_group(
+    session_id: int,
+    grid_square_params: GridSquareParameters,
+    murfey_db: Session,
+) -> Optional[DataCollectionGroup]:
     if grid_square_params.sample is not None:
-        dcg = murfey_db.exec(
+        return murfey_db.exec(
             select(DataCollectionGroup)
             .where(DataCollectionGroup.session_id == session_id)
             .where(DataCollectionGroup.sample == grid_square_params.sample)
             .order_by(desc(DataCollectionGroup.id))
         ).first()
+    return murfey_db.exec(
+        select(DataCollectionGroup)
+        .where(DataCollectionGroup.session_id == session_id)
+        .where(DataCollectionGroup.tag == grid_square_params.tag)
+        .order_by(desc(DataCollectionGroup.id))
+    ).first()
+
+
+def _update_grid_square(
+    grid_square: GridSquare, grid_square_params: GridSquareParameters
+) -> GridSquare:
+    """
+    Updates an existing grid square with the new parameters, queueing the change to
+    be written to ISPyB alongside any further updates to the same grid square. The
+    queue is flushed by '_flush_grid_square_updates' once the request is handled.
+    """
+    grid_square.x_location = grid_square_params.x_location or grid_square.x_location
+    grid_square.y_location = grid_square_params.y_location or grid_square.y_location
+    grid_square.x_stage_position = (
+        grid_square_params.x_stage_position or grid_square.x_stage_position
+    )
+    grid_square.y_stage_position = (
+        grid_square_params.y_stage_position or grid_square.y_stage_position
+    )
+    grid_square.readout_area_x = (
+        grid_square_params.readout_area_x or grid_square.readout_area_x
+    )
+    grid_square.readout_area_y = (
+        grid_square_params.readout_area_y or grid_square.readout_area_y
+    )
+    grid_square.thumbnail_size_x = (
+        grid_square_params.thumbnail_size_x or grid_square.thumbnail_size_x
+    )
+    grid_square.thumbnail_size_y = (
+        grid_square_params.thumbnail_size_y or grid_square.thumbnail_size_y
+    )
+    grid_square.pixel_size = grid_square_params.pixel_size or grid_square.pixel_size
+    grid_square.image = grid_square_params.image or grid_square.image
+    if _transport_object and grid_square.id is not None:
+        _transport_object.queue_grid_square_update(grid_square.id, grid_square_params)
+    return grid_square
+
+
+def _flush_grid_square_updates():
+    """
+    Writes the queued grid square updates to ISPyB, so that they aren't left waiting
+    in this process once the request that made them has been answered
+    """
+    if _transport_object and not _transport_object.flush_updates()["success"]:
+        logger.error(
+            "Failed to write grid square updates to ISPyB; they will be tried again"
+        )
+
+
+def _new_grid_square(
+    session_id: int,
+    gsid: int,
+    grid_square_params: GridSquareParameters,
+    ispyb_id: Optional[int],
+) -> GridSquare:
+    secured_grid_square_image_path = secure_path(Path(grid_square_params.image))
+    if secured_grid_square_image_path and secured_grid_square_image_path.is_file():
+        with Image.open(secured_grid_square_image_path) as image:
+            jpeg_size = image.size
+            generate_thumbnails(secured_grid_square_image_path, image)
     else:
-        dcg = murfey_db.exec(
-            select(DataCollectionGroup)
-            .where(DataCollectionGroup.session_id == session_id)
-            .where(DataCollectionGroup.tag == grid_square_params.tag)
-            .order_by(desc(DataCollectionGroup.id))
-        ).first()
+        jpeg_size = (0, 0)
+    return GridSquare(
+        id=ispyb_id,
+        name=gsid,
+        session_id=session_id,
+        tag=grid_square_params.tag,
+        x_location=grid_square_params.x_location,
+        y_location=grid_square_params.y_location,
+        x_stage_position=grid_square_params.x_stage_position,
+        y_stage_position=grid_square_params.y_stage_position,
+        readout_area_x=grid_square_params.readout_area_x,
+        readout_area_y=grid_square_params.readout_area_y,
+        thumbnail_size_x=grid_square_params.thumbnail_size_x or jpeg_size[0],
+        thumbnail_size_y=grid_square_params.thumbnail_size_y or jpeg_size[1],
+        pixel_size=grid_square_params.pixel_size,
+        image=str(secured_grid_square_image_path),
+    )
+
+
+def _smartem_client(session_id: int, murfey_db: Session):
+    """
+    Returns a SmartEM API client if SmartEM is configured for the session's
+    instrument, or None otherwise
+    """
+    murfey_session = murfey_db.exec(
+        select(MurfeySession).where(MurfeySession.id == session_id)
+    ).one()
+    machine_config = get_machine_config(instrument_name=murfey_session.instrument_name)[
+        murfey_session.instrument_name
+    ]
+    if not machine_config.smartem_api_url:
+        return None
+    return SmartEMAPIClient(
+        base_url=machine_config.smartem_api_url,
+        logger=logger,
+        keycloak_client=keycloak_client,
+    )
+
+
+def _register_grid_square_with_smartem(
+    session_id: int,
+    gsid: int,
+    grid_square_params: GridSquareParameters,
+    grid_square: GridSquare,
+    dcg: DataCollectionGroup,
+    murfey_db: Session,
+):
+    try:
+        smartem_client = _smartem_client(session_id, murfey_db)
+        if smartem_client is not None and dcg.smartem_grid_uuid:
+            secured_grid_square_image_path_full_res: Path | None = None
+            if grid_square_params.image:
+                secured_grid_square_image_path_full_res = secure_path(
+                    Path(grid_square_params.image)
+                )
+                if secured_grid_square_image_path_full_res.with_suffix(
+                    ".tiff"
+                ).is_file():
+                    secured_grid_square_image_path_full_res = (
+                        secured_grid_square_image_path_full_res.with_suffix(".tiff")
+                    )
+                else:
+                    secured_grid_square_image_path_full_res = (
+                        secured_grid_square_image_path_full_res.with_suffix(".mrc")
+                    )
+            gs_data = SmartEMGridSquareData(
+                gridsquare_id=str(gsid),
+                grid_uuid=dcg.smartem_grid_uuid,
+                center_x=(
+                    int(grid_square_params.x_location)
+                    if grid_square_params.x_location is not None
+                    else None
+                ),
+                center_y=(
+                    int(grid_square_params.y_location)
+                    if grid_square_params.y_location is not None
+                    else None
+                ),
+                size_width=grid_square_params.width,
+                size_height=grid_square_params.height,
+                **(
+                    {"uuid": grid_square.smartem_uuid}
+                    if grid_square.smartem_uuid
+                    else {}
+                ),
+                metadata=SmartEMGridSquareMetadata(
+                    atlas_node_id=0,
+                    stage_position=None,
+                    state=None,
+                    rotation=None,
+                    image_path=secured_grid_square_image_path_full_res,
+                    selected=False,
+                    unusable=False,
+                ),
+            )
+            if grid_square.smartem_uuid:
+                smartem_client.update_gridsquare(gs_data)
+            else:
+                response = smartem_client.create_grid_gridsquare(gs_data)
+                grid_square.smartem_uuid = response.uuid
+                murfey_db.add(grid_square)
+                murfey_db.commit()
+    except Exception:
+        logger.warning("Failed to register grid square with smartem", exc_info=True)
+
+
+def register_grid_square(
+    session_id: int,
+    gsid: int,
+    grid_square_params: GridSquareParameters,
+    murfey_db: Session,
+):
+    _scale_grid_square_parameters(grid_square_params)
+    dcg = _find_data_collection_group(session_id, grid_square_params, murfey_db)
+    if dcg is None:
+        logger.warning(
+            f"Grid square {sanitise(str(gsid))} could not be registered as no "
+            "data collection group was found"
+        )
+        return None
     grid_square_query = murfey_db.exec(
         select(GridSquare)
         .where(GridSquare.name == gsid)
@@ -94,169 +275,230 @@ def register_grid_square(
     ).all()
     if grid_square_query:
         # Grid square already exists in the murfey database
-        grid_square = grid_square_query[0]
-        grid_square.x_location = grid_square_params.x_location or grid_square.x_location
-        grid_square.y_location = grid_square_params.y_location or grid_square.y_location
-        grid_square.x_stage_position = (
-            grid_square_params.x_stage_position or grid_square.x_stage_position
-        )
-        grid_square.y_stage_position = (
-            grid_square_params.y_stage_position or grid_square.y_stage_position
-        )
-        grid_square.readout_area_x = (
-            grid_square_params.readout_area_x or grid_square.readout_area_x
-        )
-        grid_square.readout_area_y = (
-            grid_square_params.readout_area_y or grid_square.readout_area_y
-        )
-        grid_square.thumbnail_size_x = (
-            grid_square_params.thumbnail_size_x or grid_square.thumbnail_size_x
-        )
-        grid_square.thumbnail_size_y = (
-            grid_square_params.thumbnail_size_y or grid_square.thumbnail_size_y
-        )
-        grid_square.pixel_size = grid_square_params.pixel_size or grid_square.pixel_size
-        grid_square.image = grid_square_params.image or grid_square.image
-        if _transport_object:
-            _transport_object.do_update_grid_square(grid_square.id, grid_square_params)
+        grid_square = _update_grid_square(grid_square_query[0], grid_square_params)
     else:
         # No existing grid square in the murfey database
-        if _transport_object:
+        if _transport_object and dcg.atlas_id is not None:
             gs_ispyb_response = _transport_object.do_insert_grid_square(
                 dcg.atlas_id, gsid, grid_square_params
             )
         else:
             # mock up response so that below still works
             gs_ispyb_response = {"success": False, "return_value": None}
-        secured_grid_square_image_path = secure_path(Path(grid_square_params.image))
-        if secured_grid_square_image_path and secured_grid_square_image_path.is_file():
-            jpeg_size = Image.open(secured_grid_square_image_path).size
-        else:
-            jpeg_size = (0, 0)
-        grid_square = GridSquare(
-            id=(
-                gs_ispyb_response["return_value"]
-                if gs_ispyb_response["success"]
-                else None
-            ),
-            name=gsid,
-            session_id=session_id,
-            tag=grid_square_params.tag,
-            x_location=grid_square_params.x_location,
-            y_location=grid_square_params.y_location,
-            x_stage_position=grid_square_params.x_stage_position,
-            y_stage_position=grid_square_params.y_stage_position,
-            readout_area_x=grid_square_params.readout_area_x,
-            readout_area_y=grid_square_params.readout_area_y,
-            thumbnail_size_x=grid_square_params.thumbnail_size_x or jpeg_size[0],
-            thumbnail_size_y=grid_square_params.thumbnail_size_y or jpeg_size[1],
-            pixel_size=grid_square_params.pixel_size,
-            image=str(secured_grid_square_image_path),
+        grid_square = _new_grid_square(
+            session_id,
+            gsid,
+            grid_square_params,
+            gs_ispyb_response["return_value"] if gs_ispyb_response["success"] else None,
         )
     murfey_db.add(grid_square)
     murfey_db.commit()
+    _flush_grid_square_updates()
 
     if SMARTEM_ACTIVE:
-        try:
-            murfey_session = murfey_db.exec(
-                select(MurfeySession).where(MurfeySession.id == session_id)
-            ).one()
-            machine_config = get_machine_config(
-                instrument_name=murfey_session.instrument_name
-            )[murfey_session.instrument_name]
-            if machine_config.smartem_api_url:
-                if dcg.smartem_grid_uuid:
-                    secured_grid_square_image_path_full_res: Path | None = None
-                    if grid_square_params.image:
-                        secured_grid_square_image_path_full_res = secure_path(
-                            Path(grid_square_params.image)
-                        )
-                        if secured_grid_square_image_path_full_res.with_suffix(
-                            ".tiff"
-                        ).is_file():
-                            secured_grid_square_image_path_full_res = (
-                                secured_grid_square_image_path_full_res.with_suffix(
-                                    ".tiff"
-                                )
-                            )
-                        else:
-                            secured_grid_square_image_path_full_res = (
-                                secured_grid_square_image_path_full_res.with_suffix(
-                                    ".mrc"
-                                )
-                            )
-                    smartem_client = SmartEMAPIClient(
-                        base_url=machine_config.smartem_api_url,
-                        logger=logger,
-                        keycloak_client=keycloak_client,
-                    )
-                    gs_data = SmartEMGridSquareData(
-                        gridsquare_id=str(gsid),
-                        grid_uuid=dcg.smartem_grid_uuid,
-                        center_x=(
-                            int(grid_square_params.x_location)
-                            if grid_square_params.x_location is not None
-                            else None
-                        ),
-                        center_y=(
-                            int(grid_square_params.y_location)
-                            if grid_square_params.y_location is not None
-                            else None
-                        ),
-                        size_width=grid_square_params.width,
-                        size_height=grid_square_params.height,
-                        **(
-                            {"uuid": grid_square.smartem_uuid}
-                            if grid_square.smartem_uuid
-                            else {}
-                        ),
-                        metadata=SmartEMGridSquareMetadata(
-                            atlas_node_id=0,
-                            stage_position=None,
-                            state=None,
-                            rotation=None,
-                            image_path=secured_grid_square_image_path_full_res,
-                            selected=False,
-                            unusable=False,
-                        ),
-                    )
-                    if grid_square.smartem_uuid:
-                        smartem_client.update_gridsquare(gs_data)
-                    else:
-                        response = smartem_client.create_grid_gridsquare(gs_data)
-                        grid_square.smartem_uuid = response.uuid
-                        murfey_db.add(grid_square)
-                        murfey_db.commit()
-        except Exception:
-            logger.warning("Failed to register grid square with smartem", exc_info=True)
+        _register_grid_square_with_smartem(
+            session_id, gsid, grid_square_params, grid_square, dcg, murfey_db
+        )
 
     murfey_db.close()
 
 
-def register_foil_hole(
+def register_grid_squares(
     session_id: int,
-    gs_name: int,
-    foil_hole_params: FoilHoleParameters,
+    grid_squares: dict[int, GridSquareParameters],
     murfey_db: Session,
-) -> Optional[int]:
+):
+    """
+    Registers a set of grid squares, keyed by name, using a single lookup of the
+    existing grid squares and a single commit to the Murfey database
+    """
+    dcgs: dict[tuple[Optional[int], str], Optional[DataCollectionGroup]] = {}
+    existing_grid_squares = {
+        (grid_square.name, grid_square.tag): grid_square
+        for grid_square in murfey_db.exec(
+            select(GridSquare)
+            .where(GridSquare.session_id == session_id)
+            .where(GridSquare.name.in_(list(grid_squares.keys())))  # type: ignore
+        ).all()
+    }
+    registered: list[
+        tuple[int, GridSquareParameters, GridSquare, DataCollectionGroup]
+    ] = []
+    new_grid_squares: list[tuple[int, GridSquareParameters, DataCollectionGroup]] = []
+    for gsid, grid_square_params in grid_squares.items():
+        _scale_grid_square_parameters(grid_square_params)
+        dcg_key = (grid_square_params.sample, grid_square_params.tag)
+        if dcg_key not in dcgs:
+            dcgs[dcg_key] = _find_data_collection_group(
+                session_id, grid_square_params, murfey_db
+            )
+        if (dcg := dcgs[dcg_key]) is None:
+            logger.warning(
+                f"Grid square {sanitise(str(gsid))} could not be registered as no "
+                "data collection group was found"
+            )
+            continue
+        if (grid_square := existing_grid_squares.get((gsid, dcg.tag))) is not None:
+            grid_square = _update_grid_square(grid_square, grid_square_params)
+            murfey_db.add(grid_square)
+            registered.append((gsid, grid_square_params, grid_square, dcg))
+        else:
+            new_grid_squares.append((gsid, grid_square_params, dcg))
+
+    # Insert all the new grid squares into ISPyB in one transaction, skipping any
+    # whose data collection group has no atlas to insert them against
+    ispyb_ids: list[Optional[int]] = [None] * len(new_grid_squares)
+    inserted: list[int] = []
+    ispyb_inserts: list[tuple[int, int, GridSquareParameters]] = []
+    for i, (gsid, grid_square_params, dcg) in enumerate(new_grid_squares):
+        if dcg.atlas_id is not None:
+            inserted.append(i)
+            ispyb_inserts.append((dcg.atlas_id, gsid, grid_square_params))
+    if _transport_object and ispyb_inserts:
+        gs_ispyb_response = _transport_object.do_insert_grid_squares(ispyb_inserts)
+        if gs_ispyb_response["success"]:
+            for i, ispyb_id in zip(inserted, gs_ispyb_response["return_value"]):
+                ispyb_ids[i] = ispyb_id
+    for (gsid, grid_square_params, dcg), ispyb_id in zip(new_grid_squares, ispyb_ids):
+        grid_square = _new_grid_square(session_id, gsid, grid_square_params, ispyb_id)
+        murfey_db.add(grid_square)
+        registered.append((gsid, grid_square_params, grid_square, dcg))
+    murfey_db.commit()
+    _flush_grid_square_updates()
+
+    if SMARTEM_ACTIVE:
+        for gsid, grid_square_params, grid_square, dcg in registered:
+            _register_grid_square_with_smartem(
+                session_id, gsid, grid_square_params, grid_square, dcg, murfey_db
+            )
+
+    murfey_db.close()
+
+
+def _foil_hole_jpeg_size(foil_hole_params: FoilHoleParameters) -> tuple[int, int]:
+    secured_foil_hole_image_path = secure_path(Path(foil_hole_params.image))
+    if foil_hole_params.image and secured_foil_hole_image_path.is_file():
+        with Image.open(secured_foil_hole_image_path) as image:
+            generate_thumbnails(secured_foil_hole_image_path, image)
+            return image.size
+    return (0, 0)
+
+
+def _smartem_foil_hole_data(
+    gs: GridSquare,
+    foil_hole_params: FoilHoleParameters,
+    foil_hole: Optional[FoilHole],
+):
+    return SmartEMFoilHoleData(
+        id=str(foil_hole_params.name),
+        gridsquare_id=str(gs.name),
+        gridsquare_uuid=gs.smartem_uuid,
+        x_location=(
+            int(foil_hole_params.x_location)
+            if foil_hole_params.x_location is not None
+            else None
+        ),
+        y_location=(
+            int(foil_hole_params.y_location)
+            if foil_hole_params.y_location is not None
+            else None
+        ),
+        x_stage_position=foil_hole_params.x_stage_position,
+        y_stage_position=foil_hole_params.y_stage_position,
+        diameter=(
+            int(foil_hole_params.diameter)
+            if foil_hole_params.diameter is not None
+            else None
+        ),
+        **(
+            {"uuid": foil_hole.smartem_uuid}
+            if foil_hole and foil_hole.smartem_uuid
+            else {}
+        ),
+    )
+
+
+def _update_foil_hole(
+    foil_hole: FoilHole,
+    foil_hole_params: FoilHoleParameters,
+    jpeg_size: tuple[int, int],
+):
+    foil_hole.x_location = foil_hole_params.x_location or foil_hole.x_location
+    foil_hole.y_location = foil_hole_params.y_location or foil_hole.y_location
+    foil_hole.x_stage_position = (
+        foil_hole_params.x_stage_position or foil_hole.x_stage_position
+    )
+    foil_hole.y_stage_position = (
+        foil_hole_params.y_stage_position or foil_hole.y_stage_position
+    )
+    foil_hole.readout_area_x = (
+        foil_hole_params.readout_area_x or foil_hole.readout_area_x
+    )
+    foil_hole.readout_area_y = (
+        foil_hole_params.readout_area_y or foil_hole.readout_area_y
+    )
+    foil_hole.thumbnail_size_x = (
+        foil_hole_params.thumbnail_size_x or foil_hole.thumbnail_size_x
+    ) or jpeg_size[0]
+    foil_hole.thumbnail_size_y = (
+        foil_hole_params.thumbnail_size_y or foil_hole.thumbnail_size_y
+    ) or jpeg_size[1]
+    foil_hole.pixel_size = foil_hole_params.pixel_size or foil_hole.pixel_size
+
+
+def _new_foil_hole(
+    session_id: int,
+    gsid: int,
+    foil_hole_params: FoilHoleParameters,
+    jpeg_size: tuple[int, int],
+    ispyb_id: Optional[int],
+) -> FoilHole:
+    return FoilHole(
+        id=ispyb_id,
+        name=foil_hole_params.name,
+        session_id=session_id,
+        grid_square_id=gsid,
+        x_location=foil_hole_params.x_location,
+        y_location=foil_hole_params.y_location,
+        x_stage_position=foil_hole_params.x_stage_position,
+        y_stage_position=foil_hole_params.y_stage_position,
+        readout_area_x=foil_hole_params.readout_area_x,
+        readout_area_y=foil_hole_params.readout_area_y,
+        thumbnail_size_x=foil_hole_params.thumbnail_size_x or jpeg_size[0],
+        thumbnail_size_y=foil_hole_params.thumbnail_size_y or jpeg_size[1],
+        pixel_size=foil_hole_params.pixel_size,
+        image=str(secure_path(Path(foil_hole_params.image))),
+    )
+
+
+def _find_grid_square(
+    session_id: int, gs_name: int, tag: str, murfey_db: Session
+) -> Optional[GridSquare]:
     try:
-        gs = murfey_db.exec(
+        return murfey_db.exec(
             select(GridSquare)
-            .where(GridSquare.tag == foil_hole_params.tag)
+            .where(GridSquare.tag == tag)
             .where(GridSquare.session_id == session_id)
             .where(GridSquare.name == gs_name)
         ).one()
-        gsid = gs.id
     except NoResultFound:
+        return None
+
+
+def register_foil_hole(
+    session_id: int,
+    gs_name: int,
+    foil_hole_params: FoilHoleParameters,
+    murfey_db: Session,
+) -> Optional[int]:
+    gs = _find_grid_square(session_id, gs_name, foil_hole_params.tag, murfey_db)
+    if gs is None or gs.id is None:
         logger.warning(
             f"Foil hole {sanitise(str(foil_hole_params.name))} could not be registered as grid square {sanitise(str(gs_name))} was not found"
         )
         return None
-    secured_foil_hole_image_path = secure_path(Path(foil_hole_params.image))
-    if foil_hole_params.image and secured_foil_hole_image_path.is_file():
-        jpeg_size = Image.open(secured_foil_hole_image_path).size
-    else:
-        jpeg_size = (0, 0)
+    gsid = gs.id
+    jpeg_size = _foil_hole_jpeg_size(foil_hole_params)
     foil_hole_query = murfey_db.exec(
         select(FoilHole)
         .where(FoilHole.name == foil_hole_params.name)
@@ -269,44 +511,12 @@ def register_foil_hole(
     # do this first as the data gets mutated by the ispyb insert function
     if SMARTEM_ACTIVE and gs.smartem_uuid:
         try:
-            murfey_session = murfey_db.exec(
-                select(MurfeySession).where(MurfeySession.id == session_id)
-            ).one()
-            machine_config = get_machine_config(
-                instrument_name=murfey_session.instrument_name
-            )[murfey_session.instrument_name]
-            if machine_config.smartem_api_url:
-                smartem_client = SmartEMAPIClient(
-                    base_url=machine_config.smartem_api_url,
-                    logger=logger,
-                    keycloak_client=keycloak_client,
-                )
-                fh_data = SmartEMFoilHoleData(
-                    id=str(foil_hole_params.name),
-                    gridsquare_id=str(gs.name),
-                    gridsquare_uuid=gs.smartem_uuid,
-                    x_location=(
-                        int(foil_hole_params.x_location)
-                        if foil_hole_params.x_location is not None
-                        else None
-                    ),
-                    y_location=(
-                        int(foil_hole_params.y_location)
-                        if foil_hole_params.y_location is not None
-                        else None
-                    ),
-                    x_stage_position=foil_hole_params.x_stage_position,
-                    y_stage_position=foil_hole_params.y_stage_position,
-                    diameter=(
-                        int(foil_hole_params.diameter)
-                        if foil_hole_params.diameter is not None
-                        else None
-                    ),
-                    **(
-                        {"uuid": foil_hole_query[0].smartem_uuid}
-                        if foil_hole_query and foil_hole_query[0].smartem_uuid
-                        else {}
-                    ),
+            smartem_client = _smartem_client(session_id, murfey_db)
+            if smartem_client is not None:
+                fh_data = _smartem_foil_hole_data(
+                    gs,
+                    foil_hole_params,
+                    foil_hole_query[0] if foil_hole_query else None,
                 )
                 if foil_hole_query and foil_hole_query[0].smartem_uuid:
                     smartem_client.update_foilhole(fh_data)
@@ -323,27 +533,7 @@ def register_foil_hole(
     if foil_hole_query:
         # Foil hole already exists in the murfey database
         foil_hole = foil_hole_query[0]
-        foil_hole.x_location = foil_hole_params.x_location or foil_hole.x_location
-        foil_hole.y_location = foil_hole_params.y_location or foil_hole.y_location
-        foil_hole.x_stage_position = (
-            foil_hole_params.x_stage_position or foil_hole.x_stage_position
-        )
-        foil_hole.y_stage_position = (
-            foil_hole_params.y_stage_position or foil_hole.y_stage_position
-        )
-        foil_hole.readout_area_x = (
-            foil_hole_params.readout_area_x or foil_hole.readout_area_x
-        )
-        foil_hole.readout_area_y = (
-            foil_hole_params.readout_area_y or foil_hole.readout_area_y
-        )
-        foil_hole.thumbnail_size_x = (
-            foil_hole_params.thumbnail_size_x or foil_hole.thumbnail_size_x
-        ) or jpeg_size[0]
-        foil_hole.thumbnail_size_y = (
-            foil_hole_params.thumbnail_size_y or foil_hole.thumbnail_size_y
-        ) or jpeg_size[1]
-        foil_hole.pixel_size = foil_hole_params.pixel_size or foil_hole.pixel_size
+        _update_foil_hole(foil_hole, foil_hole_params, jpeg_size)
         if _transport_object and gs.readout_area_x:
             _transport_object.do_update_foil_hole(
                 foil_hole.id, gs.thumbnail_size_x / gs.readout_area_x, foil_hole_params
@@ -358,25 +548,12 @@ def register_foil_hole(
             )
         else:
             fh_ispyb_response = {"success": False, "return_value": None}
-        foil_hole = FoilHole(
-            id=(
-                fh_ispyb_response["return_value"]
-                if fh_ispyb_response["success"]
-                else None
-            ),
-            name=foil_hole_params.name,
-            session_id=session_id,
-            grid_square_id=gsid,
-            x_location=foil_hole_params.x_location,
-            y_location=foil_hole_params.y_location,
-            x_stage_position=foil_hole_params.x_stage_position,
-            y_stage_position=foil_hole_params.y_stage_position,
-            readout_area_x=foil_hole_params.readout_area_x,
-            readout_area_y=foil_hole_params.readout_area_y,
-            thumbnail_size_x=foil_hole_params.thumbnail_size_x or jpeg_size[0],
-            thumbnail_size_y=foil_hole_params.thumbnail_size_y or jpeg_size[1],
-            pixel_size=foil_hole_params.pixel_size,
-            image=str(secured_foil_hole_image_path),
+        foil_hole = _new_foil_hole(
+            session_id,
+            gsid,
+            foil_hole_params,
+            jpeg_size,
+            fh_ispyb_response["return_value"] if fh_ispyb_response["success"] else None,
         )
     fh_id = foil_hole.id
     foil_hole.smartem_uuid = fh_smartem_uuid
@@ -387,6 +564,116 @@ def register_foil_hole(
     return fh_id
 
 
+def register_foil_holes(
+    session_id: int,
+    gs_name: int,
+    foil_hole_params_list: list[FoilHoleParameters],
+    murfey_db: Session,
+) -> list[Optional[int]]:
+    """
+    Registers all the foil holes of a grid square at once. The existing foil holes
+    are looked up in one query, new foil holes are inserted into ISPyB in a single
+    transaction, and the Murfey database is committed once. Returns the foil hole
+    IDs in the same order as the parameters.
+    """
+    if not foil_hole_params_list:
+        return []
+    # Keep only the latest parameters for each foil hole
+    foil_hole_params_dict = {params.name: params for params in foil_hole_params_list}
+    gs = _find_grid_square(session_id, gs_name, foil_hole_params_list[0].tag, murfey_db)
+    if gs is None or gs.id is None:
+        logger.warning(
+            f"{len(foil_hole_params_dict)} foil holes could not be registered as grid square {sanitise(str(gs_name))} was not found"
+        )
+        return [None] * len(foil_hole_params_list)
+    existing_foil_holes = {
+        foil_hole.name: foil_hole
+        for foil_hole in murfey_db.exec(
+            select(FoilHole)
+            .where(FoilHole.grid_square_id == gs.id)
+            .where(FoilHole.session_id == session_id)
+            .where(FoilHole.name.in_(list(foil_hole_params_dict.keys())))  # type: ignore
+        ).all()
+    }
+
+    fh_smartem_uuids: dict[int, Optional[str]] = {}
+
+    # do this first as the data gets mutated by the ispyb insert function
+    if SMARTEM_ACTIVE and gs.smartem_uuid:
+        try:
+            smartem_client = _smartem_client(session_id, murfey_db)
+            if smartem_client is not None:
+                new_fh_data = []
+                for name, foil_hole_params in foil_hole_params_dict.items():
+                    existing_foil_hole = existing_foil_holes.get(name)
+                    fh_data = _smartem_foil_hole_data(
+                        gs, foil_hole_params, existing_foil_hole
+                    )
+                    if existing_foil_hole and existing_foil_hole.smartem_uuid:
+                        smartem_client.update_foilhole(fh_data)
+                        fh_smartem_uuids[name] = existing_foil_hole.smartem_uuid
+                    else:
+                        new_fh_data.append((name, fh_data))
+                if new_fh_data:
+                    responses = smartem_client.create_gridsquare_foilholes(
+                        gs.smartem_uuid, [fh_data for _, fh_data in new_fh_data]
+                    )
+                    for (name, _), response in zip(new_fh_data, responses or []):
+                        fh_smartem_uuids[name] = response.uuid
+        except Exception:
+            logger.warning("Failed to register foil holes with smartem", exc_info=True)
+
+    scale_factor = (
+        gs.thumbnail_size_x / gs.readout_area_x
+        if gs.thumbnail_size_x and gs.readout_area_x
+        else None
+    )
+    new_foil_hole_params = [
+        foil_hole_params
+        for name, foil_hole_params in foil_hole_params_dict.items()
+        if name not in existing_foil_holes
+    ]
+    ispyb_ids: dict[int, Optional[int]] = {}
+    if _transport_object:
+        if new_foil_hole_params:
+            fh_ispyb_response = _transport_object.do_insert_foil_holes(
+                gs.id, scale_factor, new_foil_hole_params
+            )
+            if fh_ispyb_response["success"]:
+                ispyb_ids = dict(
+                    zip(
+                        [params.name for params in new_foil_hole_params],
+                        fh_ispyb_response["return_value"],
+                    )
+                )
+        foil_hole_updates = [
+            (foil_hole_id, foil_hole_params)
+            for name, foil_hole_params in foil_hole_params_dict.items()
+            if name in existing_foil_holes
+            and (foil_hole_id := existing_foil_holes[name].id) is not None
+        ]
+        if foil_hole_updates and scale_factor:
+            _transport_object.do_update_foil_holes(scale_factor, foil_hole_updates)
+
+    foil_holes: dict[int, FoilHole] = {}
+    for name, foil_hole_params in foil_hole_params_dict.items():
+        jpeg_size = _foil_hole_jpeg_size(foil_hole_params)
+        if (foil_hole := existing_foil_holes.get(name)) is not None:
+            _update_foil_hole(foil_hole, foil_hole_params, jpeg_size)
+        else:
+            foil_hole = _new_foil_hole(
+                session_id, gs.id, foil_hole_params, jpeg_size, ispyb_ids.get(name)
+            )
+        foil_hole.smartem_uuid = fh_smartem_uuids.get(name)
+        foil_holes[name] = foil_hole
+    fh_ids = {name: foil_hole.id for name, foil_hole in foil_holes.items()}
+    murfey_db.add_all(list(foil_holes.values()))
+    murfey_db.commit()
+
+    murfey_db.close()
+    return [fh_ids[params.name] for params in foil_hole_params_list]
+
+
 def _grid_square_metadata_file(f: Path, grid_square: int) -> Optional[Path]:
     """Search through metadata directories to find the required grid square dm"""
     raw_dir = f.parent.parent.parent
@@ -3,8 +3,7 @@ from logging import getLogger
 from pathlib import Path
 from typing import List
 
-import numpy as np
-from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlmodel import Session, select
 
 import murfey.server.prometheus as prom
@@ -13,7 +12,7 @@ from murfey.server.feedback import (
     _app_id,
     _pj_id,
 )
-from murfey.util.config import get_machine_config
+from murfey.util.config import get_machine_config, get_security_config
 from murfey.util.db import (
     AutoProcProgram,
     ClassificationFeedbackParameters,
@@ -23,11 +22,13 @@ from murfey.util.db import (
     NotificationParameter,
     NotificationValue,
     ParticleSizes,
+    ParticleSizeSketch,
     ProcessingJob,
     Session as MurfeySession,
     SPARelionParameters,
 )
 from murfey.util.processing_params import default_spa_parameters
+from murfey.util.quantile_sketch import QuantileSketch
 
 logger = getLogger("murfey.workflows.spa.picking")
 
@@ -47,6 +48,40 @@ except ImportError:
     SMARTEM_ACTIVE = False
 
 
+def _get_particle_size_sketch(pj_id: int, _db: Session) -> ParticleSizeSketch:
+    """
+    Returns the particle size summary of the processing job, creating it from any
+    individually stored particle sizes if it does not exist yet. The summary is locked
+    until the end of the transaction, so that concurrent updates to it from other
+    messages for the same processing job aren't lost.
+    """
+    if (
+        sketch_entry := _db.get(
+            ParticleSizeSketch, pj_id, with_for_update=True, populate_existing=True
+        )
+    ) is not None:
+        return sketch_entry
+    sketch = QuantileSketch()
+    sketch.update_many(
+        _db.exec(
+            select(ParticleSizes.particle_size).where(ParticleSizes.pj_id == pj_id)
+        ).all()
+    )
+    # Leaves the summary alone if another message for the same processing job
+    # created it in the meantime
+    insert = (
+        sqlite.insert if _db.get_bind().dialect.name == "sqlite" else postgresql.insert
+    )
+    _db.execute(
+        insert(ParticleSizeSketch)
+        .values(pj_id=pj_id, count=sketch.count, sketch=sketch.to_bytes())
+        .on_conflict_do_nothing(index_elements=["pj_id"])
+    )
+    return _db.get_one(
+        ParticleSizeSketch, pj_id, with_for_update=True, populate_existing=True
+    )
+
+
 def _register_picked_particles_use_diameter(message: dict, _db: Session):
     """Received picked particles from the autopick service"""
     # Add this message to the table of seen messages
@@ -69,10 +104,8 @@ def _register_picked_particles_use_diameter(message: dict, _db: Session):
     _db.commit()
     _db.close()
 
-    picking_db_len = _db.exec(
-        select(func.count(ParticleSizes.id)).where(ParticleSizes.pj_id == pj_id)
-    ).one()
-    if picking_db_len > default_spa_parameters.nr_picks_before_diameter:
+    sketch_entry = _get_particle_size_sketch(pj_id, _db)
+    if sketch_entry.count > default_spa_parameters.nr_picks_before_diameter:
         # If there are enough particles to get a diameter
         instrument_name = (
             _db.exec(
@@ -92,10 +125,8 @@ def _register_picked_particles_use_diameter(message: dict, _db: Session):
 
         if not particle_diameter:
             # If the diameter has not been calculated then find it
-            picking_db = _db.exec(
-                select(ParticleSizes.particle_size).where(ParticleSizes.pj_id == pj_id)
-            ).all()
-            particle_diameter = float(np.quantile(list(picking_db), 0.75))
+            sketch = QuantileSketch.from_bytes(sketch_entry.sketch)
+            particle_diameter = sketch.quantile(0.75)
             relion_params.particle_diameter = particle_diameter
             _db.add(relion_params)
             _db.commit()
@@ -186,10 +217,18 @@ def _register_picked_particles_use_diameter(message: dict, _db: Session):
         # If not enough particles then save the new sizes
         particle_list = message.get("particle_diameters")
         assert isinstance(particle_list, list)
-        for particle in particle_list:
-            new_particle = ParticleSizes(pj_id=pj_id, particle_size=particle)
-            _db.add(new_particle)
-            _db.commit()
+        sketch = QuantileSketch.from_bytes(sketch_entry.sketch)
+        sketch.update_many(particle_list)
+        sketch_entry.count = sketch.count
+        sketch_entry.sketch = sketch.to_bytes()
+        _db.add(sketch_entry)
+        if get_security_config().particle_sizes_raw_rows:
+            # Inserted together in one statement on flush
+            _db.add_all(
+                ParticleSizes(pj_id=pj_id, particle_size=particle)
+                for particle in particle_list
+            )
+        _db.commit()
     _db.close()
 
 
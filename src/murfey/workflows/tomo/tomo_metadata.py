@@ -1,7 +1,10 @@
 import logging
+from functools import lru_cache
 from importlib.metadata import entry_points
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
+from numpy.typing import ArrayLike
 from sqlmodel import Session, select
 
 from murfey.server import _transport_object
@@ -41,6 +44,7 @@ def register_search_map_in_database(
     if search_map_query:
         # See if there is already a search map with this name and update if so
         search_map = search_map_query[0]
+        previous_transform = search_map_transform(search_map)
         search_map.lamella = search_map_params.lamella or search_map.lamella
         search_map.x_stage_position = (
             search_map_params.x_stage_position or search_map.x_stage_position
@@ -101,10 +105,14 @@ def register_search_map_in_database(
         )
         search_map.height = search_map_params.height or search_map.height
         search_map.width = search_map_params.width or search_map.width
-        if _transport_object:
-            _transport_object.do_update_search_map(search_map.id, search_map_params)
+        # Written to ISPyB along with the position, if it can be worked out
+        update_ispyb = True
+        # Batch positions placed on the search map before it changed need moving
+        if search_map_transform(search_map) is not previous_transform:
+            _reproject_tilt_series(search_map, murfey_db)
     else:
         logger.info(f"Registering new search map {sanitise(search_map_name)}")
+        update_ispyb = False
         if _transport_object:
             sm_ispyb_response = _transport_object.do_insert_search_map(
                 dcg.atlas_id, search_map_params
@@ -232,8 +240,7 @@ def register_search_map_in_database(
         )
         search_map.x_location = search_map_params.x_location
         search_map.y_location = search_map_params.y_location
-        if _transport_object:
-            _transport_object.do_update_search_map(search_map.id, search_map_params)
+        update_ispyb = True
     else:
         logger.info(
             f"Unable to register search map {sanitise(search_map_name)} position yet: "
@@ -241,6 +248,14 @@ def register_search_map_in_database(
             f"width {sanitise(str(search_map_params.width))}, "
             f"atlas pixel size {sanitise(str(dcg.atlas_pixel_size))}"
         )
+    if _transport_object and update_ispyb and search_map.id is not None:
+        sm_ispyb_response = _transport_object.do_update_search_maps(
+            [(search_map.id, search_map_params)]
+        )
+        if not sm_ispyb_response["success"]:
+            logger.error(
+                f"Failed to update search map {sanitise(search_map_name)} in ISPyB"
+            )
     murfey_db.add(search_map)
     murfey_db.commit()
 
@@ -259,41 +274,71 @@ def register_search_map_in_database(
         murfey_db.close()
 
 
-def register_batch_position_in_database(
-    session_id: MurfeySessionID,
-    batch_name: str,
-    batch_parameters: BatchPositionParameters,
-    murfey_db: Session,
-):
-    search_map = murfey_db.exec(
-        select(SearchMap)
-        .where(SearchMap.name == batch_parameters.search_map_name)
-        .where(SearchMap.tag == batch_parameters.tag)
-        .where(SearchMap.session_id == session_id)
-    ).one()
+class SearchMapTransform:
+    """
+    Projection of stage positions onto a search map, giving locations scaled to a
+    search map image 512 pixels wide. The matrices of the search map are combined
+    when the transform is made, so any number of positions can then be projected
+    with a single matrix product.
+    """
 
-    try:
-        tilt_series = murfey_db.exec(
-            select(TiltSeries)
-            .where(TiltSeries.tag == batch_name)
-            .where(TiltSeries.rsync_source == batch_parameters.tag)
-            .where(TiltSeries.session_id == session_id)
-        ).one()
-        if tilt_series.x_location:
-            logger.info(
-                f"Already did position analysis for tomogram {sanitise(batch_name)}"
-            )
-            return
-    except Exception:
-        tilt_series = TiltSeries(
-            tag=batch_name,
-            rsync_source=batch_parameters.tag,
-            session_id=session_id,
-            search_map_id=search_map.id,
+    def __init__(
+        self,
+        reference_matrix: Tuple[float, float, float, float],
+        stage_correction: Tuple[float, float, float, float],
+        image_shift_correction: Tuple[float, float, float, float],
+        stage_position: Tuple[float, float],
+        pixel_size: float,
+        width: int,
+        height: int,
+    ):
+        reference_shift_matrix = np.array(reference_matrix).reshape(2, 2)
+        stage_correction_matrix = np.array(stage_correction).reshape(2, 2)
+        image_shift_matrix = np.array(image_shift_correction).reshape(2, 2)
+        # Apply stage corrections to the location, then invert the y coordinate
+        self._matrix = np.matmul(
+            [[1, 0], [0, -1]],
+            np.matmul(
+                np.linalg.inv(reference_shift_matrix),
+                np.matmul(
+                    np.linalg.inv(stage_correction_matrix),
+                    np.matmul(
+                        np.linalg.inv(image_shift_matrix), reference_shift_matrix
+                    ),
+                ),
+            ),
         )
+        self._stage_position = np.array(stage_position)
+        self._pixel_size = pixel_size
+        self._centre = np.array([width / 2, height / 2])
+        self._scale = 512 / width
 
-    # Get the pixel location on the searchmap
-    if all(
+    def project(self, stage_positions: ArrayLike, beamshifts: ArrayLike) -> np.ndarray:
+        """
+        Finds the locations on the search map of (N, 2) arrays or nested lists of stage
+        positions, each with a beamshift applied
+        """
+        stage_vectors = np.asarray(stage_positions, dtype=float) - self._stage_position
+        # Apply shift from centre
+        centre_batch_pixels = (
+            np.matmul(stage_vectors, self._matrix.T) / self._pixel_size + self._centre
+        )
+        beamshift_pixels = np.asarray(beamshifts, dtype=float) / self._pixel_size
+        return (centre_batch_pixels + beamshift_pixels * [-1, 1]) * self._scale
+
+
+@lru_cache(maxsize=256)
+def _search_map_transform(*args) -> SearchMapTransform:
+    return SearchMapTransform(*args)
+
+
+def search_map_transform(search_map: SearchMap) -> Optional[SearchMapTransform]:
+    """
+    Returns the transform for placing batch positions on a search map, or None if
+    the search map does not have the information needed yet. Search maps with the
+    same matrices, position and dimensions share the same transform.
+    """
+    if not all(
         [
             search_map.reference_matrix_m11,
             search_map.stage_correction_m11,
@@ -304,89 +349,157 @@ def register_batch_position_in_database(
             search_map.width,
         ]
     ):
-        reference_shift_matrix = np.array(
-            [
-                [
-                    search_map.reference_matrix_m11,
-                    search_map.reference_matrix_m12,
-                ],
-                [
-                    search_map.reference_matrix_m21,
-                    search_map.reference_matrix_m22,
-                ],
-            ]
-        )
-        stage_correction_matrix = np.array(
-            [
-                [
-                    search_map.stage_correction_m11,
-                    search_map.stage_correction_m12,
-                ],
-                [
-                    search_map.stage_correction_m21,
-                    search_map.stage_correction_m22,
-                ],
-            ]
-        )
-        image_shift_matrix = np.array(
-            [
-                [
-                    search_map.image_shift_correction_m11,
-                    search_map.image_shift_correction_m12,
-                ],
-                [
-                    search_map.image_shift_correction_m21,
-                    search_map.image_shift_correction_m22,
-                ],
-            ]
-        )
+        return None
+    return _search_map_transform(
+        (
+            search_map.reference_matrix_m11,
+            search_map.reference_matrix_m12,
+            search_map.reference_matrix_m21,
+            search_map.reference_matrix_m22,
+        ),
+        (
+            search_map.stage_correction_m11,
+            search_map.stage_correction_m12,
+            search_map.stage_correction_m21,
+            search_map.stage_correction_m22,
+        ),
+        (
+            search_map.image_shift_correction_m11,
+            search_map.image_shift_correction_m12,
+            search_map.image_shift_correction_m21,
+            search_map.image_shift_correction_m22,
+        ),
+        (search_map.x_stage_position, search_map.y_stage_position),
+        search_map.pixel_size,
+        search_map.width,
+        search_map.height,
+    )
 
-        stage_vector = np.array(
-            [
-                batch_parameters.x_stage_position - search_map.x_stage_position,
-                batch_parameters.y_stage_position - search_map.y_stage_position,
-            ]
-        )
 
-        # Apply stage corrections to the location
-        corrected_vector = np.matmul(
-            np.linalg.inv(reference_shift_matrix),
-            np.matmul(
-                np.linalg.inv(stage_correction_matrix),
-                np.matmul(
-                    np.linalg.inv(image_shift_matrix),
-                    np.matmul(reference_shift_matrix, stage_vector),
-                ),
-            ),
-        )
-        # Invert y coordinate
-        inverted_corrected_vector = np.matmul([[1, 0], [0, -1]], corrected_vector)
-        # Apply shift from centre
-        centre_batch_pixel = inverted_corrected_vector / search_map.pixel_size + [
-            search_map.width / 2,
-            search_map.height / 2,
-        ]
-        tilt_series.x_location = float(
-            (
-                centre_batch_pixel[0]
-                - batch_parameters.x_beamshift / search_map.pixel_size
-            )
-            * 512
-            / search_map.width
+def _project_tilt_series(
+    transform: SearchMapTransform, tilt_series_list: List[TiltSeries]
+):
+    locations = transform.project(
+        np.array(
+            [[ts.x_stage_position, ts.y_stage_position] for ts in tilt_series_list],
+            dtype=float,
+        ),
+        np.array(
+            [[ts.x_beamshift or 0, ts.y_beamshift or 0] for ts in tilt_series_list],
+            dtype=float,
+        ),
+    )
+    for tilt_series, (x_location, y_location) in zip(
+        tilt_series_list, locations.tolist()
+    ):
+        tilt_series.x_location = x_location
+        tilt_series.y_location = y_location
+
+
+def _reproject_tilt_series(search_map: SearchMap, murfey_db: Session):
+    """
+    Places all the tilt series on a search map again, for when the search map has
+    changed. Tilt series registered without their stage positions are left as they
+    are.
+    """
+    transform = search_map_transform(search_map)
+    if transform is None or search_map.id is None:
+        return
+    tilt_series_list = list(
+        murfey_db.exec(
+            select(TiltSeries)
+            .where(TiltSeries.search_map_id == search_map.id)
+            .where(TiltSeries.x_stage_position.is_not(None))  # type: ignore
+            .where(TiltSeries.y_stage_position.is_not(None))  # type: ignore
+        ).all()
+    )
+    if tilt_series_list:
+        logger.info(
+            f"Updating the positions of {len(tilt_series_list)} tilt series on "
+            f"search map {sanitise(search_map.name)}"
         )
-        tilt_series.y_location = float(
-            (
-                centre_batch_pixel[1]
-                + batch_parameters.y_beamshift / search_map.pixel_size
+        _project_tilt_series(transform, tilt_series_list)
+        murfey_db.add_all(tilt_series_list)
+
+
+def register_batch_positions_in_database(
+    session_id: MurfeySessionID,
+    batch_positions: Dict[str, BatchPositionParameters],
+    murfey_db: Session,
+):
+    """
+    Registers the positions of a set of batch positions on their search maps. Each
+    search map and its tilt series are looked up in one query each, the positions on
+    a search map are all projected at once, and the database is committed once.
+    """
+    positions_by_search_map: Dict[Tuple[str, str], Dict[str, BatchPositionParameters]]
+    positions_by_search_map = {}
+    for batch_name, batch_parameters in batch_positions.items():
+        positions_by_search_map.setdefault(
+            (batch_parameters.tag, batch_parameters.search_map_name), {}
+        )[batch_name] = batch_parameters
+
+    for (tag, search_map_name), positions in positions_by_search_map.items():
+        search_map = murfey_db.exec(
+            select(SearchMap)
+            .where(SearchMap.name == search_map_name)
+            .where(SearchMap.tag == tag)
+            .where(SearchMap.session_id == session_id)
+        ).one()
+        existing_tilt_series = {
+            tilt_series.tag: tilt_series
+            for tilt_series in murfey_db.exec(
+                select(TiltSeries)
+                .where(TiltSeries.tag.in_(list(positions.keys())))  # type: ignore
+                .where(TiltSeries.rsync_source == tag)
+                .where(TiltSeries.session_id == session_id)
+            ).all()
+        }
+
+        tilt_series_list = []
+        for batch_name, batch_parameters in positions.items():
+            tilt_series = existing_tilt_series.get(batch_name)
+            if tilt_series is None:
+                tilt_series = TiltSeries(
+                    tag=batch_name,
+                    rsync_source=tag,
+                    session_id=session_id,
+                    search_map_id=search_map.id,
+                )
+            elif tilt_series.x_location:
+                logger.info(
+                    f"Already did position analysis for tomogram {sanitise(batch_name)}"
+                )
+                continue
+            tilt_series.search_map_id = tilt_series.search_map_id or search_map.id
+            tilt_series.x_stage_position = batch_parameters.x_stage_position
+            tilt_series.y_stage_position = batch_parameters.y_stage_position
+            tilt_series.x_beamshift = batch_parameters.x_beamshift
+            tilt_series.y_beamshift = batch_parameters.y_beamshift
+            tilt_series_list.append(tilt_series)
+        if not tilt_series_list:
+            continue
+
+        # Get the pixel locations on the searchmap
+        if (transform := search_map_transform(search_map)) is not None:
+            _project_tilt_series(transform, tilt_series_list)
+        else:
+            logger.warning(
+                f"Incomplete search map {sanitise(search_map_name)} for positions of "
+                f"{len(tilt_series_list)} tilt series: "
+                f"stage {search_map.x_stage_position}, "
+                f"width {search_map.width}, "
             )
-            * 512
-            / search_map.width
-        )
-    else:
-        logger.warning(
-            f"Incomplete search map for position of {sanitise(batch_name)}: "
-            f"stage {search_map.x_stage_position}, "
-            f"width {search_map.width}, "
-        )
-    murfey_db.add(tilt_series)
+        murfey_db.add_all(tilt_series_list)
     murfey_db.commit()
+
+
+def register_batch_position_in_database(
+    session_id: MurfeySessionID,
+    batch_name: str,
+    batch_parameters: BatchPositionParameters,
+    murfey_db: Session,
+):
+    register_batch_positions_in_database(
+        session_id, {batch_name: batch_parameters}, murfey_db
+    )
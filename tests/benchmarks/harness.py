@@ -0,0 +1,555 @@
+"""
+Harness for measuring how quickly the client pipeline keeps up with an acquisition.
+
+An acquisition profile writes files into a temporary directory at a set rate, which
+are picked up by the real MultigridDirWatcher, DirWatcher, RSyncer and Analyser
+chain, as set up by the instrument server. Files are copied with a local-to-local
+rsync when it is installed, and otherwise passed through by the RSyncer without
+being copied.
+
+The client's requests are answered by the real Murfey server, run in a separate
+process as it is for the load test (see murfey.cli.loadtest), with an SQLite
+database, and with its message broker and ISPyB connections stood in for. Each
+request is recorded against the endpoint it is for, and a file counts as registered
+once the server has accepted a request that names it.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import math
+import multiprocessing
+import re
+import resource
+import shutil
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import partial
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Callable, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from murfey.client.analyser import Analyser
+from murfey.client.multigrid_control import MultigridController
+from murfey.client.rsync import RSyncer
+from murfey.client.watchdir import DirWatcher
+from murfey.client.watchdir_multigrid import MultigridDirWatcher
+from murfey.util.api import load_route_manifest, url_path_for
+from murfey.util.config import MachineConfig
+
+logger = logging.getLogger("tests.benchmarks.harness")
+
+INSTRUMENT_NAME = "m12"
+VISIT = "cm12345-1"
+
+
+# Acquisition profiles --------------------------------------------------------------
+@dataclass
+class AcquisitionProfile:
+    """
+    Writes the files of each step of an acquisition into a grid directory, and
+    returns the paths of the files written
+    """
+
+    name: str
+    grid_directory: str
+    write_step: Callable[[Path, int], list[Path]]
+
+
+def _write(path: Path, content: bytes | str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(content, str):
+        path.write_text(content)
+    else:
+        path.write_bytes(content)
+    return path
+
+
+_MOVIE = bytes(64 * 1024)
+
+
+def _spa_step(grid: Path, step: int) -> list[Path]:
+    # A new grid square every 20 foil holes, each with its metadata
+    square = 1000 + step // 20
+    files = []
+    if step % 20 == 0:
+        files.append(
+            _write(
+                grid / "Metadata" / f"GridSquare_{square}.dm",
+                f"<GridSquare><Id>{square}</Id></GridSquare>",
+            )
+        )
+    data = grid / "Images-Disc1" / f"GridSquare_{square}" / "Data"
+    name = f"FoilHole_{2000 + step}_Data_{3000 + step}_{step}_20260101_120000"
+    files.append(
+        _write(
+            data / f"{name}.xml",
+            "<MicroscopeImage><microscopeData><acquisition><camera>"
+            "<ExposureTime>1.5</ExposureTime></camera></acquisition>"
+            "</microscopeData></MicroscopeImage>",
+        )
+    )
+    files.append(_write(data / f"{name}_fractions.tiff", _MOVIE))
+    return files
+
+
+def _tomo_step(grid: Path, step: int) -> list[Path]:
+    # Tilt series of 41 tilts each, with the mdoc updated after every tilt
+    position, tilt = divmod(step, 41)
+    angle = -60 + 3 * tilt
+    movie = _write(
+        grid / f"Position_{position + 1}_{tilt + 1:03d}_{angle:.1f}_20260101_120000"
+        "_fractions.tiff",
+        _MOVIE,
+    )
+    mdoc = grid / f"Position_{position + 1}.mdoc"
+    blocks = "".join(
+        f"[ZValue = {t}]\nTiltAngle = {-60 + 3 * t:.1f}\nExposureDose = 3\n"
+        f"PixelSpacing = 1.0\nSubFramePath = X:\\Position_{position + 1}_"
+        f"{t + 1:03d}_{-60 + 3 * t:.1f}_20260101_120000_fractions.tiff\n\n"
+        for t in range(tilt + 1)
+    )
+    _write(mdoc, f"PixelSpacing = 1.0\nImageFile = Position_{position + 1}.mrc\n\n")
+    with open(mdoc, "a") as f:
+        f.write(blocks)
+    return [movie, mdoc]
+
+
+def _clem_step(grid: Path, step: int) -> list[Path]:
+    return [_write(grid / "images" / f"sample_{step}.lif", _MOVIE)]
+
+
+def _fib_step(grid: Path, step: int) -> list[Path]:
+    name = f"Electron Snapshot ({step})"
+    return [
+        _write(
+            grid / "maps" / VISIT / "LayersData" / "Layer" / name / f"{name}.tiff",
+            _MOVIE,
+        )
+    ]
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        AcquisitionProfile("spa", "spa_grid", _spa_step),
+        AcquisitionProfile("tomo", "tomo_grid", _tomo_step),
+        AcquisitionProfile("clem", "clem_grid", _clem_step),
+        AcquisitionProfile("fib", "fib_grid", _fib_step),
+    )
+}
+
+
+# Server ----------------------------------------------------------------------------
+def _serve(workdir: Path, machine_config: dict[str, Any], connection: Connection):
+    """
+    Runs the Murfey server until told to stop, reporting the number of database
+    statements it has executed whenever asked
+    """
+    from sqlalchemy import Engine, event
+
+    from murfey.cli.loadtest import LoadProfile, local_server
+
+    statements = 0
+
+    def count_statement(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    logging.getLogger("murfey").setLevel(logging.WARNING)
+    profile = LoadProfile(instrument_name=INSTRUMENT_NAME, phases=[], requests=[])
+    with local_server(profile, workdir, machine_config) as credentials:
+        connection.send(credentials)
+        while connection.recv() == "statements":
+            connection.send(statements)
+
+
+class LocalServer:
+    """
+    Runs the Murfey server in a new process, which reads its configuration when its
+    modules are first imported, and logs in to it to set up a session
+    """
+
+    def __init__(self, workdir: Path, machine_config: MachineConfig, timeout=60):
+        workdir.mkdir(parents=True, exist_ok=True)
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=_serve,
+            args=(workdir, machine_config.model_dump(mode="json"), child_connection),
+            daemon=True,
+        )
+        self._process.start()
+        deadline = time.time() + timeout
+        while not self._connection.poll(0.1):
+            if not self._process.is_alive() or time.time() > deadline:
+                self._process.kill()
+                raise RuntimeError("Local Murfey server failed to start")
+        self.url, username, password = self._connection.recv()
+        self.session_id, self.token = self._create_session(username, password)
+
+    def _create_session(self, username: str, password: str) -> tuple[int, str]:
+        response = requests.post(
+            f"{self.url}{url_path_for('auth.router', 'generate_token')}",
+            data={"username": username, "password": password},
+        )
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = requests.post(
+            self.url
+            + url_path_for(
+                "session_info.router",
+                "create_session",
+                instrument_name=INSTRUMENT_NAME,
+                visit=VISIT,
+                name="benchmark",
+            ),
+            json={"end_time": None},
+            headers=headers,
+        )
+        response.raise_for_status()
+        session_id = response.json()
+        response = requests.get(
+            self.url
+            + url_path_for("auth.router", "mint_session_token", session_id=session_id),
+            headers=headers,
+        )
+        response.raise_for_status()
+        return session_id, response.json()["access_token"]
+
+    def statements(self) -> int:
+        self._connection.send("statements")
+        return self._connection.recv()
+
+    def close(self):
+        self._connection.send("stop")
+        self._process.join(timeout=30)
+        if self._process.is_alive():
+            self._process.kill()
+
+
+def _route_patterns() -> list[tuple[re.Pattern, str]]:
+    patterns = []
+    for router_name, routes in load_route_manifest().items():
+        if not router_name.startswith("murfey.server"):
+            continue
+        for route in routes:
+            regex = re.sub(
+                r"\{[^}:]+(:path)?\}",
+                lambda m: ".+" if m.group(1) else "[^/]+",
+                route["path"],
+            )
+            patterns.append((re.compile(f"^{regex}$"), route["function"]))
+    return patterns
+
+
+def _strings(value: Any):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _strings(item)
+
+
+class _RecordingRequests:
+    """
+    Stands in for the 'requests' module in the client's HTTP helpers, recording
+    each request against the endpoint it is for, and when each file named in an
+    accepted request was first registered
+    """
+
+    Response = requests.Response
+
+    def __init__(self):
+        self.calls: Counter[str] = Counter()
+        self.registered: dict[str, float] = {}
+        self._patterns = _route_patterns()
+        self._lock = threading.Lock()
+
+    def _endpoint(self, url: str) -> str:
+        path = urlparse(url).path
+        for pattern, function in self._patterns:
+            if pattern.match(path):
+                return function
+        return path
+
+    def _record(
+        self, method: str, url: str, json_data: Any, response: requests.Response
+    ) -> requests.Response:
+        registered = time.time()
+        with self._lock:
+            self.calls[f"{method} {self._endpoint(url)}"] += 1
+            if response.status_code < 400:
+                for value in itertools.chain(
+                    _strings(json_data), (urlparse(url).path,)
+                ):
+                    if value:
+                        self.registered.setdefault(Path(value).name, registered)
+        return response
+
+    def post(self, url: str, json: Any = None, **kwargs) -> requests.Response:
+        return self._record("POST", url, json, requests.post(url, json=json, **kwargs))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self._record("GET", url, None, requests.get(url, **kwargs))
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self._record("DELETE", url, None, requests.delete(url, **kwargs))
+
+
+class _ScaledTime:
+    """
+    Stands in for the 'time' module in the directory watchers, so that they scan
+    every 'interval' seconds rather than every 15 seconds
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+    def sleep(self, seconds: float):
+        time.sleep(min(seconds, self.interval))
+
+    def __getattr__(self, name: str):
+        return getattr(time, name)
+
+
+# Pipeline --------------------------------------------------------------------------
+class _TimedAnalyser(Analyser):
+    on_analysed: Callable[[Path], None] = staticmethod(lambda path: None)
+
+    def _analyse(self, transferred_file: Path):
+        super()._analyse(transferred_file)
+        self.on_analysed(transferred_file)
+
+
+@dataclass
+class BenchmarkResult:
+    profile: str
+    rate: float
+    steps: int
+    files: int
+    duration: float
+    files_per_second: float
+    analysis_latency: dict[str, float]
+    registration_latency: dict[str, float]
+    registered_files: int
+    http_calls: dict[str, int]
+    db_statements: int
+    peak_rss_mb: float
+    transfer: str
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(self.__dict__)
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        f"p{q}": round(
+            ordered[min(math.ceil(q / 100 * len(ordered)) - 1, len(ordered) - 1)], 4
+        )
+        for q in (50, 90, 95, 99)
+    } | {"max": round(ordered[-1], 4)}
+
+
+@dataclass
+class BenchmarkRun:
+    """
+    Runs an acquisition profile through the client pipeline, set up as it is by the
+    instrument server for a multigrid session
+    """
+
+    profile: AcquisitionProfile
+    workdir: Path
+    rate: float = 20  # Files written per second
+    steps: int = 100
+    settling_time: float = 0.5
+    scan_interval: float = 0.25
+    timeout: float = 120
+    created: dict[Path, float] = field(default_factory=dict)
+    analysed: dict[Path, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.source = self.workdir / "acquisition"
+        self.destination = self.workdir / "destination"
+        self.source.mkdir(parents=True)
+        # The server only suggests destinations within an existing visit directory
+        (self.destination / str(time.localtime().tm_year) / VISIT).mkdir(parents=True)
+        self.machine_config = MachineConfig(
+            instrument_name=INSTRUMENT_NAME,
+            acquisition_software=["epu", "tomo", "leica", "maps", "autotem"],
+            data_directories=[self.source],
+            data_required_substrings={},
+            single_data_directory=True,
+            calibrations={"dummy": {}},
+            rsync_basepath=self.destination,
+        )
+        self.transfer = "rsync" if shutil.which("rsync") else "none"
+        self._lock = threading.Lock()
+
+    def _on_analysed(self, path: Path):
+        with self._lock:
+            self.analysed.setdefault(path, time.time())
+
+    def _rsyncer(self, source: Path, basepath_remote: Path, *args, **kwargs):
+        # Copy into the local destination directory rather than to an rsync daemon
+        kwargs["local"] = True
+        return RSyncer(source, self.destination / basepath_remote, *args, **kwargs)
+
+    def _dir_watcher(self, source: Path, **kwargs):
+        kwargs["settling_time"] = self.settling_time
+        return DirWatcher(source, **kwargs)
+
+    def run(self, mocker) -> BenchmarkResult:
+        server = LocalServer(self.workdir / "server", self.machine_config)
+        try:
+            return self._run(mocker, server)
+        finally:
+            server.close()
+
+    def _run(self, mocker, server: LocalServer) -> BenchmarkResult:
+        self.requests = _RecordingRequests()
+        mocker.patch("murfey.util.client.requests", self.requests)
+        for module in ("murfey.client.watchdir", "murfey.client.watchdir_multigrid"):
+            mocker.patch(f"{module}.time", _ScaledTime(self.scan_interval))
+        mocker.patch("murfey.client.multigrid_control.RSyncer", self._rsyncer)
+        mocker.patch("murfey.client.multigrid_control.DirWatcher", self._dir_watcher)
+        mocker.patch.object(_TimedAnalyser, "on_analysed", self._on_analysed)
+        mocker.patch("murfey.client.multigrid_control.Analyser", _TimedAnalyser)
+
+        machine_config = self.machine_config.model_dump(mode="json")
+        controller = MultigridController(
+            [],
+            VISIT,
+            INSTRUMENT_NAME,
+            server.session_id,
+            murfey_url=server.url,
+            do_transfer=self.transfer == "rsync",
+            _machine_config=machine_config,
+            token=server.token,
+            data_collection_parameters={
+                "dose_per_frame": 1.0,
+                "eer_fractionation": 20,
+                "symmetry": "C1",
+            },
+        )
+        multigrid_watcher = MultigridDirWatcher(self.source, machine_config)
+        multigrid_watcher.subscribe(
+            partial(controller._start_rsyncer_multigrid, destination_overrides={})
+        )
+        grid = self.source / self.profile.grid_directory
+        grid.mkdir()
+        statements_before = server.statements()
+        multigrid_watcher.start()
+
+        start = time.time()
+        for step in range(self.steps):
+            for path in self.profile.write_step(grid, step):
+                self.created.setdefault(path, time.time())
+            time.sleep(max(start + (step + 1) / self.rate - time.time(), 0))
+
+        # Wait for every file written to be analysed
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            with self._lock:
+                if all(path in self.analysed for path in self.created):
+                    break
+            time.sleep(0.05)
+        duration = time.time() - start
+
+        multigrid_watcher.stop()
+        for component in (
+            *controller._environment.watchers.values(),
+            *controller.rsync_processes.values(),
+            *controller.analysers.values(),
+        ):
+            component.request_stop()
+            component.stop()
+        return self._result(duration, server.statements() - statements_before)
+
+    def _result(self, duration: float, db_statements: int) -> BenchmarkResult:
+        analysed = [
+            self.analysed[path] - created
+            for path, created in self.created.items()
+            if path in self.analysed
+        ]
+        registered = [
+            self.requests.registered[path.name] - created
+            for path, created in self.created.items()
+            if path.name in self.requests.registered
+        ]
+        # Peak resident set size of the whole process, which is in KiB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return BenchmarkResult(
+            profile=self.profile.name,
+            rate=self.rate,
+            steps=self.steps,
+            files=len(self.created),
+            duration=round(duration, 3),
+            files_per_second=round(len(analysed) / duration, 3),
+            analysis_latency=percentiles(analysed),
+            registration_latency=percentiles(registered),
+            registered_files=len(registered),
+            http_calls=dict(sorted(self.requests.calls.items())),
+            db_statements=db_statements,
+            peak_rss_mb=round(peak_rss, 1),
+            transfer=self.transfer,
+        )
+
+
+# Baselines -------------------------------------------------------------------------
+def compare_to_baseline(
+    result: dict[str, Any], baseline: Optional[dict[str, Any]], tolerance: float
+) -> list[str]:
+    """
+    Returns the ways in which a result is worse than its baseline by more than the
+    tolerance, given as a fraction. Only runs with the same rate and number of steps
+    as the baseline are compared.
+    """
+    if not baseline or (baseline["rate"], baseline["steps"]) != (
+        result["rate"],
+        result["steps"],
+    ):
+        return []
+    regressions = []
+    if result["files_per_second"] < baseline["files_per_second"] * (1 - tolerance):
+        regressions.append(
+            f"Throughput fell from {baseline['files_per_second']} "
+            f"to {result['files_per_second']} files/s"
+        )
+    for latency in ("analysis_latency", "registration_latency"):
+        before = baseline.get(latency, {}).get("p95")
+        after = result.get(latency, {}).get("p95")
+        if before is not None and after is not None:
+            # Allow for the time spent waiting for files to settle and be scanned
+            if after > before * (1 + tolerance) + 0.5:
+                regressions.append(
+                    f"95th percentile {latency.replace('_', ' ')} rose from "
+                    f"{before} to {after} s"
+                )
+    calls_before = sum(baseline["http_calls"].values()) / max(baseline["files"], 1)
+    calls_after = sum(result["http_calls"].values()) / max(result["files"], 1)
+    if calls_after > calls_before * (1 + tolerance):
+        regressions.append(
+            f"HTTP calls per file rose from {calls_before:.2f} to {calls_after:.2f}"
+        )
+    statements_before = baseline["db_statements"] / max(baseline["files"], 1)
+    statements_after = result["db_statements"] / max(result["files"], 1)
+    if statements_after > statements_before * (1 + tolerance):
+        regressions.append(
+            f"Database statements per file rose from {statements_before:.2f} "
+            f"to {statements_after:.2f}"
+        )
+    return regressions
@@ -0,0 +1,126 @@
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+import xmltodict
+
+from murfey.util.atlas_index import AtlasIndex, parse_atlas_positions
+from murfey.util.parse_cache import ParseCache
+from murfey.util.spa_metadata import get_grid_square_atlas_positions
+from tests.util.test_atlas_index import write_atlas
+
+NUM_TILES = 50
+SQUARES_PER_TILE = 100
+NUM_LOOKUPS = 5000
+
+
+def _xmltodict_positions(xml_path: Path) -> dict:
+    # How the grid square positions were read before the atlas index
+    with open(xml_path, "rb") as xml:
+        atlas_data = xmltodict.parse(xml)
+    positions: dict[str, tuple[int, int, float, float, int, int, float]] = {}
+    for ti in atlas_data["AtlasSessionXml"]["Atlas"]["TilesEfficient"]["_items"][
+        "TileXml"
+    ]:
+        nodes = ti["Nodes"]["KeyValuePairs"]
+        required_key = next(
+            k for k in nodes.keys() if k.startswith("KeyValuePairOfintNodeXml")
+        )
+        for gs in nodes[required_key]:
+            position = gs["value"]["b:PositionOnTheAtlas"]
+            positions.setdefault(
+                gs["key"],
+                (
+                    int(float(position["c:Center"]["d:x"])),
+                    int(float(position["c:Center"]["d:y"])),
+                    float(position["c:Physical"]["d:x"]) * 1e9,
+                    float(position["c:Physical"]["d:y"]) * 1e9,
+                    int(float(position["c:Size"]["d:width"])),
+                    int(float(position["c:Size"]["d:height"])),
+                    float(position["c:Rotation"]),
+                ),
+            )
+    return positions
+
+
+def _measure_parse(parser, xml_path: Path) -> tuple[dict, float, int]:
+    # Timed separately from measuring the memory, as tracing slows the parse down
+    start = time.perf_counter()
+    result = parser(xml_path)
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    parser(xml_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def _time_per_lookup(lookup, grid_squares: list[str]) -> float:
+    lookup(grid_squares[0])
+    start = time.perf_counter()
+    for gs in grid_squares:
+        lookup(gs)
+    return (time.perf_counter() - start) / len(grid_squares)
+
+
+@pytest.mark.benchmark
+def test_atlas_index_against_xmltodict(tmp_path: Path):
+    atlas = tmp_path / "Sample1" / "Atlas" / "Atlas.dm"
+    write_atlas(
+        atlas,
+        [
+            [
+                (gs, gs % 4000 + 0.5, gs // 4 + 0.5)
+                for gs in range(tile * SQUARES_PER_TILE, (tile + 1) * SQUARES_PER_TILE)
+            ]
+            for tile in range(NUM_TILES)
+        ],
+    )
+    grid_squares = [
+        str(gs % (NUM_TILES * SQUARES_PER_TILE)) for gs in range(NUM_LOOKUPS)
+    ]
+
+    before, before_parse_time, before_peak = _measure_parse(_xmltodict_positions, atlas)
+    (after, _), after_parse_time, after_peak = _measure_parse(
+        parse_atlas_positions, atlas
+    )
+    assert after == before
+    assert len(after) == NUM_TILES * SQUARES_PER_TILE
+
+    parse_cache = ParseCache()
+
+    def cached_xmltodict_lookup(gs: str):
+        return {gs: parse_cache.get(atlas, _xmltodict_positions)[gs]}
+
+    def indexed_lookup(gs: str):
+        return get_grid_square_atlas_positions(atlas, grid_square=gs)
+
+    # Loading the index saved by the first lookup, as another process would
+    indexed_lookup(grid_squares[0])
+    start = time.perf_counter()
+    AtlasIndex(atlas).update()
+    load_time = time.perf_counter() - start
+
+    results = {
+        "atlas_bytes": atlas.stat().st_size,
+        "grid_squares": len(after),
+        "before": {
+            "parse_seconds": before_parse_time,
+            "parse_peak_bytes": before_peak,
+            "seconds_per_lookup": _time_per_lookup(
+                cached_xmltodict_lookup, grid_squares
+            ),
+        },
+        "after": {
+            "parse_seconds": after_parse_time,
+            "parse_peak_bytes": after_peak,
+            "seconds_per_lookup": _time_per_lookup(indexed_lookup, grid_squares),
+            "load_saved_index_seconds": load_time,
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+    assert after_peak < before_peak / 2
+    assert after_parse_time < before_parse_time
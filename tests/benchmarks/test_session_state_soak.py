@@ -0,0 +1,69 @@
+import gc
+import os
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pytest
+
+from murfey.client.instance_environment import MovieTracker, MurfeyInstanceEnvironment
+
+NUM_MOVIES = 2_000_000
+TILTS_PER_SERIES = 40
+STATE_MAX_ENTRIES = 50_000
+# Growth in resident memory allowed over the soak, which keeping every movie in
+# memory exceeds several times over
+MAX_RSS_GROWTH = 200 * 1024**2
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _movie(n: int) -> Path:
+    return Path(
+        f"/dls/m01/data/2025/cm12345-6/Position_{n // TILTS_PER_SERIES}_{n}.eer"
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Reads memory use from /proc"
+)
+def test_session_state_memory_is_bounded():
+    env = MurfeyInstanceEnvironment(
+        url=urlparse("http://localhost:8000"),
+        client_id=0,
+        instrument_name="m01",
+        state_max_entries=STATE_MAX_ENTRIES,
+    )
+    gc.collect()
+    rss_before = _rss()
+    peak_rss = rss_before
+    start = time.perf_counter()
+    for n in range(NUM_MOVIES):
+        movie = _movie(n)
+        tilt_series = f"Position_{n // TILTS_PER_SERIES}"
+        env.movies[movie] = MovieTracker(movie_number=n, motion_correction_uuid=n)
+        env.movie_tilt_pair[movie] = tilt_series
+        if n % 100_000 == 0:
+            peak_rss = max(peak_rss, _rss())
+    duration = time.perf_counter() - start
+    peak_rss = max(peak_rss, _rss())
+    stats = env.state_stats()
+    print(
+        f"{NUM_MOVIES} movies in {duration:.1f} s, "
+        f"RSS grew by {(peak_rss - rss_before) / 1024**2:.1f} MB: {stats}"
+    )
+
+    assert peak_rss - rss_before < MAX_RSS_GROWTH
+    assert stats["movies"]["entries"] == NUM_MOVIES
+    assert stats["movies"]["entries_in_memory"] <= STATE_MAX_ENTRIES
+
+    # Movies spilled early on are still found, as are recent ones
+    for n in (0, 1, 12_345, NUM_MOVIES // 2, NUM_MOVIES - 1):
+        assert env.movies[_movie(n)] == MovieTracker(n, n)
+        assert env.movie_tilt_pair[_movie(n)] == f"Position_{n // TILTS_PER_SERIES}"
+    assert Path("/dls/m01/data/2025/cm12345-6/Position_0_40.eer") not in env.movies
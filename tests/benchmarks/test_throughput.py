@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from tests.benchmarks.harness import PROFILES, BenchmarkRun, compare_to_baseline
+
+# Default rate and length of each acquisition profile
+PROFILE_SETTINGS = {
+    "spa": {"rate": 20, "steps": 200},
+    "tomo": {"rate": 10, "steps": 82},
+    "clem": {"rate": 10, "steps": 50},
+    "fib": {"rate": 10, "steps": 50},
+}
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(request: pytest.FixtureRequest):
+    results: dict[str, dict] = {}
+    yield results
+    output = request.config.getoption("--benchmark-output")
+    if output is not None and results:
+        output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("profile", PROFILE_SETTINGS)
+def test_pipeline_throughput(
+    profile: str,
+    benchmark_results: dict,
+    mocker: MockerFixture,
+    request: pytest.FixtureRequest,
+    tmp_path: Path,
+):
+    settings = PROFILE_SETTINGS[profile]
+    run = BenchmarkRun(
+        PROFILES[profile],
+        tmp_path,
+        rate=request.config.getoption("--benchmark-rate") or settings["rate"],
+        steps=request.config.getoption("--benchmark-steps") or settings["steps"],
+    )
+    result = run.run(mocker).to_dict()
+    benchmark_results[profile] = result
+    print(json.dumps(result, indent=2))
+
+    # Files should have made it through the pipeline and reached the server
+    assert result["files_per_second"] > 0
+    assert sum(result["http_calls"].values()) > 0
+
+    baseline_file: Path = request.config.getoption("--benchmark-baseline")
+    baseline = (
+        json.loads(baseline_file.read_text()).get(profile)
+        if baseline_file.is_file()
+        else None
+    )
+    regressions = compare_to_baseline(
+        result, baseline, request.config.getoption("--benchmark-tolerance")
+    )
+    assert not regressions, "\n".join(regressions)
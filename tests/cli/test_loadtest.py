@@ -0,0 +1,169 @@
+import json
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+from murfey.cli.loadtest import (
+    LoopbackTransport,
+    Phase,
+    RouteStats,
+    arrival_times,
+    default_profile,
+    load_profile,
+    parse_metrics,
+    render,
+    summarise_metrics,
+)
+
+
+def test_render_keeps_the_types_of_bare_placeholders():
+    variables = {"session_id": 3, "visit": "cm12345-1", "n": 7}
+    assert render(
+        {
+            "session_id": "${session_id}",
+            "path": "/data/${visit}/FoilHole_${n}.tiff",
+            "logs": ['{"msg": "record ${n}"}'],
+            "size": 4096,
+            "unknown": "${missing}",
+        },
+        variables,
+    ) == {
+        "session_id": 3,
+        "path": "/data/cm12345-1/FoilHole_7.tiff",
+        "logs": ['{"msg": "record 7"}'],
+        "size": 4096,
+        "unknown": "${missing}",
+    }
+
+
+def test_arrival_times_follow_the_phases():
+    phases = [
+        Phase(name="ramp-up", duration=100, start_rate=0, rate=10),
+        Phase(name="soak", duration=100, rate=10),
+    ]
+    arrivals = list(arrival_times(phases, random.Random(0)))
+
+    assert [t for t, _ in arrivals] == sorted(t for t, _ in arrivals)
+    ramp_up = [t for t, phase in arrivals if phase.name == "ramp-up"]
+    soak = [t for t, phase in arrivals if phase.name == "soak"]
+    assert all(0 <= t < 100 for t in ramp_up)
+    assert all(100 <= t < 200 for t in soak)
+    # The average rate over the ramp is half the final rate
+    assert 400 < len(ramp_up) < 600
+    assert 900 < len(soak) < 1100
+    assert len([t for t in ramp_up if t < 50]) * 2 < len(
+        [t for t in ramp_up if t >= 50]
+    )
+
+
+def test_route_stats_summary():
+    stats = RouteStats()
+    for latency in (0.001, 0.02, 0.02, 0.3, 2.0):
+        stats.record(latency, 200)
+    stats.record(0.05, 500)
+    stats.record(30.0, "TimeoutError")
+
+    summary = stats.summary()
+    assert summary["requests"] == 7
+    assert summary["errors"] == 2
+    assert summary["status_codes"] == {"200": 5, "500": 1, "TimeoutError": 1}
+    assert summary["latency"]["p50"] == 0.05
+    assert summary["latency"]["max"] == 30.0
+    assert summary["histogram"]["0.005"] == 1
+    assert summary["histogram"]["0.025"] == 3
+    assert summary["histogram"]["0.5"] == 5
+    assert summary["histogram"]["30"] == summary["histogram"]["+Inf"] == 7
+
+
+def test_metrics_are_summed_over_labels_and_summarised():
+    text = (
+        "# TYPE process_cpu_seconds_total counter\n"
+        "process_cpu_seconds_total 10.0\n"
+        "# TYPE murfey_seen_files gauge\n"
+        'murfey_seen_files{visit="cm1-1"} 3.0\n'
+        'murfey_seen_files{visit="cm1-2"} 4.0\n'
+        "# TYPE process_open_fds gauge\n"
+        "process_open_fds 20.0\n"
+    )
+    first = parse_metrics(text, ["process_cpu_seconds_total", "murfey_seen_files"])
+    assert first == {"process_cpu_seconds_total": 10.0, "murfey_seen_files": 7.0}
+
+    summary = summarise_metrics(
+        [
+            (100.0, first),
+            (110.0, {"process_cpu_seconds_total": 15.0, "murfey_seen_files": 9.0}),
+            (120.0, {"process_cpu_seconds_total": 18.0, "murfey_seen_files": 8.0}),
+        ]
+    )
+    assert summary["process_cpu_seconds_total"]["rate"] == 0.4
+    assert summary["murfey_seen_files"] == {"first": 7.0, "last": 8.0, "max": 9.0}
+
+
+def test_loopback_transport_answers_ispyb_inserts():
+    transport = LoopbackTransport()
+    try:
+        first = transport.do_insert_data_collection_group(None)
+        second = transport.do_insert_atlas(None)
+        assert first["success"] and second["success"]
+        assert first["return_value"] != second["return_value"]
+        transport.send("processing_recipe", {"recipes": []})
+        assert transport.sent == {"processing_recipe": 1}
+    finally:
+        transport.close()
+
+
+def test_default_profile_loads():
+    profile = load_profile(default_profile)
+    assert profile.phases and profile.requests and profile.setup
+    assert {request.function for request in profile.requests} >= {
+        "request_spa_preprocessing",
+        "register_tilt",
+        "register_foil_hole",
+        "increment_rsync_transferred_files_prometheus",
+        "forward_logs",
+    }
+
+
+def test_loadtest_against_local_server(tmp_path: Path):
+    # Runs in a new process, as the local server reads its configuration on import
+    output = tmp_path / "results.json"
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from murfey.cli.loadtest import run; run()",
+            "--instruments",
+            "1",
+            "--sessions",
+            "2",
+            "--duration-scale",
+            "0.02",
+            "--seed",
+            "1",
+            "--output",
+            str(output),
+        ],
+        check=True,
+        capture_output=True,
+        timeout=300,
+    )
+    report = json.loads(output.read_text())
+
+    assert report["sessions"] == 2
+    setup = report["phases"]["setup"]["routes"]
+    assert all(route["errors"] == 0 for route in setup.values())
+    assert {route.split()[-1] for route in setup} == {
+        "register_rsyncer",
+        "register_dc_group",
+        "register_grid_square",
+        "register_tilt_series",
+    }
+    load = [
+        route
+        for phase in ("ramp-up", "soak")
+        for route in report["phases"].get(phase, {"routes": {}})["routes"].values()
+    ]
+    assert sum(route["requests"] for route in load) > 0
+    assert sum(route["errors"] for route in load) == 0
+    assert report["metrics"]["process_cpu_seconds_total"]["last"] > 0
@@ -0,0 +1,64 @@
+import hashlib
+from pathlib import Path
+
+from packaging.requirements import Requirement
+
+from murfey.cli.prewarm_package_cache import prewarm, read_requirements
+from murfey.server.package_cache import PackageCache
+from tests.conftest import PackageUpstream
+
+
+def test_read_requirements(tmp_path: Path):
+    requirements_file = tmp_path / "requirements.txt"
+    requirements_file.write_text(
+        "# Client requirements\n"
+        "--index-url https://example.com/simple\n"
+        "\n"
+        "murfey[client]>=0.20  # Murfey itself\n"
+        "Pillow\n"
+    )
+    assert [str(r) for r in read_requirements(requirements_file)] == [
+        "murfey[client]>=0.20",
+        "Pillow",
+    ]
+
+
+def test_prewarm_caches_newest_matching_version(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    files = {
+        "my_pkg-1.0-py3-none-any.whl": b"1.0 wheel",
+        "my_pkg-1.1-py3-none-any.whl": b"1.1 wheel",
+        "my_pkg-1.1.tar.gz": b"1.1 sdist",
+        "my_pkg-2.0-py3-none-any.whl": b"2.0 wheel",
+    }
+    links = []
+    for filename, content in files.items():
+        package_upstream.files[f"/packages/{filename}"] = content
+        digest = hashlib.sha256(content).hexdigest()
+        links.append(
+            f'<a href="{package_upstream.url}/packages/{filename}#sha256={digest}">'
+            f"{filename}</a>"
+        )
+    package_upstream.files["/simple/my-pkg"] = "\n".join(links).encode()
+
+    cache = PackageCache(tmp_path)
+    cached, failed = prewarm(
+        cache,
+        [Requirement("My_Pkg<2"), Requirement("missing")],
+        index_url=f"{package_upstream.url}/simple/",
+    )
+
+    assert sorted(url.rsplit("/", 1)[-1] for url in cached) == [
+        "my_pkg-1.1-py3-none-any.whl",
+        "my_pkg-1.1.tar.gz",
+    ]
+    assert failed == [f"{package_upstream.url}/simple/missing"]
+
+    # The cached files are then served without contacting the upstream server
+    package_upstream.requests.clear()
+    offline_cache = PackageCache(tmp_path, offline=True)
+    for url in cached:
+        offline_cache.get_file(url)
+    offline_cache.get_index(f"{package_upstream.url}/simple/my-pkg")
+    assert package_upstream.requests == []
@@ -1,8 +1,10 @@
-from unittest.mock import patch
+import os
+from unittest.mock import MagicMock, patch
 from urllib.parse import urlparse
 
 from murfey.client.contexts.atlas import AtlasContext
 from murfey.client.instance_environment import MurfeyInstanceEnvironment
+from tests.util.test_atlas_index import write_atlas
 
 
 def test_atlas_context_initialisation(tmp_path):
@@ -139,7 +141,7 @@ def test_atlas_context_dm(mock_capture_post, tmp_path):
     context = AtlasContext("tomo", tmp_path, {}, "token")
     context.post_transfer(atlas_dm, environment=env)
 
-    assert mock_capture_post.call_count == 6
+    assert mock_capture_post.call_count == 3
     mock_capture_post.assert_any_call(
         base_url="http://localhost:8000",
         router_name="workflow.router",
@@ -157,21 +159,25 @@ def test_atlas_context_dm(mock_capture_post, tmp_path):
     mock_capture_post.assert_any_call(
         base_url="http://localhost:8000",
         router_name="session_control.spa_router",
-        function_name="register_grid_square",
+        function_name="register_grid_squares",
         token="token",
         instrument_name="m01",
         session_id=1,
-        gsid=101,
         data={
-            "tag": str(atlas_dm.parent),
-            "sample": 2,
-            "x_location": 1200,
-            "y_location": 1500,
-            "x_stage_position": 2e9,
-            "y_stage_position": 3e9,
-            "width": 130,
-            "height": 560,
-            "angle": 0.14,
+            "grid_squares": {
+                gs: {
+                    "tag": str(atlas_dm.parent),
+                    "sample": 2,
+                    "x_location": 1200,
+                    "y_location": 1500,
+                    "x_stage_position": 2e9,
+                    "y_stage_position": 3e9,
+                    "width": 130,
+                    "height": 560,
+                    "angle": 0.14,
+                }
+                for gs in (101, 102, 103, 104)
+            }
         },
     )
     mock_capture_post.assert_any_call(
@@ -188,3 +194,57 @@ def test_atlas_context_dm(mock_capture_post, tmp_path):
             "tag": str(atlas_dm.parent),
         },
     )
+
+
+@patch("murfey.client.contexts.atlas.capture_post")
+def test_atlas_context_dm_registers_changed_grid_squares(mock_capture_post, tmp_path):
+    mock_capture_post.return_value = MagicMock(status_code=200)
+    env = MurfeyInstanceEnvironment(
+        url=urlparse("http://localhost:8000"),
+        client_id=0,
+        sources=[tmp_path / "cm12345-6"],
+        default_destinations={
+            tmp_path / "cm12345-6": f"{tmp_path}/destination/cm12345-6"
+        },
+        instrument_name="m01",
+        visit="cm12345-6",
+        murfey_session=1,
+        acquisition_uuid="uuid1",
+    )
+    atlas_dm = tmp_path / "cm12345-6/Supervisor_atlas/Sample2/Atlas/Atlas.dm"
+    write_atlas(atlas_dm, [[(101, 1, 1), (102, 2, 2)]])
+
+    context = AtlasContext("epu", tmp_path, {}, "token")
+    context.post_transfer(atlas_dm, environment=env)
+
+    def registered_grid_squares() -> list[int]:
+        # Grid squares are registered in a single request
+        requests = [
+            call.kwargs["data"]["grid_squares"]
+            for call in mock_capture_post.call_args_list
+            if call.kwargs["function_name"] == "register_grid_squares"
+        ]
+        assert len(requests) == 1
+        return list(requests[0])
+
+    assert registered_grid_squares() == [101, 102]
+
+    # Only the grid squares that are new or have moved are registered again
+    mock_capture_post.reset_mock()
+    write_atlas(atlas_dm, [[(101, 1, 1), (102, 2, 5)], [(103, 3, 3)]])
+    os.utime(atlas_dm, ns=(0, atlas_dm.stat().st_mtime_ns + 1000))
+    context.post_transfer(atlas_dm, environment=env)
+    assert registered_grid_squares() == [102, 103]
+
+    # Grid squares that fail to be registered are registered again
+    mock_capture_post.reset_mock()
+    mock_capture_post.return_value = None
+    write_atlas(atlas_dm, [[(101, 1, 1), (102, 2, 5)], [(103, 3, 3), (104, 4, 4)]])
+    os.utime(atlas_dm, ns=(0, atlas_dm.stat().st_mtime_ns + 1000))
+    context.post_transfer(atlas_dm, environment=env)
+    assert registered_grid_squares() == [104]
+    mock_capture_post.reset_mock()
+    mock_capture_post.return_value = MagicMock(status_code=200)
+    os.utime(atlas_dm, ns=(0, atlas_dm.stat().st_mtime_ns + 1000))
+    context.post_transfer(atlas_dm, environment=env)
+    assert registered_grid_squares() == [104]
@@ -1108,3 +1108,15 @@ def test_fib_maps_context(
 
 def test_fib_meteor_context():
     pass
+
+
+def test_fib_autotem_shard_key(tmp_path: Path):
+    context = FIBContext("autotem", tmp_path, {}, "")
+    dc_image = tmp_path / "visit/autotem/Project/Sites/Lamella (2)/DCImages/DCM_001.png"
+    project_data = tmp_path / "visit/autotem/Project/ProjectData.dat"
+    assert context.shard_key(dc_image) == "Lamella (2)"
+    assert context.shard_key(project_data) is None
+
+    # The key doesn't change once the site information has been parsed
+    context._site_info[2] = LamellaSiteInfo()
+    assert context.shard_key(dc_image) == "Lamella (2)"
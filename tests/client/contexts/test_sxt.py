@@ -1,10 +1,13 @@
+import os
+from pathlib import Path
 from unittest.mock import patch
 from urllib.parse import urlparse
 
-import numpy as np
+from olefile import OleFileIO
 
 from murfey.client.contexts.sxt import SXTContext
 from murfey.client.instance_environment import MurfeyInstanceEnvironment
+from tests.util.test_xrm import write_ole_file, xrm_streams
 
 
 def test_sxt_context_initialisation(tmp_path):
@@ -15,25 +18,23 @@ def test_sxt_context_initialisation(tmp_path):
 
 
 @patch("requests.post")
-@patch("murfey.client.contexts.sxt.OleFileIO")
+@patch("murfey.util.xrm.OleFileIO", wraps=OleFileIO)
 def test_sxt_context_xrm_atlas(mock_ole_file, mock_post, tmp_path):
     """xrm files contain metadata, test atlas-mag case"""
     mock_post().status_code = 200
-    mock_ole_file().__enter__().exists.return_value = True
-    # Motor position names
-    mock_ole_file().__enter__().openstream().read.return_value = (
-        "\x00Val1\x00\x00Energy\x00".encode()
-    )
-    # Metadata encoded arrays
-    mock_ole_file().__enter__().openstream().getvalue.side_effect = [
-        np.array([-1, 0, 1, 2, 3], dtype=np.float32).tobytes(),  # x tile positions
-        np.array([-3, -2, -1, 0, 1], dtype=np.float32).tobytes(),  # y tile positions
-        np.array([0.3], dtype=np.float32).tobytes(),  # Pixel size
-        np.array([1000], dtype=np.int32).tobytes(),  # Image Height
-        np.array([900], dtype=np.int32).tobytes(),  # Image Width
-        np.array([6], dtype=np.int32).tobytes(),  # Mosaic size
-        np.array([5], dtype=np.int32).tobytes(),  # Mosaic size
-    ]
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/example_atlas.xrm",
+        xrm_streams(
+            ImageInfo_XPosition=[-1, 0, 1, 2, 3],
+            ImageInfo_YPosition=[-3, -2, -1, 0, 1],
+            ImageInfo_PixelSize=[0.3],
+            ImageInfo_ImageHeight=[1000],
+            ImageInfo_ImageWidth=[900],
+            ImageInfo_MosiacRows=[6],
+            ImageInfo_MosiacColumns=[5],
+            ImageData1_Image1=bytes(8000),
+        ),
+    )
 
     env = MurfeyInstanceEnvironment(
         url=urlparse("http://localhost:8000"),
@@ -58,7 +59,9 @@ def test_sxt_context_xrm_atlas(mock_ole_file, mock_post, tmp_path):
     )
     assert return_value
 
-    mock_ole_file.assert_any_call(str(tmp_path / "cm12345-6/grid1/example_atlas.xrm"))
+    mock_ole_file.assert_called_once_with(
+        str(tmp_path / "cm12345-6/grid1/example_atlas.xrm")
+    )
 
     # assert mock_post.call_count == 4
     mock_post.assert_any_call(
@@ -94,26 +97,22 @@ def test_sxt_context_xrm_atlas(mock_ole_file, mock_post, tmp_path):
 
 
 @patch("requests.post")
-@patch("murfey.client.contexts.sxt.OleFileIO")
+@patch("murfey.util.xrm.OleFileIO", wraps=OleFileIO)
 def test_sxt_context_xrm_roi(mock_ole_file, mock_post, tmp_path):
     """xrm files contain metadata, test roi-mag case"""
     mock_post().status_code = 200
-    mock_ole_file().__enter__().exists.return_value = True
-    # Motor position names
-    mock_ole_file().__enter__().openstream().read.return_value = (
-        "\x00Val1\x00\x00Energy\x00".encode()
-    )
-    # Metadata encoded arrays
-    mock_ole_file().__enter__().openstream().getvalue.side_effect = [
-        np.array([-1, 0, 1, 2, 3], dtype=np.float32).tobytes(),  # x tile positions
-        np.array([-3, -2, -1, 0, 1], dtype=np.float32).tobytes(),
-        # y tile positions
-        np.array([0.03], dtype=np.float32).tobytes(),  # Pixel size, smaller than atlas
-        np.array([1000], dtype=np.int32).tobytes(),  # Image Height
-        np.array([900], dtype=np.int32).tobytes(),  # Image Width
-        np.array([6], dtype=np.int32).tobytes(),  # Mosaic size
-        np.array([5], dtype=np.int32).tobytes(),  # Mosaic size
-    ]
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/example_roi.xrm",
+        xrm_streams(
+            ImageInfo_XPosition=[-1, 0, 1, 2, 3],
+            ImageInfo_YPosition=[-3, -2, -1, 0, 1],
+            ImageInfo_PixelSize=[0.03],  # Smaller than for the atlas
+            ImageInfo_ImageHeight=[1000],
+            ImageInfo_ImageWidth=[900],
+            ImageInfo_MosiacRows=[6],
+            ImageInfo_MosiacColumns=[5],
+        ),
+    )
 
     env = MurfeyInstanceEnvironment(
         url=urlparse("http://localhost:8000"),
@@ -138,7 +137,9 @@ def test_sxt_context_xrm_roi(mock_ole_file, mock_post, tmp_path):
     )
     assert return_value
 
-    mock_ole_file.assert_any_call(str(tmp_path / "cm12345-6/grid1/example_roi.xrm"))
+    mock_ole_file.assert_called_once_with(
+        str(tmp_path / "cm12345-6/grid1/example_roi.xrm")
+    )
 
     # assert mock_post.call_count == 4
     mock_post.assert_any_call(
@@ -173,25 +174,24 @@ def test_sxt_context_xrm_roi(mock_ole_file, mock_post, tmp_path):
 
 
 @patch("requests.post")
-@patch("murfey.client.contexts.sxt.OleFileIO")
+@patch("murfey.util.xrm.OleFileIO", wraps=OleFileIO)
 def test_sxt_context_txrm(mock_ole_file, mock_post, tmp_path):
     mock_post().status_code = 200
-    mock_ole_file().__enter__().exists.return_value = True
-    # Motor position names
-    mock_ole_file().__enter__().openstream().read.return_value = (
-        "\x00Val1\x00\x00Energy\x00".encode()
-    )
-    # Metadata encoded arrays
-    mock_ole_file().__enter__().openstream().getvalue.side_effect = [
-        np.array([-55, -25, 5, 35, 65], dtype=np.float32).tobytes(),  # Angles
-        np.array([0.01001], dtype=np.float32).tobytes(),  # Pixel size
-        np.array([1024], dtype=np.int32).tobytes(),  # Image Width
-        np.array([2048], dtype=np.int32).tobytes(),  # Image Height
-        np.array([1.5], dtype=np.float32).tobytes(),  # Exposure time
-        np.array([1000], dtype=np.float32).tobytes(),  # Mag
-        np.array([200], dtype=np.int32).tobytes(),  # Image count
-        np.array([0, 519, 2, 3], dtype=np.float32).tobytes(),  # Motor Pos (energy)
-    ]
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/example.txrm",
+        xrm_streams(
+            ImageInfo_Angles=[-55, -25, 5, 35, 65],
+            ImageInfo_PixelSize=[0.01001],
+            ImageInfo_ImageWidth=[1024],
+            ImageInfo_ImageHeight=[2048],
+            ImageInfo_ExpTimes=[1.5],
+            ImageInfo_XrayMagnification=[1000],
+            ImageInfo_ImagesTaken=[200],
+            PositionInfo_AxisNames=["Val1", "Energy"],
+            PositionInfo_MotorPositions=[0, 519, 2, 3],
+            ReferenceData_Image=bytes(8000),
+        ),
+    )
 
     env = MurfeyInstanceEnvironment(
         url=urlparse("http://localhost:8000"),
@@ -217,23 +217,9 @@ def test_sxt_context_txrm(mock_ole_file, mock_post, tmp_path):
         environment=env,
     )
 
-    mock_ole_file.assert_any_call(str(tmp_path / "cm12345-6/grid1/example.txrm"))
-    assert mock_ole_file().__enter__().exists.call_count == 10
-    assert mock_ole_file().__enter__().openstream.call_count == 11  # 9 + 2 above
-    mock_ole_file().__enter__().exists.assert_any_call("ReferenceData/Image")
-    for field_name in [
-        "ImageInfo/Angles",
-        "ImageInfo/PixelSize",
-        "ImageInfo/ImageWidth",
-        "ImageInfo/ImageHeight",
-        "ImageInfo/ExpTimes",
-        "ImageInfo/XrayMagnification",
-        "ImageInfo/ImagesTaken",
-        "PositionInfo/AxisNames",
-        "PositionInfo/MotorPositions",
-    ]:
-        mock_ole_file().__enter__().exists.assert_any_call(field_name)
-        mock_ole_file().__enter__().openstream.assert_any_call(field_name)
+    mock_ole_file.assert_called_once_with(
+        str(tmp_path / "cm12345-6/grid1/example.txrm")
+    )
 
     assert mock_post.call_count == 5
     mock_post.assert_any_call(
@@ -292,33 +278,29 @@ def test_sxt_context_txrm(mock_ole_file, mock_post, tmp_path):
 
 
 @patch("requests.post")
-@patch("murfey.client.contexts.sxt.OleFileIO")
+@patch("murfey.util.xrm.OleFileIO", wraps=OleFileIO)
 def test_sxt_context_txrm_external_ref(mock_ole_file, mock_post, tmp_path):
     mock_post().status_code = 200
-    exists_return = [False]  # False for reference, then True
-    exists_return.extend([True for i in range(20)])
-    mock_ole_file().__enter__().exists.side_effect = exists_return
-    # Motor position names
-    mock_ole_file().__enter__().openstream().read.return_value = (
-        "\x00Val1\x00\x00Energy\x00".encode()
-    )
-    # Metadata encoded arrays
-    mock_ole_file().__enter__().openstream().getvalue.side_effect = [
-        np.array([-55, -25, 5, 35, 65], dtype=np.float32).tobytes(),  # Angles
-        np.array([0.01001], dtype=np.float32).tobytes(),  # Pixel size
-        np.array([1024], dtype=np.int32).tobytes(),  # Image Width
-        np.array([2048], dtype=np.int32).tobytes(),  # Image Height
-        np.array([1.5], dtype=np.float32).tobytes(),  # Exposure time
-        np.array([1000], dtype=np.float32).tobytes(),  # Mag
-        np.array([200], dtype=np.int32).tobytes(),  # Image count
-        np.array([0, 519, 2, 3], dtype=np.float32).tobytes(),  # Motor Pos (energy)
-        np.array([0], dtype=np.int32).tobytes(),  # Mosaic size
-        np.array([0], dtype=np.int32).tobytes(),  # Mosaic size
-    ]
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/example_-60to60@0.5.txrm",
+        xrm_streams(
+            ImageInfo_Angles=[-55, -25, 5, 35, 65],
+            ImageInfo_PixelSize=[0.01001],
+            ImageInfo_ImageWidth=[1024],
+            ImageInfo_ImageHeight=[2048],
+            ImageInfo_ExpTimes=[1.5],
+            ImageInfo_XrayMagnification=[1000],
+            ImageInfo_ImagesTaken=[200],
+            PositionInfo_AxisNames=["Val1", "Energy"],
+            PositionInfo_MotorPositions=[0, 519, 2, 3],
+        ),
+    )
 
     # xrm file as reference
-    (tmp_path / "cm12345-6/grid1").mkdir(parents=True)
-    (tmp_path / "cm12345-6/grid1/ref.xrm").touch()
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/ref.xrm",
+        xrm_streams(ImageInfo_MosiacRows=[0], ImageInfo_MosiacColumns=[0]),
+    )
 
     env = MurfeyInstanceEnvironment(
         url=urlparse("http://localhost:8000"),
@@ -418,33 +400,29 @@ def test_sxt_context_txrm_external_ref(mock_ole_file, mock_post, tmp_path):
 
 
 @patch("requests.post")
-@patch("murfey.client.contexts.sxt.OleFileIO")
+@patch("murfey.util.xrm.OleFileIO", wraps=OleFileIO)
 def test_sxt_context_txrm_zero_angles(mock_ole_file, mock_post, tmp_path):
     mock_post().status_code = 200
-    exists_return = [False]  # False for reference, then True
-    exists_return.extend([True for i in range(20)])
-    mock_ole_file().__enter__().exists.side_effect = exists_return
-    # Motor position names
-    mock_ole_file().__enter__().openstream().read.return_value = (
-        "\x00Val1\x00\x00Energy\x00".encode()
-    )
-    # Metadata encoded arrays
-    mock_ole_file().__enter__().openstream().getvalue.side_effect = [
-        np.array([0, 0, 0, 0, 0], dtype=np.float32).tobytes(),  # Angles
-        np.array([0.01001], dtype=np.float32).tobytes(),  # Pixel size
-        np.array([1024], dtype=np.int32).tobytes(),  # Image Width
-        np.array([2048], dtype=np.int32).tobytes(),  # Image Height
-        np.array([1.5], dtype=np.float32).tobytes(),  # Exposure time
-        np.array([1000], dtype=np.float32).tobytes(),  # Mag
-        np.array([200], dtype=np.int32).tobytes(),  # Image count
-        np.array([0, 519, 2, 3], dtype=np.float32).tobytes(),  # Motor Pos (energy)
-        np.array([0], dtype=np.int32).tobytes(),  # Mosaic size
-        np.array([0], dtype=np.int32).tobytes(),  # Mosaic size
-    ]
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/example_0.txrm",
+        xrm_streams(
+            ImageInfo_Angles=[0, 0, 0, 0, 0],
+            ImageInfo_PixelSize=[0.01001],
+            ImageInfo_ImageWidth=[1024],
+            ImageInfo_ImageHeight=[2048],
+            ImageInfo_ExpTimes=[1.5],
+            ImageInfo_XrayMagnification=[1000],
+            ImageInfo_ImagesTaken=[200],
+            PositionInfo_AxisNames=["Val1", "Energy"],
+            PositionInfo_MotorPositions=[0, 519, 2, 3],
+        ),
+    )
 
     # xrm file as reference
-    (tmp_path / "cm12345-6/grid1").mkdir(parents=True)
-    (tmp_path / "cm12345-6/grid1/ref.xrm").touch()
+    write_ole_file(
+        tmp_path / "cm12345-6/grid1/ref.xrm",
+        xrm_streams(ImageInfo_MosiacRows=[0], ImageInfo_MosiacColumns=[0]),
+    )
 
     env = MurfeyInstanceEnvironment(
         url=urlparse("http://localhost:8000"),
@@ -480,3 +458,51 @@ def test_sxt_context_txrm_zero_angles(mock_ole_file, mock_post, tmp_path):
         },
         headers={"Authorization": "Bearer "},
     )
+
+
+@patch("requests.post")
+@patch("murfey.util.xrm.OleFileIO", wraps=OleFileIO)
+def test_sxt_context_opens_each_file_once(mock_ole_file, mock_post, tmp_path):
+    mock_post().status_code = 200
+    grid_dir = tmp_path / "cm12345-6/grid1"
+    for name in ("ref.xrm", "ref_old.xrm"):
+        write_ole_file(
+            grid_dir / name,
+            xrm_streams(ImageInfo_MosiacRows=[0], ImageInfo_MosiacColumns=[0]),
+        )
+    os.utime(grid_dir / "ref_old.xrm", ns=(0, 0))
+    write_ole_file(
+        grid_dir / "roi.xrm",
+        xrm_streams(ImageInfo_MosiacRows=[2], ImageInfo_MosiacColumns=[2]),
+    )
+    for name in ("ts1.txrm", "ts2.txrm"):
+        write_ole_file(
+            grid_dir / name,
+            xrm_streams(
+                ImageInfo_Angles=[-60, 30, 60],
+                ImageInfo_PixelSize=[0.01],
+                ImageInfo_ImagesTaken=[200],
+            ),
+        )
+
+    env = MurfeyInstanceEnvironment(
+        url=urlparse("http://localhost:8000"),
+        client_id=0,
+        sources=[grid_dir],
+        default_destinations={f"{grid_dir}": f"{tmp_path}/destination/cm12345-6"},
+        instrument_name="",
+        visit="cm12345-6",
+        murfey_session=1,
+    )
+    context = SXTContext("zeiss", grid_dir, {}, "")
+    for name in ("ref.xrm", "roi.xrm", "ts1.txrm", "ts2.txrm", "ts1.txrm"):
+        context.post_transfer(grid_dir / name, environment=env)
+
+    opened = sorted(Path(call.args[0]).name for call in mock_ole_file.call_args_list)
+    assert opened == ["ref.xrm", "ref_old.xrm", "roi.xrm", "ts1.txrm", "ts2.txrm"]
+    references = [
+        call.kwargs["json"]["xrm_reference"]
+        for call in mock_post.call_args_list
+        if call.args and call.args[0].endswith("/sxt_tilt_series")
+    ]
+    assert references == [f"{tmp_path}/destination/cm12345-6/ref.xrm"] * 3
@@ -266,3 +266,52 @@ def test_setting_tilt_series_size_and_completion_from_mdoc_parsing(
         )
     assert len(context._tilt_series["test_1"]) == 11
     assert context._completed_tilt_series == ["test_1"]
+
+
+@patch("requests.get")
+@patch("requests.post")
+def test_tilt_series_length_is_registered_once_per_change(
+    mock_post, mock_get, tmp_path
+):
+    mock_post().status_code = 200
+    mock_post.reset_mock()
+
+    env = MurfeyInstanceEnvironment(
+        url=urlparse("http://localhost:8000"),
+        client_id=0,
+        sources=[tmp_path],
+        default_destinations={tmp_path: str(tmp_path)},
+        instrument_name="",
+        visit="test",
+        murfey_session=1,
+    )
+    context = TomographyContext("tomo", tmp_path, {}, "")
+
+    def length_posts() -> list[list[int]]:
+        return [
+            c.kwargs["json"]["tilt_series_lengths"]
+            for c in mock_post.call_args_list
+            if "tilt_series_length" in c.args[0]
+        ]
+
+    mdoc = tmp_path / "Position_1.mdoc"
+    for num_tilts in range(1, 4):
+        with open(mdoc, "a") as f:
+            f.write(f"[ZValue = {num_tilts - 1}]\nTiltAngle = {num_tilts}\n\n")
+        # The same version of the mdoc can be transferred more than once
+        for _ in range(3):
+            context.post_transfer(mdoc, environment=env)
+    assert context._tilt_series_sizes == {"Position_1": 3}
+    assert length_posts() == [[1], [2], [3]]
+
+    # A length that fails to be registered is sent again with the next transfer
+    mock_post.reset_mock()
+    mock_post.return_value.status_code = 500
+    with open(mdoc, "a") as f:
+        f.write("[ZValue = 3]\nTiltAngle = 4\n\n")
+    context.post_transfer(mdoc, environment=env)
+    mock_post.return_value.status_code = 200
+    context.post_transfer(mdoc, environment=env)
+    context.post_transfer(mdoc, environment=env)
+    assert length_posts() == [[4], [4]]
+    assert context._registered_tilt_series_sizes == {"Position_1": 4}
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import threading
+import time
+import zlib
 from pathlib import Path
 from unittest.mock import mock_open
 
@@ -514,3 +517,128 @@ def test_analyse_tomo(
             "acquisition_software": analyser._context._acquisition_software,
         }
     )
+
+
+def test_analyser_workers_preserve_order_per_shard(
+    mocker: MockerFixture,
+    tmp_path: Path,
+):
+    # Record the order in which files are post-processed, stalling one tilt series
+    processed: list[Path] = []
+    lock = threading.Lock()
+
+    def _post_transfer(self, transferred_file: Path, **kwargs):
+        if "Position_1_" in transferred_file.name:
+            time.sleep(0.01)
+        with lock:
+            processed.append(transferred_file)
+
+    mocker.patch(
+        "murfey.client.contexts.tomo.TomographyContext.post_transfer", _post_transfer
+    )
+
+    test_files = [
+        tmp_path
+        / f"visit/Position_{ts}_{i:03}_{i * 3.0}_20250715_012434_fractions.tiff"
+        for i in range(1, 6)
+        for ts in range(1, 5)
+    ]
+    analyser = Analyser(tmp_path, "", num_workers=4)
+    assert len(analyser.worker_threads) == 4
+    analyser.start()
+    for file in test_files:
+        analyser.queue.put(file)
+    analyser.queue.join()
+    for worker_queue in analyser.worker_queues:
+        worker_queue.join()
+    analyser.stop()
+
+    # All files are processed, and the workers are stopped with the main thread
+    assert sorted(processed) == sorted(test_files)
+    assert not any(t.is_alive() for t in analyser.worker_threads)
+    assert analyser.num_files_in_queue == 0
+
+    # Files from the same tilt series are processed in the order they arrived
+    for ts in range(1, 5):
+        ts_files = [f for f in test_files if f.name.startswith(f"Position_{ts}_")]
+        assert [f for f in processed if f in ts_files] == ts_files
+
+    # Timings are recorded for each stage
+    assert analyser.stage_timings["analyse"].count == len(test_files)
+    assert analyser.stage_timings["post_transfer"].count == len(test_files)
+
+
+def test_analyser_stalled_shard_does_not_block_others(
+    mocker: MockerFixture,
+    tmp_path: Path,
+):
+    # Stall one tilt series until the files from all the others have been processed
+    stalled = threading.Event()
+    processed: list[Path] = []
+    lock = threading.Lock()
+
+    def _post_transfer(self, transferred_file: Path, **kwargs):
+        if transferred_file.name.startswith("Position_1_"):
+            stalled.wait(timeout=10)
+        with lock:
+            processed.append(transferred_file)
+
+    mocker.patch(
+        "murfey.client.contexts.tomo.TomographyContext.post_transfer", _post_transfer
+    )
+
+    test_files = [
+        tmp_path
+        / f"visit/Position_{ts}_{i:03}_{i * 3.0}_20250715_012434_fractions.tiff"
+        for i in range(1, 6)
+        for ts in (1, 2, 4, 5)
+    ]
+    analyser = Analyser(tmp_path, "", num_workers=4)
+    analyser.start()
+    for file in test_files:
+        analyser.queue.put(file)
+    analyser.queue.join()
+
+    # The stalled tilt series is on a lane of its own
+    assert analyser._context is not None
+    lanes = {
+        ts: zlib.crc32(
+            str(
+                analyser._context.shard_key(
+                    tmp_path
+                    / f"visit/Position_{ts}_001_3.0_20250715_012434_fractions.tiff"
+                )
+            ).encode()
+        )
+        % 4
+        for ts in (1, 2, 4, 5)
+    }
+    assert lanes[1] not in (lanes[2], lanes[4], lanes[5])
+
+    others = [f for f in test_files if not f.name.startswith("Position_1_")]
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        with lock:
+            if len(processed) == len(others):
+                break
+        time.sleep(0.01)
+    with lock:
+        assert sorted(processed) == sorted(others)
+    assert not stalled.is_set()
+
+    stalled.set()
+    for worker_queue in analyser.worker_queues:
+        worker_queue.join()
+    analyser.stop()
+    assert sorted(processed) == sorted(test_files)
+
+
+def test_analyser_single_worker_runs_inline(mocker: MockerFixture, tmp_path: Path):
+    mock_post_transfer = mocker.patch.object(Analyser, "post_transfer")
+    analyser = Analyser(tmp_path, "")
+    assert analyser.num_workers == 1
+    assert not analyser.worker_queues
+    analyser._analyse(
+        tmp_path / "visit/Position_1_001_0.0_20250715_012434_fractions.tiff"
+    )
+    mock_post_transfer.assert_called_once()
@@ -0,0 +1,113 @@
+import ctypes
+import itertools
+import sys
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.client import directory_events as directory_events_module
+from murfey.client.directory_events import directory_events
+
+_WAIT_TIMEOUT = 0x102
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Uses inotify")
+def test_inotify_directory_events(tmp_path: Path):
+    events = directory_events()
+    assert events.name == "inotify"
+    assert events.watch(str(tmp_path))
+    (tmp_path / "grid1").mkdir()
+    assert events.wait(1)
+    # Files written within watched directories don't count as changes to them
+    (tmp_path / "grid1" / "Session.dm").touch()
+    assert not events.wait(0)
+
+    # Wakes that haven't been waited for don't block once the pipe fills up
+    for _ in range(100_000):
+        events.wake()
+    assert not events.wait(1)
+
+    events.close()
+    events.close()
+    events.wake()
+    assert not events.watch(str(tmp_path))
+    assert not events.wait(0)
+
+
+@pytest.fixture
+def kernel32(mocker: MockerFixture) -> MagicMock:
+    """
+    Stands in for the Windows API, handing out increasing change notification
+    handles, with the wake event as handle 1
+    """
+    kernel32 = MagicMock()
+    kernel32.CreateEventW.return_value = 1
+    handles = itertools.count(100)
+    kernel32.FindFirstChangeNotificationW.side_effect = lambda *args: next(handles)
+    mocker.patch.object(ctypes, "WinDLL", create=True, return_value=kernel32)
+    mocker.patch.object(ctypes, "get_last_error", create=True, return_value=5)
+    mocker.patch.object(directory_events_module.sys, "platform", "win32")
+    return kernel32
+
+
+def test_windows_directory_events(kernel32: MagicMock, tmp_path: Path):
+    events = directory_events(windows_change_notifications=True)
+    assert events.name == "change notifications"
+    assert events.watch(str(tmp_path / "grid1"))
+    assert events.watch(str(tmp_path / "grid1"))
+    kernel32.FindFirstChangeNotificationW.assert_called_once_with(
+        str(tmp_path / "grid1"), False, 0x3
+    )
+    assert events.watch(str(tmp_path / "grid2"))
+
+    # Changes to both directories are collected in one wait, and 'grid1', which has
+    # since been removed, is no longer waited on
+    kernel32.WaitForMultipleObjects.side_effect = [2, 1, _WAIT_TIMEOUT]
+    kernel32.FindNextChangeNotification.side_effect = lambda handle: handle != 100
+    assert events.wait(1)
+    waits = kernel32.WaitForMultipleObjects.call_args_list
+    assert [list(w.args[1]) for w in waits] == [
+        [1, 100, 101],
+        [1, 100, 101],
+        [1, 101],
+    ]
+    assert [w.args[3] for w in waits] == [1000, 0, 0]
+    kernel32.FindCloseChangeNotification.assert_called_once_with(100)
+
+    # Being woken isn't a change
+    kernel32.WaitForMultipleObjects.reset_mock()
+    kernel32.WaitForMultipleObjects.side_effect = [0, _WAIT_TIMEOUT]
+    events.wake()
+    kernel32.SetEvent.assert_called_once_with(1)
+    assert not events.wait(1)
+    assert list(kernel32.WaitForMultipleObjects.call_args.args[1]) == [1, 101]
+
+    kernel32.WaitForMultipleObjects.side_effect = [_WAIT_TIMEOUT]
+    assert not events.wait(1)
+
+
+def test_windows_directory_events_left_to_be_polled(
+    kernel32: MagicMock, tmp_path: Path
+):
+    events = directory_events(windows_change_notifications=True)
+    handles = kernel32.FindFirstChangeNotificationW.side_effect
+    kernel32.FindFirstChangeNotificationW.side_effect = None
+    kernel32.FindFirstChangeNotificationW.return_value = ctypes.c_void_p(-1).value
+    assert not events.watch(str(tmp_path / "missing"))
+
+    # Only so many handles can be waited on at once, including the wake event
+    kernel32.FindFirstChangeNotificationW.side_effect = handles
+    for n in range(63):
+        assert events.watch(str(tmp_path / f"grid{n}"))
+    assert not events.watch(str(tmp_path / "grid63"))
+
+    events.close()
+    events.close()
+    assert kernel32.FindCloseChangeNotification.call_count == 63
+    kernel32.CloseHandle.assert_called_once_with(1)
+    events.wake()
+    kernel32.SetEvent.assert_not_called()
+    assert not events.watch(str(tmp_path / "grid0"))
+    assert not events.wait(0)
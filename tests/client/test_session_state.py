@@ -0,0 +1,131 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+from urllib.parse import urlparse
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.client.instance_environment import MovieTracker, MurfeyInstanceEnvironment
+from murfey.client.session_state import SessionStateStore
+from murfey.util.api import url_path_for
+from tests.instrument_server.test_api import set_up_test_client
+
+
+def test_session_state_store_spills_to_disk():
+    store: SessionStateStore[Path, MovieTracker] = SessionStateStore(
+        "movies", key_type=Path, max_entries=100
+    )
+    for n in range(1000):
+        store[Path(f"/dls/m01/movie_{n}.tiff")] = MovieTracker(n, n + 1)
+    stats = store.stats()
+    assert stats.entries == len(store) == 1000
+    assert stats.entries_in_memory <= 100
+    assert stats.entries_on_disk == 1000 - stats.entries_in_memory
+    assert stats.evictions == stats.entries_on_disk
+    assert stats.memory_bytes > 0
+    assert stats.disk_bytes > 0
+
+    # Spilled entries can be looked up, and are moved back into memory when they are
+    assert Path("/dls/m01/movie_3.tiff") in store
+    assert Path("/dls/m01/movie_1000.tiff") not in store
+    assert store[Path("/dls/m01/movie_3.tiff")] == MovieTracker(3, 4)
+    assert store.get(Path("/dls/m01/movie_1000.tiff")) is None
+    assert store.stats().disk_reads == 1
+    assert store.stats().entries_on_disk == stats.entries_on_disk - 1
+
+    store[Path("/dls/m01/movie_5.tiff")] = MovieTracker(0, 0)
+    del store[Path("/dls/m01/movie_6.tiff")]
+    with pytest.raises(KeyError):
+        del store[Path("/dls/m01/movie_6.tiff")]
+    assert len(store) == 999
+    assert store[Path("/dls/m01/movie_5.tiff")] == MovieTracker(0, 0)
+    assert sorted(store, key=lambda p: int(p.stem.split("_")[1]))[:7] == [
+        Path(f"/dls/m01/movie_{n}.tiff") for n in (0, 1, 2, 3, 4, 5, 7)
+    ]
+
+    store.clear()
+    assert len(store) == 0
+    assert Path("/dls/m01/movie_3.tiff") not in store
+    store.close()
+
+
+def test_session_state_store_compaction_and_reopening(tmp_path: Path):
+    store: SessionStateStore[str, list] = SessionStateStore(
+        "tilt_series", max_entries=10, path=tmp_path / "state.sqlite"
+    )
+    store["ts_1"] = [1, 2, 3]
+    store["ts_2"] = [4]
+    store.compact("ts_1")
+    assert store.stats().entries_in_memory == 1
+    assert store.stats().compactions == 1
+    assert store["ts_1"] == [1, 2, 3]
+    with pytest.raises(KeyError):
+        store.compact("ts_3")
+
+    # Entries in a named file are kept when the store is closed
+    store.close()
+    reopened: SessionStateStore[str, list] = SessionStateStore(
+        "tilt_series", path=tmp_path / "state.sqlite"
+    )
+    assert sorted(reopened) == ["ts_1", "ts_2"]
+    assert reopened.stats().entries_in_memory == 0
+    assert reopened["ts_1"] == [1, 2, 3]
+    assert reopened["ts_2"] == [4]
+    reopened.close()
+
+
+def test_temporary_spill_file_is_removed_on_close():
+    store: SessionStateStore[str, int] = SessionStateStore("numbers", max_entries=1)
+    store["a"] = 1
+    store["b"] = 2
+    spill_file = Path(store._db.execute("PRAGMA database_list").fetchone()[2])
+    assert spill_file.exists()
+    store.close()
+    assert not spill_file.exists()
+
+
+def test_environment_clear():
+    env = MurfeyInstanceEnvironment(
+        url=urlparse("http://localhost:8000"),
+        client_id=0,
+        instrument_name="m01",
+        state_max_entries=5,
+    )
+    for n in range(10):
+        env.movie_tilt_pair[Path(f"/dls/m01/ts_{n % 2}_{n}.tiff")] = f"ts_{n % 2}"
+    assert env.movie_tilt_pair[Path("/dls/m01/ts_1_1.tiff")] == "ts_1"
+    assert env.state_stats()["movie_tilt_pair"]["entries_on_disk"] > 0
+
+    env.clear()
+    assert len(env.movie_tilt_pair) == 0
+
+
+def test_get_multigrid_controller_state_stats(mocker: MockerFixture):
+    session_id = 1
+    env = MurfeyInstanceEnvironment(
+        url=urlparse("http://localhost:8000"),
+        client_id=0,
+        instrument_name="m01",
+        state_max_entries=2,
+    )
+    for n in range(3):
+        env.movies[Path(f"/dls/m01/movie_{n}.tiff")] = MovieTracker(n, n)
+    mocker.patch(
+        "murfey.instrument_server.api.controllers",
+        {session_id: MagicMock(_environment=env)},
+    )
+
+    client_server = set_up_test_client(session_id=session_id)
+    response = client_server.get(
+        url_path_for(
+            "api.router",
+            "get_multigrid_controller_state_stats",
+            session_id=session_id,
+        )
+    )
+    assert response.status_code == 200
+    stats = response.json()
+    assert set(stats) == {"movies", "movie_tilt_pair"}
+    assert stats["movies"]["entries"] == 3
+    assert stats["movies"]["entries_in_memory"] == 2
+    assert stats["movies"]["entries_on_disk"] == 1
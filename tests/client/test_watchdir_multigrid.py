@@ -0,0 +1,218 @@
+import sys
+import time
+from pathlib import Path
+from unittest.mock import MagicMock, call
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.client import (
+    directory_events as directory_events_module,
+    watchdir_multigrid,
+)
+from murfey.client.directory_events import DirectoryEvents, directory_events
+from murfey.client.watchdir_multigrid import MultigridDirWatcher
+from murfey.util.api import url_path_for
+from tests.instrument_server.test_api import set_up_test_client
+
+machine_config = {
+    "create_directories": ["atlas"],
+    "analyse_created_directories": ["atlas"],
+    "single_data_directory": False,
+}
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_multigrid_watcher_scan(mocker: MockerFixture, tmp_path: Path):
+    # Directories are cached as soon as they are listed
+    mocker.patch.object(watchdir_multigrid, "_MTIME_RESOLUTION_NS", 0)
+    visit = tmp_path / "visit"
+    (visit / "atlas").mkdir(parents=True)
+    (visit / "New folder").mkdir()
+    (visit / "grid1").mkdir()
+    (tmp_path / "grid1" / "Images-Disc1").mkdir(parents=True)
+    (tmp_path / "grid1" / "gain.gain").touch()
+    (visit / "tomo_grid" / "Sample2").mkdir(parents=True)
+    (visit / "tomo_grid" / "Sample2" / "Session.dm").touch()
+    (tmp_path / "tomo_grid_Sample2").mkdir()
+    (tmp_path / "tomo_grid_Sample2" / "Position_1.mrc").touch()
+
+    watcher = MultigridDirWatcher(visit, machine_config)
+    listener = MagicMock()
+    watcher.subscribe(listener)
+    watcher._scan()
+    assert listener.call_args_list == [
+        call(
+            visit / "atlas",
+            use_suggested_path=False,
+            analyse=True,
+            tag="atlas",
+        ),
+        call(
+            visit / "grid1",
+            extra_directory="metadata_grid1",
+            analyse=True,
+            limited=True,
+            tag="metadata",
+        ),
+        call(
+            tmp_path / "grid1" / "Images-Disc1",
+            remove_files=True,
+            analyse=True,
+            tag="fractions",
+        ),
+        call(
+            visit / "tomo_grid" / "Sample2",
+            extra_directory="metadata_tomo_grid_Sample2",
+            analyse=True,
+            limited=True,
+            tag="metadata",
+        ),
+        call(tmp_path / "tomo_grid_Sample2", analyse=True, tag="fractions"),
+    ]
+    assert watcher.stats().directories_detected == 5
+
+    # Nothing is listed again until a directory changes
+    listener.reset_mock()
+    listings = watcher.stats().directory_listings
+    watcher._scan()
+    listener.assert_not_called()
+    assert watcher.stats().directory_listings == listings
+
+    (visit / "grid2").mkdir()
+    watcher._scan()
+    listener.assert_called_once_with(
+        visit / "grid2",
+        extra_directory="metadata_grid2",
+        analyse=True,
+        limited=True,
+        tag="metadata",
+    )
+    # The visit directory and the new grid are listed
+    assert watcher.stats().directory_listings == listings + 2
+
+
+def test_multigrid_watcher_polling_fallback(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch.object(
+        watchdir_multigrid, "directory_events", return_value=DirectoryEvents()
+    )
+    watcher = MultigridDirWatcher(tmp_path, machine_config, poll_interval=0.05)
+    listener = MagicMock()
+    final_listener = MagicMock()
+    watcher.subscribe(listener)
+    watcher.subscribe(final_listener, final=True)
+    watcher.start()
+    try:
+        (tmp_path / "grid1").mkdir()
+        assert wait_for(lambda: listener.call_count == 1)
+        assert watcher.stats().notifier == "polling"
+    finally:
+        watcher.stop()
+    final_listener.assert_called_once_with()
+
+
+@pytest.mark.parametrize("enabled", (False, True))
+def test_windows_change_notifications_are_only_used_when_enabled(
+    mocker: MockerFixture, tmp_path: Path, enabled: bool
+):
+    mocker.patch.object(directory_events_module.sys, "platform", "win32")
+    mock_windows_events = mocker.patch.object(
+        directory_events_module, "WindowsDirectoryEvents"
+    )
+    events = directory_events(windows_change_notifications=enabled)
+    if enabled:
+        assert events is mock_windows_events.return_value
+    else:
+        mock_windows_events.assert_not_called()
+        assert events.name == "polling"
+    mocker.stopall()
+
+    # The setting is taken from the machine config
+    mock_directory_events = mocker.patch.object(
+        watchdir_multigrid, "directory_events", return_value=DirectoryEvents()
+    )
+    watcher = MultigridDirWatcher(
+        tmp_path,
+        {**machine_config, "windows_change_notifications": enabled},
+        poll_interval=0.05,
+    )
+    watcher.start()
+    watcher.stop()
+    mock_directory_events.assert_called_once_with(windows_change_notifications=enabled)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Uses inotify")
+def test_multigrid_watcher_detects_new_grids_from_events(
+    mocker: MockerFixture, tmp_path: Path
+):
+    events = directory_events()
+    assert events.name == "inotify"
+    events.close()
+    # Only changes are waited for, with no passes on a timer during the test
+    watcher = MultigridDirWatcher(tmp_path / "visit", machine_config, poll_interval=60)
+    (tmp_path / "visit").mkdir()
+    notified: dict[Path, float] = {}
+
+    def record_notification(path: Path, **kwargs):
+        notified.setdefault(path, time.time())
+
+    watcher.subscribe(record_notification)
+    watcher.start()
+    try:
+        assert wait_for(lambda: watcher.stats().passes == 1)
+
+        created = time.time()
+        (tmp_path / "visit" / "grid1").mkdir()
+        assert wait_for(lambda: tmp_path / "visit" / "grid1" in notified, timeout=1)
+        assert notified[tmp_path / "visit" / "grid1"] - created < 1
+        (tmp_path / "grid1" / "Images-Disc1").mkdir(parents=True)
+        assert wait_for(
+            lambda: tmp_path / "grid1" / "Images-Disc1" in notified, timeout=1
+        )
+        stats = watcher.stats()
+        assert stats.notifier == "inotify"
+        assert stats.last_detection_latency is not None
+        assert stats.max_detection_latency is not None
+        assert stats.max_detection_latency < 1
+
+        # Nothing is looked at while nothing changes
+        spy_scan = mocker.spy(watcher, "_scan")
+        time.sleep(0.5)
+        spy_scan.assert_not_called()
+        assert watcher.stats().passes == stats.passes
+        assert watcher.stats().directory_listings == stats.directory_listings
+    finally:
+        start = time.perf_counter()
+        watcher.stop()
+    # Stopping doesn't wait for the poll interval
+    assert time.perf_counter() - start < 5
+    # Stopping again once the watcher's events are closed does nothing
+    watcher.request_stop()
+    watcher.stop()
+
+
+def test_get_multigrid_watcher_stats(mocker: MockerFixture, tmp_path: Path):
+    session_id = 1
+    watcher = MultigridDirWatcher(tmp_path, machine_config)
+    (tmp_path / "grid1").mkdir()
+    watcher._scan()
+    mocker.patch("murfey.instrument_server.api.watchers", {session_id: watcher})
+
+    client_server = set_up_test_client(session_id=session_id)
+    response = client_server.get(
+        url_path_for("api.router", "get_multigrid_watcher_stats", session_id=session_id)
+    )
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["notifier"] == "polling"
+    assert stats["passes"] == 0
+    assert stats["directories_detected"] == 1
+    assert stats["directory_listings"] > 0
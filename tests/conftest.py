@@ -2,7 +2,10 @@ from __future__ import annotations
 
 import json
 import os
+import threading
+import time
 from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from typing import Any, Generator, Type, TypeVar
 
@@ -20,6 +23,62 @@ from sqlmodel import Session as SQLModelSession, SQLModel, select as sm_select
 
 from murfey.util.db import Session as MurfeySession
 
+"""
+=======================================================================================
+Options for running the throughput benchmarks, which are skipped by default
+=======================================================================================
+"""
+
+
+def pytest_addoption(parser: pytest.Parser):
+    group = parser.getgroup("benchmark", "Murfey throughput benchmarks")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="Run the tests marked as benchmarks",
+    )
+    group.addoption(
+        "--benchmark-output",
+        type=Path,
+        default=None,
+        help="JSON file to write the benchmark results to",
+    )
+    group.addoption(
+        "--benchmark-baseline",
+        type=Path,
+        default=Path(__file__).parent / "benchmarks" / "baseline.json",
+        help="JSON file of benchmark results to compare against",
+    )
+    group.addoption(
+        "--benchmark-tolerance",
+        type=float,
+        default=0.25,
+        help="Fraction by which results can be worse than the baseline",
+    )
+    group.addoption(
+        "--benchmark-rate",
+        type=float,
+        default=None,
+        help="Files per second written by the acquisition profiles",
+    )
+    group.addoption(
+        "--benchmark-steps",
+        type=int,
+        default=None,
+        help="Number of acquisition steps written by each profile",
+    )
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]):
+    if config.getoption("--benchmark"):
+        return None
+    skip_benchmark = pytest.mark.skip(reason="Benchmarks only run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+    return None
+
 
 @pytest.fixture(scope="session")
 def session_tmp_path(tmp_path_factory) -> Path:
@@ -372,3 +431,60 @@ def murfey_db_session(
         session.close()
         transaction.rollback()
         connection.close()
+
+
+class PackageUpstream:
+    """
+    A local HTTP server standing in for the package repositories proxied by the
+    bootstrap endpoints. Files are served with an ETag, conditional requests are
+    answered with a 304 response, and every request received is recorded.
+    """
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.requests: list[tuple[str, dict[str, str]]] = []
+        self.delay = 0.0
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                upstream.requests.append((self.path, dict(self.headers)))
+                time.sleep(upstream.delay)
+                content = upstream.files.get(self.path)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = f'"{hash(content)}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def requests_for(self, path: str) -> int:
+        return sum(1 for request_path, _ in self.requests if request_path == path)
+
+
+@pytest.fixture
+def package_upstream() -> Generator[PackageUpstream, None, None]:
+    upstream = PackageUpstream()
+    thread = threading.Thread(target=upstream.server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield upstream
+    finally:
+        upstream.server.shutdown()
+        upstream.server.server_close()
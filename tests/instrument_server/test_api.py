@@ -101,6 +101,26 @@ def test_check_multigrid_controller_status(mocker: MockerFixture):
     }
 
 
+@pytest.mark.parametrize(
+    ("function_name", "registry"),
+    (
+        ("get_multigrid_watcher_stats", "watchers"),
+        ("get_multigrid_controller_state_stats", "controllers"),
+    ),
+)
+def test_multigrid_stats_for_unknown_session(
+    mocker: MockerFixture, function_name: str, registry: str
+):
+    session_id = 1
+    mocker.patch(f"murfey.instrument_server.api.{registry}", {2: MagicMock()})
+
+    client_server = set_up_test_client(session_id=session_id)
+    response = client_server.get(
+        url_path_for("api.router", function_name, session_id=session_id)
+    )
+    assert response.status_code == 404
+
+
 test_upload_gain_reference_params_matrix = (
     # Rsync URL settings
     ("http://1.1.1.1",),  # When rsync_url is provided
@@ -0,0 +1,278 @@
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from unittest.mock import ANY, MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.instrument_server import gain_references
+from murfey.instrument_server.api import _get_machine_config
+from murfey.instrument_server.gain_references import (
+    GainReferenceCatalogue,
+    detector_hint,
+    file_type_of,
+)
+from murfey.util.api import url_path_for
+from tests.instrument_server.test_api import set_up_test_client
+
+
+def make_gain_reference(path: Path, mtime: float, size: int = 0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(size)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.mark.parametrize(
+    ("name", "file_type", "detector"),
+    (
+        ("20250101_Falcon4i_gain.gain", "eer", "falcon"),
+        ("gain_20250101.gain", "eer", "falcon"),
+        ("CountRef_K3_300kV.dm4", "dm4", "k3"),
+        ("K2-0001 gain.DM4", "dm4", "k2"),
+        ("SuperRef_20250101.dm4", "dm4", None),
+        ("gain_ref.mrc", "mrc", None),
+        ("gain_F4i.tiff", "tiff", "falcon"),
+        ("notes.txt", "txt", None),
+    ),
+)
+def test_gain_reference_metadata(name: str, file_type: str, detector: Optional[str]):
+    assert file_type_of(name) == file_type
+    assert detector_hint(name, file_type) == detector
+
+
+def test_gain_reference_catalogue(mocker: MockerFixture, tmp_path: Path):
+    make_gain_reference(tmp_path / "2024" / "CountRef_K3.dm4", 1000, size=2_600_000)
+    make_gain_reference(tmp_path / "2025" / "Falcon_gain.gain", 3000)
+    make_gain_reference(tmp_path / "2025" / "old" / "gain.mrc", 2000)
+    catalogue = GainReferenceCatalogue(tmp_path)
+    assert catalogue.refresh()
+
+    total, found = catalogue.query()
+    assert total == 3
+    assert [g.name for g in found] == [
+        "Falcon_gain.gain",
+        "gain.mrc",
+        "CountRef_K3.dm4",
+    ]
+    k3_gain = found[2].as_file()
+    assert k3_gain.size == 3
+    assert k3_gain.size_bytes == 2_600_000
+    assert k3_gain.file_type == "dm4"
+    assert k3_gain.detector == "k3"
+    assert k3_gain.timestamp == datetime.fromtimestamp(1000)
+    assert k3_gain.full_path == str(tmp_path / "2024" / "CountRef_K3.dm4")
+
+    # Nothing is listed again until a directory changes
+    spy_scandir = mocker.spy(gain_references.os, "scandir")
+    assert not catalogue.refresh()
+    spy_scandir.assert_not_called()
+
+    make_gain_reference(tmp_path / "2025" / "old" / "K2_gain.dm4", 4000)
+    (tmp_path / "2024" / "CountRef_K3.dm4").unlink()
+    assert catalogue.refresh()
+    assert spy_scandir.call_count == 2
+    assert [g.name for g in catalogue.query()[1]] == [
+        "K2_gain.dm4",
+        "Falcon_gain.gain",
+        "gain.mrc",
+    ]
+
+    # Files rewritten in place are picked up without listing their directory again
+    spy_scandir.reset_mock()
+    directory_mtime_ns = (tmp_path / "2025" / "old").stat().st_mtime_ns
+    with open(tmp_path / "2025" / "old" / "gain.mrc", "r+b") as f:
+        f.truncate(1000)
+    os.utime(tmp_path / "2025" / "old" / "gain.mrc", (5000, 5000))
+    os.utime(tmp_path / "2025" / "old", ns=(directory_mtime_ns, directory_mtime_ns))
+    assert catalogue.refresh()
+    spy_scandir.assert_not_called()
+    newest = catalogue.query()[1][0]
+    assert (newest.name, newest.size, newest.mtime) == ("gain.mrc", 1000, 5000)
+
+
+def test_gain_reference_catalogue_request_refresh(tmp_path: Path):
+    catalogue = GainReferenceCatalogue(tmp_path, refresh_interval=3600)
+    # Catalogues that have never been refreshed are always due
+    assert catalogue.request_refresh(60)
+    catalogue.start()
+    try:
+        assert catalogue.wait_until_ready(10)
+        make_gain_reference(tmp_path / "gain.gain", 1000)
+        # Refreshed recently, so the new file isn't looked for yet
+        assert not catalogue.request_refresh(60)
+        time.sleep(0.1)
+        assert len(catalogue) == 0
+        # Picked up by the background thread, rather than the caller
+        assert catalogue.request_refresh(0)
+        deadline = time.monotonic() + 10
+        while len(catalogue) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(catalogue) == 1
+    finally:
+        catalogue.stop()
+
+
+def test_gain_reference_catalogue_filters(tmp_path: Path):
+    for day in range(1, 31):
+        for name in ("Falcon_gain.gain", "CountRef_K3.dm4"):
+            make_gain_reference(
+                tmp_path / f"{day:02}" / name, datetime(2025, 1, day).timestamp()
+            )
+    catalogue = GainReferenceCatalogue(tmp_path)
+    catalogue.refresh()
+
+    total, found = catalogue.query(file_type="EER", offset=5, limit=10)
+    assert total == 30
+    assert [Path(g.path).parent.name for g in found] == [
+        f"{day:02}" for day in range(25, 15, -1)
+    ]
+    assert catalogue.query(detector="falcon")[0] == 30
+    assert catalogue.query(detector="k3", file_type="eer")[0] == 0
+
+    total, found = catalogue.query(
+        detector="k3",
+        since=datetime(2025, 1, 10),
+        until=datetime(2025, 1, 19),
+        offset=8,
+    )
+    assert total == 10
+    assert [Path(g.path).parent.name for g in found] == ["11", "10"]
+
+
+def test_gain_reference_queries_do_not_depend_on_directory_size(
+    mocker: MockerFixture, tmp_path: Path
+):
+    """
+    Indexes directories with 500 and 50,000 gain references, then checks that once
+    indexed, a page of gain references takes the same time to find in both and that
+    the file system is not touched while doing so
+    """
+
+    def query_time(catalogue: GainReferenceCatalogue, repeats: int = 200) -> float:
+        times = []
+        for n in range(repeats):
+            start = time.perf_counter()
+            total, page = catalogue.query(detector="falcon", offset=n, limit=20)
+            times.append(time.perf_counter() - start)
+            assert len(page) == 20
+        return sorted(times)[repeats // 2]
+
+    query_times = {}
+    for num_files in (500, 50_000):
+        directory = tmp_path / str(num_files)
+        for n in range(num_files):
+            name = "Falcon_gain.gain" if n % 2 else "CountRef_K3.dm4"
+            make_gain_reference(directory / f"{n // 1000:03}" / f"{n}_{name}", 1e9 + n)
+        catalogue = GainReferenceCatalogue(directory)
+        catalogue.refresh()
+        assert len(catalogue) == num_files
+        # Warm up
+        assert catalogue.query(detector="falcon")[0] == num_files // 2
+
+        mock_scandir = mocker.patch.object(gain_references.os, "scandir")
+        mock_stat = mocker.patch.object(gain_references.os, "stat")
+        query_times[num_files] = query_time(catalogue)
+        mock_scandir.assert_not_called()
+        mock_stat.assert_not_called()
+        mocker.stopall()
+
+    assert query_times[50_000] < 5 * query_times[500] + 1e-4
+
+
+def test_get_possible_gain_references(mocker: MockerFixture, tmp_path: Path):
+    session_id = 1
+    for day in range(1, 6):
+        make_gain_reference(
+            tmp_path / f"gain_{day}.gain", datetime(2025, 1, day).timestamp()
+        )
+    make_gain_reference(tmp_path / "CountRef.dm4", datetime(2025, 2, 1).timestamp())
+
+    mock_requests = mocker.patch("murfey.instrument_server.api.requests")
+    mock_requests.get.return_value = MagicMock(
+        status_code=200,
+        json=MagicMock(return_value={"gain_reference_directory": str(tmp_path)}),
+    )
+    mocker.patch(
+        "murfey.instrument_server.api._get_murfey_url",
+        return_value="https://murfey.server.test",
+    )
+    mocker.patch("murfey.instrument_server.api.tokens", {session_id: ANY})
+    mocker.patch("murfey.instrument_server.api._machine_configs", {})
+    mocker.patch("murfey.instrument_server.gain_references._catalogues", {})
+
+    client_server = set_up_test_client(session_id=session_id)
+    url_path = url_path_for(
+        "api.router",
+        "get_possible_gain_references",
+        instrument_name="murfey",
+        session_id=session_id,
+    )
+    response = client_server.get(url_path)
+    assert response.headers["X-Total-Count"] == "6"
+    assert [f["name"] for f in response.json()][:2] == ["CountRef.dm4", "gain_5.gain"]
+
+    response = client_server.get(
+        url_path,
+        params={"file_type": "eer", "until": "2025-01-03T12:00", "limit": 2},
+    )
+    assert response.headers["X-Total-Count"] == "3"
+    assert [(f["name"], f["detector"]) for f in response.json()] == [
+        ("gain_3.gain", "falcon"),
+        ("gain_2.gain", "falcon"),
+    ]
+    # The machine config is only fetched once
+    mock_requests.get.assert_called_once()
+
+    # Gain references collected since the last request are looked for in the
+    # background, without holding up the requests that ask for them
+    mocker.patch("murfey.instrument_server.api._gain_reference_max_age", 0)
+    catalogue = gain_references._catalogues[tmp_path]
+    refreshing = threading.Event()
+    release = threading.Event()
+    original_refresh = catalogue.refresh
+
+    def slow_refresh() -> bool:
+        refreshing.set()
+        release.wait(10)
+        return original_refresh()
+
+    mocker.patch.object(catalogue, "refresh", side_effect=slow_refresh)
+    make_gain_reference(tmp_path / "gain_6.gain", datetime(2025, 3, 1).timestamp())
+    start = time.perf_counter()
+    response = client_server.get(url_path)
+    assert time.perf_counter() - start < 5
+    assert response.headers["X-Total-Count"] == "6"
+    assert refreshing.wait(10)
+
+    release.set()
+    deadline = time.monotonic() + 10
+    while len(catalogue) < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    response = client_server.get(url_path)
+    assert response.headers["X-Total-Count"] == "7"
+    assert response.json()[0]["name"] == "gain_6.gain"
+    catalogue.stop()
+
+
+def test_failed_machine_config_responses_are_not_kept(mocker: MockerFixture):
+    mock_requests = mocker.patch("murfey.instrument_server.api.requests")
+    mock_requests.get.side_effect = [
+        MagicMock(status_code=500, json=MagicMock(return_value={"detail": "Error"})),
+        MagicMock(status_code=200, json=MagicMock(return_value={"camera": "FALCON"})),
+    ]
+    mocker.patch(
+        "murfey.instrument_server.api._get_murfey_url",
+        return_value="https://murfey.server.test",
+    )
+    mocker.patch("murfey.instrument_server.api.tokens", {1: ANY})
+    mocker.patch("murfey.instrument_server.api._machine_configs", {})
+
+    assert _get_machine_config("murfey", 1) == {"detail": "Error"}
+    assert _get_machine_config("murfey", 1) == {"camera": "FALCON"}
+    assert _get_machine_config("murfey", 1) == {"camera": "FALCON"}
+    assert mock_requests.get.call_count == 2
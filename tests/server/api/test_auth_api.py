@@ -1,17 +1,24 @@
 import copy
 import secrets
+import time
+from contextlib import asynccontextmanager
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from aiohttp import web
 from fastapi import HTTPException
+from jose import jwt
 from pytest_mock import MockerFixture
 from sqlmodel import Session as SQLModelSession
 
 from murfey.server.api.auth import (
+    TokenCache,
     check_user,
     get_visit_name,
     submit_to_auth_endpoint,
+    token_cache,
     validate_frontend_session_access,
+    validate_instrument_token,
     validate_session_against_visit,
     validate_token,
     validate_user,
@@ -20,6 +27,39 @@ from murfey.server.api.auth import (
 from murfey.util.db import MurfeyUser, Session as MurfeySession
 
 
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    # Validation outcomes must not leak between tests
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+
+@asynccontextmanager
+async def auth_server_stand_in(valid_tokens: set[str], calls: list[str]):
+    """
+    Runs a local auth server that accepts the given bearer tokens, recording the
+    tokens it was asked to validate
+    """
+
+    async def validate(request: web.Request):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        calls.append(token)
+        return web.json_response({"valid": token in valid_tokens})
+
+    app = web.Application()
+    app.router.add_get("/validate_token", validate)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await runner.cleanup()
+
+
 @pytest.mark.parametrize(
     "test_params",
     (  # User to check | Expected result
@@ -314,8 +354,106 @@ def test_validate_session_against_visit(
 
 
 @pytest.mark.asyncio
-async def test_validate_instrument_token():
-    pass
+async def test_validate_instrument_token_is_cached(mocker: MockerFixture):
+    calls: list[str] = []
+    async with auth_server_stand_in({"good_token"}, calls) as instrument_auth_url:
+        mock_security_config = MagicMock()
+        mock_security_config.instrument_auth_url = instrument_auth_url
+        mock_security_config.instrument_auth_type = "token"
+        mocker.patch("murfey.server.api.auth.security_config", mock_security_config)
+
+        # The auth server is only asked once about a valid token
+        for _ in range(20):
+            assert await validate_instrument_token(token="good_token") is None
+        assert calls == ["good_token"]
+
+        # Rejected tokens are also remembered
+        for _ in range(20):
+            with pytest.raises(HTTPException):
+                await validate_instrument_token(token="bad_token")
+        assert calls == ["good_token", "bad_token"]
+
+        # Clearing the cache causes the token to be validated again
+        token_cache.clear()
+        assert await validate_instrument_token(token="good_token") is None
+        assert calls == ["good_token", "bad_token", "good_token"]
+
+
+@pytest.mark.asyncio
+async def test_validate_token_is_cached_with_auth_url(mocker: MockerFixture):
+    calls: list[str] = []
+    async with auth_server_stand_in({"good_token"}, calls) as frontend_auth_url:
+        mocker.patch("murfey.server.api.auth.auth_url", frontend_auth_url)
+        mock_security_config = MagicMock()
+        mock_security_config.auth_type = "cookie"
+        mock_security_config.cookie_key = "_oauth2_proxy"
+        mocker.patch("murfey.server.api.auth.security_config", mock_security_config)
+        mock_request = MagicMock()
+        mock_request.headers = {"authorization": "Bearer good_token"}
+
+        for _ in range(20):
+            assert (
+                await validate_token(token="good_token", request=mock_request) is None
+            )
+        assert calls == ["good_token"]
+
+
+def test_token_cache_entries_expire_with_token():
+    cache = TokenCache(max_ttl=60, negative_ttl=5)
+    expired_token = jwt.encode({"expiry_time": time.time() - 1}, "key")
+    expiring_token = jwt.encode({"exp": int(time.time()) + 30}, "key")
+
+    cache.set("instrument_token", expired_token, True)
+    assert cache.get("instrument_token", expired_token) is None
+
+    cache.set("instrument_token", expiring_token, True)
+    assert cache.get("instrument_token", expiring_token) is True
+    # Results for one kind of validation are not reused for another
+    assert cache.get("frontend_token", expiring_token) is None
+
+
+def test_token_cache_negative_ttl(mocker: MockerFixture):
+    cache = TokenCache(max_ttl=60, negative_ttl=5)
+    mock_time = mocker.patch("murfey.server.api.auth.time.time", return_value=1000)
+    cache.set("instrument_token", "bad_token", False)
+    assert cache.get("instrument_token", "bad_token") is False
+    mock_time.return_value = 1006
+    assert cache.get("instrument_token", "bad_token") is None
+
+    # Caching can be turned off
+    cache = TokenCache(max_ttl=0, negative_ttl=0)
+    cache.set("instrument_token", "good_token", True)
+    assert len(cache) == 0
+
+
+def test_token_cache_invalidation():
+    cache = TokenCache(max_ttl=60, negative_ttl=5)
+    session_token = jwt.encode({"session": 1, "visit": "cm12345-1"}, "key")
+    other_session_token = jwt.encode({"session": 2, "visit": "cm12345-2"}, "key")
+    user_token = jwt.encode({"user": "murfey_user"}, "key")
+    for token in (session_token, other_session_token, user_token):
+        cache.set("instrument_token", token, True)
+
+    assert cache.invalidate_session(1) == 1
+    assert cache.get("instrument_token", session_token) is None
+    assert cache.get("instrument_token", other_session_token) is True
+
+    assert cache.invalidate_user("murfey_user") == 1
+    assert cache.get("instrument_token", user_token) is None
+    assert len(cache) == 1
+
+
+def test_token_cache_invalidated_on_user_change(murfey_db_session: SQLModelSession):
+    user = MurfeyUser(username="murfey_user", hashed_password="asdfghjkl")
+    murfey_db_session.add(user)
+    murfey_db_session.commit()
+    user_token = jwt.encode({"user": "murfey_user"}, "key")
+    token_cache.set("frontend_token", user_token, True)
+
+    user.hashed_password = "qwertyuiop"
+    murfey_db_session.add(user)
+    murfey_db_session.commit()
+    assert token_cache.get("frontend_token", user_token) is None
 
 
 def test_get_visit_name(
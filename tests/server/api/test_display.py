@@ -0,0 +1,137 @@
+import statistics
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from pytest_mock import MockerFixture
+from sqlmodel import Session
+
+from murfey.server.api.display import router
+from murfey.server.murfey_db import murfey_db_session as murfey_db_dependency
+from murfey.server.thumbnails import ThumbnailCache
+from murfey.util.db import DataCollectionGroup, GridSquare
+from tests.conftest import ExampleVisit, get_or_create_db_entry
+
+session_id = ExampleVisit.murfey_session_id
+dcg_id = 31
+
+
+@pytest.fixture
+def display_client(
+    mocker: MockerFixture, murfey_db_session: Session, tmp_path: Path
+) -> TestClient:
+    get_or_create_db_entry(
+        murfey_db_session,
+        DataCollectionGroup,
+        lookup_kwargs={"id": dcg_id, "session_id": session_id, "tag": "atlas"},
+    )
+    thumbnail_cache = ThumbnailCache(tmp_path / "thumbnails")
+    mocker.patch(
+        "murfey.server.api.display.get_thumbnail_cache",
+        return_value=thumbnail_cache,
+    )
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[murfey_db_dependency] = lambda: murfey_db_session
+    return TestClient(app)
+
+
+def add_grid_square(
+    murfey_db_session: Session, tmp_path: Path, name: int, size: int = 1024
+) -> Path:
+    # Smooth images with some noise, which compress like real micrographs
+    rng = np.random.default_rng(name)
+    gradient = np.linspace(0, 200, size, dtype=np.float32)
+    data = gradient[None, :] + rng.normal(0, 20, size=(size, size))
+    image_path = tmp_path / f"GridSquare_{name}.jpg"
+    Image.fromarray(np.clip(data, 0, 255).astype(np.uint8)).save(image_path, quality=95)
+    get_or_create_db_entry(
+        murfey_db_session,
+        GridSquare,
+        lookup_kwargs={
+            "name": name,
+            "session_id": session_id,
+            "tag": "atlas",
+            "image": str(image_path),
+        },
+    )
+    return image_path
+
+
+def image_url(name: int) -> str:
+    return (
+        f"/display/sessions/{session_id}/data_collection_groups/{dcg_id}"
+        f"/grid_squares/{name}/image"
+    )
+
+
+def test_grid_square_thumbnail(
+    display_client: TestClient, murfey_db_session: Session, tmp_path: Path
+):
+    image_path = add_grid_square(murfey_db_session, tmp_path, 1)
+
+    full_size = display_client.get(image_url(1))
+    assert full_size.status_code == 200
+    assert full_size.content == image_path.read_bytes()
+
+    thumbnail = display_client.get(image_url(1), params={"size": 128})
+    assert thumbnail.status_code == 200
+    assert thumbnail.headers["content-type"] == "image/jpeg"
+    assert thumbnail.headers["cache-control"] == "public, max-age=3600"
+    assert thumbnail.headers["etag"] != full_size.headers["etag"]
+    assert len(thumbnail.content) < len(full_size.content) / 10
+
+    assert display_client.get(image_url(1), params={"size": 100}).status_code == 422
+
+
+def test_if_none_match_returns_not_modified(
+    display_client: TestClient, murfey_db_session: Session, tmp_path: Path
+):
+    add_grid_square(murfey_db_session, tmp_path, 2)
+    etag = display_client.get(image_url(2), params={"size": 512}).headers["etag"]
+
+    response = display_client.get(
+        image_url(2), params={"size": 512}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    response = display_client.get(
+        image_url(2), params={"size": 512}, headers={"If-None-Match": '"other"'}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.benchmark
+def test_atlas_page_benchmark(
+    display_client: TestClient, murfey_db_session: Session, tmp_path: Path
+):
+    """
+    Compares loading the images for an atlas page of 100 grid squares at full
+    resolution against loading their 512 px thumbnails, once made.
+    """
+    names = range(100, 200)
+    for name in names:
+        add_grid_square(murfey_db_session, tmp_path, name)
+
+    def load_page(params: dict) -> tuple[int, float]:
+        total_bytes = 0
+        latencies = []
+        for name in names:
+            start = time.perf_counter()
+            response = display_client.get(image_url(name), params=params)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+            total_bytes += len(response.content)
+        return total_bytes, statistics.quantiles(latencies, n=20)[-1]
+
+    full_bytes, full_p95 = load_page({})
+    load_page({"size": 512})  # First load makes the thumbnails
+    thumbnail_bytes, thumbnail_p95 = load_page({"size": 512})
+    assert thumbnail_bytes < full_bytes / 3
+    assert thumbnail_p95 < full_p95
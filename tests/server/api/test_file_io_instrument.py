@@ -1,16 +1,22 @@
+import asyncio
+from datetime import datetime
 from pathlib import Path
 from unittest.mock import MagicMock
 
 import pytest
 from pytest_mock import MockerFixture
 
+from murfey.server.api import file_io_instrument
 from murfey.server.api.file_io_instrument import (
     Dest,
+    FractionationParameters,
     SuggestedPathParameters,
     make_rsyncer_destination,
     suggest_path,
+    write_eer_fractionation_file,
 )
 from murfey.util.config import MachineConfig
+from tests.util.test_eer import make_eer
 
 
 @pytest.mark.parametrize(
@@ -59,8 +65,8 @@ def test_suggest_path(
     mock_db.exec.return_value.one.return_value = mock_session
 
     # Mock 'get_machine_config'
-    machine_config = MachineConfig(
-        **{
+    machine_config = MachineConfig.model_validate(
+        {
             "rsync_basepath": str(rsync_basepath),
             "mkdir_chmod": "0o775",
         }
@@ -137,8 +143,8 @@ def test_make_rsyncer_destination(
     mock_db.exec.return_value.one.return_value = mock_session
 
     # Mock 'get_machine_config'
-    machine_config = MachineConfig(
-        **{
+    machine_config = MachineConfig.model_validate(
+        {
             "rsync_basepath": str(rsync_basepath),
             "mkdir_chmod": "0o775",
         }
@@ -158,3 +164,148 @@ def test_make_rsyncer_destination(
     )
     assert result == dest
     assert destination.exists()
+
+
+def test_write_eer_fractionation_file_once_per_parameter_set(
+    mocker: MockerFixture,
+    tmp_path: Path,
+):
+    instrument_name = "test"
+    visit_name = "visit"
+    session_id = 1
+
+    rsync_basepath = tmp_path / "data"
+    year = str(datetime.now().year)
+    gain_dir = rsync_basepath / year / visit_name / "processing"
+    gain_dir.mkdir(parents=True)
+    movies = []
+    for i in range(100):
+        movie = tmp_path / "movies" / f"movie_{i}.eer"
+        movie.parent.mkdir(exist_ok=True)
+        movie.write_bytes(make_eer(1200))
+        movies.append(movie)
+
+    # Mock the database calls, with no processing parameters registered
+    mock_session = MagicMock()
+    mock_session.instrument_name = instrument_name
+    mock_db = MagicMock()
+    mock_db.exec.return_value.one.return_value = mock_session
+    mock_db.exec.return_value.all.return_value = []
+
+    mocker.patch(
+        "murfey.server.api.file_io_instrument.get_machine_config",
+        return_value={
+            instrument_name: MachineConfig(
+                rsync_basepath=rsync_basepath, gain_directory_name="processing"
+            ),
+        },
+    )
+    mocker.patch.dict(
+        "murfey.server.api.file_io_instrument._fractionation_files", clear=True
+    )
+    spy_num_frames = mocker.spy(file_io_instrument, "num_frames")
+    spy_open = mocker.patch("builtins.open", wraps=open)
+
+    # The SPA context asks for a file for every movie, and the tomography context
+    # gives the number of frames instead
+    for movie in movies:
+        for params in (
+            FractionationParameters(
+                fractionation=20,
+                dose_per_frame=1,
+                eer_path=str(movie),
+                fractionation_file_name="eer_fractionation_spa.txt",
+            ),
+            FractionationParameters(
+                fractionation=20,
+                dose_per_frame=1,
+                num_frames=1200,
+                fractionation_file_name="eer_fractionation_tomo.txt",
+            ),
+        ):
+            result = asyncio.run(
+                write_eer_fractionation_file(
+                    visit_name=visit_name,
+                    session_id=session_id,
+                    fractionation_params=params,
+                    db=mock_db,
+                )
+            )
+            assert result == {
+                "eer_fractionation_file": str(gain_dir / params.fractionation_file_name)
+            }
+
+    assert sorted(f.name for f in gain_dir.iterdir()) == [
+        "eer_fractionation_spa.txt",
+        "eer_fractionation_tomo.txt",
+    ]
+    for frac_file in gain_dir.iterdir():
+        assert frac_file.read_text() == "1200 20 0.05"
+    # The session and movie are only looked up for the first request of each set,
+    # while the processing parameters are checked for every request
+    assert spy_num_frames.call_count == 1
+    assert mock_db.exec.call_count == 2 * len(movies) + 2
+    assert [c.args[1] for c in spy_open.call_args_list].count("w") == 2
+
+
+def test_write_eer_fractionation_file_follows_session_parameters(
+    mocker: MockerFixture,
+    tmp_path: Path,
+):
+    instrument_name = "test"
+    rsync_basepath = tmp_path / "data"
+    gain_dir = rsync_basepath / str(datetime.now().year) / "visit" / "processing"
+    gain_dir.mkdir(parents=True)
+
+    session_parameters = MagicMock(
+        dose_per_frame=1, eer_fractionation=20, eer_fractionation_file=None
+    )
+    mock_db = MagicMock()
+    mock_db.exec.return_value.one.return_value.instrument_name = instrument_name
+    mock_db.exec.return_value.all.return_value = [session_parameters]
+    mock_get_machine_config = mocker.patch(
+        "murfey.server.api.file_io_instrument.get_machine_config",
+        return_value={
+            instrument_name: MachineConfig(
+                rsync_basepath=rsync_basepath, gain_directory_name="processing"
+            ),
+        },
+    )
+    mocker.patch.dict(
+        "murfey.server.api.file_io_instrument._fractionation_files", clear=True
+    )
+    mocker.patch("murfey.server.api.file_io_instrument._max_fractionation_files", 1)
+
+    def request(file_name: str):
+        return asyncio.run(
+            write_eer_fractionation_file(
+                visit_name="visit",
+                session_id=1,
+                fractionation_params=FractionationParameters(
+                    fractionation=10,
+                    dose_per_frame=2,
+                    num_frames=1200,
+                    fractionation_file_name=file_name,
+                ),
+                db=mock_db,
+            )
+        )
+
+    # The file is written with the session's parameters rather than the requested
+    # ones, and set up again if they change
+    request("eer_fractionation.txt")
+    assert (gain_dir / "eer_fractionation.txt").read_text() == "1200 20 0.05"
+    assert session_parameters.eer_fractionation_file == str(
+        gain_dir / "eer_fractionation.txt"
+    )
+    request("eer_fractionation.txt")
+    assert mock_get_machine_config.call_count == 1
+    session_parameters.dose_per_frame = 2
+    request("eer_fractionation.txt")
+    assert mock_get_machine_config.call_count == 2
+
+    # Only the most recent files are remembered
+    request("eer_fractionation_2.txt")
+    assert list(file_io_instrument._fractionation_files.values()) == [
+        str(gain_dir / "eer_fractionation_2.txt")
+    ]
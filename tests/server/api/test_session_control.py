@@ -128,4 +128,5 @@ async def test_gather_upstream_files(
         upstream_visit_path=Path(upstream_visit_path),
         search_strings=search_strings,
         db=mock_db,
+        refresh=False,
     )
@@ -3,9 +3,13 @@ from typing import Any
 from unittest.mock import MagicMock
 
 import pytest
+from fastapi import HTTPException
 from pytest_mock import MockerFixture
 
-from murfey.server.api.session_info import gather_upstream_files
+from murfey.server.api.session_info import (
+    gather_upstream_files,
+    invalidate_ispyb_cache,
+)
 from murfey.util.models import UpstreamFileRequestInfo
 
 
@@ -56,4 +60,20 @@ async def test_gather_upstream_files(
         upstream_visit_path=Path(upstream_visit_path),
         search_strings=search_strings,
         db=mock_db,
+        refresh=False,
     )
+
+
+def test_invalidate_ispyb_cache(mocker: MockerFixture):
+    mock_invalidate = mocker.patch(
+        "murfey.server.api.session_info.invalidate_ispyb_caches", return_value=3
+    )
+    assert invalidate_ispyb_cache() == {"removed": 3}
+    mock_invalidate.assert_called_once_with(None)
+    assert invalidate_ispyb_cache(query="ongoing_visits") == {"removed": 3}
+    mock_invalidate.assert_called_with("ongoing_visits")
+
+    with pytest.raises(HTTPException) as exc_info:
+        invalidate_ispyb_cache(query="unknown")
+    assert exc_info.value.status_code == 404
+    assert mock_invalidate.call_count == 2
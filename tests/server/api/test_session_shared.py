@@ -5,10 +5,21 @@ import pytest
 from pytest_mock import MockerFixture
 
 from murfey.server.api.session_shared import find_upstream_visits, gather_upstream_files
+from murfey.server.upstream_index import UpstreamIndex
 from murfey.util.config import MachineConfig
 from tests.conftest import ExampleVisit
 
 
+@pytest.fixture(autouse=True)
+def upstream_index(mocker: MockerFixture, tmp_path: Path):
+    index = UpstreamIndex(tmp_path / "upstream_index.sqlite")
+    mocker.patch(
+        "murfey.server.api.session_shared.get_upstream_index", return_value=index
+    )
+    yield index
+    index.close()
+
+
 @pytest.mark.parametrize("recurse", (True, False))
 def test_find_upstream_visits(
     mocker: MockerFixture,
@@ -118,7 +129,7 @@ def test_find_upstream_visits_permission_error(
 
     # Mock the 'os.scandir' function used
     mocker.patch(
-        "murfey.server.api.session_shared.os.scandir",
+        "murfey.server.upstream_index.os.scandir",
         side_effect=PermissionError(),
     )
 
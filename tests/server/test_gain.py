@@ -1,15 +1,87 @@
 import os
+import struct
+import time
 from pathlib import Path
 from unittest import mock
 from unittest.mock import AsyncMock, MagicMock
 
+import mrcfile
+import numpy as np
 import pytest
+from PIL import Image
 from pytest_mock import MockerFixture
 
-from murfey.server.gain import Camera, prepare_gain
+from murfey.server import gain
+from murfey.server.gain import Camera, prepare_eer_gain, prepare_gain
 from murfey.util import secure_path
 
 
+def _dm4_tag(name: str, content: bytes, group: bool = False) -> bytes:
+    return (
+        bytes([20 if group else 21])
+        + struct.pack(">H", len(name))
+        + name.encode()
+        + struct.pack(">Q", len(content))
+        + content
+    )
+
+
+def _dm4_group(*tags: bytes) -> bytes:
+    return b"\x00\x01" + struct.pack(">Q", len(tags)) + b"".join(tags)
+
+
+def _dm4_data(info: list[int], payload: bytes) -> bytes:
+    return b"%%%%" + struct.pack(f">Q{len(info)}Q", len(info), *info) + payload
+
+
+def write_dm4(path: Path, image: np.ndarray):
+    """
+    Writes a DigitalMicrograph 4 file with a thumbnail followed by the image
+    """
+
+    def image_entry(pixels: np.ndarray) -> bytes:
+        height, width = pixels.shape
+        image_data = _dm4_group(
+            _dm4_tag(
+                "Data", _dm4_data([20, 6, pixels.size], pixels.astype("<f4").tobytes())
+            ),
+            _dm4_tag("DataType", _dm4_data([3], struct.pack("<i", 2))),
+            _dm4_tag(
+                "Dimensions",
+                _dm4_group(
+                    _dm4_tag("", _dm4_data([5], struct.pack("<I", width))),
+                    _dm4_tag("", _dm4_data([5], struct.pack("<I", height))),
+                ),
+                group=True,
+            ),
+        )
+        return _dm4_tag(
+            "", _dm4_group(_dm4_tag("ImageData", image_data, group=True)), group=True
+        )
+
+    root = _dm4_group(
+        _dm4_tag("Name", _dm4_data([18, 4], "gain".encode("utf-16-le"))),
+        _dm4_tag(
+            "ImageList",
+            _dm4_group(image_entry(image[::8, ::8]), image_entry(image)),
+            group=True,
+        ),
+    )
+    path.write_bytes(struct.pack(">IQI", 4, len(root), 1) + root + bytes(8))
+
+
+@pytest.fixture
+def gain_cache(mocker: MockerFixture, tmp_path: Path, monkeypatch):
+    # Run without any IMOD programs being available
+    monkeypatch.setenv("PATH", "")
+    cache_directory = tmp_path / "gain_cache"
+    mocker.patch(
+        "murfey.server.gain.get_security_config",
+        return_value=MagicMock(gain_cache_directory=cache_directory),
+    )
+    return cache_directory
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "test_params",
@@ -179,6 +251,108 @@ async def test_prepare_gain(
         assert result == (gain_out, (gain_out_superres if rescale else gain_out))
 
 
+def read_mrc(path: Path) -> np.ndarray:
+    with mrcfile.open(path) as mrc:
+        return mrc.data.copy()
+
+
 @pytest.mark.asyncio
-async def test_prepare_eer_gain():
-    pass
+@pytest.mark.parametrize("camera", (Camera.K3_FLIPX, Camera.K3_FLIPY))
+@pytest.mark.parametrize("rescale", (True, False))
+async def test_prepare_gain_in_process(
+    camera: Camera, rescale: bool, gain_cache: Path, tmp_path: Path
+):
+    rng = np.random.default_rng(0)
+    image = rng.uniform(0.5, 1.5, size=(96, 128)).astype(np.float32)
+    gain_path = tmp_path / "processing" / "K3-18480071_Gain_Ref.dm4"
+    gain_path.parent.mkdir()
+    write_dm4(gain_path, image)
+
+    gain_out, gain_out_superres = await prepare_gain(
+        camera, gain_path, {}, {}, rescale=rescale, tag="20260101"
+    )
+
+    # Inverted in Y on conversion, then flipped and binned as 'clip' and 'newstack' do
+    superres = image[::-1]
+    superres = superres[::-1] if camera == Camera.K3_FLIPX else superres[:, ::-1]
+    binned = superres.reshape(48, 2, 64, 2).mean(axis=(1, 3))
+    assert gain_out == gain_path.parent / "gain_20260101.mrc"
+    if rescale:
+        assert gain_out_superres == gain_path.parent / "gain_20260101_superres.mrc"
+        assert gain_out_superres.is_symlink()
+        np.testing.assert_array_equal(read_mrc(gain_out_superres), superres)
+        np.testing.assert_allclose(read_mrc(gain_out), binned, rtol=1e-6)
+    else:
+        assert gain_out_superres == gain_out
+        np.testing.assert_array_equal(read_mrc(gain_out), superres)
+
+
+@pytest.mark.asyncio
+async def test_prepare_gain_reuses_cached_results(
+    mocker: MockerFixture, gain_cache: Path, tmp_path: Path
+):
+    gain_path = tmp_path / "processing" / "gain.dm4"
+    gain_path.parent.mkdir()
+    write_dm4(gain_path, np.arange(64 * 64, dtype=np.float32).reshape(64, 64))
+    spy_read = mocker.spy(gain, "read_dm4")
+
+    first, _ = await prepare_gain(Camera.K3_FLIPY, gain_path, {}, {}, tag="1")
+    second, _ = await prepare_gain(Camera.K3_FLIPY, gain_path, {}, {}, tag="2")
+    assert spy_read.call_count == 1
+    np.testing.assert_array_equal(read_mrc(first), read_mrc(second))
+
+    # A different transform of the same gain reference is a separate result
+    await prepare_gain(Camera.K3_FLIPX, gain_path, {}, {}, tag="3")
+    assert spy_read.call_count == 2
+    assert len(list(gain_cache.glob("*.mrc"))) == 4
+
+
+@pytest.mark.asyncio
+async def test_prepare_gain_falls_back_to_imod(mocker: MockerFixture, gain_cache: Path):
+    mock_logger = mocker.patch("murfey.server.gain.logger")
+    gain_path = gain_cache.parent / "processing" / "gain.dm4"
+    gain_path.parent.mkdir()
+    gain_path.write_bytes(b"Not a DM4 file")
+
+    result = await prepare_gain(Camera.K3_FLIPY, gain_path, {}, {})
+    mock_logger.warning.assert_called_once()
+    mock_logger.error.assert_called_with(
+        "No executables were provided to prepare the gain reference with"
+    )
+    assert result == (None, None)
+
+
+@pytest.mark.asyncio
+async def test_prepare_eer_gain(gain_cache: Path, tmp_path: Path):
+    rng = np.random.default_rng(0)
+    image = rng.uniform(0.5, 1.5, size=(64, 48)).astype(np.float32)
+    gain_path = tmp_path / "processing" / "20260101_gain.tiff"
+    gain_path.parent.mkdir()
+    Image.fromarray(image, mode="F").save(gain_path)
+
+    gain_out, gain_out_superres = await prepare_eer_gain(gain_path, {}, {})
+    assert gain_out == gain_path.parent / "gain.mrc"
+    assert gain_out_superres is None
+    np.testing.assert_array_equal(read_mrc(gain_out), image[::-1])
+    assert gain_out.with_suffix(".gain").read_bytes() == gain_path.read_bytes()
+
+
+@pytest.mark.benchmark
+@pytest.mark.asyncio
+async def test_prepare_4k_gain_timing(gain_cache: Path, tmp_path: Path):
+    gain_path = tmp_path / "processing" / "gain.dm4"
+    gain_path.parent.mkdir()
+    write_dm4(
+        gain_path,
+        np.random.default_rng(0).uniform(0.5, 1.5, (4096, 4096)).astype(np.float32),
+    )
+
+    start = time.perf_counter()
+    await prepare_gain(Camera.K3_FLIPX, gain_path, {}, {}, tag="1")
+    prepared = time.perf_counter() - start
+    start = time.perf_counter()
+    await prepare_gain(Camera.K3_FLIPX, gain_path, {}, {}, tag="2")
+    cached = time.perf_counter() - start
+    # Launching the three IMOD programs alone takes longer than this
+    assert prepared < 5
+    assert cached < prepared
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock
+
+import aiohttp
+import pytest
+from aiohttp import web
+from pytest_mock import MockerFixture
+
+from murfey.server.api.instrument import check_if_session_is_active
+from murfey.server.instrument_client import (
+    InstrumentServerClient,
+    instrument_server_client,
+)
+
+
+@asynccontextmanager
+async def instrument_server_stand_in(delays: list[float] | None = None):
+    """
+    Runs a local server that answers every request with a 200 response, optionally
+    waiting before responding. Yields the server URL and a list of the client ports
+    of the requests it received, from which the number of connections can be found.
+    """
+    delays = list(delays or [])
+    client_ports: list[int] = []
+
+    async def respond(request: web.Request):
+        client_ports.append(request.transport.get_extra_info("peername")[1])
+        if delays:
+            await asyncio.sleep(delays.pop(0))
+        return web.json_response({"success": True})
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", respond)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}", client_ports
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_slow_instrument_server_does_not_delay_others(mocker: MockerFixture):
+    async with (
+        instrument_server_stand_in(delays=[1]) as (slow_url, _),
+        instrument_server_stand_in() as (fast_url, _),
+    ):
+        machine_configs = {
+            "slow": MagicMock(instrument_server_url=slow_url),
+            "fast": MagicMock(instrument_server_url=fast_url),
+        }
+        mocker.patch(
+            "murfey.server.api.instrument.get_machine_config",
+            side_effect=lambda instrument_name: machine_configs,
+        )
+        mocker.patch(
+            "murfey.server.api.instrument.instrument_server_tokens",
+            {1: {"access_token": "token_1"}, 2: {"access_token": "token_2"}},
+        )
+
+        start_time = time.perf_counter()
+        finish_times: dict[str, float] = {}
+
+        async def check(instrument_name: str, session_id: int):
+            result = await check_if_session_is_active(instrument_name, session_id)
+            finish_times[instrument_name] = time.perf_counter() - start_time
+            return result
+
+        results = await asyncio.gather(check("slow", 1), check("fast", 2))
+        await instrument_server_client.close()
+
+    assert results == [{"active": True}, {"active": True}]
+    assert finish_times["slow"] >= 1
+    assert finish_times["fast"] < 0.5
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused():
+    client = InstrumentServerClient(limit_per_host=2)
+    async with instrument_server_stand_in() as (url, client_ports):
+        for _ in range(10):
+            async with client.get(f"{url}/health") as response:
+                assert (await response.json()) == {"success": True}
+        assert len(set(client_ports)) == 1
+
+        # Concurrent requests are limited to the connections allowed per host
+        client_ports.clear()
+
+        async def post():
+            async with client.post(f"{url}/sessions/1/finalise_session") as response:
+                return response.status
+
+        assert await asyncio.gather(*(post() for _ in range(10))) == [200] * 10
+        assert len(set(client_ports)) <= 2
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_get_requests_are_retried():
+    client = InstrumentServerClient(retry_delay=0)
+    timeout = aiohttp.ClientTimeout(sock_read=0.2)
+    async with instrument_server_stand_in(delays=[0.5]) as (url, client_ports):
+        async with client.get(f"{url}/health", timeout=timeout) as response:
+            assert response.status == 200
+        assert len(client_ports) == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_post_requests_are_not_retried():
+    client = InstrumentServerClient(retry_delay=0)
+    timeout = aiohttp.ClientTimeout(sock_read=0.2)
+    async with instrument_server_stand_in(delays=[0.5]) as (url, client_ports):
+        with pytest.raises(asyncio.TimeoutError):
+            async with client.post(f"{url}/sessions/1/stop_rsyncer", timeout=timeout):
+                pass
+        assert len(client_ports) == 1
+    await client.close()
+
+
+def test_session_from_a_finished_event_loop_is_detached():
+    client = InstrumentServerClient()
+    old_session = asyncio.run(client.session())
+    new_session = asyncio.run(client.session())
+    assert new_session is not old_session
+    assert old_session.closed
+    assert old_session.connector is None
+    asyncio.run(client.close())
+
+
+def test_session_from_a_running_event_loop_is_closed_on_that_loop():
+    client = InstrumentServerClient()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        old_session = asyncio.run_coroutine_threadsafe(client.session(), loop).result(
+            timeout=5
+        )
+        new_session = asyncio.run(client.session())
+        assert new_session is not old_session
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), loop).result(timeout=5)
+        assert old_session.closed
+        asyncio.run(client.close())
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
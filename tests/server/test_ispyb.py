@@ -1,14 +1,37 @@
+import datetime
+import threading
+import time
 from unittest import mock
 
+import pytest
 from ispyb.sqlalchemy import BLSession, DataCollectionGroup, Proposal
 from pytest import mark
+from pytest_mock import MockerFixture
 from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
-from murfey.server.ispyb import TransportManager, get_proposal_id, get_session_id
+from murfey.server import ispyb
+from murfey.server.ispyb import (
+    ISPyBLookupCache,
+    TransportManager,
+    Visit,
+    get_all_ongoing_visits,
+    get_proposal_id,
+    get_session_id,
+    invalidate_ispyb_caches,
+)
+from murfey.util.models import GridSquareParameters
 from tests.conftest import ExampleVisit, get_or_create_db_entry
 
 
+@pytest.fixture(autouse=True)
+def clear_ispyb_caches():
+    invalidate_ispyb_caches()
+    yield
+    invalidate_ispyb_caches()
+
+
 def test_get_session_id(
     ispyb_db_session: Session,
 ):
@@ -61,6 +84,23 @@ def test_get_proposal_id(
     assert proposal_id == result
 
 
+def test_get_session_id_is_cached(mocker: MockerFixture, ispyb_db_session: Session):
+    spy_query = mocker.spy(ispyb_db_session, "query")
+    results = [
+        get_session_id(
+            microscope=ExampleVisit.instrument_name,
+            proposal_code=ExampleVisit.proposal_code,
+            proposal_number=str(ExampleVisit.proposal_number),
+            visit_number=str(ExampleVisit.visit_number),
+            db=ispyb_db_session,
+        )
+        for _ in range(3)
+    ]
+    assert results[0] is not None
+    assert results == [results[0]] * 3
+    assert spy_query.call_count == 1
+
+
 @mark.skip
 def test_get_sub_samples_from_visit():
     pass
@@ -110,3 +150,259 @@ def test_update_data_collection_group(mock_transport, ispyb_db_session: Session)
         lookup_kwargs={"dataCollectionGroupId": 1},
     )
     assert final_dcg_entry.experimentTypeId == 2
+
+
+def _mock_ispyb_session(first_id: int = 1):
+    """
+    Returns a mock ISPyB session that assigns sequential IDs to added records
+    """
+    db = mock.MagicMock()
+    db.__enter__.return_value = db
+
+    def _add_all(records):
+        for i, record in enumerate(records):
+            setattr(record, "gridSquareId", first_id + i)
+
+    db.add_all.side_effect = _add_all
+    return db
+
+
+@mock.patch("workflows.transport.pika_transport.PikaTransport")
+def test_insert_grid_squares_returns_ids_in_order(mock_transport):
+    db = _mock_ispyb_session(first_id=11)
+    transport_manager = TransportManager("PikaTransport")
+    with mock.patch("murfey.server.ispyb.ISPyBSession", return_value=db):
+        result = transport_manager.do_insert_grid_squares(
+            [
+                (1, label, GridSquareParameters(tag="tag", x_location_scaled=label))
+                for label in (5, 3, 4)
+            ]
+        )
+
+    assert result == {"success": True, "return_value": [11, 12, 13]}
+    db.add_all.assert_called_once()
+    assert [record.gridSquareLabel for record in db.add_all.call_args[0][0]] == [
+        5,
+        3,
+        4,
+    ]
+    db.commit.assert_called_once()
+
+
+@mock.patch("workflows.transport.pika_transport.PikaTransport")
+def test_queued_grid_square_updates_are_coalesced(mock_transport):
+    db = _mock_ispyb_session()
+    transport_manager = TransportManager("PikaTransport", update_delay=60)
+    with mock.patch("murfey.server.ispyb.ISPyBSession", return_value=db):
+        transport_manager.queue_grid_square_update(
+            1, GridSquareParameters(tag="tag", image="a.jpg", angle=10)
+        )
+        transport_manager.queue_grid_square_update(
+            2, GridSquareParameters(tag="tag", x_location_scaled=20)
+        )
+        transport_manager.queue_grid_square_update(
+            1, GridSquareParameters(tag="tag", image="b.jpg", x_location_scaled=30)
+        )
+        # Nothing is written until the queue is flushed
+        db.execute.assert_not_called()
+        result = transport_manager.flush_updates()
+
+    assert result == {"success": True, "return_value": [1, 2]}
+    db.execute.assert_called_once()
+    assert db.execute.call_args[0][1] == [
+        {
+            "gridSquareId": 1,
+            "gridSquareImage": "b.jpg",
+            "angle": 10,
+            "pixelLocationX": 30,
+        },
+        {"gridSquareId": 2, "pixelLocationX": 20},
+    ]
+    db.commit.assert_called_once()
+
+    # The queue is empty after flushing
+    assert transport_manager.flush_updates() == {"success": True, "return_value": []}
+    db.execute.assert_called_once()
+
+
+@mock.patch("workflows.transport.pika_transport.PikaTransport")
+def test_queued_updates_are_flushed_after_delay(mock_transport):
+    db = _mock_ispyb_session()
+    transport_manager = TransportManager("PikaTransport", update_delay=0.05)
+    with mock.patch("murfey.server.ispyb.ISPyBSession", return_value=db):
+        transport_manager.queue_grid_square_update(
+            3, GridSquareParameters(tag="tag", x_location_scaled=15)
+        )
+        for _ in range(100):
+            if db.commit.called:
+                break
+            time.sleep(0.01)
+
+    db.execute.assert_called_once()
+    assert db.execute.call_args[0][1] == [{"gridSquareId": 3, "pixelLocationX": 15}]
+
+
+@mock.patch("workflows.transport.pika_transport.PikaTransport")
+def test_failed_grid_square_updates_are_retried(mock_transport, caplog):
+    db = _mock_ispyb_session()
+    db.execute.side_effect = OperationalError("UPDATE", {}, Exception("gone away"))
+    transport_manager = TransportManager("PikaTransport", update_delay=60)
+    with mock.patch("murfey.server.ispyb.ISPyBSession", return_value=db):
+        transport_manager.queue_grid_square_update(
+            1, GridSquareParameters(tag="tag", image="a.jpg", angle=10)
+        )
+        assert transport_manager.flush_updates()["success"] is False
+
+        # Failed updates are queued again, behind any newer ones
+        transport_manager.queue_grid_square_update(
+            1, GridSquareParameters(tag="tag", image="b.jpg")
+        )
+        assert transport_manager.flush_updates()["success"] is False
+        assert db.execute.call_args[0][1] == [
+            {"gridSquareId": 1, "gridSquareImage": "b.jpg", "angle": 10}
+        ]
+
+        # Updates are given up on after the maximum number of attempts
+        assert transport_manager.flush_updates()["success"] is False
+        assert db.execute.call_count == transport_manager.max_update_attempts
+        assert transport_manager.flush_updates() == {
+            "success": True,
+            "return_value": [],
+        }
+    assert "Gave up writing queued updates to GridSquare entries [1]" in caplog.text
+
+
+def test_ispyb_lookup_cache_expires(mocker: MockerFixture):
+    clock = mocker.patch("murfey.server.ispyb.time.monotonic", return_value=0)
+    cache = ISPyBLookupCache("test", ttl=10)
+    lookup = mock.MagicMock(side_effect=[1, 2])
+    db = mock.MagicMock()
+
+    assert cache.get("key", lookup, db) == 1
+    clock.return_value = 9
+    assert cache.get("key", lookup, db) == 1
+    lookup.assert_called_once_with(db)
+
+    clock.return_value = 10
+    assert cache.get("key", lookup, db) == 2
+    assert cache.get("key", lookup, db) == 2
+    assert lookup.call_count == 2
+
+    assert cache.invalidate("key") == 1
+    assert cache.invalidate("key") == 0
+    assert len(cache) == 0
+
+
+def test_ispyb_lookup_cache_does_not_cache_failures():
+    cache = ISPyBLookupCache("test", ttl=10)
+    lookup = mock.MagicMock(side_effect=[IndexError, None, 3])
+    with pytest.raises(IndexError):
+        cache.get("key", lookup, mock.MagicMock())
+    assert cache.get("key", lookup, mock.MagicMock()) is None
+    assert cache.get("key", lookup, mock.MagicMock()) == 3
+    assert cache.get("key", lookup, mock.MagicMock()) == 3
+    assert lookup.call_count == 3
+
+
+def test_ispyb_lookup_cache_collapses_concurrent_lookups():
+    cache = ISPyBLookupCache("test", ttl=10)
+    release = threading.Event()
+    calls = []
+
+    def slow_lookup(db):
+        calls.append(db)
+        release.wait(5)
+        return 42
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                cache.get("key", slow_lookup, mock.MagicMock())
+            )
+        )
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    # Give the other threads time to find the lookup under way
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [42] * 10
+    assert len(calls) == 1
+
+
+def test_ispyb_lookup_cache_refreshes_stale_results(mocker: MockerFixture):
+    clock = mocker.patch("murfey.server.ispyb.time.monotonic", return_value=0)
+    background_db = mock.MagicMock()
+    mocker.patch("murfey.server.ispyb.ISPyBSession", return_value=background_db)
+    cache = ISPyBLookupCache("test", ttl=10, stale_ttl=100)
+    release = threading.Event()
+    values = iter([1, 2])
+
+    def lookup(db):
+        if db is background_db:
+            release.wait(5)
+        return next(values)
+
+    assert cache.get("key", lookup, mock.MagicMock()) == 1
+
+    # Once expired, the old result is returned while it is looked up again
+    clock.return_value = 50
+    for _ in range(5):
+        assert cache.get("key", lookup, mock.MagicMock()) == 1
+    release.set()
+    for _ in range(100):
+        if cache.get("key", lookup, mock.MagicMock()) == 2:
+            break
+        time.sleep(0.01)
+    assert cache.get("key", lookup, mock.MagicMock()) == 2
+    background_db.close.assert_called_once()
+
+    # Results past their stale lifetime are looked up again before being returned
+    clock.return_value = 1000
+    with pytest.raises(StopIteration):
+        cache.get("key", lookup, mock.MagicMock())
+
+
+def test_get_all_ongoing_visits_is_cached(mocker: MockerFixture):
+    now = datetime.datetime.now()
+    visits = [
+        Visit(
+            start=now - datetime.timedelta(days=1),
+            end=now + end,
+            session_id=session_id,
+            name=f"cm12345-{session_id}",
+            beamline="m12",
+            proposal_title="Test",
+        )
+        for session_id, end in (
+            (1, datetime.timedelta(days=1)),
+            (2, datetime.timedelta(seconds=1)),
+        )
+    ]
+    mock_lookup = mocker.patch(
+        "murfey.server.ispyb._lookup_ongoing_visits", return_value=visits
+    )
+    assert get_all_ongoing_visits("m12", mock.MagicMock()) == visits
+    assert get_all_ongoing_visits("m12", mock.MagicMock()) == visits
+    assert get_all_ongoing_visits("m13", mock.MagicMock()) == visits
+    assert mock_lookup.call_count == 2
+    assert get_all_ongoing_visits("m12", None) == []
+
+    # Visits that end while cached are no longer returned
+    mocker.patch(
+        "murfey.server.ispyb.datetime.datetime",
+        mock.MagicMock(
+            now=mock.MagicMock(return_value=now + datetime.timedelta(seconds=2))
+        ),
+    )
+    assert get_all_ongoing_visits("m12", mock.MagicMock()) == visits[:1]
+    assert mock_lookup.call_count == 2
+
+    assert invalidate_ispyb_caches("ongoing_visits") == 2
+    get_all_ongoing_visits("m12", mock.MagicMock())
+    assert mock_lookup.call_count == 3
+    assert ispyb.ongoing_visits_cache.invalidate() == 1
@@ -0,0 +1,175 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+
+from murfey.server.api.bootstrap import pypi
+from murfey.server.package_cache import PackageCache, PackageNotCached, UpstreamError
+from tests.conftest import PackageUpstream
+
+
+def test_files_are_stored_by_content_hash(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    package_upstream.files["/a/pkg-1.0.whl"] = b"wheel"
+    package_upstream.files["/b/pkg-1.0.whl"] = b"wheel"
+    cache = PackageCache(tmp_path)
+
+    first = cache.get_file(f"{package_upstream.url}/a/pkg-1.0.whl")
+    again = cache.get_file(f"{package_upstream.url}/a/pkg-1.0.whl")
+    copy = cache.get_file(f"{package_upstream.url}/b/pkg-1.0.whl")
+
+    assert first.sha256 == hashlib.sha256(b"wheel").hexdigest()
+    assert first.path.read_bytes() == b"wheel"
+    assert first.path.name == first.sha256
+    # The repeated request is served from disk, and identical files are stored once
+    assert again == first
+    assert copy.path == first.path
+    assert package_upstream.requests_for("/a/pkg-1.0.whl") == 1
+    assert len(list((tmp_path / "blobs").rglob("*.whl"))) == 0
+    assert cache.current_bytes == len(b"wheel")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_persists_between_instances(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    package_upstream.files["/pkg-1.0.whl"] = b"wheel"
+    PackageCache(tmp_path).get_file(f"{package_upstream.url}/pkg-1.0.whl")
+    PackageCache(tmp_path).get_file(f"{package_upstream.url}/pkg-1.0.whl")
+    assert package_upstream.requests_for("/pkg-1.0.whl") == 1
+
+
+def test_concurrent_requests_are_collapsed(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    package_upstream.files["/pkg-1.0.whl"] = b"wheel" * 1000
+    package_upstream.delay = 0.2
+    cache = PackageCache(tmp_path)
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(
+            executor.map(
+                lambda _: cache.get_file(f"{package_upstream.url}/pkg-1.0.whl"),
+                range(10),
+            )
+        )
+
+    assert len({result.path for result in results}) == 1
+    assert package_upstream.requests_for("/pkg-1.0.whl") == 1
+
+
+def test_upstream_errors_are_raised_and_not_cached(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    cache = PackageCache(tmp_path)
+    with pytest.raises(UpstreamError) as exc_info:
+        cache.get_file(f"{package_upstream.url}/missing.whl")
+    assert exc_info.value.status_code == 404
+
+    package_upstream.files["/missing.whl"] = b"wheel"
+    assert cache.get_file(f"{package_upstream.url}/missing.whl").size == 5
+
+
+def test_index_pages_are_revalidated(package_upstream: PackageUpstream, tmp_path: Path):
+    package_upstream.files["/simple/pkg"] = b"version 1"
+    cache = PackageCache(tmp_path, index_ttl=0.2)
+    url = f"{package_upstream.url}/simple/pkg"
+
+    assert cache.get_index(url).path.read_bytes() == b"version 1"
+    # Fresh copies are used without contacting the upstream server
+    assert cache.get_index(url).path.read_bytes() == b"version 1"
+    assert package_upstream.requests_for("/simple/pkg") == 1
+
+    # Stale copies are revalidated using the ETag
+    time.sleep(0.3)
+    assert cache.get_index(url).path.read_bytes() == b"version 1"
+    assert package_upstream.requests_for("/simple/pkg") == 2
+    assert package_upstream.requests[-1][1].get("If-None-Match")
+    assert cache.revalidations == 1
+
+    # Changed pages are downloaded again
+    package_upstream.files["/simple/pkg"] = b"version 2"
+    time.sleep(0.3)
+    assert cache.get_index(url).path.read_bytes() == b"version 2"
+
+
+def test_stale_index_is_used_if_upstream_is_unreachable(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    package_upstream.files["/simple/pkg"] = b"version 1"
+    cache = PackageCache(tmp_path, index_ttl=0)
+    url = f"{package_upstream.url}/simple/pkg"
+    cache.get_index(url)
+
+    package_upstream.server.shutdown()
+    package_upstream.server.server_close()
+    assert cache.get_index(url).path.read_bytes() == b"version 1"
+
+
+def test_least_recently_used_files_are_evicted(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    for name in ("a", "b", "c"):
+        package_upstream.files[f"/{name}.whl"] = name.encode() * 100
+    cache = PackageCache(tmp_path, max_bytes=250)
+
+    a = cache.get_file(f"{package_upstream.url}/a.whl")
+    b = cache.get_file(f"{package_upstream.url}/b.whl")
+    time.sleep(0.01)
+    cache.get_file(f"{package_upstream.url}/a.whl")  # 'b' is now least recently used
+    cache.get_file(f"{package_upstream.url}/c.whl")
+
+    assert cache.current_bytes == 200
+    assert a.path.exists()
+    assert not b.path.exists()
+    cache.get_file(f"{package_upstream.url}/b.whl")
+    assert package_upstream.requests_for("/b.whl") == 2
+    assert package_upstream.requests_for("/a.whl") == 1
+
+
+def test_offline_mode_serves_only_cached_files(
+    package_upstream: PackageUpstream, tmp_path: Path
+):
+    package_upstream.files["/pkg-1.0.whl"] = b"wheel"
+    package_upstream.files["/simple/pkg"] = b"index"
+    PackageCache(tmp_path).get_file(f"{package_upstream.url}/pkg-1.0.whl")
+    PackageCache(tmp_path).get_index(f"{package_upstream.url}/simple/pkg")
+    package_upstream.requests.clear()
+
+    cache = PackageCache(tmp_path, index_ttl=0, offline=True)
+    assert cache.get_file(f"{package_upstream.url}/pkg-1.0.whl").size == 5
+    assert cache.get_index(f"{package_upstream.url}/simple/pkg").size == 5
+    with pytest.raises(PackageNotCached):
+        cache.get_file(f"{package_upstream.url}/pkg-2.0.whl")
+    assert package_upstream.requests == []
+
+
+def test_pypi_file_is_served_from_cache_with_range_support(
+    mocker: MockerFixture, package_upstream: PackageUpstream, tmp_path: Path
+):
+    content = bytes(range(256)) * 10
+    package_upstream.files["/packages/ab/cd/ef/pkg-1.0-py3-none-any.whl"] = content
+    cache = PackageCache(tmp_path)
+    mocker.patch("murfey.server.api.bootstrap.get_package_cache", return_value=cache)
+    mocker.patch("murfey.server.api.bootstrap.python_repo_url", package_upstream.url)
+    app = FastAPI()
+    app.include_router(pypi)
+    client = TestClient(app)
+
+    url = "/pypi/packages/ab/cd/ef/pkg-1.0-py3-none-any.whl"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == content
+
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == content[100:200]
+    assert package_upstream.requests_for(url.removeprefix("/pypi")) == 1
+
+    assert client.get("/pypi/packages/ab/cd/ef/missing.whl").status_code == 404
@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from murfey.server.thumbnails import THUMBNAIL_SIZES, ThumbnailCache
+
+
+def make_image(path: Path, size: tuple[int, int] = (1000, 800), mode: str = "RGB"):
+    rng = np.random.default_rng(0)
+    if mode == "I;16":
+        data = rng.integers(0, 4096, size=size[::-1], dtype=np.uint16)
+    else:
+        data = rng.integers(0, 255, size=(*size[::-1], 3), dtype=np.uint8)
+    Image.fromarray(data).save(path)
+    return path
+
+
+def test_thumbnail_is_made_once(tmp_path: Path):
+    source = make_image(tmp_path / "grid_square.jpg")
+    cache = ThumbnailCache(tmp_path / "thumbnails")
+
+    thumbnail = cache.get(source, 128)
+    with Image.open(thumbnail) as image:
+        assert image.size == (128, 102)
+    modified = thumbnail.stat().st_mtime_ns
+    os.utime(thumbnail, ns=(modified - 10**9, modified - 10**9))
+
+    # The cached thumbnail is returned, and marked as having been used
+    assert cache.get(source, 128) == thumbnail
+    assert thumbnail.stat().st_mtime_ns >= modified
+    assert cache.current_bytes == thumbnail.stat().st_size
+
+
+def test_thumbnail_is_remade_if_image_changes(tmp_path: Path):
+    source = make_image(tmp_path / "grid_square.jpg")
+    cache = ThumbnailCache(tmp_path / "thumbnails")
+    etag = cache.etag(source, 512)
+    thumbnail = cache.get(source, 512)
+
+    make_image(source, size=(400, 400))
+    os.utime(source, ns=(10**18, 10**18))
+    assert cache.etag(source, 512) != etag
+    with Image.open(cache.get(source, 512)) as image:
+        assert image.size == (400, 400)
+    assert cache.get(source, 512) != thumbnail
+
+
+def test_16_bit_images_are_rescaled(tmp_path: Path):
+    source = make_image(tmp_path / "foil_hole.tiff", mode="I;16")
+    cache = ThumbnailCache(tmp_path / "thumbnails")
+    with Image.open(cache.get(source, 512)) as image:
+        assert image.mode == "L"
+        assert image.getextrema()[1] > 200
+
+
+def test_generate_makes_all_sizes(tmp_path: Path):
+    source = make_image(tmp_path / "grid_square.jpg", size=(3000, 1500))
+    cache = ThumbnailCache(tmp_path / "thumbnails")
+    with Image.open(source) as image:
+        paths = cache.generate(source, image)
+    assert sorted(paths) == sorted(THUMBNAIL_SIZES)
+    for size, path in paths.items():
+        with Image.open(path) as image:
+            assert max(image.size) == size
+        assert cache.get(source, size) == path
+
+
+def test_least_recently_used_thumbnails_are_evicted(tmp_path: Path):
+    cache = ThumbnailCache(tmp_path / "thumbnails")
+    sources = [make_image(tmp_path / f"{i}.jpg", size=(300, 300)) for i in range(4)]
+    thumbnails = [cache.get(source, 128) for source in sources]
+    for i, thumbnail in enumerate(thumbnails):
+        os.utime(thumbnail, ns=(10**18 + i * 10**9,) * 2)
+    thumbnail_size = thumbnails[0].stat().st_size
+
+    cache.max_bytes = int(thumbnail_size * 4.5)
+    cache.get(make_image(tmp_path / "new.jpg", size=(300, 300)), 128)
+    assert not thumbnails[0].exists()
+    assert all(thumbnail.exists() for thumbnail in thumbnails[1:])
+    assert cache.current_bytes <= cache.max_bytes
@@ -0,0 +1,209 @@
+import os
+import statistics
+import time
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.server.upstream_index import UpstreamIndex
+
+
+def make_files(root: Path, rel_paths: list[str]):
+    for rel_path in rel_paths:
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY))
+
+
+def set_mtime(path: Path, seconds: float):
+    os.utime(path, (seconds, seconds))
+
+
+example_files = [
+    "processed/grid1/TileScan1/Position_1/composite_BF_FL.tiff",
+    "processed/grid1/TileScan1/Position_1/gray.tiff",
+    "processed/grid1/TileScan1/Position_2/red.TIF",
+    "processed/grid2/Overview/composite.tiff",
+    "processed/top_level.tiff",
+    "screenshots/overview_1.png",
+    "screenshots/.hidden.png",
+    "maps/map/image_[1].tiff",
+]
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    (
+        "processed/**/composite*.tiff",
+        "processed/**/*.tiff",
+        "processed/*/TileScan?/**/*",
+        "screenshots/**/*",
+        "**/*.png",
+        "processed/grid[12]/**/*.tiff",
+        "processed/grid[!1]/**/*.tiff",
+        "maps/**/image_*",
+        "processed/**",
+    ),
+)
+def test_glob_matches_pathlib(tmp_path: Path, pattern: str):
+    visit = tmp_path / "visit"
+    make_files(visit, example_files)
+    index = UpstreamIndex(tmp_path / "index.sqlite")
+    expected = sorted(path for path in visit.glob(pattern) if path.is_file())
+    assert sorted(index.glob(visit, pattern)) == expected
+
+
+def test_tiffs_are_listed_by_suffix(tmp_path: Path):
+    visit = tmp_path / "visit"
+    make_files(visit, example_files)
+    index = UpstreamIndex(tmp_path / "index.sqlite")
+    files = index.files(visit / "processed", (".tiff", ".tif"))
+    assert [str(f.path) for f in files] == [
+        "grid1/TileScan1/Position_1/composite_BF_FL.tiff",
+        "grid1/TileScan1/Position_1/gray.tiff",
+        "grid2/Overview/composite.tiff",
+        "top_level.tiff",
+        "grid1/TileScan1/Position_2/red.TIF",
+    ]
+    assert all(f.size == 0 for f in files)
+
+
+def test_index_is_reused_until_stale(tmp_path: Path):
+    visit = tmp_path / "visit"
+    make_files(visit, ["a/1.tiff"])
+    index = UpstreamIndex(tmp_path / "index.sqlite", max_age=3600)
+    assert len(index.glob(visit, "**/*.tiff")) == 1
+
+    make_files(visit, ["a/2.tiff"])
+    assert len(index.glob(visit, "**/*.tiff")) == 1
+    assert index.scans == 1
+    # A refresh can be requested to pick up the new file straight away
+    assert len(index.glob(visit, "**/*.tiff", refresh=True)) == 2
+
+    # The index is shared with other processes using the same file
+    other_index = UpstreamIndex(tmp_path / "index.sqlite", max_age=3600)
+    assert len(other_index.glob(visit, "**/*.tiff")) == 2
+    assert other_index.scans == 0
+
+
+def test_only_changed_directories_are_listed_again(
+    mocker: MockerFixture, tmp_path: Path
+):
+    visit = tmp_path / "visit"
+    make_files(visit, [f"{d}/{f}.tiff" for d in "abcde" for f in range(3)])
+    make_files(visit, ["old/removed/1.tiff"])
+    index = UpstreamIndex(tmp_path / "index.sqlite", max_age=0)
+    assert len(index.glob(visit, "**/*.tiff")) == 16
+
+    make_files(visit, ["c/new.tiff", "f/new.tiff"])
+    (visit / "old" / "removed" / "1.tiff").unlink()
+    (visit / "old" / "removed").rmdir()
+    scandir = mocker.patch("murfey.server.upstream_index.os.scandir", wraps=os.scandir)
+    files = index.glob(visit, "**/*.tiff")
+
+    assert len(files) == 17
+    assert visit / "c/new.tiff" in files
+    assert visit / "old/removed/1.tiff" not in files
+    listed = sorted(Path(call.args[0]).name for call in scandir.call_args_list)
+    assert listed == ["c", "f", "old", "visit"]
+
+
+def test_closed_visits_are_not_checked_again(tmp_path: Path):
+    visit = tmp_path / "visit"
+    make_files(visit, ["a/1.tiff"])
+    for path in (visit / "a", visit):
+        set_mtime(path, time.time() - 30 * 24 * 3600)
+    index = UpstreamIndex(tmp_path / "index.sqlite", max_age=0, immutable_after=3600)
+    index.glob(visit, "**/*.tiff")
+
+    make_files(visit, ["a/2.tiff"])
+    assert len(index.glob(visit, "**/*.tiff")) == 1
+    assert index.scans == 1
+    assert len(index.glob(visit, "**/*.tiff", refresh=True)) == 2
+
+
+def test_scans_from_other_processes_are_replaced(tmp_path: Path, mocker: MockerFixture):
+    visit = tmp_path / "visit"
+    make_files(visit, example_files)
+    index = UpstreamIndex(tmp_path / "index.sqlite")
+    other_index = UpstreamIndex(tmp_path / "index.sqlite")
+    original_stat = os.stat
+    interrupted: list[bool] = []
+
+    def stat_after_other_scan(path, *args, **kwargs):
+        # Another process scans the tree after this one has read what it knows
+        if not interrupted:
+            interrupted.append(True)
+            other_index.files(visit, (".tiff",))
+        return original_stat(path, *args, **kwargs)
+
+    mocker.patch(
+        "murfey.server.upstream_index.os.stat", side_effect=stat_after_other_scan
+    )
+    assert sorted(index.files(visit, (".tiff",), refresh=True)) == sorted(
+        other_index.files(visit, (".tiff",))
+    )
+    assert interrupted
+
+
+def test_find_directories(tmp_path: Path):
+    make_files(
+        tmp_path / "data",
+        [
+            "2020/cm12345-1/file.txt",
+            "2020/cm12345-1/cm12345-1/nested.txt",
+            "2021/cm12345-2/file.txt",
+            "2021/sub/cm12345-3/too_deep.txt",
+            "2021/bi12345-1/file.txt",
+        ],
+    )
+    index = UpstreamIndex(tmp_path / "index.sqlite", max_age=0)
+    assert index.find_directories(tmp_path / "data", "cm12345-", max_depth=2) == {
+        "cm12345-1": tmp_path / "data/2020/cm12345-1",
+        "cm12345-2": tmp_path / "data/2021/cm12345-2",
+    }
+    make_files(tmp_path / "data", ["2021/cm12345-4/file.txt"])
+    assert "cm12345-4" in index.find_directories(
+        tmp_path / "data", "cm12345-", max_depth=2
+    )
+
+
+@pytest.mark.benchmark
+def test_query_time_is_independent_of_tree_size(tmp_path: Path):
+    """
+    Compares searching the index of a visit of 20,000 files with one of 200,000
+    files, where both contain the same 50 processed files being searched for
+    """
+    processed = [
+        f"processed/grid1/TileScan1/Position_{n}/composite_BF_FL.tiff"
+        for n in range(50)
+    ]
+    visits = {}
+    for name, n_dirs in (("small", 20), ("large", 200)):
+        visits[name] = tmp_path / name
+        make_files(
+            visits[name],
+            [f"raw/{d}/frame_{f}.tiff" for d in range(n_dirs) for f in range(1000)]
+            + processed,
+        )
+    index = UpstreamIndex(tmp_path / "index.sqlite", max_age=3600)
+    for visit in visits.values():
+        index.files(visit, ())
+
+    def query_time(visit: Path) -> float:
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            files = index.glob(visit, "processed/**/composite*.tiff")
+            timings.append(time.perf_counter() - start)
+            assert len(files) == 50
+        return statistics.median(timings)
+
+    small, large = query_time(visits["small"]), query_time(visits["large"])
+    start = time.perf_counter()
+    walked = [p for p in visits["large"].glob("**/composite*.tiff") if p.is_file()]
+    walk = time.perf_counter() - start
+    assert len(walked) == 50
+    assert large < 3 * small + 0.001
+    assert large * 10 < walk
@@ -0,0 +1,135 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.util import atlas_index
+from murfey.util.atlas_index import AtlasIndex, AtlasPosition, read_atlas_index
+from murfey.util.spa_metadata import get_grid_square_atlas_positions
+
+
+def grid_square_node(grid_square: int, x: float, y: float, angle: float = 0.5) -> str:
+    return (
+        "<KeyValuePairOfintNodeXmlXXXX>"
+        f"<key>{grid_square}</key>"
+        "<value><b:PositionOnTheAtlas>"
+        f"<c:Center><d:x>{x}</d:x><d:y>{y}</d:y></c:Center>"
+        f"<c:Physical><d:x>{x * 1e-6}</d:x><d:y>{y * 1e-6}</d:y></c:Physical>"
+        "<c:Size><d:width>130</d:width><d:height>120.5</d:height></c:Size>"
+        f"<c:Rotation>{angle}</c:Rotation>"
+        "</b:PositionOnTheAtlas>"
+        # Grid square nodes carry plenty of other data that isn't needed
+        "<b:State>Acquired</b:State><b:Selected>true</b:Selected>"
+        "</value>"
+        "</KeyValuePairOfintNodeXmlXXXX>"
+    )
+
+
+def atlas_xml(tiles: list[list[tuple[int, float, float]]]) -> str:
+    """
+    Generates an atlas metadata file in the layout written by EPU, from a list of
+    tiles, each with a list of (grid square ID, x, y) tuples
+    """
+    tile_xml = "".join(
+        "<TileXml><Nodes><KeyValuePairs>"
+        + "".join(grid_square_node(*gs) for gs in tile)
+        + "</KeyValuePairs></Nodes><TileImage>Tile.jpg</TileImage></TileXml>"
+        for tile in tiles
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<AtlasSessionXml xmlns="http://schemas.datacontract.org/2004/07/Applications.Epu.Persistence"'
+        ' xmlns:b="http://schemas.datacontract.org/2004/07/Fei.Applications.Common.Omp.Atlas"'
+        ' xmlns:c="http://schemas.datacontract.org/2004/07/Fei.Types"'
+        ' xmlns:d="http://schemas.datacontract.org/2004/07/System.Drawing">'
+        f"<Atlas><TilesEfficient><_items>{tile_xml}</_items></TilesEfficient></Atlas>"
+        "</AtlasSessionXml>"
+    )
+
+
+def write_atlas(path: Path, tiles: list[list[tuple[int, float, float]]]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(atlas_xml(tiles))
+
+
+def test_atlas_index_reads_all_grid_squares(tmp_path: Path):
+    atlas = tmp_path / "Sample1" / "Atlas" / "Atlas.dm"
+    # A tile with a single grid square, and a grid square that is on two tiles
+    write_atlas(atlas, [[(1, 100.7, 200)], [(2, 300, 400), (3, 500, 600)], [(2, 9, 9)]])
+
+    index, update = read_atlas_index(atlas)
+    assert update.parsed
+    assert list(update.changed) == ["1", "2", "3"]
+    assert index.get(1) == pytest.approx(
+        AtlasPosition(100, 200, 100.7e3, 200e3, 130, 120, 0.5)
+    )
+    assert index.get("2") == pytest.approx((300, 400, 300e3, 400e3, 130, 120, 0.5))
+    assert index.get(4) is None
+
+    assert get_grid_square_atlas_positions(atlas, grid_square="3") == {
+        "3": pytest.approx((500, 600, 500e3, 600e3, 130, 120, 0.5))
+    }
+    assert get_grid_square_atlas_positions(atlas, grid_square="4") == {}
+    assert list(get_grid_square_atlas_positions(atlas)) == ["1", "2", "3"]
+
+
+def test_atlas_index_is_only_parsed_once(mocker: MockerFixture, tmp_path: Path):
+    atlas = tmp_path / "Atlas.dm"
+    write_atlas(atlas, [[(1, 1, 1), (2, 2, 2)]])
+    read_atlas_index(atlas)
+
+    mock_parse = mocker.patch("murfey.util.atlas_index.parse_atlas_positions")
+    for gs in range(100):
+        get_grid_square_atlas_positions(atlas, grid_square=str(gs))
+    _, update = read_atlas_index(atlas)
+    assert update == ({}, [], False)
+    mock_parse.assert_not_called()
+
+
+def test_atlas_index_is_loaded_from_file(mocker: MockerFixture, tmp_path: Path):
+    atlas = tmp_path / "source" / "Atlas.dm"
+    write_atlas(atlas, [[(1, 1, 1), (2, 2, 2)]])
+    positions = read_atlas_index(atlas)[0].positions
+    assert (atlas.parent / ".Atlas.dm.index.json").is_file()
+
+    # A new index for the same atlas, or for a copy of it with a different
+    # modification time, should load the saved index instead of parsing the atlas
+    copied_atlas = tmp_path / "destination" / "Atlas.dm"
+    copied_atlas.parent.mkdir()
+    shutil.copy(atlas, copied_atlas)
+    shutil.copy(atlas.parent / ".Atlas.dm.index.json", copied_atlas.parent)
+    os.utime(copied_atlas, ns=(0, 0))
+
+    spy_parse = mocker.spy(atlas_index, "parse_atlas_positions")
+    for path in (atlas, copied_atlas):
+        index = AtlasIndex(path)
+        update = index.update()
+        assert not update.parsed
+        assert index.positions == update.changed == positions
+    spy_parse.assert_not_called()
+
+    # The saved index should be ignored if it doesn't match the atlas
+    write_atlas(copied_atlas, [[(1, 1, 1), (2, 2, 3)]])
+    os.utime(copied_atlas, ns=(0, 0))
+    index = AtlasIndex(copied_atlas)
+    assert index.update().parsed
+    assert index.get(2) == pytest.approx((2, 3, 2e3, 3e3, 130, 120, 0.5))
+
+
+def test_atlas_index_reports_changes_when_rewritten(tmp_path: Path):
+    atlas = tmp_path / "Atlas.dm"
+    write_atlas(atlas, [[(1, 1, 1), (2, 2, 2), (3, 3, 3)]])
+    index, _ = read_atlas_index(atlas)
+    positions = index.positions
+
+    write_atlas(atlas, [[(1, 1, 1), (2, 2, 5)], [(4, 4, 4)]])
+    os.utime(atlas, ns=(atlas.stat().st_atime_ns, atlas.stat().st_mtime_ns + 1000))
+    index, update = read_atlas_index(atlas)
+    assert update.parsed
+    assert list(update.changed) == ["2", "4"]
+    assert update.removed == ["3"]
+    assert list(index.positions) == ["1", "2", "4"]
+    # Positions handed out before the atlas changed are left as they were
+    assert list(positions) == ["1", "2", "3"]
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import sqlalchemy
+
+from murfey.util.db import setup
+
+
+def test_setup_adds_new_columns_to_existing_tables(tmp_path: Path):
+    url = f"sqlite:///{tmp_path / 'murfey.db'}"
+    setup(url)
+    engine = sqlalchemy.create_engine(url)
+    # A database created before the tilt series positions were stored
+    with engine.begin() as connection:
+        for column in ("x_stage_position", "y_beamshift"):
+            connection.execute(
+                sqlalchemy.text(f"ALTER TABLE tiltseries DROP COLUMN {column}")
+            )
+
+    setup(url)
+    columns = {
+        column["name"]
+        for column in sqlalchemy.inspect(engine).get_columns("tiltseries")
+    }
+    assert {
+        "x_stage_position",
+        "y_stage_position",
+        "x_beamshift",
+        "y_beamshift",
+    } <= columns
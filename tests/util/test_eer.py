@@ -0,0 +1,139 @@
+import os
+import struct
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from murfey.util import eer
+from murfey.util.eer import EERHeader, _count_ifds, eer_header, num_frames
+
+
+def make_eer(num_frames: int, width: int = 4096, height: int = 4096) -> bytes:
+    """
+    Builds a BigTIFF file laid out like an EER movie, with each frame's IFD followed
+    by a block of compressed frame data
+    """
+    data = bytearray(b"II" + struct.pack("<HHHQ", 43, 8, 0, 16))
+    tags = [
+        (256, 3, 1, width),
+        (257, 4, 1, height),
+        (259, 3, 1, 65001),
+        (273, 16, 1, 0),
+    ]
+    for frame in range(num_frames):
+        ifd = len(data)
+        frame_data = bytes([frame % 256]) * (300 + frame % 50)
+        data += struct.pack("<Q", len(tags))
+        for tag, field_type, count, value in tags:
+            data += struct.pack("<HHQQ", tag, field_type, count, value)
+        next_ifd = ifd + 8 + 20 * len(tags) + 8 + len(frame_data)
+        data += struct.pack("<Q", next_ifd if frame < num_frames - 1 else 0)
+        data += frame_data
+    return bytes(data)
+
+
+class CountingStream(BytesIO):
+    """
+    File stream that counts the reads and seeks made on it
+    """
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.calls = 0
+
+    def fileno(self):
+        raise OSError("Not a file on disk")
+
+    def read(self, *args):
+        self.calls += 1
+        return super().read(*args)
+
+    def seek(self, *args):
+        self.calls += 1
+        return super().seek(*args)
+
+
+def count_ifds_one_at_a_time(file_stream) -> int:
+    # Seeks to and reads each IFD in turn, as the frames used to be counted
+    file_stream.seek(8, 0)
+    ifd = int.from_bytes(file_stream.read(8), "little")
+    n = 0
+    while ifd != 0:
+        n += 1
+        file_stream.seek(ifd, 0)
+        num_tags = int.from_bytes(file_stream.read(8), "little")
+        file_stream.seek(ifd + 8 + 20 * num_tags, 0)
+        ifd = int.from_bytes(file_stream.read(8), "little")
+    return n
+
+
+@pytest.fixture(autouse=True)
+def clear_header_cache():
+    eer._cached_eer_header.cache_clear()
+    yield
+    eer._cached_eer_header.cache_clear()
+
+
+@pytest.mark.parametrize("frames", (1, 40, 5000))
+def test_count_ifds_reads_in_large_windows(frames: int):
+    data = make_eer(frames)
+    baseline = CountingStream(data)
+    windowed = CountingStream(data)
+
+    assert _count_ifds(windowed) == count_ifds_one_at_a_time(baseline) == frames
+    if frames > 1000:
+        assert windowed.calls * 100 < baseline.calls
+
+
+def test_eer_header_from_file(tmp_path: Path):
+    eer_path = tmp_path / "movie.eer"
+    eer_path.write_bytes(make_eer(3000, width=4096, height=2048))
+
+    assert eer_header(eer_path) == EERHeader(
+        num_frames=3000, width=4096, height=2048, compression=65001
+    )
+
+
+def test_classic_tiff_frame_count():
+    data = bytearray(b"II" + struct.pack("<HI", 42, 8))
+    for frame in range(3):
+        ifd = len(data)
+        data += struct.pack("<H", 1) + struct.pack("<HHII", 256, 3, 1, 512)
+        data += struct.pack("<I", ifd + 2 + 12 + 4 if frame < 2 else 0)
+    assert eer.read_eer_header(CountingStream(bytes(data))) == EERHeader(
+        num_frames=3, width=512, height=0, compression=0
+    )
+
+
+def test_num_frames_is_cached_until_the_file_changes(tmp_path: Path, mocker):
+    eer_path = tmp_path / "movie.eer"
+    eer_path.write_bytes(make_eer(2000))
+    spy_read = mocker.spy(eer, "read_eer_header")
+
+    assert [num_frames(eer_path) for _ in range(10)] == [2000] * 10
+    assert spy_read.call_count == 1
+
+    eer_path.write_bytes(make_eer(2500))
+    stat = eer_path.stat()
+    os.utime(eer_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert num_frames(eer_path) == 2500
+    assert spy_read.call_count == 2
+
+
+def test_eer_header_of_movies_still_being_written(tmp_path: Path):
+    eer_path = tmp_path / "movie.eer"
+    eer_path.touch()
+    assert eer_header(eer_path) == EERHeader(
+        num_frames=0, width=0, height=0, compression=0
+    )
+
+    # Frames whose IFDs haven't been written yet end the chain
+    data = make_eer(10)
+    for truncated_length in (4, 20, len(data) // 2, len(data) - 400):
+        eer._cached_eer_header.cache_clear()
+        eer_path.write_bytes(data[:truncated_length])
+        assert num_frames(eer_path) < 10
+        assert _count_ifds(CountingStream(data[:truncated_length])) == num_frames(
+            eer_path
+        )
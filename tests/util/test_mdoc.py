@@ -3,7 +3,13 @@ from __future__ import annotations
 from datetime import datetime
 from pathlib import Path
 
-from murfey.util.mdoc import get_block, get_global_data, get_num_blocks
+from murfey.util.mdoc import (
+    get_block,
+    get_global_data,
+    get_num_blocks,
+    parse_mdoc,
+    read_mdoc,
+)
 
 
 def test_mdoc_file_parse_global_data():
@@ -42,3 +48,92 @@ def test_mdoc_file_get_number_of_blocks():
     with open(Path(__file__).parent / "test_1.mdoc", "r") as md:
         block_count = get_num_blocks(md)
     assert block_count == 11
+
+
+def test_parse_mdoc_reads_global_data_and_every_block():
+    with open(Path(__file__).parent / "test_1.mdoc", "r") as md:
+        global_data, blocks = parse_mdoc(md)
+    with open(Path(__file__).parent / "test_1.mdoc", "r") as md:
+        assert global_data == get_global_data(md)
+        md.seek(0)
+        assert blocks == [get_block(md) for _ in range(11)]
+    assert [block["TiltAngle"] for block in blocks[:2]] == ["-0.00949884", "2.98863"]
+
+
+def test_mdoc_date_times_are_converted_when_looked_up():
+    with open(Path(__file__).parent / "test_1.mdoc", "r") as md:
+        _, blocks = parse_mdoc(md)
+    assert dict.__getitem__(blocks[0], "DateTime") == "01-Aug-2022  18:58:35"
+    assert blocks[0].get("DateTime") == datetime(2022, 8, 1, 18, 58, 35)
+    assert dict.__getitem__(blocks[0], "DateTime") == datetime(2022, 8, 1, 18, 58, 35)
+
+
+def _mdoc_text(num_blocks: int) -> str:
+    text = "PixelSpacing = 1.94\nVoltage = 300\nImageSize = 4096 4096\n\n"
+    for z in range(num_blocks):
+        text += (
+            f"[ZValue = {z}]\nTiltAngle = {-60 + 2 * z}\nNumSubFrames = 10\n"
+            f"SubFramePath = X:\\data\\Position_1_{z + 1:03d}.tiff\n"
+            "DateTime = 01-Aug-2022  18:58:35\n\n"
+        )
+    return text
+
+
+def test_mdoc_appended_one_block_at_a_time_is_parsed_once(tmp_path: Path):
+    mdoc_path = tmp_path / "Position_1.mdoc"
+    mdoc_path.write_text(_mdoc_text(0))
+    mdoc, update = read_mdoc(mdoc_path)
+    assert mdoc.global_data["ImageSize"] == ("4096", "4096")
+    assert update.num_blocks == 0
+
+    length_updates = []
+    for num_blocks in range(1, 61):
+        # SerialEM writes out the whole file again after each tilt
+        mdoc_path.write_text(_mdoc_text(num_blocks))
+        for _ in range(2):  # Each version of the file is transferred twice
+            mdoc, update = read_mdoc(mdoc_path)
+            assert not update.reparsed
+            if update.length_changed:
+                length_updates.append(update.num_blocks)
+                assert [block["TiltAngle"] for block in update.new_blocks] == [
+                    str(-60 + 2 * (num_blocks - 1))
+                ]
+            else:
+                assert update.new_blocks == []
+
+    assert length_updates == list(range(1, 61))
+    assert len(mdoc.blocks) == 60
+    # Each byte was parsed once, rather than the whole file on every transfer
+    assert mdoc.bytes_parsed == mdoc_path.stat().st_size
+
+
+def test_mdoc_rewritten_or_truncated_is_parsed_again(tmp_path: Path):
+    mdoc_path = tmp_path / "Position_1.mdoc"
+    mdoc_path.write_text(_mdoc_text(5))
+    read_mdoc(mdoc_path)
+
+    mdoc_path.write_text(_mdoc_text(3))
+    mdoc, update = read_mdoc(mdoc_path)
+    assert update.reparsed
+    assert (update.previous_num_blocks, update.num_blocks) == (5, 3)
+    assert len(update.new_blocks) == 3
+
+    mdoc_path.write_text(_mdoc_text(4).replace("Voltage = 300", "Voltage = 200"))
+    mdoc, update = read_mdoc(mdoc_path)
+    assert update.reparsed
+    assert mdoc.global_data["Voltage"] == "200"
+    assert len(mdoc.blocks) == 4
+
+
+def test_mdoc_partly_written_line_is_left_until_complete(tmp_path: Path):
+    mdoc_path = tmp_path / "Position_1.mdoc"
+    text = _mdoc_text(2)
+    mdoc_path.write_text(text[:-20])
+    mdoc, update = read_mdoc(mdoc_path)
+    assert update.num_blocks == 2
+    assert "DateTime" not in mdoc.blocks[1]
+
+    mdoc_path.write_text(text)
+    mdoc, update = read_mdoc(mdoc_path)
+    assert not update.reparsed and not update.length_changed
+    assert mdoc.blocks[1]["DateTime"] == datetime(2022, 8, 1, 18, 58, 35)
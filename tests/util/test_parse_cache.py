@@ -0,0 +1,100 @@
+import os
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from murfey.util.parse_cache import ParseCache
+
+
+def _make_parser(name: str = "parser") -> MagicMock:
+    parser = MagicMock(side_effect=lambda path: path.read_text())
+    parser.__module__ = __name__
+    parser.__qualname__ = name
+    return parser
+
+
+def test_parse_cache_parses_unchanged_file_once(tmp_path: Path):
+    test_file = tmp_path / "file.xml"
+    test_file.write_text("contents")
+    parser = _make_parser()
+
+    cache = ParseCache()
+    for _ in range(5):
+        assert cache.get(test_file, parser) == "contents"
+    parser.assert_called_once_with(test_file)
+    assert cache.hits == 4
+    assert cache.misses == 1
+
+
+def test_parse_cache_reparses_changed_file(tmp_path: Path):
+    test_file = tmp_path / "file.xml"
+    test_file.write_text("contents")
+    parser = _make_parser()
+
+    cache = ParseCache()
+    assert cache.get(test_file, parser) == "contents"
+
+    # Rewrite the file with a new modification time
+    test_file.write_text("new contents")
+    stat = test_file.stat()
+    os.utime(test_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(test_file, parser) == "new contents"
+    assert parser.call_count == 2
+
+    # The entry for the old version of the file should have been dropped
+    assert len(cache) == 1
+    assert cache.current_bytes == len("new contents")
+
+
+def test_parse_cache_separates_parsers(tmp_path: Path):
+    test_file = tmp_path / "file.xml"
+    test_file.write_text("contents")
+    parser_1 = _make_parser("parser_1")
+    parser_2 = _make_parser("parser_2")
+
+    cache = ParseCache()
+    cache.get(test_file, parser_1)
+    cache.get(test_file, parser_2)
+    parser_1.assert_called_once()
+    parser_2.assert_called_once()
+    assert len(cache) == 2
+
+
+def test_parse_cache_evicts_least_recently_used(tmp_path: Path):
+    test_files = []
+    for i in range(3):
+        test_file = tmp_path / f"file_{i}.xml"
+        test_file.write_text("x" * 10)
+        test_files.append(test_file)
+    parser = _make_parser()
+
+    cache = ParseCache(max_bytes=20)
+    cache.get(test_files[0], parser)
+    cache.get(test_files[1], parser)
+    # Using the first file makes the second one the least recently used
+    cache.get(test_files[0], parser)
+    cache.get(test_files[2], parser)
+    assert len(cache) == 2
+    assert cache.current_bytes == 20
+
+    parser.reset_mock()
+    cache.get(test_files[0], parser)
+    parser.assert_not_called()
+    cache.get(test_files[1], parser)
+    parser.assert_called_once_with(test_files[1])
+
+
+def test_parse_cache_invalidate(tmp_path: Path):
+    test_file = tmp_path / "file.xml"
+    test_file.write_text("contents")
+    parser = _make_parser()
+
+    cache = ParseCache()
+    cache.get(test_file, parser)
+    cache.invalidate(test_file)
+    assert len(cache) == 0
+    cache.get(test_file, parser)
+    assert parser.call_count == 2
+
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.current_bytes == 0
@@ -0,0 +1,78 @@
+import random
+
+import numpy as np
+import pytest
+
+from murfey.util.quantile_sketch import QuantileSketch
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Documented bound on the rank error, as a fraction of the number of values
+RANK_ERROR = 0.02
+
+
+def rank_error(values: np.ndarray, value: float, q: float) -> float:
+    """
+    Returns how far the value is, in rank, from the exact quantile of the values
+    """
+    low = np.searchsorted(values, value, side="left") / len(values)
+    high = np.searchsorted(values, value, side="right") / len(values)
+    return 0.0 if low <= q <= high else min(abs(low - q), abs(high - q))
+
+
+def test_exact_for_few_values():
+    sketch = QuantileSketch()
+    sketch.update_many(range(1, 101))
+    assert sketch.count == 100
+    assert sketch.quantiles((0.25, 0.5, 1.0)) == [25, 50, 100]
+
+
+def test_empty_sketch_raises():
+    with pytest.raises(ValueError):
+        QuantileSketch().quantile(0.5)
+
+
+def test_micrograph_replay_within_error_bound():
+    """
+    Replays the particle sizes picked from 10,000 micrographs, storing and loading
+    the sketch between micrographs as the picking workflow does
+    """
+    rng = np.random.default_rng(1)
+    stored = QuantileSketch(rng=random.Random(1)).to_bytes()
+    picked = []
+    for _ in range(10000):
+        # Two populations of particles, plus some ice and aggregates
+        sizes = np.concatenate(
+            (
+                rng.normal(160, 15, size=rng.integers(10, 40)),
+                rng.normal(240, 25, size=rng.integers(0, 15)),
+                rng.uniform(20, 600, size=rng.integers(0, 5)),
+            )
+        )
+        sketch = QuantileSketch.from_bytes(stored)
+        sketch.update_many(sizes.tolist())
+        stored = sketch.to_bytes()
+        picked.append(sizes)
+
+    values = np.sort(np.concatenate(picked))
+    sketch = QuantileSketch.from_bytes(stored)
+    assert sketch.count == len(values)
+    for q, value in zip(QUANTILES, sketch.quantiles(QUANTILES)):
+        assert rank_error(values, value, q) <= RANK_ERROR
+    # The stored sketch stays small however many particles are picked
+    assert sum(len(level) for level in sketch.compactors) < 3 * sketch.k + 100
+    assert len(stored) < 4 * (3 * sketch.k + 100)
+
+
+def test_merged_sketches_within_error_bound():
+    rng = np.random.default_rng(2)
+    first, second = rng.normal(100, 10, 50000), rng.normal(200, 10, 30000)
+    sketch = QuantileSketch(rng=random.Random(2))
+    sketch.update_many(first.tolist())
+    other = QuantileSketch(rng=random.Random(3))
+    other.update_many(second.tolist())
+    sketch.merge(other)
+
+    values = np.sort(np.concatenate((first, second)))
+    assert sketch.count == len(values)
+    for q, value in zip(QUANTILES, sketch.quantiles(QUANTILES)):
+        assert rank_error(values, value, q) <= RANK_ERROR
@@ -0,0 +1,178 @@
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from murfey.util import spa_metadata
+from murfey.util.parse_cache import parse_cache
+from murfey.util.spa_metadata import (
+    foil_hole_data,
+    foil_hole_image_index,
+    get_foil_hole_targets,
+)
+
+
+def grid_square_xml(
+    foil_holes: list[tuple[int, bool]],
+    efficient: bool = True,
+) -> str:
+    """
+    Generates a minimal GridSquare metadata file in the layout written by EPU, using
+    a list of (foil hole ID, is near grid bar) tuples
+    """
+    container = "TargetLocationsEfficient" if efficient else "TargetLocations"
+    blocks = "".join(
+        f"<b:KeyValuePairOfintTargetLocationXXXX><b:key>{fh}</b:key><b:value>"
+        f"<IsNearGridBar>{str(near_grid_bar).lower()}</IsNearGridBar>"
+        f'<PixelCenter xmlns:c="http://schemas.datacontract.org/2004/07/System.Drawing">'
+        f"<c:x>{fh * 10 + 0.5}</c:x><c:y>{fh * 20 + 0.5}</c:y></PixelCenter>"
+        f'<PixelWidthHeight xmlns:c="http://schemas.datacontract.org/2004/07/System.Drawing">'
+        f"<c:height>50</c:height><c:width>50.7</c:width></PixelWidthHeight>"
+        f'<StagePosition xmlns:c="http://schemas.datacontract.org/2004/07/Fei.Types">'
+        f"<c:X>{fh * 1e-6}</c:X><c:Y>{fh * 2e-6}</c:Y><c:Z>0</c:Z></StagePosition>"
+        f"</b:value></b:KeyValuePairOfintTargetLocationXXXX>"
+        for fh, near_grid_bar in foil_holes
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<GridSquareXml xmlns="http://schemas.datacontract.org/2004/07/Applications.Epu.Persistence">'
+        '<TargetLocations xmlns:a="http://schemas.datacontract.org/2004/07/Fei.SharedObjects">'
+        f"<{container}>"
+        '<a:m_serializationArray xmlns:b="http://schemas.microsoft.com/2003/10/Serialization/Arrays">'
+        f"{blocks}"
+        "</a:m_serializationArray>"
+        f"</{container}>"
+        "</TargetLocations>"
+        "</GridSquareXml>"
+    )
+
+
+@pytest.mark.parametrize("efficient", (True, False))
+def test_get_foil_hole_targets(efficient: bool, tmp_path: Path):
+    xml_path = tmp_path / "Metadata" / "GridSquare_1.dm"
+    xml_path.parent.mkdir()
+    xml_path.write_text(
+        grid_square_xml([(1, False), (2, True), (3, False)], efficient=efficient)
+    )
+
+    targets = get_foil_hole_targets(xml_path)
+    assert list(targets.keys()) == [1, 2, 3]
+    assert targets[1].x_location == 10.5
+    assert targets[1].y_location == 20.5
+    assert targets[1].x_stage_position == 1e-6
+    assert targets[1].y_stage_position == 2e-6
+    assert targets[1].diameter == 50.7
+    assert not targets[1].near_grid_bar
+    assert targets[2].near_grid_bar
+
+    # Subsequent lookups should be served from the cache
+    hits = parse_cache.hits
+    assert get_foil_hole_targets(xml_path) is targets
+    assert parse_cache.hits == hits + 1
+
+
+def test_foil_hole_data(tmp_path: Path):
+    xml_path = tmp_path / "Metadata" / "GridSquare_1.dm"
+    xml_path.parent.mkdir()
+    xml_path.write_text(grid_square_xml([(1, False), (2, False)]))
+
+    fh = foil_hole_data(xml_path, 2, 1)
+    assert fh.id == 2
+    assert fh.grid_square_id == 1
+    assert fh.x_location == 20.5
+    assert fh.y_location == 40.5
+    assert fh.diameter == 50.7
+    assert fh.image == ""
+
+    # Unknown foil holes only return their IDs
+    assert foil_hole_data(xml_path, 4, 1).x_location is None
+
+
+def _num_listings(spy_scandir, directory: Path) -> int:
+    return sum(
+        1
+        for call in spy_scandir.call_args_list
+        if call.args and Path(call.args[0]) == directory
+    )
+
+
+def test_foil_hole_image_index_matches_glob(mocker: MockerFixture, tmp_path: Path):
+    # Directories are cached as soon as they are listed
+    mocker.patch.object(spa_metadata, "_MTIME_RESOLUTION_NS", 0)
+    # Create a grid square with 1,000 foil holes, with two images for every foil hole
+    num_foil_holes = 1000
+    fh_dir = tmp_path / "Images-Disc1" / "GridSquare_5" / "FoilHoles"
+    fh_dir.mkdir(parents=True)
+    for fh in range(num_foil_holes):
+        for i in range(2):
+            image = fh_dir / f"FoilHole_{fh}_20250101_00000{i}.jpg"
+            image.touch()
+            os.utime(image, ns=(i, i))
+    (fh_dir / "FoilHole_1_20250101_000001.xml").touch()
+
+    # Look up the images using the original per-foil hole glob
+    start_time = time.perf_counter()
+    expected = {}
+    for fh in range(num_foil_holes):
+        image_paths = list(
+            tmp_path.glob(f"Images-Disc*/GridSquare_5/FoilHoles/FoilHole_{fh}_*.jpg")
+        )
+        image_paths.sort(key=lambda x: (x.stat().st_ctime, str(x)))
+        expected[fh] = image_paths[-1]
+    glob_time = time.perf_counter() - start_time
+
+    # Look up the images using the index
+    spy_scandir = mocker.spy(os, "scandir")
+    start_time = time.perf_counter()
+    index = foil_hole_image_index(tmp_path, 5)
+    found = {fh: index.newest_image(fh, refresh=False) for fh in range(num_foil_holes)}
+    index_time = time.perf_counter() - start_time
+    assert found == expected
+    assert _num_listings(spy_scandir, fh_dir) == 1
+    assert index_time < glob_time
+
+    # The directory isn't listed again until it changes
+    foil_hole_image_index(tmp_path, 5)
+    assert _num_listings(spy_scandir, fh_dir) == 1
+
+    # New images are picked up on the next lookup
+    new_image = fh_dir / "FoilHole_0_20250101_000002.jpg"
+    new_image.touch()
+    stat = fh_dir.stat()
+    os.utime(fh_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.newest_image(0) == new_image
+    assert _num_listings(spy_scandir, fh_dir) == 2
+
+    # Removed images are dropped from the index
+    new_image.unlink()
+    os.utime(fh_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert index.newest_image(0) == expected[0]
+
+
+def test_foil_hole_image_index_relists_recently_modified_directories(tmp_path: Path):
+    fh_dir = tmp_path / "Images-Disc1" / "GridSquare_5" / "FoilHoles"
+    fh_dir.mkdir(parents=True)
+    (fh_dir / "FoilHole_1_20250101_000000.jpg").touch()
+    mtime_ns = fh_dir.stat().st_mtime_ns
+    index = foil_hole_image_index(tmp_path, 5)
+    assert index.newest_image(2) is None
+
+    # Written in the same tick as the listing, so the directory's mtime is unchanged
+    (fh_dir / "FoilHole_2_20250101_000000.jpg").touch()
+    os.utime(fh_dir, ns=(mtime_ns, mtime_ns))
+    assert index.newest_image(2) == fh_dir / "FoilHole_2_20250101_000000.jpg"
+
+
+def test_foil_hole_image_indexes_are_bounded(mocker: MockerFixture, tmp_path: Path):
+    mocker.patch.object(spa_metadata, "_max_foil_hole_image_indexes", 3)
+    mocker.patch.object(spa_metadata, "_foil_hole_image_indexes", OrderedDict())
+    first = foil_hole_image_index(tmp_path, 1)
+    for grid_square in range(2, 5):
+        foil_hole_image_index(tmp_path, grid_square)
+    assert list(spa_metadata._foil_hole_image_indexes) == [
+        (tmp_path, grid_square) for grid_square in range(2, 5)
+    ]
+    assert foil_hole_image_index(tmp_path, 1) is not first
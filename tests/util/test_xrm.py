@@ -0,0 +1,269 @@
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+from olefile import OleFileIO
+from pytest_mock import MockerFixture
+
+from murfey.util import xrm
+from murfey.util.xrm import get_xrm_header, read_xrm_header, xrm_reference_index
+
+_SECTOR = 512
+_MINI_SECTOR = 64
+_MINI_CUTOFF = 4096
+_FREE = 0xFFFFFFFF
+_END = 0xFFFFFFFE
+_FAT_SECTOR = 0xFFFFFFFD
+
+
+def _sectors(data: bytes, size: int) -> int:
+    return -(-len(data) // size)
+
+
+def _pad(data: bytes, size: int) -> bytes:
+    return data + b"\x00" * (_sectors(data, size) * size - len(data))
+
+
+def write_ole_file(path: Path, streams: dict[str, bytes]):
+    """
+    Writes a minimal OLE compound file (version 3) containing the given streams,
+    which are named by their storage paths, e.g. "ImageInfo/Angles"
+    """
+    # Build the storage tree, with the root entry first
+    entries: list[dict] = [{"name": "Root Entry", "type": 5, "children": []}]
+    storages = {"": 0}
+    for stream_path, data in streams.items():
+        parent = ""
+        for name in stream_path.split("/")[:-1]:
+            storage = f"{parent}/{name}" if parent else name
+            if storage not in storages:
+                storages[storage] = len(entries)
+                entries[storages[parent]]["children"].append(len(entries))
+                entries.append({"name": name, "type": 1, "children": []})
+            parent = storage
+        entries[storages[parent]]["children"].append(len(entries))
+        entries.append(
+            {
+                "name": stream_path.split("/")[-1],
+                "type": 2,
+                "data": data,
+                "children": [],
+            }
+        )
+
+    # Small streams are stored in the mini stream, and larger ones in sectors
+    ministream = b""
+    minifat: list[int] = []
+    large_streams = []
+    for entry in entries:
+        data = entry.get("data")
+        if data is None:
+            continue
+        if len(data) < _MINI_CUTOFF:
+            entry["start"] = len(minifat) if data else _END
+            num = _sectors(data, _MINI_SECTOR)
+            minifat.extend(list(range(len(minifat) + 1, len(minifat) + num)) + [_END])
+            ministream += _pad(data, _MINI_SECTOR)
+        else:
+            large_streams.append(entry)
+
+    # Lay out the sectors after the header
+    fat: list[int] = []
+    body = b""
+
+    def add_chain(data: bytes) -> int:
+        nonlocal body
+        if not data:
+            return _END
+        start = len(fat)
+        num = _sectors(data, _SECTOR)
+        fat.extend(list(range(start + 1, start + num)) + [_END])
+        body += _pad(data, _SECTOR)
+        return start
+
+    entries[0]["start"] = add_chain(ministream)
+    entries[0]["size"] = len(ministream)
+    for entry in large_streams:
+        entry["start"] = add_chain(entry["data"])
+    minifat_bytes = struct.pack(f"<{len(minifat)}I", *minifat) if minifat else b""
+    first_minifat = add_chain(minifat_bytes)
+
+    def sibling_key(i: int):
+        return (len(entries[i]["name"]), entries[i]["name"].upper())
+
+    siblings = dict.fromkeys(range(len(entries)), _FREE)
+    child = dict.fromkeys(range(len(entries)), _FREE)
+    for i, entry in enumerate(entries):
+        # Chain the children as right siblings in order, making a valid binary tree
+        children = sorted(entry["children"], key=sibling_key)
+        if children:
+            child[i] = children[0]
+        for left, right in zip(children, children[1:]):
+            siblings[left] = right
+    directory = b""
+    for i, entry in enumerate(entries):
+        name = entry["name"].encode("utf-16-le") + b"\x00\x00"
+        data = entry.get("data", b"")
+        directory += struct.pack(
+            "<64sHBBIII16sIQQIQ",
+            name,
+            len(name),
+            entry["type"],
+            1,  # Black
+            _FREE,
+            siblings[i],
+            child[i],
+            b"\x00" * 16,
+            0,
+            0,
+            0,
+            entry.get("start", _END if entry["type"] != 1 else 0),
+            entry.get("size", len(data)),
+        )
+    first_directory = add_chain(directory)
+
+    # The FAT has to describe its own sectors too
+    num_fat = 1
+    while _sectors(b"\x00" * (len(fat) + num_fat) * 4, _SECTOR) > num_fat:
+        num_fat += 1
+    fat_start = len(fat)
+    fat.extend([_FAT_SECTOR] * num_fat)
+    fat.extend([_FREE] * (num_fat * _SECTOR // 4 - len(fat)))
+    body += struct.pack(f"<{len(fat)}I", *fat)
+
+    difat = list(range(fat_start, fat_start + num_fat)) + [_FREE] * (109 - num_fat)
+    header = struct.pack(
+        "<8s16sHHHHH6sIIIIIIIII109I",
+        bytes.fromhex("D0CF11E0A1B11AE1"),
+        b"\x00" * 16,
+        0x3E,
+        3,
+        0xFFFE,
+        9,
+        6,
+        b"\x00" * 6,
+        0,
+        num_fat,
+        first_directory,
+        0,
+        _MINI_CUTOFF,
+        first_minifat,
+        _sectors(minifat_bytes, _SECTOR),
+        _END,
+        0,
+        *difat,
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(header + body)
+
+
+def xrm_streams(**values) -> dict[str, bytes]:
+    """
+    Encodes header values given as keyword arguments named after the streams, e.g.
+    ImageInfo_PixelSize=[0.3]
+    """
+    streams = {}
+    for key, value in values.items():
+        name = key.replace("_", "/", 1)
+        if name == "PositionInfo/AxisNames":
+            streams[name] = "".join(f"\x00{axis}\x00" for axis in value).encode()
+        elif name in xrm.HEADER_STREAMS:
+            streams[name] = np.array(value, dtype=xrm.HEADER_STREAMS[name]).tobytes()
+        else:
+            streams[name] = value
+    return streams
+
+
+def test_write_ole_file(tmp_path: Path):
+    streams = {
+        "ImageInfo/PixelSize": b"\x01\x02\x03\x04",
+        "ImageInfo/Angles": bytes(range(200)),
+        "ImageData1/Image1": os.urandom(20000),
+        "Empty": b"",
+    }
+    write_ole_file(tmp_path / "test.xrm", streams)
+    with OleFileIO(str(tmp_path / "test.xrm")) as ole:
+        for name, data in streams.items():
+            assert ole.openstream(name).read() == data
+
+
+def test_read_xrm_header(mocker: MockerFixture, tmp_path: Path):
+    write_ole_file(
+        tmp_path / "example.txrm",
+        xrm_streams(
+            ImageInfo_Angles=[-60, 0, 60],
+            ImageInfo_PixelSize=[0.01],
+            ImageInfo_ImageWidth=[1024],
+            PositionInfo_AxisNames=["Sample X", "Energy"],
+            PositionInfo_MotorPositions=[3, 519],
+            ReferenceData_Image=b"\x00" * 8000,
+            ImageData1_Image1=b"\x00" * 8000,
+        ),
+    )
+    spy_openstream = mocker.spy(OleFileIO, "openstream")
+
+    header = read_xrm_header(tmp_path / "example.txrm")
+    assert header.get("ImageInfo/Angles").tolist() == [-60, 0, 60]
+    assert header.get("ImageInfo/ImageWidth").tolist() == [1024]
+    assert header.get("ImageInfo/ImageHeight") is None
+    assert header.axis_names == ["Sample X", "Energy"]
+    assert header.has_reference
+    assert header.mosaic_size is None
+    # The image streams are never opened
+    opened = {call.args[1] for call in spy_openstream.call_args_list}
+    assert opened == {
+        "ImageInfo/Angles",
+        "ImageInfo/PixelSize",
+        "ImageInfo/ImageWidth",
+        "PositionInfo/AxisNames",
+        "PositionInfo/MotorPositions",
+    }
+
+
+def test_xrm_header_is_cached_until_the_file_changes(
+    mocker: MockerFixture, tmp_path: Path
+):
+    xrm_file = tmp_path / "example.xrm"
+    write_ole_file(xrm_file, xrm_streams(ImageInfo_PixelSize=[0.3]))
+    spy_read = mocker.spy(xrm, "read_xrm_header")
+
+    header = get_xrm_header(xrm_file)
+    assert get_xrm_header(xrm_file) is header
+    assert spy_read.call_count == 1
+
+    write_ole_file(xrm_file, xrm_streams(ImageInfo_PixelSize=[0.5, 0.5]))
+    assert get_xrm_header(xrm_file).get("ImageInfo/PixelSize").tolist() == [0.5, 0.5]
+    assert spy_read.call_count == 2
+
+
+def test_xrm_reference_index(mocker: MockerFixture, tmp_path: Path):
+    reference = xrm_streams(ImageInfo_MosiacRows=[0], ImageInfo_MosiacColumns=[0])
+    write_ole_file(tmp_path / "ref_1.xrm", reference)
+    write_ole_file(tmp_path / "atlas.xrm", reference)
+    # Named as a reference, but a mosaic
+    write_ole_file(
+        tmp_path / "ref_mosaic.xrm",
+        xrm_streams(ImageInfo_MosiacRows=[2], ImageInfo_MosiacColumns=[3]),
+    )
+    os.utime(tmp_path / "ref_mosaic.xrm", ns=(0, 2 * 10**18))
+    spy_read = mocker.spy(xrm, "read_xrm_header")
+
+    index = xrm_reference_index(tmp_path)
+    assert index.newest_reference() == tmp_path / "ref_1.xrm"
+    assert index.newest_reference() == tmp_path / "ref_1.xrm"
+    # Only the files named as references are read, and only once
+    assert sorted(call.args[0].name for call in spy_read.call_args_list) == [
+        "ref_1.xrm",
+        "ref_mosaic.xrm",
+    ]
+
+    # References added as they are transferred are used without listing the directory
+    write_ole_file(tmp_path / "ref_2.xrm", reference)
+    os.utime(tmp_path / "ref_2.xrm", ns=(0, 3 * 10**18))
+    index.add(tmp_path / "ref_2.xrm")
+    assert index.newest_reference(refresh=False) == tmp_path / "ref_2.xrm"
+
+    (tmp_path / "ref_2.xrm").unlink()
+    assert index.newest_reference() == tmp_path / "ref_1.xrm"
+    assert spy_read.call_count == 3
@@ -1,3 +1,6 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any
 from unittest.mock import MagicMock
@@ -5,7 +8,7 @@ from unittest.mock import MagicMock
 import ispyb.sqlalchemy as ISPyBDB
 import pytest
 from pytest_mock import MockerFixture
-from sqlalchemy import select as sa_select
+from sqlalchemy import event, select as sa_select
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 from sqlmodel import select as sm_select
 from sqlmodel.orm.session import Session as SQLModelSession
@@ -243,6 +246,209 @@ def test_register_grid_square():
     _register_grid_square
 
 
+def add_imaging_site(
+    murfey_db: SQLModelSession,
+    session_id: int,
+    dcg_name: str,
+    n: int,
+    data_type: str = "grid_square",
+) -> MurfeyDB.ImagingSite:
+    # Lay the sites out on a grid within the atlas extents
+    x0 = 0.0021 + 0.00008 * (n % 25)
+    y0 = 0.0021 + 0.00008 * (n // 25)
+    imaging_site = MurfeyDB.ImagingSite(
+        site_name=f"{dcg_name}--Position {n}",
+        session_id=session_id,
+        data_type=data_type,
+        dcg_name=dcg_name,
+        image_path=f"/data/{dcg_name}/Position {n}.tiff",
+        thumbnail_path=f"/data/{dcg_name}/Position {n}.png",
+        **(
+            {"x0": 0.002, "x1": 0.0044, "y0": 0.002, "y1": 0.0044}
+            if data_type == "atlas"
+            else {"x0": x0, "x1": x0 + 0.00005, "y0": y0, "y1": y0 + 0.00005}
+        ),
+        image_pixels_x=2048,
+        image_pixels_y=2048,
+        image_pixel_size=1.6e-7,
+        thumbnail_pixels_x=512,
+        thumbnail_pixels_y=512,
+        **{flag: flag == "has_grey" for flag in COLOR_FLAGS_MURFEY_TO_ISPYB},
+    )
+    murfey_db.add(imaging_site)
+    murfey_db.commit()
+    return imaging_site
+
+
+def test_register_grid_square_is_incremental(
+    mocker: MockerFixture,
+    murfey_db_engine,
+    murfey_db_session: SQLModelSession,
+):
+    """
+    Registers the grid squares of a CLEM session of 500 series one result at a
+    time, checking that each result costs a constant number of database statements
+    and ISPyB calls, rather than one that grows with the number of series.
+    """
+    session_id = ExampleVisit.murfey_session_id
+    dcg_name = "Grid_500"
+    get_or_create_db_entry(
+        murfey_db_session,
+        MurfeyDB.DataCollectionGroup,
+        lookup_kwargs={
+            "id": 500,
+            "session_id": session_id,
+            "tag": dcg_name,
+            "atlas_id": 5,
+        },
+    )
+    mocker.patch.dict(
+        "murfey.workflows.clem.register_preprocessing_results._grid_square_registration_states",
+        clear=True,
+    )
+    new_ids = iter(range(10000, 20000))
+    mock_transport = MagicMock()
+    mock_transport.do_insert_grid_squares.side_effect = lambda grid_squares, **_: {
+        "success": True,
+        "return_value": [next(new_ids) for _ in grid_squares],
+    }
+    mocker.patch(
+        "murfey.workflows.clem.register_preprocessing_results._transport_object",
+        new=mock_transport,
+    )
+
+    statements: list[str] = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    atlas = add_imaging_site(murfey_db_session, session_id, dcg_name, 0, "atlas")
+    _register_grid_square(session_id, atlas, murfey_db_session)
+
+    event.listen(murfey_db_engine, "before_cursor_execute", count_statement)
+    try:
+        statements_per_result = []
+        for n in range(1, 501):
+            imaging_site = add_imaging_site(murfey_db_session, session_id, dcg_name, n)
+            statements.clear()
+            _register_grid_square(session_id, imaging_site, murfey_db_session)
+            statements_per_result.append(len(statements))
+
+        # A new atlas moves every grid square, so they are updated in one batch
+        atlas = add_imaging_site(murfey_db_session, session_id, dcg_name, 0, "atlas")
+        statements.clear()
+        _register_grid_square(session_id, atlas, murfey_db_session)
+        full_refresh_statements = len(statements)
+    finally:
+        event.remove(murfey_db_engine, "before_cursor_execute", count_statement)
+
+    # The cost of registering each result does not grow with the session
+    assert max(statements_per_result) <= 10
+    assert sum(statements_per_result[-100:]) <= sum(statements_per_result[:100])
+    assert mock_transport.do_insert_grid_squares.call_count == 500
+    assert all(
+        len(call.args[0]) == 1
+        for call in mock_transport.do_insert_grid_squares.call_args_list
+    )
+    mock_transport.do_insert_grid_square.assert_not_called()
+    mock_transport.do_update_grid_square.assert_not_called()
+
+    mock_transport.do_update_grid_squares.assert_called_once()
+    update_args = mock_transport.do_update_grid_squares.call_args
+    assert len(update_args.args[0]) == 500
+    assert update_args.kwargs["color_flags"][0]["hasGrey"] == 1
+    assert full_refresh_statements <= 10
+
+    grid_squares = murfey_db_session.exec(
+        sm_select(MurfeyDB.GridSquare).where(MurfeyDB.GridSquare.tag == dcg_name)
+    ).all()
+    assert len(grid_squares) == 500
+    sites = murfey_db_session.exec(
+        sm_select(MurfeyDB.ImagingSite)
+        .where(MurfeyDB.ImagingSite.dcg_name == dcg_name)
+        .where(MurfeyDB.ImagingSite.data_type == "grid_square")
+    ).all()
+    assert {site.grid_square_id for site in sites} == {gs.id for gs in grid_squares}
+
+
+def test_register_grid_square_coalesces_concurrent_results(mocker: MockerFixture):
+    states: dict = {}
+    mocker.patch(
+        "murfey.workflows.clem.register_preprocessing_results._grid_square_registration_states",
+        new=states,
+    )
+    mocker.patch(
+        "murfey.workflows.clem.register_preprocessing_results._transport_object",
+        new=MagicMock(),
+    )
+    first_pass_started = threading.Event()
+    release_first_pass = threading.Event()
+    passes: list[tuple[set[int], MagicMock]] = []
+
+    def register_changed(session_id, dcg_name, changed_site_ids, full_refresh, db):
+        passes.append((changed_site_ids, db))
+        first_pass_started.set()
+        release_first_pass.wait(timeout=10)
+        return True
+
+    mocker.patch(
+        "murfey.workflows.clem.register_preprocessing_results._register_changed_grid_squares",
+        side_effect=register_changed,
+    )
+
+    dbs = [MagicMock() for _ in range(10)]
+
+    def result(n: int):
+        imaging_site = MagicMock(id=n, dcg_name="Grid_1", data_type="grid_square")
+        _register_grid_square(1, imaging_site, dbs[n])
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        first = executor.submit(result, 0)
+        assert first_pass_started.wait(timeout=10)
+        others = [executor.submit(result, n) for n in range(1, 10)]
+        deadline = time.monotonic() + 10
+        while len(states[(1, "Grid_1")].changed_site_ids) < 9:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        # Results arriving while a pass is running wait for the pass covering them
+        assert not any(future.done() for future in (first, *others))
+        release_first_pass.set()
+        for future in (first, *others):
+            future.result(timeout=10)
+
+    # The nine results that arrived together are registered in one pass, using the
+    # database session of one of them
+    assert [site_ids for site_ids, _ in passes] == [{0}, set(range(1, 10))]
+    assert passes[0][1] is dbs[0]
+    assert passes[1][1] in dbs[1:]
+
+
+def test_register_grid_square_reports_failures_to_waiting_results(
+    mocker: MockerFixture,
+):
+    mocker.patch.dict(
+        "murfey.workflows.clem.register_preprocessing_results._grid_square_registration_states",
+        clear=True,
+    )
+    mocker.patch(
+        "murfey.workflows.clem.register_preprocessing_results._transport_object",
+        new=MagicMock(),
+    )
+    register_changed = mocker.patch(
+        "murfey.workflows.clem.register_preprocessing_results._register_changed_grid_squares",
+        side_effect=[RuntimeError("ISPyB unavailable"), True],
+    )
+    imaging_site = MagicMock(id=1, dcg_name="Grid_1", data_type="grid_square")
+    with pytest.raises(RuntimeError):
+        _register_grid_square(1, imaging_site, MagicMock())
+
+    # The sites are kept for the next pass
+    imaging_site = MagicMock(id=2, dcg_name="Grid_1", data_type="grid_square")
+    _register_grid_square(1, imaging_site, MagicMock())
+    assert register_changed.call_args.args[2] == {1, 2}
+
+
 @pytest.mark.parametrize(
     "test_params",
     (  # Colors
@@ -3,10 +3,16 @@ from unittest.mock import MagicMock
 
 import numpy as np
 import PIL.Image
+import PIL.ImageSequence
+import pytest
 from pytest_mock import MockerFixture
 
 from murfey.util.models import FIBGIFParameters
-from murfey.workflows.fib.make_milling_gif import run
+from murfey.workflows.fib.make_milling_gif import (
+    FrameCache,
+    MillingAnimationBuilder,
+    run,
+)
 
 
 def test_make_gif(
@@ -82,3 +88,195 @@ def test_make_gif(
     )
     assert output_file.exists()
     assert result.get("success", False)
+
+
+def _make_tiffs(directory: Path, num_images: int, shape=(96, 128)) -> list[Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(num_images):
+        data = rng.integers(1000, 5000, size=shape, dtype=np.uint16)
+        data[:, (i % shape[1])] = 60000  # A feature that moves between frames
+        image_path = directory / f"image_{i:03d}.tiff"
+        PIL.Image.fromarray(data).save(image_path)
+        images.append(image_path)
+    return images
+
+
+def _make_gif_from_scratch(images: list[Path], output_file: Path):
+    # Makes the GIF the way it was made before frames were cached
+    converted = []
+    for f in images:
+        with PIL.Image.open(f) as im:
+            im.thumbnail((512, 512))
+            frame = np.array(im, dtype=np.float32)
+        vmin, vmax = np.percentile(frame, (0.5, 99.5))
+        scale = 255 / ((vmax - vmin) or 1)
+        np.clip(frame, a_min=vmin, a_max=vmax, out=frame)
+        np.subtract(frame, vmin, out=frame)
+        np.multiply(frame, scale, out=frame)
+        converted.append(PIL.Image.fromarray(frame.astype(np.uint8), mode="L"))
+    converted[0].save(
+        output_file,
+        format="GIF",
+        append_images=converted[1:],
+        save_all=True,
+        duration=30,
+        loop=0,
+    )
+
+
+def _read_frames(animation: Path) -> list[np.ndarray]:
+    with PIL.Image.open(animation) as im:
+        return [
+            np.array(frame.convert("L")) for frame in PIL.ImageSequence.Iterator(im)
+        ]
+
+
+def test_animation_work_grows_linearly(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 300)
+    output_file = tmp_path / "lamella_1.gif"
+    builder = MillingAnimationBuilder(FrameCache(tmp_path / "spill"), debounce=0)
+
+    # Request the animation each time an image arrives, as the client does
+    for i in range(1, len(images) + 1):
+        future = builder.submit(
+            FIBGIFParameters(
+                lamella_number=1, images=images[:i], output_file=output_file
+            )
+        )
+        assert future.done()
+        assert future.result() == output_file
+
+    # Each image is only loaded and encoded once
+    assert builder.frame_cache.decoded == len(images)
+    assert builder.encoded == len(images)
+
+    # The animation looks the same as one made in a single pass
+    reference_file = tmp_path / "reference.gif"
+    _make_gif_from_scratch(images, reference_file)
+    frames = _read_frames(output_file)
+    reference_frames = _read_frames(reference_file)
+    assert len(frames) == len(images)
+    for frame, reference_frame in zip(frames, reference_frames):
+        np.testing.assert_array_equal(frame, reference_frame)
+    with PIL.Image.open(output_file) as im:
+        assert im.info["loop"] == 0
+        assert im.info["duration"] == 30
+
+
+def test_animation_is_rewritten_if_images_change(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 5)
+    output_file = tmp_path / "lamella_1.gif"
+    builder = MillingAnimationBuilder(FrameCache(tmp_path / "spill"), debounce=0)
+
+    builder.build(
+        FIBGIFParameters(lamella_number=1, images=images[1:], output_file=output_file)
+    )
+    # An earlier image arriving late means the animation has to be written again
+    builder.build(
+        FIBGIFParameters(lamella_number=1, images=images, output_file=output_file)
+    )
+    assert builder.frame_cache.decoded == 5
+    assert builder.encoded == 9
+    assert len(_read_frames(output_file)) == 5
+
+
+def test_webp_animation(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 10)
+    builder = MillingAnimationBuilder(FrameCache(tmp_path / "spill"), debounce=0)
+    output_file = builder.build(
+        FIBGIFParameters(
+            lamella_number=1, images=images, output_file=tmp_path / "lamella_1.webp"
+        )
+    )
+    with PIL.Image.open(output_file) as im:
+        assert im.format == "WEBP"
+    assert len(_read_frames(output_file)) == 10
+
+
+def test_frames_are_spilled_to_disk(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 10)
+    frame_bytes = 96 * 128
+    frame_cache = FrameCache(tmp_path / "spill", max_memory_bytes=frame_bytes * 4)
+    for image_path in images:
+        frame_cache.get(image_path)
+    assert frame_cache.memory_bytes == frame_bytes * 4
+    assert len(list((tmp_path / "spill").glob("*.npy"))) == 6
+
+    # Spilled frames are read back instead of being loaded from the images again
+    for image_path in images:
+        frame_cache.get(image_path)
+    assert frame_cache.decoded == 10
+
+
+def test_rapid_requests_are_coalesced(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 10)
+    output_file = tmp_path / "lamella_1.gif"
+    builder = MillingAnimationBuilder(FrameCache(tmp_path / "spill"), debounce=0.3)
+
+    futures = [
+        builder.submit(
+            FIBGIFParameters(
+                lamella_number=1, images=images[:i], output_file=output_file
+            )
+        )
+        for i in range(1, len(images) + 1)
+    ]
+    assert futures[0].done()
+    assert all(future is futures[1] for future in futures[1:])
+    assert not futures[1].done()
+    assert futures[1].result(timeout=5) == output_file
+
+    # Only the first and the last of the requests are acted on
+    assert builder.frame_cache.decoded == 10
+    assert builder.encoded == 10
+    assert len(_read_frames(output_file)) == 10
+
+
+def test_deferred_build_failures_are_reported(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 2)
+    output_file = tmp_path / "lamella_1.gif"
+    builder = MillingAnimationBuilder(FrameCache(tmp_path / "spill"), debounce=0.1)
+
+    builder.submit(
+        FIBGIFParameters(lamella_number=1, images=images[:1], output_file=output_file)
+    ).result()
+    images[1].unlink()
+    future = builder.submit(
+        FIBGIFParameters(lamella_number=1, images=images, output_file=output_file)
+    )
+    with pytest.raises(FileNotFoundError):
+        future.result(timeout=5)
+
+
+def test_rewritten_images_are_loaded_again(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 3)
+    output_file = tmp_path / "lamella_1.gif"
+    builder = MillingAnimationBuilder(FrameCache(tmp_path / "spill"), debounce=0)
+    params = FIBGIFParameters(lamella_number=1, images=images, output_file=output_file)
+    builder.build(params)
+
+    # An image replaced under the same name is not taken from the cache, and the
+    # animation is written again rather than appended to
+    PIL.Image.fromarray(np.zeros((96, 128), dtype=np.uint16)).save(images[1])
+    builder.build(params)
+    assert builder.frame_cache.decoded == 4
+    assert builder.encoded == 6
+    assert not _read_frames(output_file)[1].any()
+
+
+def test_animation_records_are_bounded(tmp_path: Path):
+    images = _make_tiffs(tmp_path / "DCImages", 1)
+    builder = MillingAnimationBuilder(
+        FrameCache(tmp_path / "spill"), debounce=0, max_animations=2
+    )
+    for i in range(5):
+        builder.submit(
+            FIBGIFParameters(
+                lamella_number=i, images=images, output_file=tmp_path / f"{i}.gif"
+            )
+        ).result()
+    assert list(builder._written) == [tmp_path / "3.gif", tmp_path / "4.gif"]
+    assert len(builder._last_built) <= 1
+    assert not builder._build_locks
@@ -2,8 +2,8 @@ from unittest import mock
 
 from sqlmodel import Session, select
 
-from murfey.util.db import DataCollectionGroup, GridSquare
-from murfey.util.models import GridSquareParameters
+from murfey.util.db import DataCollectionGroup, FoilHole, GridSquare
+from murfey.util.models import FoilHoleParameters, GridSquareParameters
 from murfey.workflows.spa import flush_spa_preprocess
 from tests.conftest import ExampleVisit
 
@@ -45,8 +45,9 @@ def test_register_grid_square_update_add_locations(
         ExampleVisit.murfey_session_id, 101, new_parameters, murfey_db_session
     )
 
-    # Check this would have updated ispyb
-    mock_transport.do_update_grid_square.assert_called_with(1, new_parameters)
+    # Check this would have updated ispyb before the request returned
+    mock_transport.queue_grid_square_update.assert_called_with(1, new_parameters)
+    mock_transport.flush_updates.assert_called_once_with()
 
     # Confirm the database was updated
     grid_square_final_parameters = murfey_db_session.exec(select(GridSquare)).one()
@@ -96,7 +97,7 @@ def test_register_grid_square_update_add_nothing(
     )
 
     # Check this would have updated ispyb
-    mock_transport.do_update_grid_square.assert_called_with(1, new_parameters)
+    mock_transport.queue_grid_square_update.assert_called_with(1, new_parameters)
 
     # Confirm the database was not updated
     grid_square_final_parameters = murfey_db_session.exec(select(GridSquare)).one()
@@ -167,3 +168,132 @@ def test_register_grid_square_insert_with_ispyb(
     assert grid_square_final_parameters.thumbnail_size_y == 256
     assert grid_square_final_parameters.pixel_size == 1.02
     assert grid_square_final_parameters.image == f"{tmp_path}/image_path"
+
+
+@mock.patch("murfey.workflows.spa.flush_spa_preprocess._transport_object")
+def test_register_grid_squares_inserts_and_updates(
+    mock_transport, murfey_db_session: Session
+):
+    dcg = DataCollectionGroup(
+        id=1,
+        session_id=ExampleVisit.murfey_session_id,
+        tag="session_tag",
+        atlas_id=90,
+        sample=2,
+    )
+    murfey_db_session.add(dcg)
+    murfey_db_session.add(
+        GridSquare(
+            id=1,
+            name=101,
+            session_id=ExampleVisit.murfey_session_id,
+            tag="session_tag",
+        )
+    )
+    murfey_db_session.commit()
+
+    mock_transport.do_insert_grid_squares.return_value = {
+        "return_value": [2, 3],
+        "success": True,
+    }
+    grid_squares = {
+        gsid: GridSquareParameters(
+            tag="session_tag", x_location=gsid + 0.5, y_location=gsid + 0.25
+        )
+        for gsid in (101, 102, 103)
+    }
+
+    flush_spa_preprocess.register_grid_squares(
+        ExampleVisit.murfey_session_id, grid_squares, murfey_db_session
+    )
+
+    mock_transport.queue_grid_square_update.assert_called_once_with(
+        1, grid_squares[101]
+    )
+    mock_transport.flush_updates.assert_called_once_with()
+    mock_transport.do_insert_grid_squares.assert_called_once_with(
+        [(90, 102, grid_squares[102]), (90, 103, grid_squares[103])]
+    )
+    mock_transport.do_insert_grid_square.assert_not_called()
+    registered = {
+        gs.name: gs
+        for gs in murfey_db_session.exec(
+            select(GridSquare).where(
+                GridSquare.session_id == ExampleVisit.murfey_session_id
+            )
+        ).all()
+    }
+    assert {name: gs.id for name, gs in registered.items()} == {
+        101: 1,
+        102: 2,
+        103: 3,
+    }
+    assert all(gs.x_location == gs.name + 0.5 for gs in registered.values())
+
+
+@mock.patch("murfey.workflows.spa.flush_spa_preprocess._transport_object")
+def test_register_foil_holes_inserts_and_updates(
+    mock_transport, murfey_db_session: Session
+):
+    dcg = DataCollectionGroup(
+        id=1,
+        session_id=ExampleVisit.murfey_session_id,
+        tag="session_tag",
+        atlas_id=90,
+        sample=2,
+    )
+    murfey_db_session.add(dcg)
+    murfey_db_session.add(
+        GridSquare(
+            id=1,
+            name=101,
+            session_id=ExampleVisit.murfey_session_id,
+            tag="session_tag",
+            readout_area_x=4000,
+            thumbnail_size_x=400,
+        )
+    )
+    murfey_db_session.add(
+        FoilHole(
+            id=10,
+            name=1,
+            session_id=ExampleVisit.murfey_session_id,
+            grid_square_id=1,
+        )
+    )
+    murfey_db_session.commit()
+
+    mock_transport.do_insert_foil_holes.return_value = {
+        "return_value": [11, 12],
+        "success": True,
+    }
+    foil_holes = [
+        FoilHoleParameters(tag="session_tag", name=name, x_location=float(name))
+        for name in (2, 1, 3)
+    ]
+
+    fh_ids = flush_spa_preprocess.register_foil_holes(
+        ExampleVisit.murfey_session_id, 101, foil_holes, murfey_db_session
+    )
+
+    # IDs are returned in the order the foil holes were given
+    assert fh_ids == [11, 10, 12]
+    mock_transport.do_insert_foil_holes.assert_called_once_with(
+        1, 0.1, [foil_holes[0], foil_holes[2]]
+    )
+    mock_transport.do_update_foil_holes.assert_called_once_with(
+        0.1, [(10, foil_holes[1])]
+    )
+    mock_transport.do_insert_foil_hole.assert_not_called()
+    registered = murfey_db_session.exec(
+        select(FoilHole).where(FoilHole.session_id == ExampleVisit.murfey_session_id)
+    ).all()
+    assert {fh.name: fh.id for fh in registered} == {1: 10, 2: 11, 3: 12}
+    assert all(fh.x_location == float(fh.name) for fh in registered)
+
+
+def test_register_foil_holes_without_grid_square(murfey_db_session: Session):
+    foil_holes = [FoilHoleParameters(tag="session_tag", name=name) for name in (1, 2)]
+    assert flush_spa_preprocess.register_foil_holes(
+        ExampleVisit.murfey_session_id, 999, foil_holes, murfey_db_session
+    ) == [None, None]
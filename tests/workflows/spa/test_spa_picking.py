@@ -0,0 +1,254 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from pytest_mock import MockerFixture
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from murfey.util.db import (
+    AutoProcProgram,
+    CtfParameters,
+    DataCollection,
+    DataCollectionGroup,
+    ParticleSizes,
+    ParticleSizeSketch,
+    ProcessingJob,
+    SPARelionParameters,
+)
+from murfey.util.quantile_sketch import QuantileSketch
+from murfey.workflows.spa import picking
+from tests.conftest import ExampleVisit, get_or_create_db_entry
+
+particles_per_micrograph = 400
+
+
+def set_up_picking_db(murfey_db_session: Session) -> tuple[int, int]:
+    dcg_entry: DataCollectionGroup = get_or_create_db_entry(
+        murfey_db_session,
+        DataCollectionGroup,
+        lookup_kwargs={
+            "id": 0,
+            "session_id": ExampleVisit.murfey_session_id,
+            "tag": "test_dcg",
+        },
+    )
+    dc_entry: DataCollection = get_or_create_db_entry(
+        murfey_db_session,
+        DataCollection,
+        lookup_kwargs={"id": 0, "tag": "test_dc", "dcg_id": dcg_entry.id},
+    )
+    for pj_id, recipe in ((1, "em-spa-preprocess"), (2, "em-spa-extract")):
+        get_or_create_db_entry(
+            murfey_db_session,
+            ProcessingJob,
+            lookup_kwargs={"id": pj_id, "recipe": recipe, "dc_id": dc_entry.id},
+        )
+        get_or_create_db_entry(
+            murfey_db_session,
+            AutoProcProgram,
+            lookup_kwargs={"id": pj_id, "pj_id": pj_id},
+        )
+    get_or_create_db_entry(
+        murfey_db_session,
+        SPARelionParameters,
+        lookup_kwargs={
+            "pj_id": 1,
+            "angpix": 1.0,
+            "dose_per_frame": 1.0,
+            "gain_ref": None,
+            "voltage": 300,
+            "motion_corr_binning": 1,
+            "symmetry": "C1",
+            "particle_diameter": None,
+        },
+    )
+    return 1, 1
+
+
+def picked_particles_message(n: int, particle_diameters: list[float]) -> dict:
+    return {
+        "session_id": ExampleVisit.murfey_session_id,
+        "program_id": 1,
+        "particle_diameters": particle_diameters,
+        "extraction_parameters": {
+            "micrographs_file": f"MotionCorr/{n}.mrc",
+            "coord_list_file": f"AutoPick/{n}.star",
+            "extract_file": f"Extract/{n}.star",
+            "ctf_values": {
+                "CtfImage": f"CtfFind/{n}.ctf",
+                "CtfMaxResolution": 4.0,
+                "CtfFigureOfMerit": 0.1,
+                "DefocusU": 1.0,
+                "DefocusV": 1.0,
+                "DefocusAngle": 0.0,
+            },
+        },
+    }
+
+
+@pytest.mark.parametrize("raw_rows", (False, True))
+def test_picked_particles_are_summarised(
+    mocker: MockerFixture,
+    murfey_db_engine,
+    murfey_db_session: Session,
+    raw_rows: bool,
+):
+    """
+    Replays the picked particles from a run of micrographs, checking that each one
+    takes a constant handful of database statements and commits, rather than the
+    insert and commit per particle previously needed
+    """
+    program_id, pj_id = set_up_picking_db(murfey_db_session)
+    mock_security_config = MagicMock()
+    mock_security_config.particle_sizes_raw_rows = raw_rows
+    mocker.patch(
+        "murfey.workflows.spa.picking.get_security_config",
+        return_value=mock_security_config,
+    )
+    statements: list[str] = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def count_commit(conn):
+        statements.append("COMMIT")
+
+    rng = np.random.default_rng(0)
+    picked = []
+    statements_per_micrograph = []
+    event.listen(murfey_db_engine, "before_cursor_execute", count_statement)
+    event.listen(murfey_db_engine, "commit", count_commit)
+    try:
+        for n in range(20):
+            sizes = rng.normal(160, 20, size=particles_per_micrograph).tolist()
+            picked.extend(sizes)
+            statements.clear()
+            picking._register_picked_particles_use_diameter(
+                picked_particles_message(n, sizes), murfey_db_session
+            )
+            statements_per_micrograph.append(len(statements))
+    finally:
+        event.remove(murfey_db_engine, "before_cursor_execute", count_statement)
+        event.remove(murfey_db_engine, "commit", count_commit)
+
+    assert max(statements_per_micrograph) * 100 <= 2 * particles_per_micrograph
+    sketch_entry = murfey_db_session.get(ParticleSizeSketch, pj_id)
+    assert sketch_entry is not None
+    assert sketch_entry.count == len(picked)
+    sketch = QuantileSketch.from_bytes(sketch_entry.sketch)
+    assert sketch.quantile(0.5) == pytest.approx(np.quantile(picked, 0.5), rel=0.02)
+
+    raw_sizes = murfey_db_session.exec(
+        select(ParticleSizes.particle_size).where(ParticleSizes.pj_id == pj_id)
+    ).all()
+    assert len(raw_sizes) == (len(picked) if raw_rows else 0)
+
+
+def test_particle_diameter_is_read_from_sketch(
+    mocker: MockerFixture, murfey_db_session: Session
+):
+    program_id, pj_id = set_up_picking_db(murfey_db_session)
+    mocker.patch.object(picking.default_spa_parameters, "nr_picks_before_diameter", 999)
+    mocker.patch("murfey.workflows.spa.picking.get_machine_config")
+    mock_transport = mocker.patch("murfey.workflows.spa.picking._transport_object")
+
+    rng = np.random.default_rng(1)
+    picked = []
+    for n in range(5):
+        sizes = rng.normal(160, 20, size=200).tolist()
+        picked.extend(sizes)
+        picking._register_picked_particles_use_diameter(
+            picked_particles_message(n, sizes), murfey_db_session
+        )
+    # The next micrograph takes the count over the threshold
+    picking._register_picked_particles_use_diameter(
+        picked_particles_message(5, []), murfey_db_session
+    )
+
+    relion_params = murfey_db_session.get(SPARelionParameters, pj_id)
+    assert relion_params is not None
+    assert relion_params.particle_diameter is not None
+    # Within the documented rank error of the exact 75th percentile
+    assert (
+        np.quantile(picked, 0.73)
+        <= relion_params.particle_diameter
+        <= np.quantile(picked, 0.77)
+    )
+    # All the saved micrographs are sent on for extraction
+    ctf_entries = murfey_db_session.exec(
+        select(CtfParameters).where(CtfParameters.pj_id == pj_id)
+    ).all()
+    assert mock_transport.send.call_count == len(ctf_entries) == 6
+
+
+def test_particle_size_sketch_is_locked_and_not_overwritten(
+    mocker: MockerFixture,
+    murfey_db_engine,
+    murfey_db_session: Session,
+):
+    program_id, pj_id = set_up_picking_db(murfey_db_session)
+    mocker.patch("murfey.workflows.spa.picking.get_security_config")
+    # Another message for the same processing job creates the summary between it
+    # being looked up and inserted
+    existing = QuantileSketch()
+    existing.update_many([100.0] * 10)
+    murfey_db_session.add(
+        ParticleSizeSketch(pj_id=pj_id, count=10, sketch=existing.to_bytes())
+    )
+    murfey_db_session.commit()
+    murfey_db_session.expunge_all()
+    original_get = murfey_db_session.get
+    lookups: list[int] = []
+
+    def get_missing_first(*args, **kwargs):
+        lookups.append(1)
+        return None if len(lookups) == 1 else original_get(*args, **kwargs)
+
+    mocker.patch.object(murfey_db_session, "get", side_effect=get_missing_first)
+    statements: list[str] = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(murfey_db_engine, "before_cursor_execute", record_statement)
+    try:
+        picking._register_picked_particles_use_diameter(
+            picked_particles_message(0, [200.0] * 5), murfey_db_session
+        )
+    finally:
+        event.remove(murfey_db_engine, "before_cursor_execute", record_statement)
+
+    # The summary is read for update, and the sizes are added to the existing one
+    assert any(
+        "particlesizesketch" in statement.lower() and "FOR UPDATE" in statement
+        for statement in statements
+    )
+    sketch_entry = original_get(ParticleSizeSketch, pj_id, populate_existing=True)
+    assert sketch_entry is not None
+    assert sketch_entry.count == 15
+
+
+def test_particle_size_sketch_is_created_on_sqlite(mocker: MockerFixture):
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as sqlite_session:
+        sqlite_session.add(ParticleSizes(pj_id=1, particle_size=100.0))
+        sqlite_session.commit()
+        sketch_entry = picking._get_particle_size_sketch(1, sqlite_session)
+        assert sketch_entry.count == 1
+        sqlite_session.commit()
+
+        # A summary created by another message in the meantime is left alone
+        sqlite_session.add(ParticleSizes(pj_id=1, particle_size=200.0))
+        sqlite_session.commit()
+        original_get = sqlite_session.get
+        lookups: list[int] = []
+
+        def get_missing_first(*args, **kwargs):
+            lookups.append(1)
+            return None if len(lookups) == 1 else original_get(*args, **kwargs)
+
+        mocker.patch.object(sqlite_session, "get", side_effect=get_missing_first)
+        sketch_entry = picking._get_particle_size_sketch(1, sqlite_session)
+        assert sketch_entry.count == 1
@@ -1,5 +1,8 @@
 from unittest import mock
 
+import numpy as np
+import pytest
+from sqlalchemy import event
 from sqlmodel import Session, select
 
 from murfey.util.db import DataCollectionGroup, SearchMap, TiltSeries
@@ -49,7 +52,7 @@ def test_register_search_map_update_with_dimensions(
     )
 
     # Check this would have updated ispyb
-    mock_transport.do_update_search_map.assert_called_with(1, new_parameters)
+    mock_transport.do_update_search_maps.assert_called_once_with([(1, new_parameters)])
 
     # Confirm the database was updated
     sm_final_parameters = murfey_db_session.exec(select(SearchMap)).one()
@@ -135,16 +138,18 @@ def test_register_search_map_update_with_all_parameters(
     assert sm_final_parameters.y_location is not None
 
     # Check this would have updated ispyb
-    update_args = mock_transport.do_update_search_map.call_args_list
-    assert len(update_args) == 2
-    assert update_args[0][0][0] == 1
-    assert update_args[1][0][0] == 1
-    assert update_args[0][0][1].x_stage_position == 0.3
-    assert update_args[0][0][1].y_stage_position == 0.4
-    assert update_args[1][0][1].x_location == sm_final_parameters.x_location
-    assert update_args[1][0][1].y_location == sm_final_parameters.y_location
-    assert update_args[1][0][1].height_on_atlas == 311
-    assert update_args[1][0][1].width_on_atlas == 155
+    # The new parameters and the position are written together
+    mock_transport.do_update_search_maps.assert_called_once()
+    ((search_map_id, update_parameters),) = (
+        mock_transport.do_update_search_maps.call_args[0][0]
+    )
+    assert search_map_id == 1
+    assert update_parameters.x_stage_position == 0.3
+    assert update_parameters.y_stage_position == 0.4
+    assert update_parameters.x_location == sm_final_parameters.x_location
+    assert update_parameters.y_location == sm_final_parameters.y_location
+    assert update_parameters.height_on_atlas == 311
+    assert update_parameters.width_on_atlas == 155
 
 
 @mock.patch("murfey.workflows.tomo.tomo_metadata._transport_object")
@@ -184,6 +189,8 @@ def test_register_search_map_insert_with_ispyb(
 
     # Check this would have updated ispyb
     mock_transport.do_insert_search_map.assert_called_with(90, new_parameters)
+    # There is no position to write yet
+    mock_transport.do_update_search_maps.assert_not_called()
 
     # Confirm the database entry was made
     sm_final_parameters = murfey_db_session.exec(select(SearchMap)).one()
@@ -367,3 +374,239 @@ def test_register_batch_position_new(murfey_db_session: Session):
     bp_final_parameters = murfey_db_session.exec(select(TiltSeries)).one()
     assert bp_final_parameters.x_location == 880 * 512 / 2000
     assert bp_final_parameters.y_location == (4000 - 1780) * 512 / 2000
+
+
+def skewed_search_map() -> SearchMap:
+    return SearchMap(
+        id=1,
+        name="SearchMap_1",
+        session_id=ExampleVisit.murfey_session_id,
+        tag="session_tag",
+        x_stage_position=1e-4,
+        y_stage_position=-2e-4,
+        pixel_size=1e-8,
+        reference_matrix_m11=1.01,
+        reference_matrix_m12=0.01,
+        reference_matrix_m21=0.02,
+        reference_matrix_m22=1.02,
+        stage_correction_m11=0.99,
+        stage_correction_m12=-0.01,
+        stage_correction_m21=-0.02,
+        stage_correction_m22=0.98,
+        image_shift_correction_m11=1.03,
+        image_shift_correction_m12=0.03,
+        image_shift_correction_m21=-0.03,
+        image_shift_correction_m22=0.97,
+        height=4000,
+        width=2000,
+    )
+
+
+def single_position_location(
+    search_map: SearchMap, batch_parameters: BatchPositionParameters
+) -> tuple[float, float]:
+    """
+    Places a batch position on a search map one matrix at a time, as was done
+    before batch positions were registered together
+    """
+    reference_shift_matrix = np.array(
+        [
+            [search_map.reference_matrix_m11, search_map.reference_matrix_m12],
+            [search_map.reference_matrix_m21, search_map.reference_matrix_m22],
+        ]
+    )
+    stage_correction_matrix = np.array(
+        [
+            [search_map.stage_correction_m11, search_map.stage_correction_m12],
+            [search_map.stage_correction_m21, search_map.stage_correction_m22],
+        ]
+    )
+    image_shift_matrix = np.array(
+        [
+            [
+                search_map.image_shift_correction_m11,
+                search_map.image_shift_correction_m12,
+            ],
+            [
+                search_map.image_shift_correction_m21,
+                search_map.image_shift_correction_m22,
+            ],
+        ]
+    )
+    stage_vector = np.array(
+        [
+            batch_parameters.x_stage_position - search_map.x_stage_position,
+            batch_parameters.y_stage_position - search_map.y_stage_position,
+        ]
+    )
+    corrected_vector = np.matmul(
+        np.linalg.inv(reference_shift_matrix),
+        np.matmul(
+            np.linalg.inv(stage_correction_matrix),
+            np.matmul(
+                np.linalg.inv(image_shift_matrix),
+                np.matmul(reference_shift_matrix, stage_vector),
+            ),
+        ),
+    )
+    inverted_corrected_vector = np.matmul([[1, 0], [0, -1]], corrected_vector)
+    centre_batch_pixel = inverted_corrected_vector / search_map.pixel_size + [
+        search_map.width / 2,
+        search_map.height / 2,
+    ]
+    return (
+        float(
+            (
+                centre_batch_pixel[0]
+                - batch_parameters.x_beamshift / search_map.pixel_size
+            )
+            * 512
+            / search_map.width
+        ),
+        float(
+            (
+                centre_batch_pixel[1]
+                + batch_parameters.y_beamshift / search_map.pixel_size
+            )
+            * 512
+            / search_map.width
+        ),
+    )
+
+
+def synthetic_batch_positions(
+    num_positions: int, search_map_name: str = "SearchMap_1"
+) -> dict[str, BatchPositionParameters]:
+    rng = np.random.default_rng(0)
+    stage_positions = rng.uniform(-1e-5, 1e-5, size=(num_positions, 2)) + [1e-4, -2e-4]
+    beamshifts = rng.uniform(-1e-6, 1e-6, size=(num_positions, 2))
+    # Every other position is a beamshifted area around the position before it
+    beamshifts[::2] = 0
+    stage_positions[1::2] = stage_positions[::2]
+    return {
+        f"Position_{n}": BatchPositionParameters(
+            tag="session_tag",
+            x_stage_position=stage_positions[n][0],
+            y_stage_position=stage_positions[n][1],
+            x_beamshift=beamshifts[n][0],
+            y_beamshift=beamshifts[n][1],
+            search_map_name=search_map_name,
+        )
+        for n in range(num_positions)
+    }
+
+
+def test_register_batch_positions_matches_single_positions(
+    murfey_db_session: Session, murfey_db_engine
+):
+    """
+    Registers 500 batch positions at once, checking they are placed where they would
+    have been one at a time, in a fixed number of database statements
+    """
+    search_map = skewed_search_map()
+    murfey_db_session.add(search_map)
+    murfey_db_session.commit()
+    batch_positions = synthetic_batch_positions(500)
+    expected_locations = {
+        batch_name: single_position_location(search_map, batch_parameters)
+        for batch_name, batch_parameters in batch_positions.items()
+    }
+    # Some of the tilt series are already known, but haven't been placed yet
+    for n in range(0, 500, 5):
+        murfey_db_session.add(
+            TiltSeries(
+                tag=f"Position_{n}",
+                rsync_source="session_tag",
+                session_id=ExampleVisit.murfey_session_id,
+            )
+        )
+    murfey_db_session.commit()
+
+    statements: list[str] = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def count_commit(conn):
+        statements.append("COMMIT")
+
+    event.listen(murfey_db_engine, "before_cursor_execute", count_statement)
+    event.listen(murfey_db_engine, "commit", count_commit)
+    try:
+        tomo_metadata.register_batch_positions_in_database(
+            ExampleVisit.murfey_session_id, batch_positions, murfey_db_session
+        )
+    finally:
+        event.remove(murfey_db_engine, "before_cursor_execute", count_statement)
+        event.remove(murfey_db_engine, "commit", count_commit)
+    assert len(statements) <= 6
+
+    tilt_series = murfey_db_session.exec(select(TiltSeries)).all()
+    assert len(tilt_series) == 500
+    for ts in tilt_series:
+        assert ts.search_map_id == 1
+        assert (ts.x_location, ts.y_location) == pytest.approx(
+            expected_locations[ts.tag], rel=1e-12, abs=1e-9
+        )
+
+
+def test_register_batch_positions_placed_when_search_map_changes(
+    murfey_db_session: Session,
+):
+    """
+    Registers batch positions before their search map is complete, which are then
+    placed once the search map is complete, and moved when it changes
+    """
+    murfey_db_session.add(
+        SearchMap(
+            id=1,
+            name="SearchMap_1",
+            session_id=ExampleVisit.murfey_session_id,
+            tag="session_tag",
+        )
+    )
+    murfey_db_session.add(
+        DataCollectionGroup(
+            id=1,
+            session_id=ExampleVisit.murfey_session_id,
+            tag="session_tag",
+            atlas_id=90,
+            atlas_pixel_size=1e-5,
+        )
+    )
+    murfey_db_session.commit()
+    batch_positions = synthetic_batch_positions(20)
+    tomo_metadata.register_batch_positions_in_database(
+        ExampleVisit.murfey_session_id, batch_positions, murfey_db_session
+    )
+    for ts in murfey_db_session.exec(select(TiltSeries)).all():
+        assert ts.x_location is None
+
+    search_map = skewed_search_map()
+    search_map_parameters = SearchMapParameters(
+        tag="session_tag",
+        x_stage_position=search_map.x_stage_position,
+        y_stage_position=search_map.y_stage_position,
+        pixel_size=search_map.pixel_size,
+        reference_matrix={"m11": 1.01, "m12": 0.01, "m21": 0.02, "m22": 1.02},
+        stage_correction={"m11": 0.99, "m12": -0.01, "m21": -0.02, "m22": 0.98},
+        image_shift_correction={"m11": 1.03, "m12": 0.03, "m21": -0.03, "m22": 0.97},
+        height=search_map.height,
+        width=search_map.width,
+    )
+    for pixel_size in (1e-8, 2e-8):
+        search_map.pixel_size = search_map_parameters.pixel_size = pixel_size
+        with mock.patch("murfey.workflows.tomo.tomo_metadata._transport_object"):
+            tomo_metadata.register_search_map_in_database(
+                ExampleVisit.murfey_session_id,
+                "SearchMap_1",
+                search_map_parameters,
+                murfey_db_session,
+                close_db=False,
+            )
+        for ts in murfey_db_session.exec(select(TiltSeries)).all():
+            assert (ts.x_location, ts.y_location) == pytest.approx(
+                single_position_location(search_map, batch_positions[ts.tag]),
+                rel=1e-12,
+                abs=1e-9,
+            )